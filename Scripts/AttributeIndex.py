@@ -0,0 +1,135 @@
+"""
+Bitmap indexes of the categorical attribute columns of the reference layers.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+Model.py filters the zoning layer with GEN_ZON2 = 0 OR GEN_ZON2 = 101 and the
+property layer with F_TYPE = 'CONDO' by scanning the attribute table on every
+call. A bitmap index holds, for every distinct value of a column, one bit per
+feature of the layer (packed 8 features per byte). It is built once from the
+.dbf file and saved next to the layer as {LayerName}.shp.{Field}.twmbitmap.npz
+together with the fingerprint of the layer, like the spatial index, and
+rebuilt when the layer changes.
+
+An attribute predicate (e.g. GEN_ZON2 IN (0, 101)) is the OR of the bitmaps of
+its values, and it is tested directly on the candidates of the spatial index
+(see Contains): only the bits of the features near the route are read, and the
+attribute column is never loaded. Adding another zoning class (commercial
+GEN_ZON2 = 201, mixed use GEN_ZON2 = 6 OR 202) costs another OR of two small
+bitmaps and a bit test of the same candidates.
+
+Example Usage (build or refresh the bitmap indexes of every filtered column):
+python AttributeIndex.py
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Optional
+import numpy as np
+import os
+import re
+
+from Shapefile import ReadAttributes, NormalisePath
+from SpatialIndex import Fingerprint
+
+# bump when the layout of the bitmap indexes changes
+BITMAP_VERSION = 1
+BITMAP_SUFFIX = ".twmbitmap.npz"
+
+
+class BitmapIndex:
+    def __init__(self, values: np.ndarray, bitmaps: np.ndarray, features: int,
+                 fingerprint: Optional[np.ndarray] = None):
+        # distinct values of the column and their packed bitmaps (values x bytes)
+        self.values = values
+        self.bitmaps = bitmaps
+        self.features = features
+        self.fingerprint = fingerprint
+
+    @staticmethod
+    def Build(column: np.ndarray, fingerprint: Optional[np.ndarray] = None) -> "BitmapIndex":
+        values, inverse = np.unique(column, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        bitmaps = np.zeros((len(values), (len(column) + 7) // 8), dtype=np.uint8)
+        # features grouped by value, one packed row per value
+        order = np.argsort(inverse, kind="stable")
+        starts = np.searchsorted(inverse[order], np.arange(len(values) + 1))
+        for value in range(len(values)):
+            bits = np.zeros(len(column), dtype=bool)
+            bits[order[starts[value]:starts[value + 1]]] = True
+            bitmaps[value] = np.packbits(bits)
+        return BitmapIndex(values, bitmaps, len(column), fingerprint)
+
+    def Save(self, path: str):
+        # write to a temporary file first so concurrent readers never see a partial index
+        temporaryPath = path + "." + str(os.getpid()) + ".tmp.npz"
+        np.savez(temporaryPath, values=self.values, bitmaps=self.bitmaps, features=self.features,
+                 fingerprint=self.fingerprint)
+        os.replace(temporaryPath, path)
+
+    @staticmethod
+    def Load(path: str) -> "BitmapIndex":
+        with np.load(path) as data:
+            return BitmapIndex(data["values"], data["bitmaps"], int(data["features"]), data["fingerprint"])
+
+    def Bitmap(self, values: list) -> np.ndarray:
+        # packed bitmap of the features whose value is one of values (OR of their bitmaps)
+        rows = np.flatnonzero(np.isin(self.values, values))
+        if len(rows) == 0:
+            return np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+        return np.bitwise_or.reduce(self.bitmaps[rows], axis=0)
+
+    def Features(self, values: list) -> np.ndarray:
+        # ids of the features whose value is one of values
+        return np.flatnonzero(np.unpackbits(self.Bitmap(values), count=self.features))
+
+
+def Contains(bitmap: np.ndarray, features: np.ndarray) -> np.ndarray:
+    # bit of every given feature id in a packed bitmap
+    features = np.asarray(features, dtype=np.int64)
+    return ((bitmap[features >> 3] >> (7 - (features & 7)).astype(np.uint8)) & 1).astype(bool)
+
+
+def BitmapIndexPath(shpPath: str, field: str) -> str:
+    return shpPath + "." + re.sub(r"[^A-Za-z0-9_]", "_", field) + BITMAP_SUFFIX
+
+
+def LoadOrBuildBitmapIndex(shpPath: str, field: str) -> BitmapIndex:
+    # load the bitmap index of the column saved next to the layer, rebuilding
+    # it if the layer changed
+    shpPath = NormalisePath(shpPath)
+    fingerprint = np.append(Fingerprint(shpPath), BITMAP_VERSION)
+    path = BitmapIndexPath(shpPath, field)
+    if os.path.exists(path):
+        try:
+            index = BitmapIndex.Load(path)
+            if index.fingerprint is not None and np.array_equal(index.fingerprint, fingerprint):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+
+    column = ReadAttributes(os.path.splitext(shpPath)[0] + ".dbf", [field])[field]
+    index = BitmapIndex.Build(column, fingerprint)
+    try:
+        index.Save(path)
+    except OSError:
+        # read-only data folder, keep the index in memory only
+        pass
+    return index
+
+
+if __name__ == '__main__':
+    import NumpyModel
+
+    for feature, fields in NumpyModel.LayerFields.items():
+        path = NumpyModel.dataFolder + feature
+        if not os.path.exists(path):
+            print("Skipping missing layer: " + path)
+            continue
+        for field in fields:
+            index = LoadOrBuildBitmapIndex(path, field)
+            print("Indexed " + str(len(index.values)) + " values of " + field + " over " + str(index.features) +
+                  " features of " + feature)
@@ -0,0 +1,310 @@
+"""
+Scanline clip-and-sum engine for the Business Improvement Area (BIA) metric.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+Step 8 of Model.py counts the overlaps of the BIAs and the route buffer with
+Count Overlapping Features, measures every overlap with AREA_GEODESIC and sums
+the overlaps with COUNT_ = 2: the area covered by exactly one BIA inside the
+buffer, plus the area covered by exactly two BIAs outside of it.
+
+This engine computes the same sum in memory without building the buffer. The
+plane is cut by horizontal scanlines (2% of the buffer size apart, between 1
+and 10 metres) and, on every scanline:
+
+- the BIA polygons are clipped exactly by their edge crossings (even-odd rule,
+  so holes and multipart BIAs are handled), and a single sort of all the
+  crossings gives the pieces of scanline covered by the BIAs with their BIA
+  count. The pieces do not depend on the route and are computed once per
+  process.
+- the buffer is the union of the sections of the capsules (points within the
+  buffer size of a route segment) of the route segments, merged into
+  disjoint intervals on every scanline
+
+The covered pieces inside the buffer intervals are found by binary search
+and clipped to them, and the lengths with the wanted counts are summed. The
+planar areas are then corrected to geodesic areas with the area scale of the
+projection (see Geometry.GeodesicAreaFactors), evaluated once per
+AREA_CORRECTION_CELL square as it varies by less than 1e-6 across it. The
+double overlaps outside the buffer are the double overlaps of the whole
+layer, also computed once per process, minus those inside the buffer.
+
+As the BIAs are swept once, several buffers (the routes of BatchModel.py or
+the buffer sizes of Sweep.py) only add their own intervals: the buffer sizes
+share one scanline spacing and are clipped as distance bands (see
+BIAOverlapAreas).
+
+Tolerance: on the routes of RoutesPaths.txt at 100 m the result is within 1.5%
+of Results.csv. The difference comes from the buffer: arcpy approximates the
+round ends and joins of its PLANAR buffer with polygons, while this engine
+uses exact capsules. The crossings are exact along every scanline, so the
+integration error of the scanline spacing is below 0.01%.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Optional, List, Dict, Tuple
+import numpy as np
+
+from Shapefile import Layer
+from SpatialIndex import Fingerprint
+import Geometry
+
+# distance between the scanlines as a fraction of the buffer size, clamped
+# to [MIN_SCANLINE_SPACING, MAX_SCANLINE_SPACING] metres
+ScanlineSpacingFraction = 0.02
+MIN_SCANLINE_SPACING = 1.0
+MAX_SCANLINE_SPACING = 10.0
+
+# size (metres) of the squares sharing a geodesic area correction
+AREA_CORRECTION_CELL = 250.0
+
+# crossings of the layer polygons with the scanlines, pieces of scanline
+# covered by the polygons and area covered by exactly two polygons of a
+# layer, per (layer, fingerprint of its files, spacing)
+_crossingCache: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = {}
+_coverageCache: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = {}
+_doubleOverlapCache: Dict[str, float] = {}
+
+
+def ScanlineSpacing(bufferMetres: float) -> float:
+    return min(max(bufferMetres * ScanlineSpacingFraction, MIN_SCANLINE_SPACING), MAX_SCANLINE_SPACING)
+
+
+def _LayerKey(layer: Layer, spacing: float) -> str:
+    # a layer updated on disk while the process runs gets new entries
+    return layer.path + "|" + ",".join(str(value) for value in Fingerprint(layer.path)) + "|" + str(spacing)
+
+
+def PolygonCrossings(layer: Layer, spacing: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # (feature, scanline, x, delta) of every crossing of a polygon boundary
+    # with a scanline, delta is +1 where the scanline enters the polygon and
+    # -1 where it leaves it
+    key = _LayerKey(layer, spacing)
+    if key in _crossingCache:
+        return _crossingCache[key]
+
+    a, b, edgeFeature = Geometry.PolygonEdges(layer.Metres(), layer.partOffsets, layer.featureOffsets)
+    edges, lines, x = Geometry.ScanlineCrossings(a, b, spacing)
+    features = edgeFeature[edges]
+
+    # along a scanline the crossings of one polygon alternate between entering and leaving
+    order = np.lexsort((x, lines, features))
+    features, lines, x = features[order], lines[order], x[order]
+    newGroup = np.concatenate([[True], (features[1:] != features[:-1]) | (lines[1:] != lines[:-1])])
+    groupStart = np.maximum.accumulate(np.where(newGroup, np.arange(len(x)), 0))
+    delta = np.where((np.arange(len(x)) - groupStart) % 2 == 0, 1, -1).astype(np.int32)
+
+    _crossingCache[key] = (features, lines, x, delta)
+    return _crossingCache[key]
+
+
+def _Sweep(lines: np.ndarray, x: np.ndarray, countDelta: np.ndarray):
+    # (scanline, start x, length, polygon count) of the pieces between
+    # consecutive end points on every scanline
+    order = np.lexsort((x, lines))
+    lines, x = lines[order], x[order]
+    counts = np.cumsum(countDelta[order])
+    sameLine = lines[1:] == lines[:-1]
+    return lines[:-1][sameLine], x[:-1][sameLine], np.diff(x)[sameLine], counts[:-1][sameLine]
+
+
+def _Spans(groups: np.ndarray, lines: np.ndarray, x: np.ndarray, delta: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # (group, scanline, low x, high x) of the spans where the sum of delta is
+    # positive, ordered by group, scanline and x. The deltas of every
+    # (group, scanline) sum to 0. At the same x the positive deltas come
+    # first, so touching spans are joined.
+    order = np.lexsort((-delta, x, lines, groups))
+    counts = np.cumsum(delta[order])
+    before = counts - delta[order]
+    starts = order[(before <= 0) & (counts > 0)]
+    ends = order[(before > 0) & (counts <= 0)]
+    keep = x[ends] > x[starts]
+    return groups[starts][keep], lines[starts][keep], x[starts][keep], x[ends][keep]
+
+
+def MergeIntervals(groups: np.ndarray, lines: np.ndarray, low: np.ndarray,
+                   high: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # union of the (scanline, low x, high x) intervals of every group (e.g.
+    # the capsule sections of a buffer), as disjoint (group, scanline, low x,
+    # high x) intervals ordered by group, scanline and x
+    if len(lines) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    keys = groups.astype(np.int64) * (int(lines.max()) - int(lines.min()) + 1) + (lines - lines.min())
+    order = np.lexsort((low, keys))
+    keys, low, high = keys[order], low[order], high[order]
+    newKey = np.concatenate([[True], keys[1:] != keys[:-1]])
+
+    # an interval starts a new span unless it starts before the furthest end
+    # of the intervals before it on its scanline. The ends are offset by
+    # scanline so that the running maximum never carries over to the next one.
+    left = low.min()
+    width = np.ceil(high.max() - left) + 1.0
+    offset = (np.cumsum(newKey) - 1) * width - left
+    reach = np.maximum.accumulate(high + offset)
+    first = newKey.copy()
+    first[1:] |= low[1:] + offset[1:] > reach[:-1]
+    starts = np.flatnonzero(first)
+    return groups[order][starts], lines[order][starts], low[starts], np.maximum.reduceat(high, starts)
+
+
+def CoveragePieces(layer: Layer, spacing: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # (scanline, start x, length, polygon count) of the pieces of scanline
+    # covered by at least one polygon of the layer, ordered by scanline and x.
+    # They do not depend on the route and are swept once per process.
+    key = _LayerKey(layer, spacing)
+    if key not in _coverageCache:
+        _, lines, x, delta = PolygonCrossings(layer, spacing)
+        pieceLines, pieceX, lengths, counts = _Sweep(lines, x, delta)
+        covered = (counts > 0) & (lengths > 0)
+        _coverageCache[key] = pieceLines[covered], pieceX[covered], lengths[covered], counts[covered]
+    return _coverageCache[key]
+
+
+def ClipCoverage(layer: Layer, lines: np.ndarray, low: np.ndarray, high: np.ndarray,
+                 spacing: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # (interval, scanline, start x, length, polygon count) of the parts of
+    # the coverage pieces inside the (scanline, low x, high x) intervals,
+    # which must be disjoint on every scanline (see MergeIntervals)
+    pieceLines, pieceX, pieceLengths, pieceCounts = CoveragePieces(layer, spacing)
+    if len(pieceLines) == 0 or len(lines) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0),
+                np.zeros(0, dtype=np.int32))
+    pieceEnd = pieceX + pieceLengths
+
+    # the pieces are disjoint and ordered by scanline then x, so the keys
+    # scanline * width + x are sorted. The keys are rounded, so the range of
+    # pieces of every interval is widened by one on both sides and the
+    # pieces are clipped exactly below.
+    firstLine = pieceLines[0]
+    left = pieceX.min()
+    width = np.ceil(pieceEnd.max() - left) + 1.0
+    lineKeys = (np.clip(lines, firstLine, pieceLines[-1]) - firstLine) * width
+    first = np.maximum(np.searchsorted((pieceLines - firstLine) * width + (pieceEnd - left),
+                                       lineKeys + np.clip(low - left, 0.0, width - 1.0), side="right") - 1, 0)
+    last = np.minimum(np.searchsorted((pieceLines - firstLine) * width + (pieceX - left),
+                                      lineKeys + np.clip(high - left, 0.0, width - 1.0), side="left") + 1, len(pieceLines))
+    counts = np.maximum(last - first, 0)
+    intervals = np.repeat(np.arange(len(lines)), counts)
+    pieces = Geometry.ExpandRanges(first, counts)
+
+    start = np.maximum(low[intervals], pieceX[pieces])
+    lengths = np.minimum(high[intervals], pieceEnd[pieces]) - start
+    inside = (pieceLines[pieces] == lines[intervals]) & (lengths > 0)
+    return (intervals[inside], lines[intervals][inside], start[inside], lengths[inside],
+            pieceCounts[pieces][inside])
+
+
+def GeodesicPieceAreas(lines: np.ndarray, x: np.ndarray, lengths: np.ndarray, spacing: float) -> np.ndarray:
+    # geodesic area of every piece of scanline (scanline, start x, length)
+    if len(lines) == 0:
+        return np.zeros(0)
+    middles = np.stack([x + lengths / 2, Geometry.ScanlineY(lines, spacing)], axis=1)
+    cells = np.floor(middles / AREA_CORRECTION_CELL).astype(np.int64)
+    uniqueCells, inverse = np.unique(Geometry.CellKey(cells[:, 0], cells[:, 1]), return_inverse=True)
+    cellX, cellY = Geometry.CellIndices(uniqueCells)
+    factors = Geometry.GeodesicAreaFactors((np.stack([cellX, cellY], axis=1) + 0.5) * AREA_CORRECTION_CELL)
+    return lengths * factors[inverse] * spacing
+
+
+def _GeodesicArea(lines: np.ndarray, x: np.ndarray, lengths: np.ndarray, spacing: float) -> float:
+    return float(np.sum(GeodesicPieceAreas(lines, x, lengths, spacing)))
+
+
+def DoubleOverlapArea(layer: Layer, spacing: float) -> float:
+    # area covered by exactly two polygons of the layer, independent of the route
+    key = _LayerKey(layer, spacing)
+    if key not in _doubleOverlapCache:
+        lines, x, lengths, counts = CoveragePieces(layer, spacing)
+        double = counts == 2
+        _doubleOverlapCache[key] = _GeodesicArea(lines[double], x[double], lengths[double], spacing)
+    return _doubleOverlapCache[key]
+
+
+def BIAOverlapArea(layer: Layer, grid: Geometry.SegmentGrid, bufferMetres: float,
+                   spacing: Optional[float] = None) -> float:
+    # geodesic area with an overlap count of exactly 2 when counting the BIAs
+    # and the route buffer together (see the module docstring)
+    return float(BIAOverlapAreas(layer, grid, [bufferMetres], spacing)[0])
+
+
+def BufferOverlapArea(layer: Layer, bufferLines: np.ndarray, low: np.ndarray, high: np.ndarray,
+                      spacing: float) -> float:
+    # same as BIAOverlapArea for a buffer given by its (scanline, low x, high x)
+    # intervals, which may overlap each other
+    return float(GroupBufferOverlapAreas(layer, np.zeros(len(bufferLines), dtype=np.int64),
+                                         bufferLines, low, high, spacing, 1)[0])
+
+
+def BufferPieces(layer: Layer, bufferLines: np.ndarray, low: np.ndarray, high: np.ndarray,
+                 spacing: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # (scanline, start x, length, BIA count) of the pieces of scanline inside
+    # the buffer covered by at least one BIA
+    _, lines, merged, mergedHigh = MergeIntervals(np.zeros(len(bufferLines), dtype=np.int64), bufferLines, low, high)
+    _, lines, x, lengths, counts = ClipCoverage(layer, lines, merged, mergedHigh, spacing)
+    return lines, x, lengths, counts
+
+
+def _GroupAreas(layer: Layer, groups: np.ndarray, lines: np.ndarray, x: np.ndarray, lengths: np.ndarray,
+                counts: np.ndarray, spacing: float, size: int) -> np.ndarray:
+    # area with an overlap count of exactly 2 of every group, from the pieces
+    # of scanline covered by the BIAs inside the buffer of the group: one BIA
+    # inside the buffer, plus the double overlaps of the layer outside of it
+    areas = GeodesicPieceAreas(lines, x, lengths, spacing)
+    single = counts == 1
+    double = counts == 2
+    return (DoubleOverlapArea(layer, spacing) + np.bincount(groups[single], areas[single], minlength=size)
+            - np.bincount(groups[double], areas[double], minlength=size))
+
+
+def GroupBufferOverlapAreas(layer: Layer, bufferGroups: np.ndarray, bufferLines: np.ndarray, low: np.ndarray,
+                            high: np.ndarray, spacing: float, groups: int) -> np.ndarray:
+    # BufferOverlapArea of several buffers at once (i.e. the buffers of several
+    # routes, see BatchModel.py), with the group of every buffer interval, the
+    # intervals of a group following each other. The buffer of every group is
+    # merged on its own (a few small sorts are faster than a large one), then
+    # all of them are clipped against the same coverage pieces, so the
+    # crossings of the BIAs are swept once whatever the number of groups.
+    bounds = np.flatnonzero(np.concatenate([[True], bufferGroups[1:] != bufferGroups[:-1], [True]]))
+    merged = [MergeIntervals(bufferGroups[start:end], bufferLines[start:end], low[start:end], high[start:end])
+              for start, end in zip(bounds[:-1], bounds[1:])]
+    intervalGroups, lines, merged, mergedHigh = (np.concatenate([np.zeros(0, dtype=dtype)] + [part[i] for part in merged])
+                                                 for i, dtype in enumerate((np.int64, np.int64, np.float64, np.float64)))
+    intervals, lines, x, lengths, counts = ClipCoverage(layer, lines, merged, mergedHigh, spacing)
+    return _GroupAreas(layer, intervalGroups[intervals], lines, x, lengths, counts, spacing, groups)
+
+
+def BIAOverlapAreas(layer: Layer, grid: Geometry.SegmentGrid, bufferSizes: List[float],
+                    spacing: Optional[float] = None) -> np.ndarray:
+    # BIAOverlapArea of several buffer sizes in one pass. All the sizes share
+    # the scanline spacing of the largest one, the corridor is split into the
+    # distance bands between consecutive sizes (the buffer of a size contains
+    # the buffers of the smaller sizes) and every band is clipped once, so the
+    # area of a size is the sum of the bands inside it.
+    bufferSizes = np.asarray(bufferSizes, dtype=np.float64)
+    distances = np.unique(bufferSizes)
+    spacing = spacing or ScanlineSpacing(distances[-1])
+
+    groups, lines, x, delta = [], [], [], []
+    for band, distance in enumerate(distances):
+        bufferLines, low, high = Geometry.CapsuleIntervals(grid.a, grid.b, distance, spacing)
+        _, mergedLines, low, high = MergeIntervals(np.zeros(len(bufferLines), dtype=np.int64), bufferLines, low, high)
+        # the buffer of this size counts +1 in its band and -1 in the next one
+        for group, sign in ((band, 1), (band + 1, -1)):
+            if group < len(distances):
+                signs = np.full(len(mergedLines), sign, dtype=np.int32)
+                groups.append(np.full(2 * len(mergedLines), group))
+                lines.append(np.concatenate([mergedLines, mergedLines]))
+                x.append(np.concatenate([low, high]))
+                delta.append(np.concatenate([signs, -signs]))
+    bands, bandLines, bandLow, bandHigh = _Spans(np.concatenate(groups), np.concatenate(lines),
+                                                 np.concatenate(x), np.concatenate(delta))
+
+    pieceIntervals, lines, x, lengths, counts = ClipCoverage(layer, bandLines, bandLow, bandHigh, spacing)
+    bandAreas = _GroupAreas(layer, bands[pieceIntervals], lines, x, lengths, counts, spacing, len(distances))
+    # every band holds the double overlaps of the layer once
+    bandAreas[1:] -= DoubleOverlapArea(layer, spacing)
+    return np.cumsum(bandAreas)[np.searchsorted(distances, bufferSizes)]
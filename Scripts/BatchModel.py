@@ -0,0 +1,334 @@
+"""
+Layer-major evaluation of a batch of routes, one pass per reference layer.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+Model in NumpyModel.py evaluates one route at a time, so a batch of routes
+queries every reference layer once per route, and the zoning layer is copied
+out of its snapshot once per route. BatchModel turns the loops around: the
+segments of all the routes are bucketed together in a single grid, each
+segment tagged with its route, and every reference layer is visited once for
+the whole batch:
+
+- the points (places of interest, subway stations, high traffic
+  intersections) near any route come from one query of the spatial index, and
+  every point is paired with the routes having a segment within the buffer
+  size (see SegmentGrid.NearPairs in Geometry.py)
+- the zoning layer is copied once for the bbox of all the routes, and every
+  residential zone near any route is decoded once and paired with the routes
+  it intersects
+- the crossings of the BIAs with the scanlines are swept once, and the buffer
+  of every route is clipped against the same covered pieces (see
+  GroupBufferOverlapAreas in BIAArea.py). The capsule sections of the
+  buffers are still computed route by route, so this step takes about as
+  long as in Model.
+- the condominium points, loaded once, are tested against the closed ring of
+  every route. With CondominiumWithin the condominium polygons are copied
+  once for the bbox of all the routes and indexed once, instead of once per
+  route
+
+The counts of every route are then a bincount of the (feature, route) pairs,
+so the route x metric table comes out of one sweep per layer, with the same
+results as Model in NumpyModel.py. Runner.py uses it as the batch backend.
+On the routes of RoutesPaths.txt, moved around to make 40 routes, the batch
+takes 3.8 s against 8.5 s route by route, mostly saved on the residential
+zones.
+
+Example Usage:
+python BatchModel.py 100 Meters {LocationOfRouteFeature.shp} {OtherRouteFeature.shp}
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Optional, List, Dict, Tuple
+from sys import argv
+import numpy as np
+import pandas as pd
+import time
+
+from Model import GetMetrics
+from Profiling import Profiler
+from Shapefile import Layer
+import NumpyModel
+import ResultCache
+import AttributeIndex
+import Containment
+import Geometry
+import BIAArea
+
+# point metrics and their layers
+PointMetrics = [("Number of Places of Interests", NumpyModel.POIFeature),
+                ("Number of Subway Stations", NumpyModel.SubwayFeature),
+                ("Number of High Traffic Intersections", NumpyModel.HighTrafficFeature)]
+
+
+def RoutesGrid(routes: List[Layer], bufferMetres: float) -> Tuple[Geometry.SegmentGrid, np.ndarray]:
+    # grid of the segments of all the routes, and the route of every segment
+    segments = [Geometry.LineSegments(route.Metres(), route.partOffsets) for route in routes]
+    a = np.concatenate([np.zeros((0, 2))] + [start for start, _ in segments])
+    b = np.concatenate([np.zeros((0, 2))] + [end for _, end in segments])
+    segmentRoutes = np.repeat(np.arange(len(routes)), [len(start) for start, _ in segments])
+    return Geometry.SegmentGrid(a, b, bufferMetres), segmentRoutes
+
+
+def RoutesBox(routes: List[Layer], distance: float = 0.0) -> np.ndarray:
+    # lon/lat bbox of all the routes expanded by distance metres
+    boxes = np.array([NumpyModel.RouteBox(route, distance) for route in routes])
+    return np.concatenate([boxes[:, 0:2].min(axis=0), boxes[:, 2:4].max(axis=0)])
+
+
+def PointPairs(layer: Layer, grid: Geometry.SegmentGrid, segmentRoutes: np.ndarray,
+               bufferMetres: float) -> Tuple[np.ndarray, np.ndarray]:
+    # (point, route) of every point within the buffer of a route
+    candidates = NumpyModel.LoadIndex(layer).QueryRoute(grid, bufferMetres)
+    points, routes = grid.NearPairs(layer.Points(metres=True)[candidates], bufferMetres, segmentRoutes)
+    return candidates[points], routes
+
+
+def PolygonPairs(layer: Layer, grid: Geometry.SegmentGrid, segmentRoutes: np.ndarray, bufferMetres: float,
+                 bitmap: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    # (polygon, route) of every polygon intersecting the buffer of a route,
+    # optionally restricted to the features set in a bitmap over the whole
+    # layer. Every polygon is decoded once and tested against every route near
+    # it as in PolygonDistances (see NumpyModel.py).
+    index = NumpyModel.LoadIndex(layer)
+    candidates = index.QueryRoute(grid, bufferMetres)
+    if bitmap is not None:
+        candidates = candidates[AttributeIndex.Contains(bitmap, NumpyModel.GlobalIds(layer, candidates))]
+
+    features, routes = [], []
+    for feature in candidates:
+        segments = grid.SegmentsNearBox(index.boxes[feature], bufferMetres)
+        if len(segments) == 0:
+            continue
+        rings, ringOffsets = NumpyModel._FeatureRings(layer, feature)
+        edgeStart, edgeEnd = Geometry.LineSegments(rings, ringOffsets)
+
+        # the segments are ordered by route, the distance to a route is the
+        # smallest distance to its segments
+        segmentRoute = segmentRoutes[segments]
+        starts = np.flatnonzero(np.concatenate([[True], segmentRoute[1:] != segmentRoute[:-1]]))
+        distances = np.minimum.reduceat(
+            Geometry.SegmentDistancesToSegments(edgeStart, edgeEnd, grid.a[segments], grid.b[segments]), starts)
+        # or the route running entirely inside the polygon
+        near = (distances <= bufferMetres) | Geometry.PointsInRings(grid.a[segments[starts]], rings, ringOffsets)
+        features.append(np.full(np.count_nonzero(near), feature))
+        routes.append(segmentRoute[starts[near]])
+    return (np.concatenate([np.zeros(0, dtype=np.int64)] + features),
+            np.concatenate([np.zeros(0, dtype=np.int64)] + routes))
+
+
+def BIAAreas(layer: Layer, grid: Geometry.SegmentGrid, segmentRoutes: np.ndarray, bufferMetres: float,
+             routes: int) -> np.ndarray:
+    # BIAOverlapArea (see NumpyModel.py) of every route, the scanline
+    # intervals of the buffer of every route are tagged with the route
+    spacing = BIAArea.ScanlineSpacing(bufferMetres)
+    intervals = [Geometry.CapsuleIntervals(grid.a[segmentRoutes == route], grid.b[segmentRoutes == route], bufferMetres, spacing)
+                 for route in range(routes)]
+    lineRoutes = np.repeat(np.arange(routes), [len(lines) for lines, _, _ in intervals])
+    return BIAArea.GroupBufferOverlapAreas(layer, lineRoutes,
+                                           np.concatenate([np.zeros(0, dtype=np.int64)] + [lines for lines, _, _ in intervals]),
+                                           np.concatenate([np.zeros(0)] + [low for _, low, _ in intervals]),
+                                           np.concatenate([np.zeros(0)] + [high for _, _, high in intervals]), spacing, routes)
+
+
+def BatchModel(Routes: List[str], BufferSize: int, BufferSizeUnit: str,
+               Metrics: Optional[List[str]] = None, CondominiumWithin: bool = False) -> List[Dict[str, Optional[int]]]:
+    # results of Model (see NumpyModel.py) for every route, in the order of
+    # Routes. A route that cannot be read gets an Error and is left out of the
+    # batch, a failing step gives an Error to the routes it failed for only,
+    # with the metrics of the other steps.
+    Metrics = GetMetrics() if Metrics is None else Metrics
+    results: List[Dict[str, Optional[int]]] = [{} for _ in Routes]
+    # keep track of the time, memory and feature counts of every step (see Profiling.py)
+    profiler = Profiler("Batch of " + str(len(Routes)) + " routes")
+
+    print("==============================================================")
+    print("Step 1: Preparing Routes...")
+    step = profiler.Start("Step 1: Preparing Routes")
+
+    bufferMetres = Geometry.BufferSizeInMetres(BufferSize, BufferSizeUnit)
+    routes, positions = [], []
+    for position, Route in enumerate(Routes):
+        try:
+            routes.append(NumpyModel.LoadRoute(Route))
+            positions.append(position)
+        except Exception as e:
+            results[position]["Error"] = str(e)
+    positions = np.array(positions, dtype=np.int64)
+    grid, segmentRoutes = RoutesGrid(routes, bufferMetres)
+
+    print("Finished Preparing Routes: " + str(len(routes)) + " routes, " + str(len(grid.a)) + " segments")
+    print("Step 1: Completed in " + str(round(profiler.Stop(step, len(Routes), len(routes)), 2)) + " s.")
+
+    def Record(metric: str, values: np.ndarray):
+        for position, value in zip(positions, values):
+            results[position][metric] = int(value)
+
+    def Fail(error: Exception, routes: Optional[np.ndarray] = None):
+        # the routes a step failed for keep the metrics of the other steps,
+        # and the first error of every route is reported
+        for position in (positions if routes is None else routes):
+            results[position].setdefault("Error", str(error))
+
+    for number, (metric, feature) in enumerate(PointMetrics):
+        if metric not in Metrics or len(routes) == 0:
+            continue
+        try:
+            print("==============================================================")
+            print("Step " + str(number + 2) + ": Counting " + metric[len("Number of "):] + " within the buffers...")
+            step = profiler.Start("Step " + str(number + 2) + ": " + metric[len("Number of "):])
+
+            layer = NumpyModel.LoadLayer(feature, [])
+            _, pointRoutes = PointPairs(layer, grid, segmentRoutes, bufferMetres)
+            Record(metric, np.bincount(pointRoutes, minlength=len(routes)))
+
+            print("Finished Counting " + metric[len("Number of "):] + ": " + str(len(pointRoutes)) + " (feature, route) pairs")
+            print("Step " + str(number + 2) + ": Completed in " + str(round(profiler.Stop(step, len(layer), len(pointRoutes)), 2)) + " s.")
+        except Exception as e:
+            Fail(e)
+
+    if "Number of Residential Zones" in Metrics and len(routes) > 0:
+        try:
+            print("==============================================================")
+            print("Step 6: Counting Number of Residential Zones within the buffers...")
+            step = profiler.Start("Step 6: Residential Zones")
+
+            # Filter out residential zones from the zoning data using GEN_ZON2 = 0 OR 101
+            Zoning = NumpyModel.LoadLayerInBox(NumpyModel.ZoningFeature, RoutesBox(routes, bufferMetres), [])
+            ResidentialZones = NumpyModel.LoadBitmapIndex(NumpyModel.ZoningFeature, "GEN_ZON2").Bitmap(NumpyModel.ResidentialZoneCodes)
+            _, zoneRoutes = PolygonPairs(Zoning, grid, segmentRoutes, bufferMetres, ResidentialZones)
+            Record("Number of Residential Zones", np.bincount(zoneRoutes, minlength=len(routes)))
+
+            print("Finished Counting Number of Residential Zones: " + str(len(zoneRoutes)) + " (feature, route) pairs")
+            print("Step 6: Completed in " + str(round(profiler.Stop(step, len(Zoning), len(zoneRoutes)), 2)) + " s.")
+        except Exception as e:
+            Fail(e)
+
+    if "Areas of Business Improvement Areas" in Metrics and len(routes) > 0:
+        try:
+            print("==============================================================")
+            print("Step 8: Calculating Areas of Business Improvement Areas within the buffers...")
+            step = profiler.Start("Step 8: Business Improvement Areas")
+
+            BIA = NumpyModel.LoadLayer(NumpyModel.BIAFeature, [])
+            Record("Areas of Business Improvement Areas", BIAAreas(BIA, grid, segmentRoutes, bufferMetres, len(routes)))
+
+            print("Finished Calculating Areas of Business Improvement Areas within the buffers")
+            print("Step 8: Completed in " + str(round(profiler.Stop(step, len(BIA)), 2)) + " s.")
+        except Exception as e:
+            Fail(e)
+
+    if "Number of Condomininiums within the Route Coverage Area" in Metrics and len(routes) > 0:
+        try:
+            print("==============================================================")
+            print("Step 9: Counting Number of Condomininiums within the Closed Routes")
+            step = profiler.Start("Step 9: Condominiums")
+
+            # Count how many condominiums (F_TYPE = 'CONDO') are inside every connected route polygon,
+            # the condominiums are loaded (and indexed) once for the bbox of all the routes
+            if CondominiumWithin:
+                Property = NumpyModel.LoadLayerInBox(NumpyModel.PropertyFeature, RoutesBox(routes), [])
+                Condominiums = NumpyModel.LoadBitmapIndex(NumpyModel.PropertyFeature, "F_TYPE").Bitmap([NumpyModel.CondominiumType])
+                Property = Property.Subset(AttributeIndex.Contains(Condominiums, NumpyModel.GlobalIds(Property, np.arange(len(Property)))))
+                index = NumpyModel.LoadIndex(Property)
+                scanned = len(Property)
+            else:
+                points = NumpyModel.LoadRepresentativePoints(NumpyModel.PropertyFeature, "F_TYPE", NumpyModel.CondominiumType)
+                scanned = len(points)
+
+            for route, position in zip(routes, positions):
+                try:
+                    ring = NumpyModel.ClosedRoutePolygon(route)
+                    if CondominiumWithin:
+                        count = NumpyModel.CountFeaturesWithinPolygon(Property, ring, index=index)
+                    else:
+                        count = np.count_nonzero(Containment.PointsInRing(points, ring))
+                    results[position]["Number of Condomininiums within the Route Coverage Area"] = int(count)
+                except Exception as e:
+                    Fail(e, [position])
+
+            print("Step 9: Completed in " + str(round(profiler.Stop(step, scanned), 2)) + " s.")
+        except Exception as e:
+            Fail(e)
+
+    # the steps of the batch are reported once, with the first route
+    profile = profiler.Close()
+    for position, result in enumerate(results):
+        result["Profile"] = profile if position == 0 else []
+    return results
+
+
+def Model(Route: str, BufferSize: int, BufferSizeUnit: str, ScratchFolder: Optional[str] = None,
+          Metrics: Optional[List[str]] = None, CondominiumWithin: bool = False) -> Dict[str, Optional[int]]:
+    # same contract as Model in Model.py, a batch of one route. ScratchFolder
+    # is accepted for compatibility, this backend does not write any intermediate files
+    return BatchModel([Route], BufferSize, BufferSizeUnit, Metrics, CondominiumWithin)[0]
+
+
+def CachedBatchModel(Routes: List[str], BufferSize: int, BufferSizeUnit: str,
+                     UseCache: bool = True) -> List[Dict[str, Optional[int]]]:
+    # same results as BatchModel, but the routes with every metric in the
+    # cache (see ResultCache.py) are left out of the batch, and the others are
+    # evaluated for the metrics missing from the cache
+    if not UseCache:
+        return BatchModel(Routes, BufferSize, BufferSizeUnit)
+
+    cached: List[Dict[str, Optional[int]]] = []
+    keys: List[Dict[str, str]] = []
+    for Route in Routes:
+        found, routeKeys = {}, {}
+        try:
+            routeHash = ResultCache.RouteHash(Route)
+            routeKeys = {metric: ResultCache.MetricKey("batch", metric, routeHash, BufferSize, BufferSizeUnit)
+                         for metric in GetMetrics()}
+            for metric, key in routeKeys.items():
+                entry = ResultCache.Load(key)
+                if entry is not None and entry.get("metric") == metric:
+                    found[metric] = entry["value"]
+        except (OSError, ValueError):
+            # let the batch report the unreadable route
+            pass
+        cached.append(found)
+        keys.append(routeKeys)
+
+    pending = [position for position, found in enumerate(cached) if len(found) < len(GetMetrics())]
+    missing = [metric for metric in GetMetrics() if any(metric not in cached[position] for position in pending)]
+    print(str(len(Routes) - len(pending)) + " routes found in the cache, evaluating " + str(len(pending)) + " routes...")
+    evaluated = BatchModel([Routes[position] for position in pending], BufferSize, BufferSizeUnit, missing) if pending else []
+
+    results = [dict(found, Profile=[]) for found in cached]
+    try:
+        for position, result in zip(pending, evaluated):
+            for metric in missing:
+                if metric in result and metric not in cached[position] and metric in keys[position]:
+                    ResultCache.Store(keys[position][metric], {"metric": metric, "value": result[metric], "backend": "batch",
+                                                               "bufferSize": BufferSize, "bufferSizeUnit": BufferSizeUnit})
+    except OSError:
+        # read-only project folder, results are still returned
+        pass
+
+    for position, result in zip(pending, evaluated):
+        results[position] = dict(result, **cached[position])
+    return results
+
+
+if __name__ == '__main__':
+    # if not enough arguments, print usage
+    if len(argv) < 4:
+        print("Error: Missing arguments")
+        print("Usage: BatchModel.py <BufferSize> <BufferSizeUnit> <Route> [<Route> ...]")
+        exit(1)
+
+    scriptStartTime = time.time()
+    results = BatchModel(argv[3:], int(argv[1]), argv[2])
+
+    print("Script ended in " + str(round((time.time() - scriptStartTime), 2)) + " s.")
+    print("\nResult:")
+    table = pd.DataFrame([{metric: result.get(metric) for metric in GetMetrics() + ["Error"]} for result in results],
+                         index=pd.Index(argv[3:], name="Route")).dropna(axis=1, how="all")
+    with pd.option_context("display.width", 200, "display.max_columns", 10):
+        print(table)
@@ -0,0 +1,349 @@
+"""
+Benchmark suite of the evaluation pipeline on synthetic routes and reference layers.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+The benchmark runs offline and without ArcGIS Pro. It generates, in a
+temporary folder laid out like the Data folder:
+
+- synthetic reference layers over the extent of Toronto, with the number of
+  places of interest, subway stations, intersections, zoning areas, BIAs and
+  property parcels of the chosen scale (see BenchmarkScales)
+- synthetic closed marathon routes of MarathonLength metres with the chosen
+  number of vertices, and a RoutesPaths.txt listing them
+
+and times with the NumPy backend:
+
+- every step of Model (median over the routes and repeats, see Profiling.py)
+- full Model calls, the first one (reading the layers and building their
+  indexes) and the following ones separately
+- a batch of RunModelOnRoutesFromFile on all the routes, route by route with
+  the numpy backend and in one pass per layer with the batch backend
+  (BatchModel.py). Both must give the same results.
+- Rank, TopRoutes and ParetoRoutes over a table of random candidate routes
+
+The timings are saved as a machine-readable baseline in
+Benchmarks/{Scale}.json at the root of the project. A run is compared with the
+saved baseline, and any timing slower than the baseline by more than the
+regression threshold (RegressionThreshold, 25% by default) is reported and
+makes the script exit with an error. The data is generated from a fixed seed,
+so the runs of the same scale are comparable.
+
+Example Usage (run the quick benchmark and compare it with its baseline):
+python Benchmark.py
+
+Example Usage (run at the scale of Toronto and save it as the new baseline):
+python Benchmark.py toronto --save
+
+Example Usage (use a 10% regression threshold):
+python Benchmark.py quick --threshold 0.1
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+from contextlib import redirect_stdout
+from sys import argv
+import numpy as np
+import pandas as pd
+import platform
+import tempfile
+import shutil
+import time
+import json
+import os
+
+from Shapefile import Layer, WriteLayer
+from Model import GetMetrics
+from Ranking import Rank, ConvertToMaximizingMetrics, TopRoutes, ParetoRoutes
+import NumpyModel
+import Geometry
+import Runner
+
+benchmarkFolder = NumpyModel.rootFolder + "Benchmarks" + os.sep
+
+# number of features of every synthetic layer, routes and candidates per scale.
+# "toronto" is about the size of the real Toronto open data layers.
+BenchmarkScales = {
+    "quick": {"poi": 200, "subway": 75, "intersections": 1100, "zoning": 3000, "bia": 85,
+              "property": 40000, "routes": 4, "routeVertices": 1200, "candidates": 10000, "repeats": 3},
+    "toronto": {"poi": 2000, "subway": 75, "intersections": 10000, "zoning": 15000, "bia": 85,
+                "property": 500000, "routes": 8, "routeVertices": 5000, "candidates": 100000, "repeats": 3},
+}
+
+# extent of the synthetic layers in metres around Toronto City Hall (see Geometry.ToMetres)
+Extent = (-20000.0, -6000.0, 20000.0, 20000.0)
+
+MarathonLength = 42195.0
+BenchmarkBufferSize = 100
+BenchmarkBufferSizeUnit = "Meters"
+BenchmarkSeed = 2024
+
+# a timing slower than the baseline by more than this fraction is a regression.
+# Timings under MIN_COMPARED_TIME seconds are too noisy to be compared.
+RegressionThreshold = 0.25
+MIN_COMPARED_TIME = 0.01
+
+ResidentialZoneShare = 0.4
+CondominiumShare = 0.05
+
+
+def PointLayer(xy: np.ndarray) -> Layer:
+    lonlat = Geometry.ToLonLat(xy)
+    offsets = np.arange(len(xy) + 1, dtype=np.int64)
+    return Layer(1, lonlat, offsets, offsets, np.concatenate([lonlat, lonlat], axis=1), {})
+
+
+def PolygonLayer(rng: np.random.Generator, centres: np.ndarray, minRadius: float, maxRadius: float,
+                 vertices: int) -> Layer:
+    # star shaped polygons around the centres, one closed clockwise ring each
+    count = len(centres)
+    angles = -np.linspace(0, 2 * np.pi, vertices, endpoint=False)[None, :] + rng.uniform(0, 2 * np.pi, (count, 1))
+    radii = rng.uniform(minRadius, maxRadius, (count, 1)) * rng.uniform(0.6, 1.0, (count, vertices))
+    rings = centres[:, None, :] + radii[..., None] * np.stack([np.cos(angles), np.sin(angles)], axis=-1)
+    rings = np.concatenate([rings, rings[:, :1]], axis=1)
+
+    lonlat = Geometry.ToLonLat(rings.reshape(-1, 2))
+    perRing = lonlat.reshape(count, vertices + 1, 2)
+    bboxes = np.concatenate([perRing.min(axis=1), perRing.max(axis=1)], axis=1)
+    partOffsets = np.arange(count + 1, dtype=np.int64) * (vertices + 1)
+    return Layer(5, lonlat, partOffsets, np.arange(count + 1, dtype=np.int64), bboxes, {})
+
+
+def RandomPoints(rng: np.random.Generator, count: int) -> np.ndarray:
+    return rng.uniform(Extent[0:2], Extent[2:4], (count, 2))
+
+
+def GenerateLayers(folder: str, scale: Dict[str, int], rng: np.random.Generator):
+    # reference layers of the model, at the same paths relative to folder as under the Data folder
+    layers = {}
+    layers[NumpyModel.POIFeature] = PointLayer(RandomPoints(rng, scale["poi"]))
+    layers[NumpyModel.SubwayFeature] = PointLayer(RandomPoints(rng, scale["subway"]))
+    layers[NumpyModel.HighTrafficFeature] = PointLayer(RandomPoints(rng, scale["intersections"]))
+
+    zoning = PolygonLayer(rng, RandomPoints(rng, scale["zoning"]), 50, 300, 8)
+    residential = rng.random(len(zoning)) < ResidentialZoneShare
+    zoning.attributes["GEN_ZON2"] = np.where(residential, rng.choice(NumpyModel.ResidentialZoneCodes, len(zoning)),
+                                             rng.choice([1, 4, 6, 201, 202], len(zoning)))
+    layers[NumpyModel.ZoningFeature] = zoning
+
+    layers[NumpyModel.BIAFeature] = PolygonLayer(rng, RandomPoints(rng, scale["bia"]), 300, 1500, 24)
+
+    parcels = PolygonLayer(rng, RandomPoints(rng, scale["property"]), 8, 30, 5)
+    parcels.attributes["F_TYPE"] = np.where(rng.random(len(parcels)) < CondominiumShare, NumpyModel.CondominiumType,
+                                            rng.choice(["COMMON", "CORRIDOR", "RESERVE"], len(parcels)))
+    layers[NumpyModel.PropertyFeature] = parcels
+
+    for relativePath, layer in layers.items():
+        os.makedirs(os.path.dirname(folder + relativePath), exist_ok=True)
+        WriteLayer(folder + relativePath, layer)
+
+
+def RouteLayer(rng: np.random.Generator, vertices: int) -> Layer:
+    # closed loop of MarathonLength metres around downtown, as an open polyline
+    # (the model closes it), wiggling with a few random harmonics
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radius = np.ones(vertices)
+    for harmonic in range(2, 7):
+        radius += rng.uniform(0, 0.3 / harmonic) * np.sin(harmonic * angles + rng.uniform(0, 2 * np.pi))
+    xy = np.stack([radius * np.cos(angles) * 1.6, radius * np.sin(angles)], axis=1)
+    length = np.hypot(*np.diff(np.concatenate([xy, xy[:1]]), axis=0).T).sum()
+    xy = xy * (MarathonLength / length) + rng.uniform([-3000, 0], [3000, 4000])
+
+    lonlat = Geometry.ToLonLat(xy)
+    bbox = np.concatenate([lonlat.min(axis=0), lonlat.max(axis=0)])[None, :]
+    return Layer(3, lonlat, np.array([0, vertices]), np.array([0, 1]), bbox, {"Id": np.zeros(1, dtype=np.int64)})
+
+
+def GenerateRoutes(folder: str, scale: Dict[str, int], rng: np.random.Generator) -> Tuple[List[Tuple[str, str]], str]:
+    # (name, path) of the routes and the RoutesPaths.txt listing them
+    routes = []
+    for i in range(scale["routes"]):
+        name = "Synthetic-" + str(i + 1)
+        path = folder + "Routes" + os.sep + name + ".shp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        WriteLayer(path, RouteLayer(rng, scale["routeVertices"]))
+        routes.append((name, path))
+
+    # RoutesPaths.txt holds paths relative to the Data folder with Windows separators
+    routesPath = folder + "RoutesPaths.txt"
+    with open(routesPath, "w") as file:
+        file.write("Route,Path\n")
+        for name, path in routes:
+            file.write(name + "," + os.path.relpath(path, NumpyModel.rootFolder + "Data").replace(os.sep, "\\") + "\n")
+    return routes, routesPath
+
+
+def CandidateTable(rng: np.random.Generator, candidates: int) -> pd.DataFrame:
+    # random metrics of candidate routes with a weight row, like Results.csv
+    values = {metric: rng.integers(0, 1000, candidates) for metric in GetMetrics()}
+    df = pd.DataFrame(values, index=["Candidate-" + str(i + 1) for i in range(candidates)])
+    df.loc["weight"] = rng.integers(1, 4, len(GetMetrics()))
+    return df
+
+
+def Time(function: Callable[[], object], repeats: int = 1) -> List[float]:
+    # wall time of every call, the output of the calls is discarded
+    timings = []
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        for _ in range(repeats):
+            startTime = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - startTime)
+    return timings
+
+
+def RunBenchmarks(scaleName: str, folder: str) -> Dict[str, float]:
+    # median wall time (seconds) of every benchmark
+    scale = BenchmarkScales[scaleName]
+    rng = np.random.default_rng(BenchmarkSeed)
+
+    print("Generating synthetic layers and routes in " + folder + "...")
+    GenerateLayers(folder, scale, rng)
+    routes, routesPath = GenerateRoutes(folder, scale, rng)
+
+    results = {}
+    dataFolder = NumpyModel.dataFolder
+    NumpyModel.dataFolder = folder
+    try:
+        print("Timing Model...")
+        steps = {}
+        firstCall = True
+        for _, route in routes:
+            for _ in range(scale["repeats"]):
+                result = {}
+
+                def Evaluate():
+                    result.update(NumpyModel.Model(route, BenchmarkBufferSize, BenchmarkBufferSizeUnit))
+
+                timing = Time(Evaluate)[0]
+                if "Error" in result:
+                    raise RuntimeError("Model failed on " + route + ": " + result["Error"])
+                # the first call reads the layers and builds their indexes
+                if firstCall:
+                    results["Model (first call)"] = timing
+                    firstCall = False
+                    continue
+                steps.setdefault("Model", []).append(timing)
+                for step in result["Profile"]:
+                    steps.setdefault("Model: " + step["step"], []).append(step["wall"])
+        results.update({name: float(np.median(timings)) for name, timings in steps.items()})
+
+        print("Timing RunModelOnRoutesFromFile...")
+        tables = {}
+        for backend, name in (("numpy", "RunModelOnRoutesFromFile"), ("batch", "RunModelOnRoutesFromFile batch")):
+
+            def RunBatch():
+                tables[backend] = Runner.RunModelOnRoutesFromFile(backend, 1, False, None, routesPath,
+                                                                  BenchmarkBufferSize, BenchmarkBufferSizeUnit)
+
+            results[name + " (" + str(len(routes)) + " routes)"] = float(np.median(Time(RunBatch, scale["repeats"])))
+        if not tables["batch"].equals(tables["numpy"]):
+            raise RuntimeError("The batch backend differs from the numpy backend")
+
+        print("Timing Rank...")
+        table = CandidateTable(rng, scale["candidates"])
+        results["Rank (" + str(scale["candidates"]) + " candidates)"] = float(np.median(Time(
+            lambda: Rank(ConvertToMaximizingMetrics(table.copy())), scale["repeats"])))
+        results["TopRoutes (" + str(scale["candidates"]) + " candidates)"] = float(np.median(Time(
+            lambda: TopRoutes(table, 10), scale["repeats"])))
+        results["ParetoRoutes (" + str(scale["candidates"]) + " candidates)"] = float(np.median(Time(
+            lambda: ParetoRoutes(table), scale["repeats"])))
+    finally:
+        NumpyModel.dataFolder = dataFolder
+
+    return results
+
+
+def BaselinePath(scaleName: str) -> str:
+    return benchmarkFolder + scaleName + ".json"
+
+
+def SaveBaseline(scaleName: str, results: Dict[str, float]):
+    os.makedirs(benchmarkFolder, exist_ok=True)
+    baseline = {
+        "scale": scaleName,
+        "sizes": BenchmarkScales[scaleName],
+        "seed": BenchmarkSeed,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": platform.platform(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "results": results,
+    }
+    with open(BaselinePath(scaleName), "w") as file:
+        json.dump(baseline, file, indent=2)
+
+
+def LoadBaseline(scaleName: str) -> Optional[Dict]:
+    if not os.path.exists(BaselinePath(scaleName)):
+        return None
+    with open(BaselinePath(scaleName), "r") as file:
+        return json.load(file)
+
+
+def FindRegressions(results: Dict[str, float], baseline: Dict[str, float],
+                    threshold: float = RegressionThreshold) -> List[Tuple[str, float, float]]:
+    # (benchmark, baseline, current) of the benchmarks slower than the baseline by more than threshold
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None or max(previous, current) < MIN_COMPARED_TIME:
+            continue
+        if current > previous * (1 + threshold):
+            regressions.append((name, previous, current))
+    return regressions
+
+
+if __name__ == "__main__":
+    print("Starting script...")
+    scriptStartTime = time.time()
+
+    # --save and --threshold {fraction} can be given anywhere after the script name
+    arguments = argv[1:]
+    save = "--save" in arguments
+    threshold = RegressionThreshold
+    if "--threshold" in arguments:
+        position = arguments.index("--threshold")
+        threshold = float(arguments[position + 1])
+        del arguments[position:position + 2]
+    arguments = [argument for argument in arguments if argument != "--save"]
+
+    scaleName = arguments[0] if len(arguments) > 0 else "quick"
+    if scaleName not in BenchmarkScales:
+        print("Error: Unknown scale " + scaleName + ", expected one of " + ", ".join(BenchmarkScales))
+        exit(1)
+
+    folder = tempfile.mkdtemp(prefix="TWM_Benchmark_") + os.sep
+    try:
+        results = RunBenchmarks(scaleName, folder)
+    finally:
+        shutil.rmtree(folder, True)
+
+    baseline = LoadBaseline(scaleName)
+    print("\nResults (" + scaleName + "):")
+    for name, value in results.items():
+        previous = baseline["results"].get(name) if baseline else None
+        comparison = "" if not previous else " (baseline " + str(round(previous, 4)) + " s, " + \
+            str(round((value / previous - 1) * 100, 1)) + "%)"
+        print(f"{name}: {round(value, 4)} s{comparison}")
+
+    regressions = FindRegressions(results, baseline["results"], threshold) if baseline else []
+
+    if save:
+        SaveBaseline(scaleName, results)
+        print("\nBaseline saved to " + BaselinePath(scaleName))
+    elif baseline is None:
+        print("\nNo baseline found for " + scaleName + ", run with --save to create " + BaselinePath(scaleName))
+
+    print("Script ended in", round(time.time() - scriptStartTime, 2), "s")
+
+    if regressions and not save:
+        print("\n" + str(len(regressions)) + " regressions over " + str(round(threshold * 100)) + "%:")
+        for name, previous, current in regressions:
+            print(f"{name}: {round(previous, 4)} s -> {round(current, 4)} s")
+        exit(1)
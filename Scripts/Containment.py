@@ -0,0 +1,149 @@
+"""
+Vectorized point-in-polygon engine for the condominiums within the closed route.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+Step 9 of Model.py closes the route into a polygon and selects the condominium
+parcels WITHIN it. Here every parcel is reduced once to a representative point,
+a point guaranteed to be inside the parcel (its centroid when that is inside,
+otherwise the middle of its widest section). The points of the condominium
+parcels are saved next to the layer as {LayerName}.shp.F_TYPE-CONDO.twmrep.npz
+together with the fingerprint of the layer, like the spatial index, so a route
+evaluation never reads the property layer. A route is then a single batched
+even-odd test of those points against the closed route ring, with a bbox and a
+grid prefilter: points in grid cells not touched by the ring are classified by
+the centre of their cell.
+
+A parcel straddling the route counts when its representative point is inside
+the ring, while WITHIN in Model.py only counts the parcels entirely inside.
+The exact WITHIN test (every vertex inside the ring and no edge crossing it) is
+kept as an opt-in slower path, see the CondominiumWithin argument of Model in
+NumpyModel.py.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Optional, Tuple
+import numpy as np
+import os
+import re
+
+from Shapefile import Layer, ReadAttributes, ReadLayerFeatures, NormalisePath
+from SpatialIndex import Fingerprint
+import Geometry
+
+# bump when the way the representative points are chosen changes
+REPRESENTATIVE_VERSION = 1
+REPRESENTATIVE_SUFFIX = ".twmrep.npz"
+
+# target number of ring edges per cell of the prefilter grid
+EDGES_PER_CELL = 4
+
+
+def RepresentativePoints(layer: Layer) -> np.ndarray:
+    # lon/lat of a point inside every polygon of the layer, NaN for null shapes
+    points = np.full((len(layer), 2), np.nan)
+    if len(layer.xy) == 0:
+        return points
+    a, b, edgeFeature = Geometry.PolygonEdges(layer.Metres(), layer.partOffsets, layer.featureOffsets)
+
+    # area weighted centroid of the rings, holes have the opposite orientation
+    cross = a[:, 0] * b[:, 1] - b[:, 0] * a[:, 1]
+    area = np.bincount(edgeFeature, cross, minlength=len(layer)) / 2
+    centroidX = np.bincount(edgeFeature, (a[:, 0] + b[:, 0]) * cross, minlength=len(layer))
+    centroidY = np.bincount(edgeFeature, (a[:, 1] + b[:, 1]) * cross, minlength=len(layer))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        points = np.stack([centroidX, centroidY], axis=1) / (6 * area[:, None])
+
+    # degenerate polygons fall back to the centre of their bbox
+    boxes = layer.MetreBoxes()
+    degenerate = ~np.isfinite(points).all(axis=1)
+    points[degenerate] = (boxes[degenerate, 0:2] + boxes[degenerate, 2:4]) / 2
+
+    # even-odd test of every centroid against the edges of its own polygon
+    p = points[edgeFeature]
+    spans = (a[:, 1] > p[:, 1]) != (b[:, 1] > p[:, 1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossingX = a[:, 0] + (p[:, 1] - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+    crossings = np.bincount(edgeFeature, spans & (p[:, 0] < crossingX), minlength=len(layer))
+    inside = crossings % 2 == 1
+
+    # concave polygons: middle of the widest section at the height of the centroid
+    for feature in np.flatnonzero(~inside & np.isfinite(points).all(axis=1)):
+        edges = np.flatnonzero((edgeFeature == feature) & spans)
+        sections = np.sort(crossingX[edges])
+        if len(sections) >= 2:
+            widest = np.argmax(sections[1::2] - sections[0::2][:len(sections) // 2])
+            points[feature] = [(sections[2 * widest] + sections[2 * widest + 1]) / 2, points[feature, 1]]
+
+    return Geometry.ToLonLat(points)
+
+
+def RepresentativePointsPath(shpPath: str, field: str, value: str) -> str:
+    return shpPath + "." + re.sub(r"[^A-Za-z0-9_]", "_", field) + "-" + re.sub(r"[^A-Za-z0-9_]", "_", value) + REPRESENTATIVE_SUFFIX
+
+
+def LoadOrBuildRepresentativePoints(shpPath: str, field: str, value: str) -> Tuple[np.ndarray, np.ndarray]:
+    # (feature ids, lon/lat points) of the features with field == value,
+    # saved next to the layer and rebuilt when the layer changes
+    shpPath = NormalisePath(shpPath)
+    fingerprint = np.append(Fingerprint(shpPath), REPRESENTATIVE_VERSION)
+    path = RepresentativePointsPath(shpPath, field, value)
+    if os.path.exists(path):
+        try:
+            with np.load(path) as data:
+                if np.array_equal(data["fingerprint"], fingerprint):
+                    return data["features"], data["points"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    values = ReadAttributes(os.path.splitext(shpPath)[0] + ".dbf", [field])[field]
+    features = np.flatnonzero(values == value)
+    points = RepresentativePoints(ReadLayerFeatures(shpPath, features, []))
+
+    try:
+        # write to a temporary file first so concurrent readers never see a partial file
+        temporaryPath = path + "." + str(os.getpid()) + ".tmp.npz"
+        np.savez(temporaryPath, features=features, points=points, fingerprint=fingerprint)
+        os.replace(temporaryPath, path)
+    except OSError:
+        # read-only data folder, keep the points in memory only
+        pass
+    return features, points
+
+
+def PointsInRing(points: np.ndarray, ring: np.ndarray, cellSize: Optional[float] = None) -> np.ndarray:
+    # even-odd test of points (metres) against a single closed ring
+    inside = np.zeros(len(points), dtype=bool)
+    if len(points) == 0 or len(ring) < 3:
+        return inside
+    ringOffsets = np.array([0, len(ring)])
+    low, high = ring.min(axis=0), ring.max(axis=0)
+    candidates = np.flatnonzero((points[:, 0] >= low[0]) & (points[:, 0] <= high[0]) &
+                                (points[:, 1] >= low[1]) & (points[:, 1] <= high[1]))
+    if len(candidates) == 0:
+        return inside
+
+    a, b = Geometry.LineSegments(ring, ringOffsets)
+    if cellSize is None:
+        cellSize = max(np.sqrt(np.prod(np.maximum(high - low, 1.0)) * EDGES_PER_CELL / max(len(a), 1)), 1.0)
+
+    # cells touched by the bbox of an edge, every other cell is entirely inside or outside
+    edgeCells, _, _ = Geometry.BucketBoxes(np.concatenate([np.minimum(a, b), np.maximum(a, b)], axis=1), cellSize)
+    cellX = np.floor(points[candidates, 0] / cellSize).astype(np.int64)
+    cellY = np.floor(points[candidates, 1] / cellSize).astype(np.int64)
+    keys = Geometry.CellKey(cellX, cellY)
+    nearEdge = np.isin(keys, edgeCells)
+
+    inside[candidates[nearEdge]] = Geometry.PointsInRings(points[candidates[nearEdge]], ring, ringOffsets)
+
+    cells, inverse = np.unique(keys[~nearEdge], return_inverse=True)
+    if len(cells):
+        centreX, centreY = Geometry.CellIndices(cells)
+        centres = (np.stack([centreX, centreY], axis=1) + 0.5) * cellSize
+        inside[candidates[~nearEdge]] = Geometry.PointsInRings(centres, ring, ringOffsets)[inverse]
+    return inside
+
@@ -0,0 +1,416 @@
+"""
+Beam search of candidate courses built from the stretches of the hand-drawn routes.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+The Proto 1.x and 2.x routes follow the baseline route for most of the course
+and leave it for a few detours (e.g. the Leslie St detour). The segment library
+is the set of these detours: every run of vertices of a route further than
+JUNCTION_DISTANCE from the baseline, which leaves and rejoins the baseline
+further along the course, is a swap that replaces the stretch of the baseline
+between its two junctions. Detours drawn the same way on several routes are
+kept once. A candidate course is the baseline with a set of swaps that do not
+overlap, so every candidate keeps the start and the finish of the baseline
+(detours through the start or the finish are left out of the library) and is
+a closed course when the baseline is.
+
+Candidates are scored in process by the incremental backend (see
+Incremental.py): a swap only changes the segments around it, the other
+segments are read from the segment cache, so a candidate costs a fraction of a
+full Model run. The score is the Overall Weighted Score of Rank (see
+Ranking.py) among the hand-drawn routes and every candidate evaluated so far,
+with the weights of the weight row of a csv file (Results.csv by default).
+
+The baseline is the certified 2023 course: the length of a candidate is the
+length of its drawing scaled by MARATHON_LENGTH over the length of the drawing
+of the baseline, so the errors of the drawing (the baseline is drawn 43.1 km
+long) do not count against the candidates.
+
+The beam starts from the baseline. At every step, every course of the beam is
+extended with every swap it can take, the new candidates whose length can
+still reach MARATHON_LENGTH (within SEARCH_LENGTH_SLACK) are scored in
+parallel, and the BEAM_WIDTH best become the next beam, the courses within
+LENGTH_TOLERANCE of MARATHON_LENGTH first. The search stops when the beam
+cannot be extended or after the given number of candidates. Only the
+candidates within LENGTH_TOLERANCE are reported: SearchResults.csv has the
+metrics of the hand-drawn routes and of the best candidates with the weight
+row (it can be passed to Ranking.py), SearchVariants.csv has the length, the
+score and the swaps of every reported candidate, and the best candidates are
+written as shapefiles to the Search folder.
+
+Example Usage (up to 20000 candidates at 100 metres with 8 workers, the 10
+best written as shapefiles):
+python CourseSearch.py 100 Meters --candidates 20000 --workers 8 --export 10
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Dict, Tuple
+from sys import argv
+import numpy as np
+import pandas as pd
+import time
+import os
+
+from Shapefile import Layer, WriteLayer
+from Ranking import MergeCsvFiles, SplitWeights, MaximizingSigns
+from Sensitivity import RankMatrix, Scores
+from Model import GetMetrics
+import NumpyModel
+import Incremental
+import ResultCache
+import Geometry
+
+# length of the course and the largest difference of a reported candidate (metres)
+MARATHON_LENGTH = 42195.0
+LENGTH_TOLERANCE = 100.0
+
+# candidates further than this from MARATHON_LENGTH are not scored (metres)
+SEARCH_LENGTH_SLACK = 10000.0
+
+# vertices of a route further than this from the baseline belong to a detour (metres)
+JUNCTION_DISTANCE = 25.0
+
+# shortest stretch of the baseline or of a route making a detour (metres)
+MIN_DETOUR_LENGTH = 200.0
+
+# smallest cosine of the angle between a route and a baseline segment it follows
+DIRECTION_COSINE = 0.5
+
+# detours whose junctions and length are all within this of each other are the same swap (metres)
+SWAP_TOLERANCE = 25.0
+
+# largest distance between the start and the finish of a closed course (metres)
+START_FINISH_DISTANCE = 50.0
+
+# courses kept at every step of the search
+BEAM_WIDTH = 64
+
+# default number of candidates scored, and candidates sent to a worker at once
+DEFAULT_CANDIDATES = 10000
+CANDIDATE_CHUNK = 16
+
+
+class Swap:
+    def __init__(self, name: str, firstSegment: int, lastSegment: int, lonlat: np.ndarray, metres: np.ndarray,
+                 lengthChange: float):
+        # the vertices of the detour replace the baseline after the vertex
+        # firstSegment and before the vertex lastSegment + 1
+        self.name = name
+        self.firstSegment = firstSegment
+        self.lastSegment = lastSegment
+        self.lonlat = lonlat
+        self.metres = metres
+        self.lengthChange = lengthChange
+
+
+def PathLength(xy: np.ndarray) -> float:
+    return float(np.hypot(*np.diff(xy, axis=0).T).sum()) if len(xy) > 1 else 0.0
+
+
+def BuildCourse(baseline: Layer, swaps: List[Swap]) -> Layer:
+    # the baseline with the swaps, ordered along the course and not overlapping
+    lonlat, metres = [], []
+    start = 0
+    for swap in swaps:
+        lonlat += [baseline.xy[start:swap.firstSegment + 1], swap.lonlat]
+        metres += [baseline.Metres()[start:swap.firstSegment + 1], swap.metres]
+        start = swap.lastSegment + 1
+    lonlat.append(baseline.xy[start:])
+    metres.append(baseline.Metres()[start:])
+    lonlat, metres = np.concatenate(lonlat), np.concatenate(metres)
+    return Layer(baseline.shapeType, lonlat, np.array([0, len(lonlat)], dtype=np.int64), np.array([0, 1], dtype=np.int64),
+                 np.concatenate([lonlat.min(axis=0), lonlat.max(axis=0)])[None, :], baseline.attributes, "",
+                 None, metres)
+
+
+def MatchMeasures(xy: np.ndarray, grid: Geometry.SegmentGrid, measures: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # (measure, segment) of the baseline matched by every vertex of a route,
+    # (NaN, -1) for the vertices away from the baseline. A vertex matches the
+    # baseline segments within JUNCTION_DISTANCE running the same way, so the
+    # two lanes of an out and back stretch are told apart, and of these the
+    # one closest to the measure expected from the distance run since the last match.
+    directions = np.gradient(xy, axis=0) if len(xy) > 1 else np.zeros_like(xy)
+    matched, matchedSegments = np.full(len(xy), np.nan), np.full(len(xy), -1, dtype=np.int64)
+    expected = 0.0
+    for vertex, point in enumerate(xy):
+        if vertex > 0:
+            expected += float(np.hypot(*(point - xy[vertex - 1])))
+        candidates = grid.SegmentsNearBox(np.concatenate([point, point]), JUNCTION_DISTANCE)
+        if len(candidates) == 0:
+            continue
+        a, b = grid.a[candidates], grid.b[candidates]
+        ab = b - a
+        lengths = np.maximum((ab ** 2).sum(axis=1), 1e-12)
+        t = np.clip(((point - a) * ab).sum(axis=1) / lengths, 0, 1)
+        distances = np.hypot(*(a + t[:, None] * ab - point).T)
+        cosines = (ab @ directions[vertex]) / np.sqrt(lengths) / max(float(np.hypot(*directions[vertex])), 1e-12)
+        near = np.flatnonzero((distances <= JUNCTION_DISTANCE) & (cosines >= DIRECTION_COSINE))
+        if len(near) == 0:
+            continue
+        candidateMeasures = measures[candidates[near]] + t[near] * np.sqrt(lengths[near])
+        best = int(np.argmin(np.abs(candidateMeasures - expected)))
+        matched[vertex], matchedSegments[vertex] = candidateMeasures[best], candidates[near][best]
+        expected = matched[vertex]
+
+    # the matches that break the order along the baseline (i.e. a vertex of a
+    # turnaround matched to the other lane) are dropped
+    found = np.flatnonzero(matchedSegments >= 0)
+    kept = found[LongestNonDecreasing(matched[found])]
+    dropped = np.setdiff1d(found, kept)
+    matched[dropped], matchedSegments[dropped] = np.nan, -1
+    return matched, matchedSegments
+
+
+def LongestNonDecreasing(values: np.ndarray) -> np.ndarray:
+    # positions of a longest non-decreasing subsequence of values (patience sorting)
+    tails, tailPositions = [], []
+    previous = np.full(len(values), -1, dtype=np.int64)
+    for position, value in enumerate(values):
+        length = int(np.searchsorted(tails, value, side="right"))
+        if length > 0:
+            previous[position] = tailPositions[length - 1]
+        if length == len(tails):
+            tails.append(value)
+            tailPositions.append(position)
+        else:
+            tails[length], tailPositions[length] = value, position
+    positions = []
+    position = tailPositions[-1] if len(tailPositions) > 0 else -1
+    while position >= 0:
+        positions.append(position)
+        position = previous[position]
+    return np.array(positions[::-1], dtype=np.int64)
+
+
+def Detours(route: Layer, grid: Geometry.SegmentGrid) -> List[Tuple[int, int, float, float, int, int]]:
+    # (entry vertex, exit vertex, entry measure, exit measure, entry segment,
+    # exit segment) of every detour of the route from the baseline of the grid:
+    # the runs of vertices away from the baseline, and the jumps along the
+    # baseline that the distance run along the route does not account for
+    # (i.e. a shorter out and back). The stretches of the route before its
+    # first and after its last match would move the start or the finish, they
+    # are left out.
+    xy = route.Metres()
+    measures = np.concatenate([[0.0], np.cumsum(np.hypot(*(grid.b - grid.a).T))])
+    matched, segments = MatchMeasures(xy, grid, measures)
+    run = np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(xy, axis=0).T))])
+    found = np.flatnonzero(segments >= 0)
+    detours = []
+    for entry, exit in zip(found[:-1], found[1:]):
+        if exit == entry + 1 and abs((matched[exit] - matched[entry]) - (run[exit] - run[entry])) <= SWAP_TOLERANCE:
+            continue
+        # the small differences of two drawings of the same streets are not detours
+        if max(matched[exit] - matched[entry], run[exit] - run[entry]) < MIN_DETOUR_LENGTH:
+            continue
+        # a detour running against the baseline does not replace a stretch of it
+        if matched[exit] <= matched[entry] or segments[exit] < segments[entry]:
+            continue
+        detours.append((int(entry), int(exit), matched[entry], matched[exit], int(segments[entry]), int(segments[exit])))
+    return detours
+
+
+def SwapLibrary(baseline: Layer, routes: List[Tuple[str, Layer]]) -> List[Swap]:
+    # the detours of the routes from the baseline, ordered along the course,
+    # each detour drawn on several routes kept once
+    if len(baseline) != 1 or len(baseline.partOffsets) != 2:
+        raise ValueError("The baseline route must be a single polyline")
+    a, b = Geometry.LineSegments(baseline.Metres(), baseline.partOffsets)
+    grid = Geometry.SegmentGrid(a, b, JUNCTION_DISTANCE)
+    swaps, bounds = [], []
+    for name, route in routes:
+        for number, (entry, exit, entryMeasure, exitMeasure, firstSegment, lastSegment) in enumerate(Detours(route, grid)):
+            metres = route.Metres()[entry:exit + 1]
+            detourLength = PathLength(metres)
+            if any(abs(entryMeasure - other[0]) <= SWAP_TOLERANCE and abs(exitMeasure - other[1]) <= SWAP_TOLERANCE and
+                   abs(detourLength - other[2]) <= SWAP_TOLERANCE for other in bounds):
+                continue
+            bounds.append((entryMeasure, exitMeasure, detourLength))
+            swap = Swap(name + " #" + str(number + 1), firstSegment, lastSegment, route.xy[entry:exit + 1], metres, 0.0)
+            swap.lengthChange = PathLength(BuildCourse(baseline, [swap]).Metres()) - PathLength(baseline.Metres())
+            swaps.append(swap)
+    return sorted(swaps, key=lambda swap: (swap.firstSegment, swap.lastSegment))
+
+
+def Extensions(state: Tuple[int, ...], swaps: List[Swap]) -> List[Tuple[int, ...]]:
+    # the courses with one more swap, the swaps of a course are kept ordered
+    # along the course and must not share a segment of the baseline
+    extensions = []
+    for candidate, swap in enumerate(swaps):
+        if candidate in state:
+            continue
+        if all(swaps[other].lastSegment < swap.firstSegment or swap.lastSegment < swaps[other].firstSegment for other in state):
+            extensions.append(tuple(sorted(state + (candidate,), key=lambda index: swaps[index].firstSegment)))
+    return extensions
+
+
+# baseline and library of the current worker process, see InitialiseSearchWorker
+_workerSearch: Dict[str, object] = {}
+
+
+def InitialiseSearchWorker(baseline: Layer, swaps: List[Swap], bufferMetres: float, metrics: List[str]):
+    _workerSearch.update(baseline=baseline, swaps=swaps, bufferMetres=bufferMetres, metrics=metrics,
+                         fingerprints=Incremental.LayerFingerprints())
+
+
+def EvaluateStates(states: List[Tuple[int, ...]]) -> List[Dict[str, Optional[int]]]:
+    # metrics of the courses, run in a worker process. A failing course is
+    # reported in its result instead of being raised so it does not stop the search.
+    results = []
+    for state in states:
+        try:
+            course = BuildCourse(_workerSearch["baseline"], [_workerSearch["swaps"][index] for index in state])
+            results.append(Incremental.EvaluateLayer(course, _workerSearch["bufferMetres"], _workerSearch["metrics"],
+                                                     _workerSearch["fingerprints"]))
+        except Exception as e:
+            results.append({"Error": str(e)})
+    return results
+
+
+def LoadWeights(path: Optional[str], metrics: List[str]) -> np.ndarray:
+    # weight of every metric from the weight row of a csv file, 1 without a
+    # weight row, 0 for the metrics without a weight (left out as by Rank)
+    if path is None or not os.path.exists(path):
+        return np.ones(len(metrics))
+    df = MergeCsvFiles([path])
+    _, _, weights = SplitWeights(df)
+    weights = pd.Series(weights, index=df.columns).reindex(metrics).to_numpy(dtype=float)
+    return np.nan_to_num(weights, nan=0.0)
+
+
+def OverallScores(values: np.ndarray, weights: np.ndarray, metrics: List[str]) -> np.ndarray:
+    # Overall Weighted Score of Rank of every row of values (rows x metrics)
+    ranks, counts = RankMatrix(values * MaximizingSigns(metrics))
+    return Scores(weights[None, :], ranks, counts)[0]
+
+
+def CourseSearch(BufferSize: int, BufferSizeUnit: str, routes: List[Tuple[str, str]], candidates: int = DEFAULT_CANDIDATES,
+                 workers: int = 1, weightsPath: Optional[str] = None,
+                 beamWidth: int = BEAM_WIDTH) -> Tuple[pd.DataFrame, pd.DataFrame, Dict[str, Layer]]:
+    # (metrics of the hand-drawn routes and of the candidates within
+    # LENGTH_TOLERANCE with the weight row, length, score and swaps of these
+    # candidates, their courses), see the module docstring. The first route is the baseline.
+    metrics = GetMetrics()
+    bufferMetres = Geometry.BufferSizeInMetres(BufferSize, BufferSizeUnit)
+    weights = LoadWeights(weightsPath, metrics)
+    layers = [(name, NumpyModel.LoadRoute(route)) for name, route in routes]
+    baseline = layers[0][1]
+    swaps = SwapLibrary(baseline, layers[1:])
+    baseLength = PathLength(baseline.Metres())
+    closed = np.hypot(*(baseline.Metres()[0] - baseline.Metres()[-1])) <= START_FINISH_DISTANCE
+    print(f"Segment library: {len(swaps)} swaps from {len(layers) - 1} routes, baseline of {round(baseLength)} m" +
+          ("" if closed else " (the baseline is not a closed course)"))
+
+    InitialiseSearchWorker(baseline, swaps, bufferMetres, metrics)
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=InitialiseSearchWorker,
+                                   initargs=(baseline, swaps, bufferMetres, metrics)) if workers > 1 else None
+
+    def Evaluate(states: List[Tuple[int, ...]]) -> List[Dict[str, Optional[int]]]:
+        if executor is None:
+            return EvaluateStates(states)
+        chunks = [states[start:start + CANDIDATE_CHUNK] for start in range(0, len(states), CANDIDATE_CHUNK)]
+        return [result for results in executor.map(EvaluateStates, chunks) for result in results]
+
+    def Length(state: Tuple[int, ...]) -> float:
+        # the baseline is the certified course, its drawing is MARATHON_LENGTH long
+        return (baseLength + sum(swaps[index].lengthChange for index in state)) * MARATHON_LENGTH / baseLength
+
+    try:
+        # the hand-drawn routes are ranked with the candidates
+        reference = {}
+        for name, route in layers:
+            reference[name] = Incremental.EvaluateLayer(route, bufferMetres, metrics)
+
+        def Scored() -> Dict[Tuple[int, ...], float]:
+            # scores among the hand-drawn routes and every candidate so far
+            states = [state for state in evaluated if "Error" not in evaluated[state]]
+            values = np.array([[evaluated[state].get(metric, np.nan) for metric in metrics] for state in states] +
+                              [[result.get(metric, np.nan) for metric in metrics] for result in reference.values()], dtype=float)
+            return dict(zip(states, OverallScores(values, weights, metrics)))
+
+        evaluated: Dict[Tuple[int, ...], Dict[str, Optional[int]]] = {(): Evaluate([()])[0]}
+        scores = Scored()
+        beam = [()]
+        step = 0
+        while len(beam) > 0 and len(evaluated) < candidates:
+            step += 1
+            startTime = time.time()
+            extensions = sorted({extension for state in beam for extension in Extensions(state, swaps)})
+            extensions = [state for state in extensions
+                          if state not in evaluated and abs(Length(state) - MARATHON_LENGTH) <= SEARCH_LENGTH_SLACK]
+            extensions = extensions[:candidates - len(evaluated)]
+            if len(extensions) == 0:
+                break
+            evaluated.update(zip(extensions, Evaluate(extensions)))
+            scores = Scored()
+            ranked = sorted((state for state in extensions if state in scores),
+                            key=lambda state: (abs(Length(state) - MARATHON_LENGTH) > LENGTH_TOLERANCE, -scores[state]))
+            beam = ranked[:beamWidth]
+            feasible = [state for state in scores if abs(Length(state) - MARATHON_LENGTH) <= LENGTH_TOLERANCE]
+            print(f"Step {step}: {len(extensions)} candidates scored in {round(time.time() - startTime, 2)} s, "
+                  f"{len(evaluated)} in total, {len(feasible)} within {LENGTH_TOLERANCE} m of {MARATHON_LENGTH} m")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        ResultCache.Evict()
+
+    # the reported candidates, best first
+    feasible = sorted((state for state in scores if abs(Length(state) - MARATHON_LENGTH) <= LENGTH_TOLERANCE),
+                      key=lambda state: -scores[state])
+    names = {state: "Variant " + str(number + 1) for number, state in enumerate(feasible)}
+    rows = dict(reference)
+    rows.update({names[state]: evaluated[state] for state in feasible})
+    results = pd.DataFrame.from_dict({name: {metric: row.get(metric) for metric in metrics} for name, row in rows.items()},
+                                     orient="index").rename_axis("Route")
+    results.loc["weight"] = weights
+
+    variants = pd.DataFrame({"Route": [names[state] for state in feasible],
+                             "Length (m)": [round(Length(state), 1) for state in feasible],
+                             "Overall Weighted Score": [scores[state] for state in feasible],
+                             "Swaps": [" + ".join(swaps[index].name for index in state) or "Baseline" for state in feasible]})
+    courses = {names[state]: BuildCourse(baseline, [swaps[index] for index in state]) for state in feasible}
+    return results, variants.set_index("Route"), courses
+
+
+if __name__ == "__main__":
+    from Runner import ReadRoutesFromFile, rootFolder
+
+    arguments = argv[1:]
+    options = {"--candidates": str(DEFAULT_CANDIDATES), "--workers": "1", "--export": "10", "--beam": str(BEAM_WIDTH),
+               "--weights": rootFolder + "Results.csv"}
+    for option in options:
+        if option in arguments:
+            position = arguments.index(option)
+            options[option] = arguments[position + 1]
+            del arguments[position:position + 2]
+
+    if len(arguments) < 2 or not arguments[0].isdigit() or arguments[1] not in ("Meters", "Kilometers"):
+        print("Usage: CourseSearch.py <BufferSize> <BufferSizeUnit> [--candidates N] [--workers N] [--beam N] [--export N] [--weights CSV]")
+        print("Example: CourseSearch.py 100 Meters --candidates 20000 --workers 8 --export 10")
+        exit(1)
+
+    print("Starting script...")
+    startTime = time.time()
+    results, variants, courses = CourseSearch(int(arguments[0]), arguments[1], ReadRoutesFromFile(),
+                                              int(options["--candidates"]), int(options["--workers"]),
+                                              options["--weights"], int(options["--beam"]))
+
+    # the hand-drawn routes, the best candidates and the weight row
+    exported = list(variants.index[:int(options["--export"])])
+    references = [name for name in results.index if name not in variants.index and name != "weight"]
+    results.loc[references + exported + ["weight"]].to_csv(rootFolder + "SearchResults.csv")
+    variants.to_csv(rootFolder + "SearchVariants.csv")
+
+    folder = rootFolder + "Search" + os.sep
+    os.makedirs(folder, exist_ok=True)
+    for name in exported:
+        WriteLayer(folder + name.replace(" ", "-") + ".shp", courses[name])
+
+    with pd.option_context("display.width", 200, "display.max_colwidth", 80):
+        print(variants.head(int(options["--export"])).round(3))
+    print(f"Saved {len(variants)} candidates to SearchVariants.csv, the best {len(exported)} to SearchResults.csv and the Search folder")
+    print("Script ended in", round(time.time() - startTime, 2), "s")
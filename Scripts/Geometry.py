@@ -0,0 +1,590 @@
+"""
+Vectorized NumPy geometry used by the arcpy-free evaluation backend.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+All functions work on planar coordinates in metres. Lon/lat coordinates from
+the layers are converted with ToMetres before any distance or area is measured,
+so a buffer of N metres is a true N metre corridor around the route.
+
+The metric projection is UTM zone 17N (transverse Mercator on WGS84, evaluated
+with the Krueger series, accurate to well below a millimetre), shifted to put
+Toronto City Hall at (0, 0) and scaled to be true to scale there. It is
+conformal, so distances are within 0.01% of the ellipsoid over the Greater
+Toronto Area and areas are corrected to geodesic areas with the point scale
+factor (GeodesicAreaFactors) instead of being measured again on the ellipsoid.
+The reference layers project their vertices once (see Layer.Metres in
+Shapefile.py and the snapshots of Snapshot.py).
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Tuple
+import numpy as np
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+# UTM zone 17N, the zone of Toronto
+UTM_CENTRAL_MERIDIAN = -81.0
+UTM_SCALE = 0.9996
+UTM_FALSE_EASTING = 500000.0
+
+# Toronto City Hall, used as the origin of the local metric projection
+TORONTO_ORIGIN = (-79.3839, 43.6534)
+
+# upper bound on the size of a point x segment distance matrix held in memory
+MAX_MATRIX_SIZE = 4_000_000
+
+# offset keeping grid cell indices positive when packed into a single int64 key
+CELL_OFFSET = 1 << 20
+
+# smallest cell size (metres) of the grids bucketing the route segments
+MIN_SEGMENT_CELL_SIZE = 10.0
+
+
+def _TransverseMercatorSeries() -> Tuple[float, np.ndarray, np.ndarray, np.ndarray]:
+    # rectifying radius and the Krueger series coefficients (4th order in n)
+    n = WGS84_F / (2 - WGS84_F)
+    radius = WGS84_A / (1 + n) * (1 + n ** 2 / 4 + n ** 4 / 64)
+    alpha = np.array([n / 2 - 2 * n ** 2 / 3 + 5 * n ** 3 / 16 + 41 * n ** 4 / 180,
+                      13 * n ** 2 / 48 - 3 * n ** 3 / 5 + 557 * n ** 4 / 1440,
+                      61 * n ** 3 / 240 - 103 * n ** 4 / 140,
+                      49561 * n ** 4 / 161280])
+    beta = np.array([n / 2 - 2 * n ** 2 / 3 + 37 * n ** 3 / 96 - n ** 4 / 360,
+                     n ** 2 / 48 + n ** 3 / 15 - 437 * n ** 4 / 1440,
+                     17 * n ** 3 / 480 - 37 * n ** 4 / 840,
+                     4397 * n ** 4 / 161280])
+    delta = np.array([2 * n - 2 * n ** 2 / 3 - 2 * n ** 3 + 116 * n ** 4 / 45,
+                      7 * n ** 2 / 3 - 8 * n ** 3 / 5 - 227 * n ** 4 / 45,
+                      56 * n ** 3 / 15 - 136 * n ** 4 / 35,
+                      4279 * n ** 4 / 630])
+    return radius, alpha, beta, delta
+
+
+UTM_RADIUS, UTM_ALPHA, UTM_BETA, UTM_DELTA = _TransverseMercatorSeries()
+UTM_ORDERS = 2 * np.arange(1, 5)
+
+
+def _ConformalCoordinates(lonlat: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # (xi', eta', tan of the conformal latitude, longitude from the central meridian)
+    lat = np.radians(lonlat[..., 1])
+    dLon = np.radians(lonlat[..., 0] - UTM_CENTRAL_MERIDIAN)
+    e = np.sqrt(WGS84_E2)
+    t = np.sinh(np.arctanh(np.sin(lat)) - e * np.arctanh(e * np.sin(lat)))
+    return np.arctan2(t, np.cos(dLon)), np.arctanh(np.sin(dLon) / np.sqrt(1 + t ** 2)), t, dLon
+
+
+def LonLatToUTM(lonlat: np.ndarray) -> np.ndarray:
+    # (easting, northing) in UTM zone 17N
+    xi, eta, _, _ = _ConformalCoordinates(lonlat)
+    orderXi, orderEta = UTM_ORDERS * xi[..., None], UTM_ORDERS * eta[..., None]
+    northing = xi + np.sum(UTM_ALPHA * np.sin(orderXi) * np.cosh(orderEta), axis=-1)
+    easting = eta + np.sum(UTM_ALPHA * np.cos(orderXi) * np.sinh(orderEta), axis=-1)
+    return np.stack([UTM_SCALE * UTM_RADIUS * easting + UTM_FALSE_EASTING, UTM_SCALE * UTM_RADIUS * northing], axis=-1)
+
+
+def UTMToLonLat(en: np.ndarray) -> np.ndarray:
+    # inverse of LonLatToUTM
+    xi = en[..., 1] / (UTM_SCALE * UTM_RADIUS)
+    eta = (en[..., 0] - UTM_FALSE_EASTING) / (UTM_SCALE * UTM_RADIUS)
+    orderXi, orderEta = UTM_ORDERS * xi[..., None], UTM_ORDERS * eta[..., None]
+    xiPrime = xi - np.sum(UTM_BETA * np.sin(orderXi) * np.cosh(orderEta), axis=-1)
+    etaPrime = eta - np.sum(UTM_BETA * np.cos(orderXi) * np.sinh(orderEta), axis=-1)
+    chi = np.arcsin(np.sin(xiPrime) / np.cosh(etaPrime))
+    lat = chi + np.sum(UTM_DELTA * np.sin(UTM_ORDERS * chi[..., None]), axis=-1)
+    lon = UTM_CENTRAL_MERIDIAN + np.degrees(np.arctan2(np.sinh(etaPrime), np.cos(xiPrime)))
+    return np.stack([lon, np.degrees(lat)], axis=-1)
+
+
+def UTMScaleFactors(lonlat: np.ndarray) -> np.ndarray:
+    # point scale factor of UTM zone 17N, ratio of a small distance in the
+    # projection to the same distance on the ellipsoid
+    xi, eta, t, dLon = _ConformalCoordinates(lonlat)
+    n = WGS84_F / (2 - WGS84_F)
+    orderXi, orderEta = UTM_ORDERS * xi[..., None], UTM_ORDERS * eta[..., None]
+    sigma = 1 + np.sum(UTM_ORDERS * UTM_ALPHA * np.cos(orderXi) * np.cosh(orderEta), axis=-1)
+    tau = np.sum(UTM_ORDERS * UTM_ALPHA * np.sin(orderXi) * np.sinh(orderEta), axis=-1)
+    lat = np.radians(lonlat[..., 1])
+    return (UTM_SCALE * UTM_RADIUS / WGS84_A * np.sqrt(1 + ((1 - n) / (1 + n) * np.tan(lat)) ** 2)
+            * np.sqrt((sigma ** 2 + tau ** 2) / (t ** 2 + np.cos(dLon) ** 2)))
+
+
+def ToMetres(lonlat: np.ndarray, origin: Tuple[float, float] = TORONTO_ORIGIN) -> np.ndarray:
+    # UTM zone 17N with the origin at (0, 0), scaled to be true to scale at the origin
+    origin = np.array(origin, dtype=float)
+    return (LonLatToUTM(lonlat) - LonLatToUTM(origin)) / UTMScaleFactors(origin)
+
+
+def ToLonLat(xy: np.ndarray, origin: Tuple[float, float] = TORONTO_ORIGIN) -> np.ndarray:
+    # inverse of ToMetres
+    origin = np.array(origin, dtype=float)
+    return UTMToLonLat(np.asarray(xy) * UTMScaleFactors(origin) + LonLatToUTM(origin))
+
+
+def LonLatBox(box: np.ndarray, origin: Tuple[float, float] = TORONTO_ORIGIN) -> np.ndarray:
+    # lon/lat bbox of a (min x, min y, max x, max y) box in metres, from its
+    # four corners as the meridians are not parallel to the y axis
+    corners = ToLonLat(np.array([[box[0], box[1]], [box[0], box[3]], [box[2], box[1]], [box[2], box[3]]]), origin)
+    return np.concatenate([corners.min(axis=0), corners.max(axis=0)])
+
+
+def BufferSizeInMetres(BufferSize: float, BufferSizeUnit: str) -> float:
+    units = {"meters": 1.0, "m": 1.0, "kilometers": 1000.0, "km": 1000.0}
+    if BufferSizeUnit.lower() not in units:
+        raise ValueError("Buffer Size Unit must be either Meters or Kilometers, got " + str(BufferSizeUnit))
+    return float(BufferSize) * units[BufferSizeUnit.lower()]
+
+
+def _SquaredPointSegmentDistances(points: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    abx, aby = (b[:, 0] - a[:, 0])[None, :], (b[:, 1] - a[:, 1])[None, :]
+    lengthSquared = abx * abx + aby * aby
+    lengthSquared[lengthSquared == 0] = 1.0
+    dx = points[:, 0, None] - a[None, :, 0]
+    dy = points[:, 1, None] - a[None, :, 1]
+    t = np.clip((dx * abx + dy * aby) / lengthSquared, 0.0, 1.0)
+    dx -= t * abx
+    dy -= t * aby
+    return dx * dx + dy * dy
+
+
+def PointSegmentDistances(points: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # (len(points), len(a)) matrix of distances from points to segments a-b
+    return np.sqrt(_SquaredPointSegmentDistances(points, a, b))
+
+
+def MinDistanceToSegments(points: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # minimum distance from every point to any of the segments, chunked to bound memory
+    if len(a) == 0:
+        return np.full(len(points), np.inf)
+    result = np.empty(len(points))
+    chunk = max(1, MAX_MATRIX_SIZE // len(a))
+    for start in range(0, len(points), chunk):
+        result[start:start + chunk] = np.sqrt(_SquaredPointSegmentDistances(points[start:start + chunk], a, b).min(axis=1))
+    return result
+
+
+def NearestSegments(points: np.ndarray, a: np.ndarray, b: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # (distance, nearest segment, position in [0, 1] of the nearest point
+    # along that segment) of every point, chunked to bound memory
+    distances, segments, t = np.full(len(points), np.inf), np.full(len(points), -1, dtype=np.int64), np.zeros(len(points))
+    if len(a) == 0:
+        return distances, segments, t
+    ab = b - a
+    lengthSquared = np.maximum(np.sum(ab * ab, axis=1), 1e-12)
+    chunk = max(1, MAX_MATRIX_SIZE // len(a))
+    for start in range(0, len(points), chunk):
+        part = slice(start, start + chunk)
+        nearest = np.argmin(_SquaredPointSegmentDistances(points[part], a, b), axis=1)
+        segments[part] = nearest
+        t[part] = np.clip(np.sum((points[part] - a[nearest]) * ab[nearest], axis=1) / lengthSquared[nearest], 0.0, 1.0)
+        distances[part] = np.hypot(*(points[part] - a[nearest] - t[part, None] * ab[nearest]).T)
+    return distances, segments, t
+
+
+def SegmentsCross(p1: np.ndarray, p2: np.ndarray, q1: np.ndarray, q2: np.ndarray) -> np.ndarray:
+    # (len(p1), len(q1)) matrix, True where segment p1-p2 intersects segment q1-q2
+    def Orientation(a, b, c):
+        return np.sign((b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1]) - (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0]))
+
+    P1, P2 = p1[:, None, :], p2[:, None, :]
+    Q1, Q2 = q1[None, :, :], q2[None, :, :]
+    o1 = Orientation(P1, P2, Q1)
+    o2 = Orientation(P1, P2, Q2)
+    o3 = Orientation(Q1, Q2, P1)
+    o4 = Orientation(Q1, Q2, P2)
+    # collinear touching cases are already caught by the endpoint distances
+    return (o1 * o2 < 0) & (o3 * o4 < 0)
+
+
+def SegmentSegmentDistance(p1: np.ndarray, p2: np.ndarray, q1: np.ndarray, q2: np.ndarray) -> float:
+    # minimum distance between two sets of segments
+    if len(p1) == 0 or len(q1) == 0:
+        return np.inf
+    distance = min(MinDistanceToSegments(p1, q1, q2).min(),
+                   MinDistanceToSegments(p2, q1, q2).min(),
+                   MinDistanceToSegments(q1, p1, p2).min(),
+                   MinDistanceToSegments(q2, p1, p2).min())
+    if distance > 0 and SegmentsCross(p1, p2, q1, q2).any():
+        return 0.0
+    return distance
+
+
+def SegmentDistancesToSegments(p1: np.ndarray, p2: np.ndarray, q1: np.ndarray, q2: np.ndarray) -> np.ndarray:
+    # distance from every segment q1-q2 to the nearest of the segments p1-p2
+    # (SegmentSegmentDistance of every segment q1-q2 on its own)
+    if len(p1) == 0:
+        return np.full(len(q1), np.inf)
+    distances = np.minimum(PointSegmentDistances(np.concatenate([p1, p2]), q1, q2).min(axis=0),
+                           np.minimum(MinDistanceToSegments(q1, p1, p2), MinDistanceToSegments(q2, p1, p2)))
+    return np.where((distances > 0) & SegmentsCross(p1, p2, q1, q2).any(axis=0), 0.0, distances)
+
+
+def CrossingParity(points: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # parity of the crossings of a ray cast in +x from every point with edges a-b
+    parity = np.zeros(len(points), dtype=bool)
+    if len(a) == 0:
+        return parity
+    chunk = max(1, MAX_MATRIX_SIZE // len(a))
+    for first in range(0, len(points), chunk):
+        x, y = points[first:first + chunk, None, 0], points[first:first + chunk, None, 1]
+        straddles = (a[None, :, 1] > y) != (b[None, :, 1] > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossingX = a[None, :, 0] + (y - a[None, :, 1]) * (b[None, :, 0] - a[None, :, 0]) / (b[None, :, 1] - a[None, :, 1])
+        parity[first:first + chunk] = np.count_nonzero(straddles & (x < crossingX), axis=1) % 2 == 1
+    return parity
+
+
+def PointsInRings(points: np.ndarray, rings: np.ndarray, ringOffsets: np.ndarray) -> np.ndarray:
+    # even-odd test of points against all rings of one polygon (holes included)
+    inside = np.zeros(len(points), dtype=bool)
+    if len(points) == 0:
+        return inside
+    a, b = LineSegments(rings, ringOffsets)
+    closing = np.flatnonzero(np.diff(ringOffsets) >= 3)
+    a = np.concatenate([a, rings[ringOffsets[closing + 1] - 1]])
+    b = np.concatenate([b, rings[ringOffsets[closing]]])
+
+    # split the polygon into horizontal strips so that every point is only
+    # tested against the edges spanning its strip
+    strips = int(np.clip(np.sqrt(len(a)), 1, 256))
+    if strips == 1 or len(points) < strips:
+        return CrossingParity(points, a, b)
+
+    low, high = rings[:, 1].min(), rings[:, 1].max()
+    height = (high - low) / strips or 1.0
+    pointStrip = np.floor((points[:, 1] - low) / height).astype(np.int64)
+    edgeLow = np.floor((np.minimum(a[:, 1], b[:, 1]) - low) / height).astype(np.int64)
+    edgeHigh = np.floor((np.maximum(a[:, 1], b[:, 1]) - low) / height).astype(np.int64)
+    for strip in np.unique(pointStrip):
+        # points above or below the polygon are outside
+        if strip < 0 or strip >= strips:
+            continue
+        members = np.flatnonzero(pointStrip == strip)
+        edges = (edgeLow <= strip) & (edgeHigh >= strip)
+        inside[members] = CrossingParity(points[members], a[edges], b[edges])
+    return inside
+
+
+def RingAreas(rings: np.ndarray, ringOffsets: np.ndarray) -> np.ndarray:
+    # signed shoelace area of every ring, negative for clockwise rings
+    areas = np.zeros(len(ringOffsets) - 1)
+    for i, (start, end) in enumerate(zip(ringOffsets[:-1], ringOffsets[1:])):
+        x, y = rings[start:end, 0], rings[start:end, 1]
+        areas[i] = 0.5 * (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+    return areas
+
+
+def LineSegments(xy: np.ndarray, partOffsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # start and end points of every segment of a set of polyline parts
+    starts = []
+    for start, end in zip(partOffsets[:-1], partOffsets[1:]):
+        if end - start >= 2:
+            starts.append(np.arange(start, end - 1))
+    if not starts:
+        return np.zeros((0, 2)), np.zeros((0, 2))
+    index = np.concatenate(starts)
+    return xy[index], xy[index + 1]
+
+
+def PolygonEdges(xy: np.ndarray, partOffsets: np.ndarray, featureOffsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # start, end and feature of every ring edge of a polygon layer, including
+    # the closing edge of the rings stored open
+    partFeature = np.repeat(np.arange(len(featureOffsets) - 1), np.diff(featureOffsets))
+    partStarts, partSizes = partOffsets[:-1], np.diff(partOffsets)
+    edgeStart = ExpandRanges(partStarts, np.maximum(partSizes - 1, 0))
+    closing = np.flatnonzero(partSizes >= 3)
+    a = np.concatenate([xy[edgeStart], xy[partStarts[closing] + partSizes[closing] - 1]])
+    b = np.concatenate([xy[edgeStart + 1], xy[partStarts[closing]]])
+    edgeFeature = np.concatenate([np.repeat(partFeature, np.maximum(partSizes - 1, 0)), partFeature[closing]])
+    return a, b, edgeFeature
+
+
+def ExpandRanges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    # concatenation of arange(start, start + count) for every (start, count)
+    counts = np.asarray(counts, dtype=np.int64)
+    if counts.sum() == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.cumsum(counts)
+    offsets = np.repeat(np.asarray(starts, dtype=np.int64) - (ends - counts), counts)
+    return np.arange(ends[-1], dtype=np.int64) + offsets
+
+
+def SimplifyPolyline(xy: np.ndarray, tolerance: float) -> np.ndarray:
+    # indices of the vertices of one polyline kept by Douglas-Peucker. Every
+    # removed vertex is within tolerance of the segment replacing it, so the
+    # simplified line never deviates from the line by more than tolerance.
+    # All the ranges of a level of the recursion are split at once.
+    if len(xy) <= 2:
+        return np.arange(len(xy))
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[[0, -1]] = True
+    starts, ends = np.array([0]), np.array([len(xy) - 1])
+    while len(starts) > 0:
+        counts = ends - starts - 1
+        starts, ends, counts = starts[counts > 0], ends[counts > 0], counts[counts > 0]
+        if len(starts) == 0:
+            break
+        vertices = ExpandRanges(starts + 1, counts)
+        ranges = np.repeat(np.arange(len(starts)), counts)
+        a, b = xy[starts][ranges], xy[ends][ranges]
+        abx, aby = b[:, 0] - a[:, 0], b[:, 1] - a[:, 1]
+        lengthSquared = np.where(abx * abx + aby * aby == 0, 1.0, abx * abx + aby * aby)
+        t = np.clip(((xy[vertices, 0] - a[:, 0]) * abx + (xy[vertices, 1] - a[:, 1]) * aby) / lengthSquared, 0.0, 1.0)
+        distances = np.hypot(xy[vertices, 0] - a[:, 0] - t * abx, xy[vertices, 1] - a[:, 1] - t * aby)
+
+        # farthest vertex of every range, split the ranges where it is beyond tolerance
+        largest = np.maximum.reduceat(distances, np.cumsum(counts) - counts)
+        farthest = np.flatnonzero(distances == largest[ranges])
+        farthest = farthest[np.concatenate([[True], ranges[farthest[1:]] != ranges[farthest[:-1]]])]
+        split = distances[farthest] > tolerance
+        middle = vertices[farthest[split]]
+        keep[middle] = True
+        starts, ends = np.concatenate([starts[split], middle]), np.concatenate([middle, ends[split]])
+    return np.flatnonzero(keep)
+
+
+def ScanlineY(lines: np.ndarray, spacing: float) -> np.ndarray:
+    # scanline k runs through the middle of the k-th row of a spacing high lattice
+    return (lines + 0.5) * spacing
+
+
+def ScanlineCrossings(a: np.ndarray, b: np.ndarray, spacing: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # (edge, scanline, x) of every crossing of the edges a-b with the scanlines.
+    # An edge covers the scanlines with low <= y < high, so a vertex shared by
+    # two edges is counted once and horizontal edges never cross.
+    low, high = np.minimum(a[:, 1], b[:, 1]), np.maximum(a[:, 1], b[:, 1])
+    first = np.ceil(low / spacing - 0.5).astype(np.int64)
+    counts = np.maximum(np.ceil(high / spacing - 0.5).astype(np.int64) - first, 0)
+    edges = np.repeat(np.arange(len(a)), counts)
+    lines = ExpandRanges(first, counts)
+    y = ScanlineY(lines, spacing)
+    p, q = a[edges], b[edges]
+    x = p[:, 0] + (y - p[:, 1]) * (q[:, 0] - p[:, 0]) / (q[:, 1] - p[:, 1])
+    return edges, lines, x
+
+
+def CapsuleIntervals(a: np.ndarray, b: np.ndarray, radius: float, spacing: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # (scanline, low x, high x) of the section of every capsule (points within
+    # radius of the segment a-b) by the scanlines it spans. The capsule is the
+    # union of two disks and a rectangle; it is convex, so its section is the
+    # hull of the sections of the three pieces.
+    if len(a) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    low = np.minimum(a[:, 1], b[:, 1]) - radius
+    high = np.maximum(a[:, 1], b[:, 1]) + radius
+    first = np.ceil(low / spacing - 0.5).astype(np.int64)
+    counts = np.maximum(np.floor(high / spacing - 0.5).astype(np.int64) - first + 1, 0)
+
+    # bound the size of the (segment, scanline) pairs held in memory
+    lines, lows, highs = [], [], []
+    totals = np.cumsum(counts)
+    chunkStart = 0
+    while chunkStart < len(a):
+        done = totals[chunkStart - 1] if chunkStart > 0 else 0
+        chunkEnd = max(chunkStart + 1, int(np.searchsorted(totals, done + MAX_MATRIX_SIZE, side="right")))
+        chunk = slice(chunkStart, chunkEnd)
+        chunkStart = chunkEnd
+        segments = np.repeat(np.arange(chunk.start, chunk.stop), counts[chunk])
+        chunkLines = ExpandRanges(first[chunk], counts[chunk])
+        y = ScanlineY(chunkLines, spacing)
+        p, q = a[segments], b[segments]
+        lo = np.full(len(y), np.inf)
+        hi = np.full(len(y), -np.inf)
+
+        # disks around both end points
+        for centre in (p, q):
+            dy = y - centre[:, 1]
+            inDisk = np.abs(dy) <= radius
+            half = np.sqrt(np.maximum(radius * radius - dy * dy, 0.0))
+            lo = np.where(inDisk, np.minimum(lo, centre[:, 0] - half), lo)
+            hi = np.where(inDisk, np.maximum(hi, centre[:, 0] + half), hi)
+
+        # rectangle of width 2 * radius along the segment
+        direction = q - p
+        length = np.hypot(direction[:, 0], direction[:, 1])
+        hasLength = length > 0
+        normal = np.zeros_like(direction)
+        normal[hasLength] = np.stack([-direction[hasLength, 1], direction[hasLength, 0]], axis=1) / length[hasLength, None] * radius
+        corners = [p + normal, q + normal, q - normal, p - normal]
+        for start, end in zip(corners, corners[1:] + corners[:1]):
+            edgeLow, edgeHigh = np.minimum(start[:, 1], end[:, 1]), np.maximum(start[:, 1], end[:, 1])
+            crosses = hasLength & (edgeLow <= y) & (y <= edgeHigh) & (edgeHigh > edgeLow)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x = start[:, 0] + (y - start[:, 1]) * (end[:, 0] - start[:, 0]) / (end[:, 1] - start[:, 1])
+            lo = np.where(crosses, np.minimum(lo, x), lo)
+            hi = np.where(crosses, np.maximum(hi, x), hi)
+
+        valid = lo <= hi
+        lines.append(chunkLines[valid])
+        lows.append(lo[valid])
+        highs.append(hi[valid])
+
+    return np.concatenate(lines), np.concatenate(lows), np.concatenate(highs)
+
+
+def GeodesicAreaFactors(xy: np.ndarray, origin: Tuple[float, float] = TORONTO_ORIGIN) -> np.ndarray:
+    # ratio of the area on the ellipsoid to the area in the ToMetres plane at
+    # the given points. The projection is conformal, so the area scale is the
+    # square of the point scale factor (relative to the origin).
+    origin = np.array(origin, dtype=float)
+    return (UTMScaleFactors(origin) / UTMScaleFactors(ToLonLat(xy, origin))) ** 2
+
+
+def CellKey(cellX: np.ndarray, cellY: np.ndarray) -> np.ndarray:
+    # pack grid cell indices into a single sortable int64 key
+    return (cellX + CELL_OFFSET) * (1 << 32) + (cellY + CELL_OFFSET)
+
+
+def CellIndices(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return keys // (1 << 32) - CELL_OFFSET, keys % (1 << 32) - CELL_OFFSET
+
+
+def BucketBoxes(boxes: np.ndarray, cellSize: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # register every box in every grid cell it covers. Returns the sorted
+    # unique cell keys, the start of every cell in the items array (plus the
+    # end) and the box ids ordered by cell.
+    valid = np.flatnonzero(np.isfinite(boxes).all(axis=1))
+    low = np.floor(boxes[valid, 0:2] / cellSize).astype(np.int64)
+    high = np.floor(boxes[valid, 2:4] / cellSize).astype(np.int64)
+    spans = high - low + 1
+
+    counts = spans[:, 0] * spans[:, 1]
+    owner = np.repeat(np.arange(len(valid)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cellX = low[owner, 0] + local % spans[owner, 0]
+    cellY = low[owner, 1] + local // spans[owner, 0]
+
+    keys = CellKey(cellX, cellY)
+    order = np.argsort(keys, kind="stable")
+    cellKeys, cellStarts = np.unique(keys[order], return_index=True)
+    return cellKeys, np.append(cellStarts, len(order)).astype(np.int64), valid[owner[order]]
+
+
+def LookupCells(cellKeys: np.ndarray, cellStarts: np.ndarray, items: np.ndarray, keys: np.ndarray,
+                unique: bool = True) -> np.ndarray:
+    # items registered in any of the given cells, with duplicates removed unless unique is False
+    if len(cellKeys) == 0 or len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    position = np.minimum(np.searchsorted(cellKeys, keys), len(cellKeys) - 1)
+    position = position[cellKeys[position] == keys]
+    if len(position) == 0:
+        return np.zeros(0, dtype=np.int64)
+    chunks = [items[cellStarts[p]:cellStarts[p + 1]] for p in position]
+    return np.unique(np.concatenate(chunks)) if unique else np.concatenate(chunks)
+
+
+def BoxCellKeys(box: np.ndarray, distance: float, cellSize: float) -> np.ndarray:
+    # keys of the cells covered by a bbox expanded by distance
+    low = np.floor((box[0:2] - distance) / cellSize).astype(np.int64)
+    high = np.floor((box[2:4] + distance) / cellSize).astype(np.int64)
+    cellX, cellY = np.meshgrid(np.arange(low[0], high[0] + 1), np.arange(low[1], high[1] + 1))
+    return np.unique(CellKey(cellX.ravel(), cellY.ravel()))
+
+
+class SegmentGrid:
+    # uniform grids bucketing the route segments so that a distance query only
+    # compares a point with the segments in its neighbouring cells. A grid is
+    # kept for every query distance, with cells the size of that distance.
+    def __init__(self, a: np.ndarray, b: np.ndarray, cellSize: float):
+        self.a = a
+        self.b = b
+        self.cellSize = max(float(cellSize), MIN_SEGMENT_CELL_SIZE)
+        self.segmentBoxes = np.concatenate([np.minimum(a, b), np.maximum(a, b)], axis=1)
+        self._buckets = {}
+        self.cellKeys, self.cellStarts, self.cellSegments = self._Buckets(self.cellSize)
+
+    def _Buckets(self, cellSize: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if cellSize not in self._buckets:
+            self._buckets[cellSize] = BucketBoxes(self.segmentBoxes, cellSize)
+        return self._buckets[cellSize]
+
+    def _SegmentsInCells(self, keys: np.ndarray) -> np.ndarray:
+        return LookupCells(self.cellKeys, self.cellStarts, self.cellSegments, keys)
+
+    def SegmentsNearBox(self, box: np.ndarray, distance: float) -> np.ndarray:
+        # ids of the segments whose bbox is within distance of the given bbox
+        candidates = self._SegmentsInCells(BoxCellKeys(box, distance, self.cellSize))
+        boxes = self.segmentBoxes[candidates]
+        near = ((boxes[:, 0] <= box[2] + distance) & (boxes[:, 2] >= box[0] - distance) &
+                (boxes[:, 1] <= box[3] + distance) & (boxes[:, 3] >= box[1] - distance))
+        return candidates[near]
+
+    def _CandidatePairs(self, points: np.ndarray, maxDistance: float, unique: bool = True):
+        # candidate (point, segment) pairs of a query within maxDistance, as
+        # blocks (points, segments) pairing every point of a cell with every
+        # segment in the cell or its 8 neighbours (sorted, and without
+        # duplicates unless unique is False). Points with NaN coordinates and
+        # cells without segments are left out.
+        cellSize = max(float(maxDistance), MIN_SEGMENT_CELL_SIZE)
+        cellKeys, cellStarts, cellSegments = self._Buckets(cellSize)
+
+        valid = np.isfinite(points).all(axis=1)
+        cells = np.floor(np.where(valid[:, None], points, 0.0) / cellSize).astype(np.int64)
+        keys = np.where(valid, CellKey(cells[:, 0], cells[:, 1]), -1)
+        order = np.argsort(keys, kind="stable")
+        uniqueKeys, starts = np.unique(keys[order], return_index=True)
+        starts = np.append(starts, len(order))
+
+        for i, key in enumerate(uniqueKeys):
+            if key < 0:
+                continue
+            members = order[starts[i]:starts[i + 1]]
+            cellX, cellY = cells[members[0]]
+            neighbours = CellKey(np.repeat(np.arange(cellX - 1, cellX + 2), 3), np.tile(np.arange(cellY - 1, cellY + 2), 3))
+            segments = LookupCells(cellKeys, cellStarts, cellSegments, np.sort(neighbours), unique=unique)
+            if len(segments) > 0:
+                yield members, segments
+
+    def Distances(self, points: np.ndarray, maxDistance: float) -> np.ndarray:
+        # distance from every point to the route, inf where it exceeds maxDistance
+        result = np.full(len(points), np.inf)
+        if len(points) == 0 or len(self.a) == 0:
+            return result
+        # duplicate segments do not change the minimum distance
+        for members, segments in self._CandidatePairs(points, maxDistance, unique=False):
+            distances = MinDistanceToSegments(points[members], self.a[segments], self.b[segments])
+            result[members] = np.where(distances <= maxDistance, distances, np.inf)
+
+        return result
+
+    def NearPairs(self, points: np.ndarray, maxDistance: float, segmentGroups: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # (point, group) of every point within maxDistance of a segment of the
+        # group, with the group of every segment (i.e. its route when the grid
+        # holds the segments of several routes), every pair once
+        if len(points) == 0 or len(self.a) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        pairPoints, pairGroups = [], []
+        for members, segments in self._CandidatePairs(points, maxDistance):
+            chunk = max(1, MAX_MATRIX_SIZE // len(segments))
+            for first in range(0, len(members), chunk):
+                memberIds, segmentIds = np.nonzero(PointSegmentDistances(
+                    points[members[first:first + chunk]], self.a[segments], self.b[segments]) <= maxDistance)
+                pairPoints.append(members[first:first + chunk][memberIds])
+                pairGroups.append(segmentGroups[segments[segmentIds]])
+
+        if len(pairPoints) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        pairs = np.unique(np.stack([np.concatenate(pairPoints), np.concatenate(pairGroups)], axis=1), axis=0)
+        return pairs[:, 0], pairs[:, 1]
+
+    def Nearest(self, points: np.ndarray, maxDistance: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # (distance, nearest segment, position along it, see NearestSegments)
+        # of every point within maxDistance of the route, (inf, -1, 0) elsewhere
+        distances, nearest, t = np.full(len(points), np.inf), np.full(len(points), -1, dtype=np.int64), np.zeros(len(points))
+        if len(points) == 0 or len(self.a) == 0:
+            return distances, nearest, t
+        # the segments are sorted so that ties go to the first segment along the route
+        for members, segments in self._CandidatePairs(points, maxDistance):
+            memberDistances, memberSegments, memberT = NearestSegments(points[members], self.a[segments], self.b[segments])
+            near = memberDistances <= maxDistance
+            distances[members[near]] = memberDistances[near]
+            nearest[members[near]] = segments[memberSegments[near]]
+            t[members[near]] = memberT[near]
+
+        return distances, nearest, t
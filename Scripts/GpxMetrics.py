@@ -0,0 +1,279 @@
+"""
+Script to compute the turn and elevation metrics of routes from their GPX tracks.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+The GPX file of a route is streamed through an expat parser in fixed size
+chunks, so only the coordinates and elevations of the track points are kept
+in memory. The track is then resampled every few metres along its length and:
+
+- the spurs of the route planners (the track leaving the course at a waypoint
+  and coming back within SpurTolerance metres of where it left, less than
+  SpurLength metres later) are removed. The turnarounds of the course run
+  out and back for longer and are kept.
+- a turn is a run of points where the heading changes by at least
+  WideTurnAngle degrees between the TurnWindow metres before and after the
+  point. The largest change of the run classifies it as a wide turn, or as a
+  sharp turn from SharpTurnAngle degrees (a U-turn).
+- the elevation gain is the sum of the climbs of the elevation profile after
+  a moving average over ElevationSmoothingWindow metres, which removes the
+  noise of the GPS/DEM elevations.
+
+The result has the same shape as TWM-Turns-Elevation-Traffic-Modelling.csv
+(one row per route with the Wide Turns, Sharp Turns and Elevation Gain
+columns). The thresholds are calibrated on the hand counted values of that
+file for the 8 routes of RoutesPaths.txt, which they do not reproduce exactly:
+
+- Sharp Turns match on 7 routes (Proto 2.2: 1 counted, 2 by hand).
+- Wide Turns are 0 to 4 turns above the hand counts (i.e. Baseline 14 vs 11,
+  Proto 1.1 11 vs 7), 2.4 on average. 21 of the 22 pairs of routes with
+  different counts in both are in the same order.
+- Elevation Gain is 17 to 22% below the hand values (i.e. Baseline 81 vs
+  100), which are rounded to 10 m, with every pair of routes in the same order.
+
+Ranking.py only uses the order of the routes in every metric, but the counts
+are not a drop-in replacement for the hand counted columns: rank the routes
+with either one of them, not a mix of both.
+
+Example Usage (routes of RoutesPaths.txt, using the .gpx next to every .shp):
+python GpxMetrics.py
+
+Example Usage (every .gpx file of the given files and folders):
+python GpxMetrics.py {LocationOfRoute.gpx} {FolderOfGpxFiles}
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import List, Dict, Tuple
+from array import array
+from sys import argv
+import xml.parsers.expat
+import numpy as np
+import pandas as pd
+import time
+import os
+
+import Geometry
+
+# size of the chunks the GPX files are read in (bytes)
+READ_CHUNK_SIZE = 1 << 16
+
+# spacing of the points the track is resampled to (metres)
+ResampleSpacing = 5.0
+
+# out and back spurs shorter than SpurLength metres, coming back within
+# SpurTolerance metres of where they left the track, are removed
+SpurLength = 150.0
+SpurTolerance = 10.0
+
+# heading change (degrees) measured between the TurnWindow metres before and
+# after every point, from which a turn is counted as wide or sharp. Calibrated
+# on the hand counts of TWM-Turns-Elevation-Traffic-Modelling.csv: the sharp
+# turns are only the U-turns, and the corners of the streets, measured at 85
+# to 90 degrees over the window, are wide turns.
+TurnWindow = 100.0
+WideTurnAngle = 85.0
+SharpTurnAngle = 170.0
+
+# length of the moving average applied to the elevations (metres)
+ElevationSmoothingWindow = 50.0
+
+
+def GetTrackMetrics() -> List[str]:
+    return ["Wide Turns", "Sharp Turns", "Elevation Gain"]
+
+
+def ReadTrack(gpxPath: str) -> Tuple[np.ndarray, np.ndarray]:
+    # lon/lat (n, 2) and elevation (n,) of every trkpt, NaN for missing elevations
+    lon, lat, elevation = array("d"), array("d"), array("d")
+    state = {"inPoint": False, "inElevation": False, "text": []}
+
+    def StartElement(name, attributes):
+        if name == "trkpt":
+            lon.append(float(attributes["lon"]))
+            lat.append(float(attributes["lat"]))
+            elevation.append(np.nan)
+            state["inPoint"] = True
+        elif name == "ele" and state["inPoint"]:
+            state["inElevation"] = True
+            state["text"] = []
+
+    def EndElement(name):
+        if name == "ele" and state["inElevation"]:
+            state["inElevation"] = False
+            text = "".join(state["text"]).strip()
+            if text:
+                elevation[-1] = float(text)
+        elif name == "trkpt":
+            state["inPoint"] = False
+
+    def CharacterData(data):
+        if state["inElevation"]:
+            state["text"].append(data)
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = StartElement
+    parser.EndElementHandler = EndElement
+    parser.CharacterDataHandler = CharacterData
+
+    with open(gpxPath, "rb") as file:
+        while True:
+            chunk = file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.Parse(chunk, False)
+    parser.Parse(b"", True)
+
+    lonlat = np.column_stack([np.frombuffer(lon), np.frombuffer(lat)]) if len(lon) else np.zeros((0, 2))
+    return lonlat, np.frombuffer(elevation).copy()
+
+
+def Resample(xy: np.ndarray, values: np.ndarray, spacing: float) -> Tuple[np.ndarray, np.ndarray]:
+    # points and interpolated values every spacing metres along the track
+    distances = np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(xy, axis=0).T))])
+    stations = np.arange(0.0, distances[-1] + spacing / 2, spacing)
+    points = np.column_stack([np.interp(stations, distances, xy[:, 0]), np.interp(stations, distances, xy[:, 1])])
+    return points, np.interp(stations, distances, values)
+
+
+def RemoveSpurs(points: np.ndarray, length: int, tolerance: float) -> np.ndarray:
+    # points of the track without the spurs of at most length points going
+    # further than 2 * tolerance from the point they leave and coming back
+    # within tolerance of it, the longest spur from every point is removed
+    n = len(points)
+    if n <= 3 or length < 3:
+        return points
+    lags = np.arange(1, min(length, n - 1) + 1)
+    indices = np.arange(n)[None, :] + lags[:, None]
+    valid = indices < n
+    distances = np.hypot(*(points[np.minimum(indices, n - 1)] - points[None, :]).transpose(2, 0, 1))
+    distances[~valid] = np.inf
+    # furthest the track went from the point before every lag
+    reach = np.maximum.accumulate(np.where(valid, distances, 0.0), axis=0)
+    reach = np.concatenate([np.zeros((1, n)), reach[:-1]])
+    spur = valid & (distances < tolerance) & (reach > 2 * tolerance)
+
+    hasSpur = spur.any(axis=0)
+    end = np.arange(n) + lags[len(lags) - 1 - np.argmax(spur[::-1], axis=0)]
+    keep = np.zeros(n, dtype=bool)
+    point = 0
+    for start in np.flatnonzero(hasSpur):
+        if start < point:
+            continue
+        keep[point:start + 1] = True
+        point = end[start]
+    keep[point:] = True
+    return points[keep]
+
+
+def HeadingChanges(points: np.ndarray, window: int) -> np.ndarray:
+    # signed heading change (degrees) at every point between the window points
+    # before and after it
+    if len(points) <= 2 * window:
+        return np.zeros(0)
+    before = points[window:-window] - points[:-2 * window]
+    after = points[2 * window:] - points[window:-window]
+    cross = before[:, 0] * after[:, 1] - before[:, 1] * after[:, 0]
+    return np.degrees(np.arctan2(cross, np.einsum("ij,ij->i", before, after)))
+
+
+def CountTurns(changes: np.ndarray) -> Tuple[int, int]:
+    # number of wide and sharp turns, every run of points turning by at least
+    # WideTurnAngle is one turn classified by its largest heading change
+    turning = np.abs(changes) >= WideTurnAngle
+    if not turning.any():
+        return 0, 0
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], turning.astype(np.int8), [0]])))
+    peaks = np.maximum.reduceat(np.abs(changes), edges[::2])
+    sharp = int(np.count_nonzero(peaks >= SharpTurnAngle))
+    return len(peaks) - sharp, sharp
+
+
+def ElevationGain(elevation: np.ndarray, window: int) -> float:
+    valid = elevation[np.isfinite(elevation)]
+    if len(valid) < 2:
+        return 0.0
+    window = min(max(window, 1), len(valid))
+    smoothed = np.convolve(valid, np.ones(window) / window, mode="valid")
+    return float(np.clip(np.diff(smoothed), 0, None).sum())
+
+
+def TrackMetrics(gpxPath: str) -> Dict[str, int]:
+    lonlat, elevation = ReadTrack(gpxPath)
+    if len(lonlat) < 2:
+        raise ValueError("Not enough track points in " + gpxPath)
+
+    # drop repeated points, they have no heading
+    xy = Geometry.ToMetres(lonlat)
+    keep = np.concatenate([[True], np.any(np.diff(xy, axis=0) != 0, axis=1)])
+    xy, elevation = xy[keep], elevation[keep]
+
+    # fill missing elevations from the neighbouring points
+    valid = np.isfinite(elevation)
+    if valid.any() and not valid.all():
+        elevation = np.interp(np.arange(len(elevation)), np.flatnonzero(valid), elevation[valid])
+
+    points, elevation = Resample(xy, elevation, ResampleSpacing)
+    points = RemoveSpurs(points, int(round(2 * SpurLength / ResampleSpacing)), SpurTolerance)
+    wideTurns, sharpTurns = CountTurns(HeadingChanges(points, int(round(TurnWindow / ResampleSpacing))))
+    gain = ElevationGain(elevation, int(round(ElevationSmoothingWindow / ResampleSpacing)))
+
+    return {"Wide Turns": wideTurns, "Sharp Turns": sharpTurns, "Elevation Gain": int(round(gain))}
+
+
+def RunOnTracks(tracks: List[Tuple[str, str]]) -> pd.DataFrame:
+    # one row per (route name, gpx path), a failing track is reported and left empty
+    results = {metric: [] for metric in GetTrackMetrics()}
+    for track_name, track in tracks:
+        try:
+            result = TrackMetrics(track)
+        except (OSError, ValueError, xml.parsers.expat.ExpatError) as e:
+            print("Error reading", track)
+            print(str(e))
+            result = {}
+        for metric in GetTrackMetrics():
+            results[metric].append(result.get(metric, None))
+
+    df = pd.DataFrame(results, index=[track[0] for track in tracks])
+    df.index.name = "Route"
+    return df
+
+
+def FindTracks(paths: List[str]) -> List[Tuple[str, str]]:
+    # (name, path) of the given .gpx files and of the .gpx files in the given folders
+    tracks = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, files in sorted(os.walk(path)):
+                for file in sorted(files):
+                    if file.lower().endswith(".gpx"):
+                        tracks.append((os.path.splitext(file)[0], os.path.join(folder, file)))
+        else:
+            tracks.append((os.path.splitext(os.path.basename(path))[0], path))
+    return tracks
+
+
+if __name__ == "__main__":
+    from Runner import ReadRoutesFromFile, rootFolder
+
+    print("Starting script...")
+    startTime = time.time()
+
+    if len(argv) > 1:
+        tracks = FindTracks(argv[1:])
+    else:
+        # the GPX track of every route is saved next to its shapefile
+        tracks = [(name, os.path.splitext(route)[0] + ".gpx") for name, route in ReadRoutesFromFile()]
+    print(len(tracks), "GPX tracks found.")
+
+    track_df = RunOnTracks(tracks)
+
+    print("Saving results to TurnsElevation.csv...")
+    track_df.to_csv(rootFolder + "TurnsElevation.csv")
+    print("Results saved to TurnsElevation.csv")
+
+    print("Script ended in", round(time.time() - startTime, 2), "s")
@@ -0,0 +1,372 @@
+"""
+Incremental re-evaluation of edited routes from cached per-segment metric contributions.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+Route variants usually change one stretch of the course (e.g. the Leslie St
+detour of the Proto 2.x routes) and keep the rest. The Model function has the
+same contract and results as Model in NumpyModel.py, but splits the route into
+segments and evaluates every segment on its own:
+
+- a segment ends at every vertex whose hash is a multiple of
+  VERTICES_PER_SEGMENT, so the boundaries follow the geometry and not the
+  position along the route: an edit only changes the segments it touches,
+  even when it adds or removes vertices
+- the contribution of every segment is cached in memory and next to the
+  metrics of ResultCache.py under the Cache folder, keyed by the coordinates of
+  the segment, the buffer size and the fingerprints of the reference layers
+
+The contribution of a segment is the ids of the points and residential zones
+within the buffer of the segment, the ids of the BIAs near it together with
+the scanline intervals of its buffer (see BIAArea.py), and the ids of the
+condominiums whose representative point has an odd number of crossings with
+the edges of the segment (ray cast in +x, see Containment.py). The metrics are
+aggregated over the segments with every feature counted once: the ids are
+merged, the BIA area is swept once over the intervals of all the segments, and
+a condominium is inside the closed route when its crossings with all the
+segments and with the edges closing the route add up to an odd number. Only
+the segments whose geometry changed are evaluated, so the cost of evaluating
+an edited route follows the size of the edit rather than the length of the
+course. With CondominiumWithin the condominiums entirely inside the closed
+route are counted on the whole route (see CountCondominiums in NumpyModel.py).
+
+Example Usage:
+python Incremental.py {LocationOfRouteFeature.shp} 100 Meters
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple
+from sys import argv
+import numpy as np
+import hashlib
+import time
+import os
+
+from Model import GetMetrics
+from Profiling import Profiler
+from SpatialIndex import Fingerprint
+import NumpyModel
+import ResultCache
+import Geometry
+import BIAArea
+
+# bump when the contributions of the segments change without a change of the data
+SEGMENT_VERSION = 1
+SEGMENT_SUFFIX = ".segment.npz"
+
+# average and largest number of vertices of a segment
+VERTICES_PER_SEGMENT = 32
+MAX_SEGMENT_VERTICES = 4 * VERTICES_PER_SEGMENT
+
+# contributions kept in memory, least recently used first
+MAX_SEGMENT_ENTRIES = 1024
+
+# arrays of a segment contribution needed by every metric
+MetricArrays = {
+    "Number of Places of Interests": ["poi"],
+    "Number of Subway Stations": ["subway"],
+    "Number of High Traffic Intersections": ["traffic"],
+    "Number of Residential Zones": ["residential"],
+    "Areas of Business Improvement Areas": ["biaLines", "biaLow", "biaHigh"],
+    "Number of Condomininiums within the Route Coverage Area": ["condominiumParity"],
+}
+
+_segmentCache: "OrderedDict[str, Dict[str, np.ndarray]]" = OrderedDict()
+
+
+def VertexHashes(xy: np.ndarray) -> np.ndarray:
+    # hash of the coordinates of every vertex, the same in every process
+    bits = np.ascontiguousarray(xy, dtype=np.float64).view(np.uint64).reshape(-1, 2)
+    mixed = bits[:, 0] * np.uint64(0x9E3779B97F4A7C15) ^ bits[:, 1] * np.uint64(0xC2B2AE3D27D4EB4F)
+    return mixed >> np.uint64(33)
+
+
+def SplitRoute(xy: np.ndarray, partOffsets: np.ndarray) -> List[Tuple[int, int]]:
+    # (first, last) vertex of every segment, consecutive segments of a part
+    # share their end vertex
+    hashes = VertexHashes(xy)
+    segments = []
+    for start, end in zip(partOffsets[:-1], partOffsets[1:]):
+        if end - start < 2:
+            continue
+        cuts = np.flatnonzero(hashes[start + 1:end - 1] % np.uint64(VERTICES_PER_SEGMENT) == 0) + start + 1
+        bounds = [int(start)] + cuts.tolist() + [int(end) - 1]
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            # split the stretches without any boundary vertex from their first vertex
+            for segmentStart in range(first, last, MAX_SEGMENT_VERTICES):
+                segments.append((segmentStart, min(segmentStart + MAX_SEGMENT_VERTICES, last)))
+    return segments
+
+
+def LayerFingerprints() -> List[str]:
+    values = []
+    for layer in NumpyModel.ReferenceLayers:
+        values.append(layer)
+        values.extend(str(value) for value in Fingerprint(NumpyModel.dataFolder + layer))
+    return values
+
+
+def SegmentKey(lonlat: np.ndarray, bufferMetres: float, fingerprints: List[str]) -> str:
+    digest = hashlib.sha256()
+    digest.update("\n".join([str(SEGMENT_VERSION), repr(float(bufferMetres))] + fingerprints).encode())
+    digest.update(np.ascontiguousarray(lonlat, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def SegmentEntryPath(key: str) -> str:
+    return ResultCache.cacheFolder + key + SEGMENT_SUFFIX
+
+
+def LoadSegment(key: str) -> Dict[str, np.ndarray]:
+    # cached arrays of a segment, empty when the segment was never evaluated
+    if key in _segmentCache:
+        _segmentCache.move_to_end(key)
+        return _segmentCache[key]
+    path = SegmentEntryPath(key)
+    try:
+        with np.load(path) as data:
+            entry = {name: data[name] for name in data.files}
+        # the modification time marks the entry as recently used for eviction
+        os.utime(path)
+    except (OSError, ValueError):
+        return {}
+    _RememberSegment(key, entry)
+    return entry
+
+
+def StoreSegment(key: str, entry: Dict[str, np.ndarray]):
+    _RememberSegment(key, entry)
+    try:
+        # write to a temporary file first so concurrent readers never see a partial entry
+        os.makedirs(ResultCache.cacheFolder, exist_ok=True)
+        path = SegmentEntryPath(key)
+        temporaryPath = path + "." + str(os.getpid()) + ".tmp.npz"
+        np.savez(temporaryPath, **entry)
+        os.replace(temporaryPath, path)
+    except OSError:
+        # read-only project folder, keep the segment in memory only
+        pass
+
+
+def _RememberSegment(key: str, entry: Dict[str, np.ndarray]):
+    _segmentCache[key] = entry
+    _segmentCache.move_to_end(key)
+    while len(_segmentCache) > MAX_SEGMENT_ENTRIES:
+        _segmentCache.popitem(last=False)
+
+
+def SegmentBox(xy: np.ndarray, distance: float) -> np.ndarray:
+    # lon/lat bbox of segment vertices (metres) expanded by distance metres
+    return Geometry.LonLatBox(np.concatenate([xy.min(axis=0) - distance, xy.max(axis=0) + distance]))
+
+
+def RequiredArrays(metric: str, condominiumWithin: bool = False) -> List[str]:
+    # the condominiums are counted on the whole route with condominiumWithin
+    if metric == "Number of Condomininiums within the Route Coverage Area" and condominiumWithin:
+        return []
+    return MetricArrays.get(metric, [])
+
+
+def EdgeParity(points: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # ids of the points whose ray cast in +x crosses the edges a-b an odd number of times
+    if len(a) == 0 or len(points) == 0:
+        return np.zeros(0, dtype=np.int64)
+    low = np.minimum(a[:, 1], b[:, 1]).min()
+    high = np.maximum(a[:, 1], b[:, 1]).max()
+    right = np.maximum(a[:, 0], b[:, 0]).max()
+    candidates = np.flatnonzero((points[:, 1] >= low) & (points[:, 1] <= high) & (points[:, 0] <= right))
+    return candidates[Geometry.CrossingParity(points[candidates], a, b)]
+
+
+def EvaluateSegment(xy: np.ndarray, bufferMetres: float, metrics: List[str]) -> Dict[str, np.ndarray]:
+    # contribution of the segment with vertices xy (metres) to the given metrics
+    a, b = xy[:-1], xy[1:]
+    grid = Geometry.SegmentGrid(a, b, bufferMetres)
+    entry = {}
+
+    for metric, name, feature in (("Number of Places of Interests", "poi", NumpyModel.POIFeature),
+                                  ("Number of Subway Stations", "subway", NumpyModel.SubwayFeature),
+                                  ("Number of High Traffic Intersections", "traffic", NumpyModel.HighTrafficFeature)):
+        if metric in metrics:
+            entry[name] = NumpyModel.PointDistances(NumpyModel.LoadLayer(feature, []), grid, bufferMetres)[0]
+
+    if "Number of Residential Zones" in metrics:
+        Zoning = NumpyModel.LoadLayerInBox(NumpyModel.ZoningFeature, SegmentBox(xy, bufferMetres), [])
+        ResidentialZones = NumpyModel.LoadBitmapIndex(NumpyModel.ZoningFeature, "GEN_ZON2").Bitmap(NumpyModel.ResidentialZoneCodes)
+        near = NumpyModel.PolygonsNearRoute(Zoning, grid, bufferMetres, bitmap=ResidentialZones)
+        # ids in the whole layer, the features of a partial layer differ from segment to segment
+        entry["residential"] = NumpyModel.GlobalIds(Zoning, near)
+
+    if "Areas of Business Improvement Areas" in metrics:
+        entry["biaLines"], entry["biaLow"], entry["biaHigh"] = Geometry.CapsuleIntervals(
+            a, b, bufferMetres, BIAArea.ScanlineSpacing(bufferMetres))
+
+    if "Number of Condomininiums within the Route Coverage Area" in metrics:
+        points = NumpyModel.LoadRepresentativePoints(NumpyModel.PropertyFeature, "F_TYPE", NumpyModel.CondominiumType)
+        entry["condominiumParity"] = EdgeParity(points, a, b)
+
+    return entry
+
+
+def JoiningEdges(xy: np.ndarray, segments: List[Tuple[int, int]]) -> Tuple[np.ndarray, np.ndarray]:
+    # edges of the closed route polygon (see ClosedRoutePolygon in NumpyModel.py)
+    # not covered by any segment: the edges joining the parts and the closing edge
+    covered = np.zeros(max(len(xy) - 1, 0), dtype=bool)
+    for first, last in segments:
+        covered[first:last] = True
+    starts = np.flatnonzero(~covered)
+    a = np.concatenate([xy[starts], xy[-1:]])
+    b = np.concatenate([xy[starts + 1], xy[:1]])
+    return a, b
+
+
+def Aggregate(route, xy: np.ndarray, segments: List[Tuple[int, int]], entries: List[Dict[str, np.ndarray]],
+              bufferMetres: float, metrics: List[str], condominiumWithin: bool = False) -> Dict[str, int]:
+    # metrics of the whole route from the contributions of its segments, every
+    # feature matched by several segments is counted once
+    def Merged(name: str) -> np.ndarray:
+        return np.unique(np.concatenate([np.zeros(0, dtype=np.int64)] + [entry[name] for entry in entries]))
+
+    result = {}
+    for metric, name in (("Number of Places of Interests", "poi"),
+                         ("Number of Subway Stations", "subway"),
+                         ("Number of High Traffic Intersections", "traffic"),
+                         ("Number of Residential Zones", "residential")):
+        if metric in metrics:
+            result[metric] = len(Merged(name))
+
+    if "Areas of Business Improvement Areas" in metrics:
+        BIA = NumpyModel.LoadLayer(NumpyModel.BIAFeature, [])
+        BIAResult = BIAArea.BufferOverlapArea(
+            BIA,
+            np.concatenate([np.zeros(0, dtype=np.int64)] + [entry["biaLines"] for entry in entries]),
+            np.concatenate([np.zeros(0)] + [entry["biaLow"] for entry in entries]),
+            np.concatenate([np.zeros(0)] + [entry["biaHigh"] for entry in entries]),
+            BIAArea.ScanlineSpacing(bufferMetres))
+        result["Areas of Business Improvement Areas"] = int(BIAResult)
+
+    if "Number of Condomininiums within the Route Coverage Area" in metrics:
+        if condominiumWithin:
+            result["Number of Condomininiums within the Route Coverage Area"] = NumpyModel.CountCondominiums(route, within=True)
+        else:
+            points = NumpyModel.LoadRepresentativePoints(NumpyModel.PropertyFeature, "F_TYPE", NumpyModel.CondominiumType)
+            a, b = JoiningEdges(xy, segments)
+            crossings = np.bincount(np.concatenate([EdgeParity(points, a, b)] + [entry["condominiumParity"] for entry in entries]),
+                                    minlength=len(points))
+            result["Number of Condomininiums within the Route Coverage Area"] = int(np.count_nonzero(crossings % 2 == 1))
+
+    return result
+
+
+def SegmentKeys(route, bufferMetres: float, fingerprints: Optional[List[str]] = None) -> Tuple[List[Tuple[int, int]], List[str]]:
+    # (first, last) vertex and cache key of every segment of the route
+    segments = SplitRoute(route.xy, route.partOffsets)
+    fingerprints = fingerprints or LayerFingerprints()
+    return segments, [SegmentKey(route.xy[first:last + 1], bufferMetres, fingerprints) for first, last in segments]
+
+
+def SegmentEntries(xy: np.ndarray, segments: List[Tuple[int, int]], keys: List[str], bufferMetres: float,
+                   metrics: List[str], condominiumWithin: bool = False) -> Tuple[List[Dict[str, np.ndarray]], int]:
+    # (contribution of every segment, number of segments reused from the
+    # cache), only the segments missing from the cache are evaluated
+    entries = []
+    reused = 0
+    for (first, last), key in zip(segments, keys):
+        entry = LoadSegment(key)
+        missing = [metric for metric in metrics if any(name not in entry for name in RequiredArrays(metric, condominiumWithin))]
+        if len(missing) == 0:
+            reused += 1
+        else:
+            entry = dict(entry, **EvaluateSegment(xy[first:last + 1], bufferMetres, missing))
+            StoreSegment(key, entry)
+        entries.append(entry)
+    return entries, reused
+
+
+def EvaluateLayer(route, bufferMetres: float, metrics: List[str],
+                  fingerprints: Optional[List[str]] = None, condominiumWithin: bool = False) -> Dict[str, int]:
+    # metrics of a route already loaded (or built in memory, see CourseSearch.py)
+    segments, keys = SegmentKeys(route, bufferMetres, fingerprints)
+    entries, _ = SegmentEntries(route.Metres(), segments, keys, bufferMetres, metrics, condominiumWithin)
+    return Aggregate(route, route.Metres(), segments, entries, bufferMetres, metrics, condominiumWithin)
+
+
+def Model(Route: str, BufferSize: int, BufferSizeUnit: str, ScratchFolder: Optional[str] = None,
+          Metrics: Optional[List[str]] = None, CondominiumWithin: bool = False) -> Dict[str, Optional[int]]:
+    # ScratchFolder is accepted for compatibility with Model.py, this backend
+    # does not write any intermediate files
+    # CondominiumWithin counts the condominiums entirely inside the closed route
+    # (see CountCondominiums in NumpyModel.py)
+    # metrics to compute (see GetMetrics), all of them by default
+    Metrics = GetMetrics() if Metrics is None else Metrics
+    # keep track of result
+    result = {}
+    # keep track of the time, memory and feature counts of every step (see Profiling.py)
+    profiler = Profiler(Route)
+
+    try:
+
+        print("==============================================================")
+        print("Step 1: Splitting Route into segments...")
+        step = profiler.Start("Step 1: Splitting Route")
+
+        bufferMetres = Geometry.BufferSizeInMetres(BufferSize, BufferSizeUnit)
+        route = NumpyModel.LoadRoute(Route)
+        xy = route.Metres()
+        segments, keys = SegmentKeys(route, bufferMetres)
+
+        print("Finished Splitting Route: " + str(len(segments)) + " segments")
+        print("Step 1: Completed in " + str(round(profiler.Stop(step), 2)) + " s.")
+
+        print("==============================================================")
+        print("Step 2: Evaluating changed segments...")
+        step = profiler.Start("Step 2: Segments")
+
+        entries, reused = SegmentEntries(xy, segments, keys, bufferMetres, Metrics, CondominiumWithin)
+
+        print("Finished Evaluating Segments: " + str(len(segments) - reused) + " evaluated, " + str(reused) + " reused")
+        print("Step 2: Completed in " + str(round(profiler.Stop(step, len(segments), len(segments) - reused), 2)) + " s.")
+
+        print("==============================================================")
+        print("Step 3: Aggregating the segments...")
+        step = profiler.Start("Step 3: Aggregating Segments")
+
+        result.update(Aggregate(route, xy, segments, entries, bufferMetres, Metrics, CondominiumWithin))
+        for metric in GetMetrics():
+            if metric in result:
+                print(metric + ": " + str(result[metric]))
+
+        print("Step 3: Completed in " + str(round(profiler.Stop(step, len(segments)), 2)) + " s.")
+
+    except Exception as e:
+        result["Error"] = str(e)
+
+    result["Profile"] = profiler.Close()
+    return result
+
+
+if __name__ == '__main__':
+    # if not enough arguments, print usage
+    if len(argv) < 4:
+        print("Error: Missing arguments")
+        print("Usage: Incremental.py <Route> <BufferSize> <BufferSizeUnit>")
+        exit(1)
+
+    scriptStartTime = time.time()
+    result = Model(argv[1], int(argv[2]), argv[3])
+    ResultCache.Evict()
+
+    if "Error" in result:
+        print("Script ended in " + str(round((time.time() - scriptStartTime), 2)) + " s. with error:")
+        print(result["Error"])
+        exit(1)
+
+    print("Script ended successfully in " + str(round((time.time() - scriptStartTime), 2)) + " s.")
+    print("\nResult:")
+    for key in GetMetrics():
+        print(f"{key}: {result[key]}")
@@ -15,12 +15,23 @@ to activate the conda environment and run the script.
 Example Usage (assuming you are in the same directory as propy.bat):
 .\propy.bat {LocationToModel.py} {LocationOfRouteFeature.shp} 100 Meters True
 
+The metrics of the baseline and the test route are cached on disk (see
+ResultCache.py), so the baseline is only evaluated once per buffer size.
+Add --no-cache to evaluate both routes from scratch.
+
 Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
 """
-from typing import Optional, List, Dict
-import arcpy
+from typing import Optional, List, Dict, Tuple
+try:
+    import arcpy
+except ImportError:
+    # arcpy is only available in ArcGIS Pro; GetMetrics is still importable
+    # without it, e.g. by the NumPy backend in NumpyModel.py
+    arcpy = None
 import time
 import json
+from Profiling import Profiler
+import Profiling
 from sys import argv
 
 # Root folder may need to be changed based on the location of the project
@@ -30,90 +41,97 @@ rootFolder = "C:\\Users\\14168\\Documents\\ArcGIS\\Projects\\TWM\\"
 workspaceGDB = rootFolder + "TWM.gdb"
 dataFolder = rootFolder + "Data\\"
 
-def Model(Route: str, BufferSize: int, BufferSizeUnit: str) -> Dict[str, Optional[int]]:
+def Model(Route: str, BufferSize: int, BufferSizeUnit: str, ScratchFolder: Optional[str] = None,
+          Metrics: Optional[List[str]] = None) -> Dict[str, Optional[int]]:
+    # folder for the intermediate feature classes, defaults to the root folder.
+    # Concurrent runs must each use their own scratch folder.
+    scratchFolder = ScratchFolder or rootFolder
+    # metrics to compute (see GetMetrics), all of them by default. The steps
+    # of the other metrics are skipped.
+    Metrics = GetMetrics() if Metrics is None else Metrics
     # keep track of result
     result = {}
     # to keep track of features which might need to be cleaned up
     intermediateFiles = []
     # To allow overwriting outputs change overwriteOutput option to True.
     arcpy.env.overwriteOutput = True
-    # keep track of time of execution
-    startTime = time.time()
+    # keep track of the time, memory and feature counts of every step (see Profiling.py)
+    profiler = Profiler(Route)
     
     try:
 
-        print("==============================================================")
-        print("Step 1: Buffering Route...")
+        if any(metric != "Number of Condomininiums within the Route Coverage Area" for metric in Metrics):
+            print("==============================================================")
+            print("Step 1: Buffering Route...")
+            step = profiler.Start("Step 1: Buffering Route")
 
-        # Create a buffer around the route
-        RouteBuffer = rootFolder + "RouteBuffer"
-        # if the buffer already exists, delete it
-        if arcpy.Exists(RouteBuffer):
-            print("File with conflicting name found, deleting existing RouteBuffer file.")
-            arcpy.Delete_management(RouteBuffer)
+            # Create a buffer around the route
+            RouteBuffer = scratchFolder + "RouteBuffer"
+            # if the buffer already exists, delete it
+            if arcpy.Exists(RouteBuffer):
+                print("File with conflicting name found, deleting existing RouteBuffer file.")
+                arcpy.Delete_management(RouteBuffer)
 
-        arcpy.Buffer_analysis(Route, RouteBuffer, str(BufferSize) + " " + BufferSizeUnit, "FULL", "ROUND", "NONE", "", "PLANAR")
+            arcpy.Buffer_analysis(Route, RouteBuffer, str(BufferSize) + " " + BufferSizeUnit, "FULL", "ROUND", "NONE", "", "PLANAR")
 
-        intermediateFiles.append(RouteBuffer)
+            intermediateFiles.append(RouteBuffer)
 
-        print("Finished Buffering Route: " + RouteBuffer)
-        print("Step 1: Completed in " + str(round((time.time() - startTime), 2)) + " s.")
+            print("Finished Buffering Route: " + RouteBuffer)
+            print("Step 1: Completed in " + str(round(profiler.Stop(step), 2)) + " s.")
 
-        startTime = time.time()
-
-        print("==============================================================")
-        print("Step 2: Counting Points of Interest (POI) within the buffer...")
+        if "Number of Places of Interests" in Metrics:
+            print("==============================================================")
+            print("Step 2: Counting Points of Interest (POI) within the buffer...")
+            step = profiler.Start("Step 2: Places of Interest")
 
-        # Count number of POI feature that intersects with RouteBuffer 
-        # using the Select Layer By Location tool
-        POIFeature = dataFolder + "Places_of_Interests\\Places of Interest and Attractions - 4326.shp"
-        POIIntersectionRes = arcpy.SelectLayerByLocation_management(POIFeature, "INTERSECT", RouteBuffer, "", "NEW_SELECTION")
+            # Count number of POI feature that intersects with RouteBuffer 
+            # using the Select Layer By Location tool
+            POIFeature = dataFolder + "Places_of_Interests\\Places of Interest and Attractions - 4326.shp"
+            POIIntersectionRes = arcpy.SelectLayerByLocation_management(POIFeature, "INTERSECT", RouteBuffer, "", "NEW_SELECTION")
 
-        POIResult = int(arcpy.GetCount_management(POIIntersectionRes).getOutput(0))
-        result["Number of Places of Interests"] = POIResult
+            POIResult = int(arcpy.GetCount_management(POIIntersectionRes).getOutput(0))
+            result["Number of Places of Interests"] = POIResult
 
-        intermediateFiles.append(POIIntersectionRes)
-        
-        print("Finished Counting Points of Interest (POI) within the buffer: " + str(POIResult))
-        print("Step 2: Completed in " + str(round((time.time() - startTime), 2)) + " s.")
+            intermediateFiles.append(POIIntersectionRes)
 
-        startTime = time.time()
+            print("Finished Counting Points of Interest (POI) within the buffer: " + str(POIResult))
+            print("Step 2: Completed in " + str(round(profiler.Stop(step, LayerCount(POIFeature), POIResult), 2)) + " s.")
 
-        print("==============================================================")
-        print("Step 3: Counting Subway Stations within the buffer...")
+        if "Number of Subway Stations" in Metrics:
+            print("==============================================================")
+            print("Step 3: Counting Subway Stations within the buffer...")
+            step = profiler.Start("Step 3: Subway Stations")
 
-        # Count number of Subway Stations feature that intersects with RouteBuffer
-        # using the Select Layer By Location tool
-        SubwayFeature = dataFolder + "SubwayStops\\TorontoSubwayStations_Ridership.shp"
-        SubwayIntersectionRes = arcpy.SelectLayerByLocation_management(SubwayFeature, "INTERSECT", RouteBuffer, "", "NEW_SELECTION")
+            # Count number of Subway Stations feature that intersects with RouteBuffer
+            # using the Select Layer By Location tool
+            SubwayFeature = dataFolder + "SubwayStops\\TorontoSubwayStations_Ridership.shp"
+            SubwayIntersectionRes = arcpy.SelectLayerByLocation_management(SubwayFeature, "INTERSECT", RouteBuffer, "", "NEW_SELECTION")
 
-        SubwayResult = int(arcpy.GetCount_management(SubwayIntersectionRes).getOutput(0))
-        result["Number of Subway Stations"] = SubwayResult
+            SubwayResult = int(arcpy.GetCount_management(SubwayIntersectionRes).getOutput(0))
+            result["Number of Subway Stations"] = SubwayResult
 
-        intermediateFiles.append(SubwayIntersectionRes)
+            intermediateFiles.append(SubwayIntersectionRes)
 
-        print("Finished Counting Subway Stations within the buffer: " + str(SubwayResult))
-        print("Step 3: Completed in " + str(round((time.time() - startTime), 2)) + " s.")
+            print("Finished Counting Subway Stations within the buffer: " + str(SubwayResult))
+            print("Step 3: Completed in " + str(round(profiler.Stop(step, LayerCount(SubwayFeature), SubwayResult), 2)) + " s.")
 
-        startTime = time.time()
+        if "Number of High Traffic Intersections" in Metrics:
+            print("==============================================================")
+            print("Step 4: Counting High Traffic Intersections within the buffer...")
+            step = profiler.Start("Step 4: High Traffic Intersections")
 
-        print("==============================================================")
-        print("Step 4: Counting High Traffic Intersections within the buffer...")
+            # Count number of High Traffic Intersections feature that intersects with RouteBuffer
+            # using the Select Layer By Location tool
+            HighTrafficFeature = dataFolder + "above_avg_car_intersections\\above_avg_car_intersections.shp"
+            HighTrafficIntersectionRes = arcpy.SelectLayerByLocation_management(HighTrafficFeature, "INTERSECT", RouteBuffer, "", "NEW_SELECTION")
 
-        # Count number of High Traffic Intersections feature that intersects with RouteBuffer
-        # using the Select Layer By Location tool
-        HighTrafficFeature = dataFolder + "above_avg_car_intersections\\above_avg_car_intersections.shp"
-        HighTrafficIntersectionRes = arcpy.SelectLayerByLocation_management(HighTrafficFeature, "INTERSECT", RouteBuffer, "", "NEW_SELECTION")
+            HighTrafficResult = int(arcpy.GetCount_management(HighTrafficIntersectionRes).getOutput(0))
+            result["Number of High Traffic Intersections"] = HighTrafficResult
 
-        HighTrafficResult = int(arcpy.GetCount_management(HighTrafficIntersectionRes).getOutput(0))
-        result["Number of High Traffic Intersections"] = HighTrafficResult
+            intermediateFiles.append(HighTrafficIntersectionRes)
 
-        intermediateFiles.append(HighTrafficIntersectionRes)
-
-        print("Finished Counting High Traffic Intersections within the buffer: " + str(HighTrafficResult))
-        print("Step 4: Completed in " + str(round((time.time() - startTime), 2)) + " s.")
-
-        startTime = time.time()
+            print("Finished Counting High Traffic Intersections within the buffer: " + str(HighTrafficResult))
+            print("Step 4: Completed in " + str(round(profiler.Stop(step, LayerCount(HighTrafficFeature), HighTrafficResult), 2)) + " s.")
 
         # print("==============================================================")
         # print("Step 5: Counting Number of Commercial Zones within the buffer...")
@@ -135,29 +153,29 @@ def Model(Route: str, BufferSize: int, BufferSizeUnit: str) -> Dict[str, Optiona
 
         # startTime = time.time()
 
-        print("==============================================================")
-        print("Step 6: Counting Number of Residential Zones within the buffer...")
+        if "Number of Residential Zones" in Metrics:
+            print("==============================================================")
+            print("Step 6: Counting Number of Residential Zones within the buffer...")
+            step = profiler.Start("Step 6: Residential Zones")
 
-        ZoningFeature = dataFolder + "Zoning_Area_-_4326\\Zoning Area - 4326.shp"
+            ZoningFeature = dataFolder + "Zoning_Area_-_4326\\Zoning Area - 4326.shp"
 
-        # Filter out residential zones from the zoning data using
-        # filter by attributes GEN_ZON2 = 0 OR 101
-        ResidentialZones = arcpy.SelectLayerByAttribute_management(ZoningFeature, "NEW_SELECTION", "GEN_ZON2 = 0 OR GEN_ZON2 = 101")
+            # Filter out residential zones from the zoning data using
+            # filter by attributes GEN_ZON2 = 0 OR 101
+            ResidentialZones = arcpy.SelectLayerByAttribute_management(ZoningFeature, "NEW_SELECTION", "GEN_ZON2 = 0 OR GEN_ZON2 = 101")
 
-        # Count number of Residential Zones feature that intersects with RouteBuffer
-        # using the Select Layer By Location tool
-        ResidentialIntersectionRes = arcpy.SelectLayerByLocation_management(ResidentialZones, "INTERSECT", RouteBuffer, "", "SUBSET_SELECTION")
+            # Count number of Residential Zones feature that intersects with RouteBuffer
+            # using the Select Layer By Location tool
+            ResidentialIntersectionRes = arcpy.SelectLayerByLocation_management(ResidentialZones, "INTERSECT", RouteBuffer, "", "SUBSET_SELECTION")
 
-        ResidentialResult = int(arcpy.GetCount_management(ResidentialIntersectionRes).getOutput(0))
-        result["Number of Residential Zones"] = ResidentialResult
+            ResidentialResult = int(arcpy.GetCount_management(ResidentialIntersectionRes).getOutput(0))
+            result["Number of Residential Zones"] = ResidentialResult
 
-        intermediateFiles.append(ResidentialIntersectionRes)
-        intermediateFiles.append(ResidentialZones)
+            intermediateFiles.append(ResidentialIntersectionRes)
+            intermediateFiles.append(ResidentialZones)
 
-        print("Finished Counting Number of Residential Zones within the buffer: " + str(ResidentialResult))
-        print("Step 6: Completed in " + str(round((time.time() - startTime), 2)) + " s.")
-
-        startTime = time.time()
+            print("Finished Counting Number of Residential Zones within the buffer: " + str(ResidentialResult))
+            print("Step 6: Completed in " + str(round(profiler.Stop(step, LayerCount(ZoningFeature, "GEN_ZON2 = 0 OR GEN_ZON2 = 101"), ResidentialResult), 2)) + " s.")
 
         # print("==============================================================")
         # print("Step 7: Counting Number of Mixed Use Zones (Commercial & Residential) within the buffer...")
@@ -181,75 +199,105 @@ def Model(Route: str, BufferSize: int, BufferSizeUnit: str) -> Dict[str, Optiona
 
         # startTime = time.time()
 
-        print("==============================================================")
-        print("Step 8: Calculating Areas of Business Improvement Areas within the buffer...")
-
-        # Find overlap using the Count Overlapping features tool
-        BIAFeature = dataFolder + "Business Improvement Areas Data - 4326\\Business Improvement Areas Data - 4326.shp"
-        BIAOverlapRes = arcpy.CountOverlappingFeatures_analysis([BIAFeature, RouteBuffer], None, 1)
-
-        # Calculate area of overlap using the Calculate Geometry tool
-        BIAOverlapAreaRes = arcpy.CalculateGeometryAttributes_management(
-            in_features=BIAOverlapRes, 
-            geometry_property=[["Area", "AREA_GEODESIC"]], 
-            length_unit="",
-            area_unit="SQUARE_METERS")
-        
-        # Select record with attribute COUNT = 2
-        ValidBIAOverlapAreaRes = arcpy.SelectLayerByAttribute_management(BIAOverlapAreaRes, "NEW_SELECTION", "COUNT_ = 2")
-
-        # sum the area of the selected records using the Summary Statistics tool
-        SummarySumTable = arcpy.analysis.Statistics(ValidBIAOverlapAreaRes, None, [["Area", "SUM"]])
-        result["Areas of Business Improvement Areas"] = int(arcpy.da.SearchCursor(SummarySumTable, "SUM_Area").next()[0])
-
-        intermediateFiles.append(BIAOverlapRes)
-        intermediateFiles.append(BIAOverlapAreaRes)
-        intermediateFiles.append(ValidBIAOverlapAreaRes)
-        intermediateFiles.append(SummarySumTable)
-
-        print("Finished Calculating Areas of Business Improvement Areas within the buffer: " + str(result["Areas of Business Improvement Areas"]) + " m2")
-        print("Step 8: Completed in " + str(round((time.time() - startTime), 2)) + " s.")
-
-        startTime = time.time()
-
-        print("==============================================================")
-        print("Step 9: Counting Number of Condomininiums within the Closed Route")
-
-        # Convert line feature to polygon
-        ConnectedRoutePolygon = rootFolder + "ConnectedRoutePolygon"
-        arcpy.FeatureToPolygon_management(Route, ConnectedRoutePolygon)
-
-        # Select all the condominiums from property data
-        PropertyFeature = dataFolder + "Property Boundaries\\PROPERTY_BOUNDARIES_WGS84.shp"
-        Condominiums = arcpy.SelectLayerByAttribute_management(PropertyFeature, "NEW_SELECTION", "F_TYPE = 'CONDO'")
-
-        # Count how many condominiums are inside the connected route polygon
-        CondominiumsIntersectionRes = arcpy.SelectLayerByLocation_management(Condominiums, "WITHIN", ConnectedRoutePolygon, "", "SUBSET_SELECTION")
-        result["Number of Condomininiums within the Route Coverage Area"] = int(arcpy.GetCount_management(CondominiumsIntersectionRes).getOutput(0))
-
-        intermediateFiles.append(CondominiumsIntersectionRes)
-        intermediateFiles.append(Condominiums)
-        intermediateFiles.append(ConnectedRoutePolygon)
-
-        print("Finished Counting Number of Condomininiums within the Route Coverage Area: " + str(result["Number of Condomininiums within the Route Coverage Area"]))
-        print("Step 9: Completed in " + str(round((time.time() - startTime), 2)) + " s.")
+        if "Areas of Business Improvement Areas" in Metrics:
+            print("==============================================================")
+            print("Step 8: Calculating Areas of Business Improvement Areas within the buffer...")
+            step = profiler.Start("Step 8: Business Improvement Areas")
+
+            # Find overlap using the Count Overlapping features tool
+            BIAFeature = dataFolder + "Business Improvement Areas Data - 4326\\Business Improvement Areas Data - 4326.shp"
+            BIAOverlapRes = arcpy.CountOverlappingFeatures_analysis([BIAFeature, RouteBuffer], None, 1)
+
+            # Calculate area of overlap using the Calculate Geometry tool
+            BIAOverlapAreaRes = arcpy.CalculateGeometryAttributes_management(
+                in_features=BIAOverlapRes, 
+                geometry_property=[["Area", "AREA_GEODESIC"]], 
+                length_unit="",
+                area_unit="SQUARE_METERS")
+
+            # Select record with attribute COUNT = 2
+            ValidBIAOverlapAreaRes = arcpy.SelectLayerByAttribute_management(BIAOverlapAreaRes, "NEW_SELECTION", "COUNT_ = 2")
+
+            # sum the area of the selected records using the Summary Statistics tool
+            # (the FREQUENCY field of the table is the number of selected records)
+            SummarySumTable = arcpy.analysis.Statistics(ValidBIAOverlapAreaRes, None, [["Area", "SUM"]])
+            BIASumArea, BIAOverlaps = arcpy.da.SearchCursor(SummarySumTable, ["SUM_Area", "FREQUENCY"]).next()
+            result["Areas of Business Improvement Areas"] = int(BIASumArea)
+
+            intermediateFiles.append(BIAOverlapRes)
+            intermediateFiles.append(BIAOverlapAreaRes)
+            intermediateFiles.append(ValidBIAOverlapAreaRes)
+            intermediateFiles.append(SummarySumTable)
+
+            print("Finished Calculating Areas of Business Improvement Areas within the buffer: " + str(result["Areas of Business Improvement Areas"]) + " m2")
+            print("Step 8: Completed in " + str(round(profiler.Stop(step, LayerCount(BIAFeature), BIAOverlaps), 2)) + " s.")
+
+        if "Number of Condomininiums within the Route Coverage Area" in Metrics:
+            print("==============================================================")
+            print("Step 9: Counting Number of Condomininiums within the Closed Route")
+            step = profiler.Start("Step 9: Condominiums")
+
+            # Convert line feature to polygon
+            ConnectedRoutePolygon = scratchFolder + "ConnectedRoutePolygon"
+            arcpy.FeatureToPolygon_management(Route, ConnectedRoutePolygon)
+
+            # Select all the condominiums from property data
+            PropertyFeature = dataFolder + "Property Boundaries\\PROPERTY_BOUNDARIES_WGS84.shp"
+            Condominiums = arcpy.SelectLayerByAttribute_management(PropertyFeature, "NEW_SELECTION", "F_TYPE = 'CONDO'")
+
+            # Count how many condominiums are inside the connected route polygon
+            CondominiumsIntersectionRes = arcpy.SelectLayerByLocation_management(Condominiums, "WITHIN", ConnectedRoutePolygon, "", "SUBSET_SELECTION")
+            result["Number of Condomininiums within the Route Coverage Area"] = int(arcpy.GetCount_management(CondominiumsIntersectionRes).getOutput(0))
+
+            intermediateFiles.append(CondominiumsIntersectionRes)
+            intermediateFiles.append(Condominiums)
+            intermediateFiles.append(ConnectedRoutePolygon)
+
+            print("Finished Counting Number of Condomininiums within the Route Coverage Area: " + str(result["Number of Condomininiums within the Route Coverage Area"]))
+            print("Step 9: Completed in " + str(round(profiler.Stop(step, LayerCount(PropertyFeature, "F_TYPE = 'CONDO'"), result["Number of Condomininiums within the Route Coverage Area"]), 2)) + " s.")
         
     except Exception as e:
         result["Error"] = str(e)
     finally:
-        startTime = time.time()
-
         print("==============================================================")
         print("Analysis completed. Cleaning up...")
+        step = profiler.Start("Clean Up")
 
         # remove the created buffer and intermediate files
         for file in intermediateFiles:
             arcpy.Delete_management(file)
 
-        print("Clean up completed in " + str(round((time.time() - startTime), 2)) + " s.")
+        print("Clean up completed in " + str(round(profiler.Stop(step), 2)) + " s.")
 
+        result["Profile"] = profiler.Close()
         return result
     
+def GetCount(features) -> int:
+    # number of (selected) features of a layer or selection result
+    return int(arcpy.GetCount_management(features).getOutput(0))
+
+# number of features of every reference layer (and attribute filter), only
+# used for the "scanned" counts of the profile, so only counted when
+# Profiling.CountFeatures is on. The reference layers do not change during a
+# batch, so every layer is counted once per process.
+layerCounts: Dict[Tuple[str, str], int] = {}
+
+def LayerCount(feature: str, where: str = "") -> Optional[int]:
+    if not Profiling.CountFeatures:
+        return None
+    if (feature, where) not in layerCounts:
+        if where:
+            # counted on a layer of its own, deleted straight away, so the
+            # selections of the steps are left untouched
+            layer = arcpy.MakeFeatureLayer_management(feature, "TWM_LayerCount", where)
+            try:
+                layerCounts[(feature, where)] = GetCount(layer)
+            finally:
+                arcpy.Delete_management(layer)
+        else:
+            layerCounts[(feature, where)] = GetCount(feature)
+    return layerCounts[(feature, where)]
+
 def GetMetrics() -> List[str]:
     return ["Number of Places of Interests", 
             "Number of Subway Stations", 
@@ -267,11 +315,15 @@ if __name__ == '__main__':
     print("Starting script...\n")
 
     scriptStartTime = time.time()
+
+    # --no-cache can be given anywhere after the script name
+    UseCache = "--no-cache" not in argv
+    argv = [argument for argument in argv if argument != "--no-cache"]
     
     # if not enough arguments, print usage
     if len(argv) < 5:
         print("Error: Missing arguments")
-        print("Usage: Model.py <Route> <BufferSize> <BufferSizeUnit> <show_chart_bool>")
+        print("Usage: Model.py <Route> <BufferSize> <BufferSizeUnit> <show_chart_bool> [--no-cache]")
         print("Example 1: Model.py C:\\Users\\14168\\Documents\\ArcGIS\\Projects\\TWM\\Data\\2023_TWM_Marathon_Route\\2023_TWM_Marathon_Route.shp 100 Meters True")
         print("Example 2: Model.py C:\\Users\\14168\\Documents\\ArcGIS\\Projects\\TWM\\Data\\2023_TWM_Marathon_Route\\2023_TWM_Marathon_Route.shp 1 Kilometers False")
         exit(1)
@@ -297,6 +349,8 @@ if __name__ == '__main__':
         exit(1)
     
 
+    from ResultCache import CachedModel, Evict
+
     # Global Environment settings
     with arcpy.EnvManager(scratchWorkspace=workspaceGDB, workspace=workspaceGDB):
         startTime = time.time()
@@ -304,7 +358,7 @@ if __name__ == '__main__':
         
         # use baseline model from data and the last 2 arguments 
         print("Doing baseline evaluation...")
-        baselineResult = Model(dataFolder + "2023_TWM_Marathon_Route\\2023_TWM_Marathon_Route.shp", *argv[2:4])
+        baselineResult = CachedModel(Model, "arcpy", dataFolder + "2023_TWM_Marathon_Route\\2023_TWM_Marathon_Route.shp", *argv[2:4], UseCache=UseCache)
         print("Baseline evaluation completed in " + str(round((time.time() - startTime), 2)) + " s.\n")
 
         # if no error in baseline result, run model with the given arguments
@@ -313,12 +367,15 @@ if __name__ == '__main__':
 
             # use the model with the given arguments
             print("Doing evaluation with test route...")
-            result = Model(*argv[1:4])
+            result = CachedModel(Model, "arcpy", *argv[1:4], UseCache=UseCache)
             print("Evaluation with test route completed in " + str(round((time.time() - startTime), 2)) + " s.\n")
         else:
             result = baselineResult
             print("Test route evaluation skipped due to error in baseline evaluation.")
 
+    # the evaluations only add to the cache, trim it once at the end
+    Evict()
+
     if "Error" in result:
         print("Script ended in " + str(round((time.time() - scriptStartTime), 2)) + " s. with error:")
         print(result["Error"])
@@ -328,17 +385,18 @@ if __name__ == '__main__':
 
         # print result
         print("\nResult:")
-        for key, value in result.items():
-            print(f"{key}: {value}")
+        for key in GetMetrics():
+            print(f"{key}: {result[key]}")
 
         # print baseline result
         print("\nBaseline Result:")
-        for key, value in baselineResult.items():
-            print(f"{key}: {value}")
+        for key in GetMetrics():
+            print(f"{key}: {baselineResult[key]}")
 
         # calculate the percentage difference of custom route from baseline
         diffResult = {}
-        for key, value in result.items():
+        for key in GetMetrics():
+            value = result[key]
             if key in baselineResult and value:
                 # rename key to make each line shorter and easier to read
                 newKey = key.replace("Number of ", "")
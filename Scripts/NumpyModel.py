@@ -0,0 +1,438 @@
+"""
+Pure Python/NumPy evaluation backend for the Toronto Waterfront Marathon model.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+The Model function has the same contract as Model in Model.py and returns the
+same metrics (see GetMetrics), but reads the shapefiles under the Data folder
+directly and computes every metric in memory with vectorized geometry. It does
+not need arcpy or an ArcGIS Pro environment. Candidate features of every
+reference layer are found through the persistent spatial index of that layer
+(see SpatialIndex.py), so only the features near the route are examined.
+Every layer is compiled once into a columnar snapshot that is memory mapped at
+load (see Snapshot.py), so the shapefiles are only parsed when they change.
+The zoning and property layers, by far the largest, are not loaded whole: only
+the features whose bbox intersects the route bbox are copied out of the
+snapshot (or decoded from the shapefile with ReadLayerInBox when the snapshot
+cannot be written). Their attribute filters are bitmap indexes tested on the
+candidates of the spatial index (see AttributeIndex.py), so the attribute
+columns are never scanned.
+
+A route feature intersects the buffer exactly when its distance to the route
+is at most the buffer size, so no buffer polygon is ever built: points are
+counted by their distance to the route, polygons by their distance to the
+route, and the Business Improvement Areas are clipped by the buffer along
+scanlines (see BIAArea.py). The BIA metric keeps the semantics of the
+COUNT_ = 2 selection in Model.py, which also picks up the areas where two BIAs
+overlap each other; on the routes in RoutesPaths.txt it is within 1.5% of the
+values in Results.csv. The condominiums are counted by a precomputed point
+inside every parcel (see Containment.py), so a parcel straddling the route
+counts when its point is inside the closed route; pass CondominiumWithin=True
+to Model to count only the parcels entirely inside the closed route, like the
+WITHIN selection of Model.py (every vertex inside and no edge crossing it).
+
+Example Usage:
+python NumpyModel.py {LocationOfRouteFeature.shp} 100 Meters
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Optional, List, Dict, Tuple
+from sys import argv
+import numpy as np
+import time
+import os
+
+from Model import GetMetrics
+from Profiling import Profiler
+from Shapefile import Layer, ReadLayer, ReadLayerInBox, BoxesIntersect, NormalisePath
+from SpatialIndex import SpatialIndex, LoadOrBuildIndex, LayerBoxesInMetres, Fingerprint
+import Geometry
+import BIAArea
+import Containment
+import Snapshot
+import AttributeIndex
+
+# Root folder is the project folder containing the Scripts folder
+rootFolder = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+dataFolder = rootFolder + "Data" + os.sep
+
+# reference layers used by the model, relative to the Data folder
+POIFeature = os.path.join("Places_of_Interests", "Places of Interest and Attractions - 4326.shp")
+SubwayFeature = os.path.join("SubwayStops", "TorontoSubwayStations_Ridership.shp")
+HighTrafficFeature = os.path.join("above_avg_car_intersections", "above_avg_car_intersections.shp")
+ZoningFeature = os.path.join("Zoning_Area_-_4326", "Zoning Area - 4326.shp")
+BIAFeature = os.path.join("Business Improvement Areas Data - 4326", "Business Improvement Areas Data - 4326.shp")
+PropertyFeature = os.path.join("Property Boundaries", "PROPERTY_BOUNDARIES_WGS84.shp")
+ReferenceLayers = [POIFeature, SubwayFeature, HighTrafficFeature, ZoningFeature, BIAFeature, PropertyFeature]
+
+# attribute columns the model filters on, with a bitmap index (see AttributeIndex.py)
+LayerFields = {ZoningFeature: ["GEN_ZON2"], PropertyFeature: ["F_TYPE"]}
+
+# attribute filters matching the SQL expressions used in Model.py
+ResidentialZoneCodes = [0, 101]
+CondominiumType = "CONDO"
+
+# GEN_ZON2 codes of the zoning classes, commercial and mixed use match the
+# commented out metrics of Model.py
+ZoneClasses = {"Residential": ResidentialZoneCodes, "Commercial": [201], "Mixed Use": [6, 202]}
+
+# cell size (metres) of the grid of the closed route edges tested against the
+# edges of the features with every vertex inside (see CountFeaturesWithinPolygon)
+WITHIN_CELL_SIZE = 100.0
+
+# loaded layers are kept for the lifetime of the process so that evaluating
+# several routes only reads each shapefile once. Every entry is keyed by the
+# full path of the layer and keeps the fingerprint of its files (see
+# SpatialIndex.Fingerprint), a layer updated while the process runs (i.e. the
+# workers of Service.py) is loaded again.
+_layerCache: Dict[str, Tuple[bytes, Layer]] = {}
+_snapshotCache: Dict[str, Tuple[bytes, Optional[Layer]]] = {}
+_indexCache: Dict[str, Tuple[bytes, SpatialIndex]] = {}
+_representativeCache: Dict[str, Tuple[bytes, Tuple[np.ndarray, np.ndarray]]] = {}
+_bitmapCache: Dict[str, Tuple[bytes, AttributeIndex.BitmapIndex]] = {}
+
+
+def _Cached(cache: Dict[str, tuple], key: str, shpPath: str, Build):
+    # cache[key] built from the layer at shpPath, built again when the files of the layer changed
+    fingerprint = Fingerprint(shpPath).tobytes()
+    entry = cache.get(key)
+    if entry is None or entry[0] != fingerprint:
+        entry = cache[key] = (fingerprint, Build())
+    return entry[1]
+
+
+def LoadLayer(relativePath: str, fields: Optional[List[str]] = None) -> Layer:
+    path = dataFolder + relativePath
+    key = path + "|" + ",".join(fields or [])
+    return _Cached(_layerCache, key, path, lambda: Snapshot.LoadOrCompileLayer(path, fields))
+
+
+def LoadLayerInBox(relativePath: str, box: np.ndarray, fields: Optional[List[str]] = None) -> Layer:
+    # only the features of the layer whose bbox intersects box (lon/lat), used
+    # for the largest layers where most features are far from any route. Only
+    # those features are copied out of the memory mapped snapshot, or decoded
+    # from the shapefile when no snapshot can be written.
+    path = dataFolder + relativePath
+    key = path + "|" + ",".join(fields or [])
+    layer = _Cached(_snapshotCache, key, path, lambda: Snapshot.LoadOrCompileSnapshot(path, fields))
+    if layer is None:
+        return ReadLayerInBox(path, box, fields)
+    return layer.Subset(np.flatnonzero(BoxesIntersect(layer.bboxes, box)))
+
+
+def LoadIndex(layer: Layer) -> SpatialIndex:
+    if layer.featureIds is not None:
+        # partial layers are small and differ from route to route, they are
+        # indexed in memory only
+        return SpatialIndex.Build(LayerBoxesInMetres(layer))
+    return _Cached(_indexCache, layer.path, layer.path, lambda: LoadOrBuildIndex(layer))
+
+
+def LoadBitmapIndex(relativePath: str, field: str) -> AttributeIndex.BitmapIndex:
+    path = dataFolder + relativePath
+    return _Cached(_bitmapCache, path + "|" + field, path, lambda: AttributeIndex.LoadOrBuildBitmapIndex(path, field))
+
+
+def GlobalIds(layer: Layer, features: np.ndarray) -> np.ndarray:
+    # ids in the whole layer of features of a (possibly partial) layer
+    return features if layer.featureIds is None else layer.featureIds[features]
+
+
+def LoadRoute(Route: str) -> Layer:
+    return ReadLayer(NormalisePath(Route), [])
+
+
+def RouteBox(route: Layer, distance: float = 0.0) -> np.ndarray:
+    # lon/lat bbox of the route expanded by distance metres
+    xy = route.Metres()
+    return Geometry.LonLatBox(np.concatenate([xy.min(axis=0) - distance, xy.max(axis=0) + distance]))
+
+
+def RouteGrid(route: Layer, bufferMetres: float) -> Geometry.SegmentGrid:
+    a, b = Geometry.LineSegments(route.Metres(), route.partOffsets)
+    return Geometry.SegmentGrid(a, b, bufferMetres)
+
+
+def PointDistances(layer: Layer, grid: Geometry.SegmentGrid, maxDistance: float) -> Tuple[np.ndarray, np.ndarray]:
+    # ids and distances to the route of the points within maxDistance of it
+    candidates = LoadIndex(layer).QueryRoute(grid, maxDistance)
+    distances = grid.Distances(layer.Points(metres=True)[candidates], maxDistance)
+    near = np.isfinite(distances)
+    return candidates[near], distances[near]
+
+
+def CountPointsNearRoute(layer: Layer, grid: Geometry.SegmentGrid, bufferMetres: float) -> int:
+    return len(PointDistances(layer, grid, bufferMetres)[0])
+
+
+def _FeatureRings(layer: Layer, feature: int):
+    rings = layer.FeatureParts(feature, metres=True)
+    ringOffsets = np.concatenate([[0], np.cumsum([len(ring) for ring in rings])])
+    return np.concatenate(rings), ringOffsets
+
+
+def PolygonDistances(layer: Layer, grid: Geometry.SegmentGrid, maxDistance: float,
+                     features: Optional[np.ndarray] = None, bitmap: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    # ids and distances to the route of the polygons within maxDistance of it,
+    # optionally restricted to the given features or to the features set in a
+    # bitmap over the whole layer (an attribute filter, see AttributeIndex.py)
+    index = LoadIndex(layer)
+    candidates = index.QueryRoute(grid, maxDistance)
+    if features is not None:
+        candidates = np.intersect1d(candidates, features)
+    if bitmap is not None:
+        candidates = candidates[AttributeIndex.Contains(bitmap, GlobalIds(layer, candidates))]
+
+    distances = np.full(len(candidates), np.inf)
+    for i, feature in enumerate(candidates):
+        segments = grid.SegmentsNearBox(index.boxes[feature], maxDistance)
+        if len(segments) == 0:
+            continue
+        routeStart, routeEnd = grid.a[segments], grid.b[segments]
+
+        rings, ringOffsets = _FeatureRings(layer, feature)
+
+        # route running entirely inside the polygon
+        if Geometry.PointsInRings(routeStart[:1], rings, ringOffsets).any():
+            distances[i] = 0.0
+            continue
+
+        edgeStart, edgeEnd = Geometry.LineSegments(rings, ringOffsets)
+        distances[i] = Geometry.SegmentSegmentDistance(edgeStart, edgeEnd, routeStart, routeEnd)
+
+    near = distances <= maxDistance
+    return candidates[near], distances[near]
+
+
+def PolygonsNearRoute(layer: Layer, grid: Geometry.SegmentGrid, bufferMetres: float,
+                      features: Optional[np.ndarray] = None, bitmap: Optional[np.ndarray] = None) -> np.ndarray:
+    # ids of the polygons intersecting the route buffer
+    return PolygonDistances(layer, grid, bufferMetres, features, bitmap)[0]
+
+
+def ZonesNearRoute(route: Layer, grid: Geometry.SegmentGrid, bufferMetres: float,
+                   classes: List[str]) -> Dict[str, np.ndarray]:
+    # ids in the whole zoning layer of the zones of every class (see
+    # ZoneClasses) intersecting the route buffer. The distances are computed
+    # once for the zones of all the classes, each class is then a bit test.
+    Zoning = LoadLayerInBox(ZoningFeature, RouteBox(route, bufferMetres), [])
+    bitmaps = LoadBitmapIndex(ZoningFeature, "GEN_ZON2")
+    codes = [code for name in classes for code in ZoneClasses[name]]
+    near = GlobalIds(Zoning, PolygonsNearRoute(Zoning, grid, bufferMetres, bitmap=bitmaps.Bitmap(codes)))
+    return {name: near[AttributeIndex.Contains(bitmaps.Bitmap(ZoneClasses[name]), near)] for name in classes}
+
+
+def BIAOverlapAreas(layer: Layer, grid: Geometry.SegmentGrid, bufferSizes: List[float]) -> np.ndarray:
+    # area with an overlap count of exactly 2 when counting the BIAs and the
+    # buffer together, the same as the COUNT_ = 2 selection of the Count
+    # Overlapping Features output in Model.py (see BIAArea.py)
+    return BIAArea.BIAOverlapAreas(layer, grid, bufferSizes)
+
+
+def BIAOverlapArea(layer: Layer, grid: Geometry.SegmentGrid, bufferMetres: float) -> float:
+    return float(BIAOverlapAreas(layer, grid, [bufferMetres])[0])
+
+
+def ClosedRoutePolygon(route: Layer) -> np.ndarray:
+    # the route closed into a single ring, matching the Connected Route Polygon
+    ring = route.Metres()
+    return np.concatenate([ring, ring[:1]])
+
+
+def CountFeaturesWithinPolygon(layer: Layer, ring: np.ndarray, features: Optional[np.ndarray] = None,
+                               bitmap: Optional[np.ndarray] = None, index: Optional[SpatialIndex] = None) -> int:
+    # features entirely inside the ring (WITHIN): every vertex inside and no
+    # edge crossing the ring, which a concave ring can do between two vertices
+    # inside. Touching the ring is allowed. Optionally restricted to the given
+    # features or to the features set in a bitmap. The index of the layer can
+    # be given when many rings are tested against the same partial layer
+    ringBox = np.concatenate([ring.min(axis=0), ring.max(axis=0)])
+    index = LoadIndex(layer) if index is None else index
+    candidates = index.QueryBox(ringBox)
+    if features is not None:
+        candidates = np.intersect1d(candidates, features)
+    if bitmap is not None:
+        candidates = candidates[AttributeIndex.Contains(bitmap, GlobalIds(layer, candidates))]
+    boxes = index.boxes[candidates]
+    candidates = candidates[(boxes[:, 0] >= ringBox[0]) & (boxes[:, 2] <= ringBox[2]) &
+                            (boxes[:, 1] >= ringBox[1]) & (boxes[:, 3] <= ringBox[3])]
+    if len(candidates) == 0:
+        return 0
+
+    candidateLayer = layer.Subset(candidates)
+    xy = candidateLayer.Metres()
+    inside = Containment.PointsInRing(xy, ring)
+    vertexFeature = np.repeat(np.arange(len(candidateLayer)), np.diff(candidateLayer.featureOffsets))
+    vertexFeature = np.repeat(vertexFeature, np.diff(candidateLayer.partOffsets))
+    outsideCount = np.bincount(vertexFeature[~inside], minlength=len(candidateLayer))
+    hasVertices = np.bincount(vertexFeature, minlength=len(candidateLayer)) > 0
+    within = np.flatnonzero((outsideCount == 0) & hasVertices)
+
+    # the edges of the features with every vertex inside against the ring
+    # edges near them
+    a, b, edgeFeature = Geometry.PolygonEdges(xy, candidateLayer.partOffsets, candidateLayer.featureOffsets)
+    order = np.argsort(edgeFeature, kind="stable")
+    bounds = np.searchsorted(edgeFeature[order], np.stack([within, within + 1]))
+    ringGrid = Geometry.SegmentGrid(ring[:-1], ring[1:], WITHIN_CELL_SIZE)
+    count = 0
+    for first, last in bounds.T:
+        edges = order[first:last]
+        box = np.concatenate([np.minimum(a[edges], b[edges]).min(axis=0), np.maximum(a[edges], b[edges]).max(axis=0)])
+        segments = ringGrid.SegmentsNearBox(box, 0.0)
+        if len(segments) == 0 or not Geometry.SegmentsCross(a[edges], b[edges], ringGrid.a[segments], ringGrid.b[segments]).any():
+            count += 1
+    return count
+
+
+def LoadRepresentativePoints(relativePath: str, field: str, value: str) -> np.ndarray:
+    # metres, representative points of the features with field == value
+    path = dataFolder + relativePath
+
+    def Build() -> Tuple[np.ndarray, np.ndarray]:
+        ids, points = Containment.LoadOrBuildRepresentativePoints(path, field, value)
+        return ids, Geometry.ToMetres(points)
+
+    return _Cached(_representativeCache, path + "|" + field + "|" + value, path, Build)[1]
+
+
+def CountCondominiums(route: Layer, within: bool = False) -> int:
+    # condominiums inside the connected route polygon, by their representative
+    # point or entirely inside it with within (slower)
+    ring = ClosedRoutePolygon(route)
+    if within:
+        Property = LoadLayerInBox(PropertyFeature, RouteBox(route), [])
+        Condominiums = LoadBitmapIndex(PropertyFeature, "F_TYPE").Bitmap([CondominiumType])
+        return CountFeaturesWithinPolygon(Property, ring, bitmap=Condominiums)
+    points = LoadRepresentativePoints(PropertyFeature, "F_TYPE", CondominiumType)
+    return int(np.count_nonzero(Containment.PointsInRing(points, ring)))
+
+
+def Model(Route: str, BufferSize: int, BufferSizeUnit: str, ScratchFolder: Optional[str] = None,
+          Metrics: Optional[List[str]] = None, CondominiumWithin: bool = False) -> Dict[str, Optional[int]]:
+    # ScratchFolder is accepted for compatibility with Model.py, this backend
+    # does not write any intermediate files
+    # CondominiumWithin counts the condominiums entirely inside the closed route
+    # (like Model.py) instead of those whose representative point is inside
+    # metrics to compute (see GetMetrics), all of them by default
+    Metrics = GetMetrics() if Metrics is None else Metrics
+    # keep track of result
+    result = {}
+    # keep track of the time, memory and feature counts of every step (see Profiling.py)
+    profiler = Profiler(Route)
+
+    try:
+
+        print("==============================================================")
+        print("Step 1: Preparing Route...")
+        step = profiler.Start("Step 1: Preparing Route")
+
+        bufferMetres = Geometry.BufferSizeInMetres(BufferSize, BufferSizeUnit)
+        route = LoadRoute(Route)
+        grid = RouteGrid(route, bufferMetres)
+
+        print("Finished Preparing Route: " + str(len(grid.a)) + " segments")
+        print("Step 1: Completed in " + str(round(profiler.Stop(step), 2)) + " s.")
+
+        if "Number of Places of Interests" in Metrics:
+            print("==============================================================")
+            print("Step 2: Counting Points of Interest (POI) within the buffer...")
+            step = profiler.Start("Step 2: Places of Interest")
+
+            POI = LoadLayer(POIFeature, [])
+            POIResult = CountPointsNearRoute(POI, grid, bufferMetres)
+            result["Number of Places of Interests"] = POIResult
+
+            print("Finished Counting Points of Interest (POI) within the buffer: " + str(POIResult))
+            print("Step 2: Completed in " + str(round(profiler.Stop(step, len(POI), POIResult), 2)) + " s.")
+
+        if "Number of Subway Stations" in Metrics:
+            print("==============================================================")
+            print("Step 3: Counting Subway Stations within the buffer...")
+            step = profiler.Start("Step 3: Subway Stations")
+
+            Subway = LoadLayer(SubwayFeature, [])
+            SubwayResult = CountPointsNearRoute(Subway, grid, bufferMetres)
+            result["Number of Subway Stations"] = SubwayResult
+
+            print("Finished Counting Subway Stations within the buffer: " + str(SubwayResult))
+            print("Step 3: Completed in " + str(round(profiler.Stop(step, len(Subway), SubwayResult), 2)) + " s.")
+
+        if "Number of High Traffic Intersections" in Metrics:
+            print("==============================================================")
+            print("Step 4: Counting High Traffic Intersections within the buffer...")
+            step = profiler.Start("Step 4: High Traffic Intersections")
+
+            HighTraffic = LoadLayer(HighTrafficFeature, [])
+            HighTrafficResult = CountPointsNearRoute(HighTraffic, grid, bufferMetres)
+            result["Number of High Traffic Intersections"] = HighTrafficResult
+
+            print("Finished Counting High Traffic Intersections within the buffer: " + str(HighTrafficResult))
+            print("Step 4: Completed in " + str(round(profiler.Stop(step, len(HighTraffic), HighTrafficResult), 2)) + " s.")
+
+        if "Number of Residential Zones" in Metrics:
+            print("==============================================================")
+            print("Step 6: Counting Number of Residential Zones within the buffer...")
+            step = profiler.Start("Step 6: Residential Zones")
+
+            # Filter out residential zones from the zoning data using GEN_ZON2 = 0 OR 101
+            ResidentialResult = len(ZonesNearRoute(route, grid, bufferMetres, ["Residential"])["Residential"])
+            result["Number of Residential Zones"] = ResidentialResult
+
+            print("Finished Counting Number of Residential Zones within the buffer: " + str(ResidentialResult))
+            print("Step 6: Completed in " + str(round(profiler.Stop(step, None, ResidentialResult), 2)) + " s.")
+
+        if "Areas of Business Improvement Areas" in Metrics:
+            print("==============================================================")
+            print("Step 8: Calculating Areas of Business Improvement Areas within the buffer...")
+            step = profiler.Start("Step 8: Business Improvement Areas")
+
+            BIA = LoadLayer(BIAFeature, [])
+            BIAResult = BIAOverlapArea(BIA, grid, bufferMetres)
+            result["Areas of Business Improvement Areas"] = int(BIAResult)
+
+            print("Finished Calculating Areas of Business Improvement Areas within the buffer: " + str(result["Areas of Business Improvement Areas"]) + " m2")
+            print("Step 8: Completed in " + str(round(profiler.Stop(step, len(BIA), len(LoadIndex(BIA).QueryRoute(grid, bufferMetres))), 2)) + " s.")
+
+        if "Number of Condomininiums within the Route Coverage Area" in Metrics:
+            print("==============================================================")
+            print("Step 9: Counting Number of Condomininiums within the Closed Route")
+            step = profiler.Start("Step 9: Condominiums")
+
+            # Count how many condominiums (F_TYPE = 'CONDO') are inside the connected route polygon
+            CondominiumResult = CountCondominiums(route, CondominiumWithin)
+            result["Number of Condomininiums within the Route Coverage Area"] = CondominiumResult
+
+            scanned = len(LoadRepresentativePoints(PropertyFeature, "F_TYPE", CondominiumType))
+            print("Finished Counting Number of Condomininiums within the Route Coverage Area: " + str(CondominiumResult))
+            print("Step 9: Completed in " + str(round(profiler.Stop(step, scanned, CondominiumResult), 2)) + " s.")
+
+    except Exception as e:
+        result["Error"] = str(e)
+
+    result["Profile"] = profiler.Close()
+    return result
+
+
+if __name__ == '__main__':
+    # if not enough arguments, print usage
+    if len(argv) < 4:
+        print("Error: Missing arguments")
+        print("Usage: NumpyModel.py <Route> <BufferSize> <BufferSizeUnit>")
+        exit(1)
+
+    scriptStartTime = time.time()
+    result = Model(argv[1], int(argv[2]), argv[3])
+
+    if "Error" in result:
+        print("Script ended in " + str(round((time.time() - scriptStartTime), 2)) + " s. with error:")
+        print(result["Error"])
+        exit(1)
+
+    print("Script ended successfully in " + str(round((time.time() - scriptStartTime), 2)) + " s.")
+    print("\nResult:")
+    for key in GetMetrics():
+        print(f"{key}: {result[key]}")
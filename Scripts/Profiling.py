@@ -0,0 +1,155 @@
+"""
+Per-step instrumentation of the model runs, with JSON lines and Chrome trace export.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+Both backends (Model.py and NumpyModel.py) record every step of an evaluation
+with a Profiler and return the records under the "Profile" key of their result.
+A record is a plain dictionary:
+
+- route, step: the evaluated route and the name of the step
+- start: wall clock time the step started at (seconds since the epoch)
+- wall, cpu: wall time and CPU time of the process spent in the step (seconds)
+- peakMemory: peak memory allocated during the step (bytes, from tracemalloc),
+  None when TraceMemory is False
+- scanned, matched: number of reference features examined by the step and
+  number of those matching the route, None when the step has no features.
+  The scanned counts of Model.py are None unless CountFeatures is True
+- pid: process that ran the step, so parallel batches can be told apart
+
+The records of a batch can be written as JSON lines (one record per line) or
+as a Chrome trace (open chrome://tracing or https://ui.perfetto.dev and load
+the file), where every worker process is a row and every step a slice.
+
+The wall and CPU times and the matched counts are always recorded. The peak
+memory needs TraceMemory, and the scanned counts of Model.py need
+CountFeatures, which Runner.py --profile both turns on.
+
+Example Usage (summary of the profile written by Runner.py --profile):
+python Profiling.py {LocationOfProfile.jsonl}
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Optional, List, Dict
+from sys import argv
+import tracemalloc
+import json
+import time
+import os
+
+# trace the allocations of the model to report the peak memory of every step.
+# Tracing slows down code allocating many small Python objects (the model runs
+# about 60% slower), so it is only turned on by Runner.py --profile.
+TraceMemory = False
+
+# count the features of the reference layers for the "scanned" counts of the
+# arcpy steps (see LayerCount in Model.py). Every count is an extra geoprocessing
+# call, so it is also only turned on by Runner.py --profile.
+CountFeatures = False
+
+
+class Profiler:
+    # records the steps of the evaluation of one route
+    def __init__(self, route: str = ""):
+        self.route = route
+        self.steps: List[Dict] = []
+        self._startedTracing = False
+        if TraceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._startedTracing = True
+
+    def Start(self, step: str) -> Dict:
+        record = {"route": self.route, "step": step, "start": time.time(), "wall": None, "cpu": None,
+                  "peakMemory": None, "scanned": None, "matched": None, "pid": os.getpid()}
+        record["_wall"] = time.perf_counter()
+        record["_cpu"] = time.process_time()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            record["_memory"] = tracemalloc.get_traced_memory()[0]
+        return record
+
+    def Stop(self, record: Dict, scanned: Optional[int] = None, matched: Optional[int] = None) -> float:
+        # completes the record and returns the wall time of the step
+        record["wall"] = time.perf_counter() - record.pop("_wall")
+        record["cpu"] = time.process_time() - record.pop("_cpu")
+        if "_memory" in record:
+            memory = record.pop("_memory")
+            record["peakMemory"] = max(tracemalloc.get_traced_memory()[1] - memory, 0) if tracemalloc.is_tracing() else None
+        record["scanned"] = None if scanned is None else int(scanned)
+        record["matched"] = None if matched is None else int(matched)
+        self.steps.append(record)
+        return record["wall"]
+
+    def Close(self) -> List[Dict]:
+        # stops tracing if this profiler started it and returns the records
+        if self._startedTracing:
+            tracemalloc.stop()
+            self._startedTracing = False
+        return self.steps
+
+
+def WriteJsonLines(steps: List[Dict], path: str):
+    with open(path, "w") as file:
+        for step in steps:
+            file.write(json.dumps(step) + "\n")
+
+
+def ReadJsonLines(path: str) -> List[Dict]:
+    with open(path, "r") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def ChromeTraceEvents(steps: List[Dict]) -> List[Dict]:
+    # one complete event ("X") per step, times in microseconds from the first step
+    if len(steps) == 0:
+        return []
+    origin = min(step["start"] for step in steps)
+    events = []
+    for step in steps:
+        events.append({
+            "name": step["step"],
+            "cat": "model",
+            "ph": "X",
+            "ts": round((step["start"] - origin) * 1e6),
+            "dur": round((step["wall"] or 0.0) * 1e6),
+            "pid": step["pid"],
+            "tid": step["pid"],
+            "args": {key: step[key] for key in ("route", "cpu", "peakMemory", "scanned", "matched")},
+        })
+    return events
+
+
+def WriteChromeTrace(steps: List[Dict], path: str):
+    with open(path, "w") as file:
+        json.dump({"traceEvents": ChromeTraceEvents(steps), "displayTimeUnit": "ms"}, file)
+
+
+def Summarise(steps: List[Dict]) -> List[Dict]:
+    # total time, CPU, largest peak memory and feature counts of every step
+    # over a batch, slowest step first
+    totals = {}
+    for step in steps:
+        total = totals.setdefault(step["step"], {"step": step["step"], "runs": 0, "wall": 0.0, "cpu": 0.0,
+                                                 "peakMemory": 0, "scanned": 0, "matched": 0})
+        total["runs"] += 1
+        total["wall"] += step["wall"] or 0.0
+        total["cpu"] += step["cpu"] or 0.0
+        total["peakMemory"] = max(total["peakMemory"], step["peakMemory"] or 0)
+        total["scanned"] += step["scanned"] or 0
+        total["matched"] += step["matched"] or 0
+    return sorted(totals.values(), key=lambda total: -total["wall"])
+
+
+if __name__ == "__main__":
+    if len(argv) < 2:
+        print("Usage: Profiling.py <Profile.jsonl>")
+        exit(1)
+
+    for total in Summarise(ReadJsonLines(argv[1])):
+        print(f"{total['step']}: {total['runs']} runs, {round(total['wall'], 2)} s wall, "
+              f"{round(total['cpu'], 2)} s CPU, {round(total['peakMemory'] / 1024 / 1024, 1)} MB peak, "
+              f"{total['scanned']} scanned, {total['matched']} matched")
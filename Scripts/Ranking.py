@@ -7,14 +7,53 @@ in collaboration with Tata Consultancy Services & Canada Running Series as
 part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
 of Toronto.
 
+The csv files are merged route by route (the values of the first file win,
+the next files fill the missing values and add routes and metrics) while they
+are read, a chunk of rows at a time, into one column per metric, so tables of
+tens of thousands of generated routes fit in memory. Besides the weighted
+ranks of every route in every metric (Rank), the overall weighted score of
+the routes is computed from one sort per metric without building the rank
+matrix, to list the best routes (TopRoutes), and the routes not beaten in
+every metric by any other route (the Pareto front, ParetoRoutes) are found
+with a sort-filter skyline. Metric values of 9999 (PLACEHOLDER_VALUE) are
+placeholders for metrics not evaluated yet: the next files can fill them, and
+a placeholder no file fills gives the route the worst value of the metric
+(with a warning), so the route keeps the metric in its mean rank, ranked last.
+
 Example Usage:
 .\Ranking.py {CSVFileContainingResultDF}.
 
+Keep only the 10 best routes with their overall weighted score, and save the
+routes of the Pareto front to ParetoRoutes.csv:
+.\Ranking.py --top 10 --pareto {CSVFileContainingResultDF} {OtherCSVFiles}
+
 Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
 """
+from typing import Dict, List, Tuple
+import numpy as np
 import pandas as pd
 import sys
 
+# metrics where a lower value is better, multiplied by -1 before ranking
+MinimizingMetrics = ["Number of High Traffic Intersections",
+                     "Number of Condomininiums within the Route Coverage Area",
+                     "Wide Turns",
+                     "Sharp Turns",
+                     "Elevation Gain",
+                     "Vehicle Delay",
+                     "Stopped Delay",
+                     "Emissions All"]
+
+# rows of a csv file read at once when merging the files
+CHUNK_SIZE = 50_000
+
+# number of routes compared with each other at once for the Pareto front
+PARETO_BLOCK = 512
+
+# value of the metrics not evaluated yet (i.e. the traffic modelling of Proto
+# 1.1 and 1.2), read as missing so the next files fill it (see TrafficImpact.py)
+PLACEHOLDER_VALUE = 9999
+
 def Rank(df: pd.DataFrame) -> pd.DataFrame:
     df_T = df.T # transpose dataframe to get metrics in rows, routes as columns
     
@@ -43,50 +82,176 @@ def Rank(df: pd.DataFrame) -> pd.DataFrame:
     return ranks
 
 def ConvertToMaximizingMetrics(df: pd.DataFrame) -> pd.DataFrame:
-    toConvert = ["Number of High Traffic Intersections", 
-                 "Number of Condomininiums within the Route Coverage Area",
-                 "Wide Turns",
-                 "Sharp Turns",
-                 "Elevation Gain",
-                 "Vehicle Delay",
-                 "Stopped Delay",
-                 "Emissions All"]
-
-    weight_provided = 'weight' in df.T.columns
-
-    # multiply the metrics that need to be be converted to maximizing metrics by -1
-    for metric in toConvert:
-        if metric in df.columns:
-            if weight_provided:
-                # drop the weight column and add it back after converting the metric
-                weight = df[metric]["weight"]
-                df[metric] = df[metric].drop('weight') * -1
-                df.loc["weight", metric] = weight
-            else:
-                df[metric] = df[metric] * -1
-    
+    # multiply the metrics that need to be be converted to maximizing metrics by -1, except their weight
+    toConvert = [metric for metric in MinimizingMetrics if metric in df.columns]
+    routes = df.index != 'weight'
+    df.loc[routes, toConvert] = df.loc[routes, toConvert] * -1
+
     return df
 
+def MergeCsvFiles(paths: List[str], chunkSize: int = CHUNK_SIZE) -> pd.DataFrame:
+    # the same table as folding the files with combine_first, read chunkSize
+    # rows at a time into one float column per metric. Routes and metrics keep
+    # the order they are first seen in. A placeholder is only filled by the
+    # next files, the ones left are the worst value of their metric.
+    rows: Dict[str, int] = {}
+    routes: List[str] = []
+    columns: Dict[str, np.ndarray] = {}
+    placeholders: Dict[str, np.ndarray] = {}
+    indexName = None
+    for path in paths:
+        for chunk in pd.read_csv(path, index_col=0, chunksize=chunkSize):
+            indexName = indexName or chunk.index.name
+            names = chunk.index.astype(str)
+            for name in names:
+                if name not in rows:
+                    rows[name] = len(routes)
+                    routes.append(name)
+
+            # grow the columns by doubling
+            capacity = len(next(iter(columns.values()))) if columns else 0
+            if len(routes) > capacity:
+                capacity = max(len(routes), 2 * capacity)
+                columns = {metric: np.concatenate([column, np.full(capacity - len(column), np.nan)])
+                           for metric, column in columns.items()}
+                placeholders = {metric: np.concatenate([placeholder, np.zeros(capacity - len(placeholder), dtype=bool)])
+                                for metric, placeholder in placeholders.items()}
+
+            target = np.fromiter((rows[name] for name in names), dtype=np.int64, count=len(names))
+            for metric in chunk.columns:
+                column = columns.setdefault(metric, np.full(capacity, np.nan))
+                placeholder = placeholders.setdefault(metric, np.zeros(capacity, dtype=bool))
+                values = pd.to_numeric(chunk[metric], errors='coerce').to_numpy(dtype=float, copy=True)
+                isPlaceholder = (values == PLACEHOLDER_VALUE) & (names != 'weight')
+                placeholder[target[isPlaceholder]] = True
+                values[isPlaceholder] = np.nan
+                # only fill the missing values, the first value of a route wins
+                fill = np.flatnonzero(~np.isnan(values) & np.isnan(column[target]))
+                filled, first = np.unique(target[fill], return_index=True)
+                column[filled] = values[fill[first]]
+
+    # placeholders no file filled: the worst value, ranked last in the metric
+    for metric, column in columns.items():
+        unfilled = np.flatnonzero(placeholders[metric][:len(routes)] & np.isnan(column[:len(routes)]))
+        if len(unfilled) > 0:
+            print("Warning: " + metric + " is not evaluated for " + ", ".join(routes[row] for row in unfilled) +
+                  " (" + str(PLACEHOLDER_VALUE) + "), ranked last in this metric.")
+            column[unfilled] = -np.inf * MaximizingSigns([metric])[0]
+
+    return pd.DataFrame({metric: column[:len(routes)] for metric, column in columns.items()},
+                        index=pd.Index(routes, name=indexName))
+
+def SplitWeights(df: pd.DataFrame) -> Tuple[pd.Index, np.ndarray, np.ndarray]:
+    # (routes, metric values of the routes, weight of every metric), weights of 1 when not specified
+    routes = df.index != 'weight'
+    values = df.loc[routes].to_numpy(dtype=float)
+    weights = df.loc['weight'].to_numpy(dtype=float) if 'weight' in df.index else np.ones(len(df.columns))
+    return df.index[routes], values, weights
+
+def MaximizingSigns(metrics: List[str]) -> np.ndarray:
+    # -1 for the metrics in MinimizingMetrics, 1 for the others
+    return np.where(np.isin(metrics, MinimizingMetrics), -1.0, 1.0)
+
+def MaxRanks(column: np.ndarray) -> np.ndarray:
+    # ascending rank in value, ties get the highest rank (method = 'max')
+    order = np.argsort(column, kind='stable')
+    ordered = column[order]
+    ranks = np.empty(len(column), dtype=np.int64)
+    ranks[order] = np.searchsorted(ordered, ordered, side='right')
+    return ranks
+
+def WeightedScores(values: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    # same as the Overall Weighted Score of Rank on maximizing metrics, summed
+    # one metric at a time instead of building the rank matrix
+    total = np.zeros(len(values))
+    counts = np.zeros(len(values))
+    for metric in range(values.shape[1]):
+        column = values[:, metric]
+        known = ~np.isnan(column)
+        ranks = MaxRanks(column[known]) * weights[metric]
+        counted = ~np.isnan(ranks)
+        total[np.flatnonzero(known)[counted]] += ranks[counted]
+        counts[np.flatnonzero(known)[counted]] += 1
+    with np.errstate(invalid='ignore'):
+        return total / counts
+
+def TopRoutes(df: pd.DataFrame, k: int) -> pd.DataFrame:
+    # Overall Weighted Score of the k best routes, best first
+    routes, values, weights = SplitWeights(df)
+    scores = WeightedScores(values * MaximizingSigns(list(df.columns)), weights)
+    ranked = np.where(np.isnan(scores), -np.inf, scores)
+    best = np.arange(len(scores)) if k >= len(scores) else np.argpartition(-ranked, k)[:k]
+    best = best[np.lexsort((best, -ranked[best]))]
+    return pd.DataFrame({'Overall Weighted Score': scores[best]}, index=routes[best])
+
+def ParetoFront(values: np.ndarray) -> np.ndarray:
+    # indices of the rows not dominated by any other row (at least as good in
+    # every column and better in one), every column maximized and missing
+    # values the worst. Sort-filter skyline: the rows are visited by
+    # decreasing sum of their ranks in every column, so a row can only be
+    # dominated by the rows before it and is only compared with the front found
+    # so far, strongest rows first, until a row of the front dominates it.
+    values = np.where(np.isnan(values), -np.inf, values)
+
+    def Dominated(rows: np.ndarray, by: np.ndarray) -> np.ndarray:
+        atLeast = np.ones((len(rows), len(by)), dtype=bool)
+        better = np.zeros((len(rows), len(by)), dtype=bool)
+        for metric in range(values.shape[1]):
+            row, other = values[rows, metric][:, None], values[by, metric][None, :]
+            atLeast &= other >= row
+            better |= other > row
+        return (atLeast & better).any(axis=1)
+
+    rankSums = np.zeros(len(values))
+    for metric in range(values.shape[1]):
+        rankSums += MaxRanks(values[:, metric])
+    order = np.argsort(-rankSums, kind='stable')
+
+    front = np.zeros(0, dtype=np.int64)
+    for first in range(0, len(order), PARETO_BLOCK):
+        rows = order[first:first + PARETO_BLOCK]
+        for start in range(0, len(front), PARETO_BLOCK):
+            rows = rows[~Dominated(rows, front[start:start + PARETO_BLOCK])]
+            if len(rows) == 0:
+                break
+        front = np.concatenate([front, rows[~Dominated(rows, rows)]])
+    return np.sort(front)
+
+def ParetoRoutes(df: pd.DataFrame) -> pd.DataFrame:
+    # metric values of the routes of the Pareto front
+    routes, values, _ = SplitWeights(df)
+    front = ParetoFront(values * MaximizingSigns(list(df.columns)))
+    return pd.DataFrame(values[front], index=routes[front], columns=df.columns)
+
 if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    top = None
+    if "--top" in arguments:
+        position = arguments.index("--top")
+        top = int(arguments[position + 1])
+        del arguments[position:position + 2]
+    arguments = [argument for argument in arguments if argument != "--pareto"]
+
     # refactor to get a list of csv files and combine them into one dataframe
-    if len(sys.argv) < 2:
-        print("Usage: .\Ranking.py {at least one CSV files containing result dataframe}.")
+    if len(arguments) < 1:
+        print("Usage: .\\Ranking.py [--top K] [--pareto] {at least one CSV files containing result dataframe}.")
         exit(1)
 
     print("Ranking routes based on GIS evaluations...")
-    
-    # loop through all csv files and combine them into one dataframe
-    df = None
-
-    for i in range(1, len(sys.argv)):
-        if i == 1:
-            df = pd.read_csv(sys.argv[i], index_col=0)
-        else:
-            df = df.combine_first(pd.read_csv(sys.argv[i], index_col=0))
-    
-    dfWithAllMaximingMetrics = ConvertToMaximizingMetrics(df)
 
-    finalDf = Rank(dfWithAllMaximingMetrics)
+    # stream all csv files into one dataframe
+    df = MergeCsvFiles(arguments)
+
+    if "--pareto" in sys.argv:
+        ParetoRoutes(df).to_csv("ParetoRoutes.csv")
+        print("Exported the routes of the Pareto front to ParetoRoutes.csv.")
+
+    if top is not None:
+        finalDf = TopRoutes(df, top)
+    else:
+        dfWithAllMaximingMetrics = ConvertToMaximizingMetrics(df)
+
+        finalDf = Rank(dfWithAllMaximingMetrics)
 
     # round off the scores to 2 decimal places
     finalDf = finalDf.round(2)
@@ -94,5 +259,5 @@ if __name__ == "__main__":
     print("Finished ranking routes. Exporting to CSV...")
 
     finalDf.to_csv("RankedRoutes.csv")
-    
+
     print("Export completed. Ranking completed successfully!")
@@ -0,0 +1,220 @@
+"""
+Content-addressed on-disk cache of the metrics computed by the TWM GIS model.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+Every metric of a route evaluation is stored as its own small entry under the
+Cache folder of the project. The key of an entry is a hash of:
+
+- the evaluation backend (arcpy or numpy) and the name of the metric
+- the geometry of the route (not the path or the attributes of the file)
+- the buffer size and unit
+- the fingerprint (size and modification time) of the reference layers the
+  metric is computed from, in the data folder of the backend (Model.py reads
+  its own data folder, the other backends read NumpyModel.dataFolder)
+
+so an entry is never reused once the route or one of its reference layers
+changes, and adding a new metric to the model only computes that metric.
+
+Evaluations only add entries: the least recently used entries are evicted once
+the cache grows over MAX_CACHE_SIZE bytes by Evict, which the entry points call
+once per batch (Runner.py, Service.py, CourseSearch.py) rather than every
+worker process after each route.
+
+Example Usage (show the size of the cache, or clear it):
+python ResultCache.py
+python ResultCache.py clear
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Callable, Optional, List, Dict
+from sys import argv
+import hashlib
+import json
+import os
+
+import NumpyModel
+import Model as ArcpyModel
+from Model import GetMetrics
+from Shapefile import ReadGeometry, ReadProjection, NormalisePath
+from SpatialIndex import Fingerprint
+from Profiling import Profiler
+
+# bump when the metrics of a backend change without a change of the data
+CACHE_VERSION = 6
+CACHE_SUFFIX = ".json"
+
+# suffixes of every entry of the cache folder, including the segments of Incremental.py
+CACHE_SUFFIXES = (CACHE_SUFFIX, ".segment.npz")
+
+cacheFolder = NumpyModel.rootFolder + "Cache" + os.sep
+
+# the least recently used entries are evicted above this size (bytes)
+MAX_CACHE_SIZE = 64 * 1024 * 1024
+
+# reference layers every metric is computed from, relative to the Data folder
+# of the backend (see DataFolder).
+MetricLayers = {
+    "Number of Places of Interests": [NumpyModel.POIFeature],
+    "Number of Subway Stations": [NumpyModel.SubwayFeature],
+    "Number of High Traffic Intersections": [NumpyModel.HighTrafficFeature],
+    "Number of Residential Zones": [NumpyModel.ZoningFeature],
+    "Areas of Business Improvement Areas": [NumpyModel.BIAFeature],
+    "Number of Condomininiums within the Route Coverage Area": [NumpyModel.PropertyFeature],
+}
+
+
+def RouteHash(Route: str) -> str:
+    # hash of the geometry and coordinate system of the route
+    shapeType, xy, partOffsets, featureOffsets, _ = ReadGeometry(NormalisePath(Route))
+    digest = hashlib.sha256()
+    digest.update(str(shapeType).encode())
+    for array in (xy, partOffsets, featureOffsets):
+        digest.update(array.tobytes())
+    digest.update(ReadProjection(NormalisePath(Route)).encode())
+    return digest.hexdigest()
+
+
+def DataFolder(backend: str) -> str:
+    # folder the backend reads its reference layers from
+    if backend == "arcpy":
+        return ArcpyModel.dataFolder
+    return NumpyModel.dataFolder
+
+
+def LayerPath(backend: str, layer: str) -> str:
+    if backend == "arcpy":
+        # Model.py joins its layer paths with Windows separators
+        return DataFolder(backend) + layer.replace(os.sep, "\\")
+    return DataFolder(backend) + layer
+
+
+def MetricKey(backend: str, metric: str, routeHash: str, BufferSize: int, BufferSizeUnit: str) -> str:
+    values = [str(CACHE_VERSION), backend, metric, routeHash, str(BufferSize), BufferSizeUnit]
+    for layer in MetricLayers.get(metric, []):
+        values.append(layer)
+        values.extend(str(value) for value in Fingerprint(LayerPath(backend, layer)))
+    return hashlib.sha256("\n".join(values).encode()).hexdigest()
+
+
+def EntryPath(key: str) -> str:
+    return cacheFolder + key + CACHE_SUFFIX
+
+
+def Load(key: str) -> Optional[Dict]:
+    path = EntryPath(key)
+    try:
+        with open(path, "r") as file:
+            entry = json.load(file)
+        # the modification time marks the entry as recently used for eviction
+        os.utime(path)
+        return entry
+    except (OSError, ValueError):
+        return None
+
+
+def Store(key: str, entry: Dict):
+    # write to a temporary file first so concurrent readers never see a partial entry
+    os.makedirs(cacheFolder, exist_ok=True)
+    path = EntryPath(key)
+    temporaryPath = path + "." + str(os.getpid()) + ".tmp"
+    with open(temporaryPath, "w") as file:
+        json.dump(entry, file)
+    os.replace(temporaryPath, path)
+
+
+def CacheEntries() -> List[os.DirEntry]:
+    if not os.path.isdir(cacheFolder):
+        return []
+    return [entry for entry in os.scandir(cacheFolder) if entry.is_file() and entry.name.endswith(CACHE_SUFFIXES)]
+
+
+def Evict(maxSize: int = MAX_CACHE_SIZE) -> int:
+    # remove the least recently used entries until the cache fits in maxSize,
+    # returns the number of removed entries
+    entries = []
+    for entry in CacheEntries():
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+    totalSize = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if totalSize <= maxSize:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        totalSize -= size
+        removed += 1
+    return removed
+
+
+def CachedModel(Model: Callable[..., Dict[str, Optional[int]]], backend: str, Route: str,
+                BufferSize: int, BufferSizeUnit: str, ScratchFolder: Optional[str] = None,
+                UseCache: bool = True) -> Dict[str, Optional[int]]:
+    # same result as Model(Route, BufferSize, BufferSizeUnit, ScratchFolder), but
+    # only the metrics missing from the cache are computed
+    if not UseCache:
+        return Model(Route, BufferSize, BufferSizeUnit, ScratchFolder)
+
+    try:
+        routeHash = RouteHash(Route)
+    except (OSError, ValueError):
+        # let the model report the unreadable route
+        return Model(Route, BufferSize, BufferSizeUnit, ScratchFolder)
+
+    profiler = Profiler(Route)
+    step = profiler.Start("Cache Lookup")
+    keys = {metric: MetricKey(backend, metric, routeHash, BufferSize, BufferSizeUnit) for metric in GetMetrics()}
+    cached = {}
+    for metric, key in keys.items():
+        entry = Load(key)
+        if entry is not None and entry.get("metric") == metric:
+            cached[metric] = entry["value"]
+    profiler.Stop(step, len(keys), len(cached))
+
+    missing = [metric for metric in GetMetrics() if metric not in cached]
+    if len(missing) == 0:
+        print("All metrics found in the cache, skipping evaluation.")
+        merged = {metric: cached[metric] for metric in GetMetrics()}
+        merged["Profile"] = profiler.Close()
+        return merged
+
+    if len(cached) > 0:
+        print(str(len(cached)) + " metrics found in the cache, evaluating " + ", ".join(missing) + "...")
+    result = Model(Route, BufferSize, BufferSizeUnit, ScratchFolder, missing)
+
+    # only store the metrics computed before any error. This may run in
+    # concurrent worker processes, so the entry points evict once per batch
+    try:
+        for metric in missing:
+            if metric in result:
+                Store(keys[metric], {"metric": metric, "value": result[metric], "backend": backend,
+                                     "bufferSize": BufferSize, "bufferSizeUnit": BufferSizeUnit})
+    except OSError:
+        # read-only project folder, results are still returned
+        pass
+
+    merged = {metric: cached.get(metric, result.get(metric)) for metric in GetMetrics() if metric in cached or metric in result}
+    if "Error" in result:
+        merged["Error"] = result["Error"]
+    merged["Profile"] = profiler.Close() + result.get("Profile", [])
+    return merged
+
+
+if __name__ == '__main__':
+    if len(argv) > 1 and argv[1] == "clear":
+        removed = Evict(0)
+        print("Removed " + str(removed) + " cache entries from " + cacheFolder)
+    else:
+        entries = CacheEntries()
+        print(str(len(entries)) + " cache entries, " + str(round(sum(entry.stat().st_size for entry in entries) / 1024, 1)) + " KB in " + cacheFolder)
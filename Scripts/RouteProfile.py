@@ -0,0 +1,171 @@
+"""
+Script to profile the metrics of routes along their length (e.g. per kilometre).
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+Model returns totals for the whole course, while the race operations need to
+know where along the course the places of interest, subway stations and high
+traffic intersections are (e.g. to place the water stations and plan the road
+closures). Instead of running the model again on every interval of the route,
+the route is linear referenced once: every feature matched within the buffer
+is projected onto its nearest point of the route, which gives its measure
+(distance from the start along the route), and the measures of all the
+features are binned by interval in a single pass.
+
+The area of the Business Improvement Areas inside the buffer is profiled the
+same way: the pieces of the scanlines of BIAArea.py inside the buffer and
+covered by a BIA (cut at most MAX_PIECE_LENGTH long) are given the measure of
+their nearest point of the route. Note that the profile sums the area covered
+by at least one BIA inside the buffer, while the metric of Model.py follows
+the COUNT_ = 2 selection (see BIAArea.py), so the totals differ where BIAs
+overlap.
+
+Example Usage (profile of every route in RoutesPaths.txt with a 100 metre
+buffer, per kilometre, saved to RouteProfile.csv):
+python RouteProfile.py 100 Meters --interval 1000
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import List, Tuple
+from sys import argv
+import numpy as np
+import pandas as pd
+import time
+
+from Shapefile import Layer
+import NumpyModel
+import BIAArea
+import Geometry
+
+# default length (metres) of the intervals of the profile
+PROFILE_INTERVAL = 1000.0
+
+# longest piece of scanline given a single measure (metres)
+MAX_PIECE_LENGTH = 10.0
+
+# point metrics of the profile and their layers
+PointMetrics = [("Number of Places of Interests", NumpyModel.POIFeature),
+                ("Number of Subway Stations", NumpyModel.SubwayFeature),
+                ("Number of High Traffic Intersections", NumpyModel.HighTrafficFeature)]
+BIAMetric = "Areas of Business Improvement Areas"
+
+
+def SegmentMeasures(grid: Geometry.SegmentGrid) -> np.ndarray:
+    # measure (metres along the route) of the start of every route segment,
+    # and the length of the route as the last value. The parts of a multipart
+    # route follow each other.
+    return np.concatenate([[0.0], np.cumsum(np.hypot(*(grid.b - grid.a).T))])
+
+
+def Measures(grid: Geometry.SegmentGrid, measures: np.ndarray, points: np.ndarray, maxDistance: float) -> np.ndarray:
+    # measure of the nearest point of the route of every point (metres), NaN
+    # for points further than maxDistance from the route
+    _, segments, t = grid.Nearest(points, maxDistance)
+    found = segments >= 0
+    result = np.full(len(points), np.nan)
+    result[found] = measures[segments[found]] + t[found] * (measures[segments[found] + 1] - measures[segments[found]])
+    return result
+
+
+def PointMeasures(layer: Layer, grid: Geometry.SegmentGrid, measures: np.ndarray, bufferMetres: float) -> np.ndarray:
+    # measures of the points of the layer within the buffer
+    features, _ = NumpyModel.PointDistances(layer, grid, bufferMetres)
+    return Measures(grid, measures, layer.Points(metres=True)[features], bufferMetres)
+
+
+def BIAMeasures(layer: Layer, grid: Geometry.SegmentGrid, measures: np.ndarray,
+                bufferMetres: float) -> Tuple[np.ndarray, np.ndarray]:
+    # (measure, geodesic area) of the pieces of the buffer covered by a BIA
+    spacing = BIAArea.ScanlineSpacing(bufferMetres)
+    bufferLines, low, high = Geometry.CapsuleIntervals(grid.a, grid.b, bufferMetres, spacing)
+    lines, x, lengths, _ = BIAArea.BufferPieces(layer, bufferLines, low, high, spacing)
+    areas = BIAArea.GeodesicPieceAreas(lines, x, lengths, spacing)
+
+    # long pieces are cut so that every part is given the measure of its own middle
+    parts = np.maximum(np.ceil(lengths / MAX_PIECE_LENGTH).astype(np.int64), 1)
+    pieces = np.repeat(np.arange(len(lines)), parts)
+    index = Geometry.ExpandRanges(np.zeros(len(lines), dtype=np.int64), parts)
+    middles = np.stack([x[pieces] + (index + 0.5) * lengths[pieces] / parts[pieces],
+                        Geometry.ScanlineY(lines[pieces], spacing)], axis=1)
+
+    # every point of the buffer is within the buffer size of the route, up to the spacing
+    return Measures(grid, measures, middles, bufferMetres + spacing), areas[pieces] / parts[pieces]
+
+
+def RouteProfile(Route: str, BufferSize: int, BufferSizeUnit: str, interval: float = PROFILE_INTERVAL) -> pd.DataFrame:
+    # one row per interval of the route with the point counts and the BIA area
+    # of the features whose nearest point of the route is in the interval
+    bufferMetres = Geometry.BufferSizeInMetres(BufferSize, BufferSizeUnit)
+    route = NumpyModel.LoadRoute(Route)
+    grid = NumpyModel.RouteGrid(route, bufferMetres)
+    measures = SegmentMeasures(grid)
+    length = measures[-1]
+    bins = max(int(np.ceil(length / interval)), 1)
+
+    def Bin(values: np.ndarray) -> np.ndarray:
+        # interval of every measure, the end of the route goes to the last interval
+        return np.minimum(np.floor(values / interval).astype(np.int64), bins - 1)
+
+    edges = np.minimum(np.arange(bins + 1) * interval, length)
+    profile = pd.DataFrame({"From (km)": edges[:-1] / 1000, "To (km)": edges[1:] / 1000})
+    for metric, feature in PointMetrics:
+        pointMeasures = PointMeasures(NumpyModel.LoadLayer(feature, []), grid, measures, bufferMetres)
+        profile[metric] = np.bincount(Bin(pointMeasures[~np.isnan(pointMeasures)]), minlength=bins)
+
+    BIAMeasure, BIAAreas = BIAMeasures(NumpyModel.LoadLayer(NumpyModel.BIAFeature, []), grid, measures, bufferMetres)
+    found = ~np.isnan(BIAMeasure)
+    profile[BIAMetric] = np.round(np.bincount(Bin(BIAMeasure[found]), BIAAreas[found], minlength=bins)).astype(np.int64)
+    return profile
+
+
+def ProfileRoutes(routes: List[Tuple[str, str]], BufferSize: int, BufferSizeUnit: str,
+                  interval: float = PROFILE_INTERVAL) -> pd.DataFrame:
+    profiles = []
+    for route_name, route in routes:
+        print(f"Profiling {route_name}...")
+        startTime = time.time()
+        try:
+            profile = RouteProfile(route, BufferSize, BufferSizeUnit, interval)
+        except Exception as e:
+            # a failing route is reported and skipped, the other routes are profiled
+            print("Error profiling", route)
+            print(str(e))
+            continue
+        profile.insert(0, "Route", route_name)
+        profiles.append(profile)
+        print(f"Finished {route_name} in " + str(round((time.time() - startTime), 2)) + " s.")
+
+    return pd.concat(profiles, ignore_index=True) if len(profiles) > 0 else pd.DataFrame()
+
+
+if __name__ == "__main__":
+    from Runner import ReadRoutesFromFile, rootFolder
+
+    arguments = argv[1:]
+    interval = PROFILE_INTERVAL
+    if "--interval" in arguments:
+        position = arguments.index("--interval")
+        interval = float(arguments[position + 1])
+        del arguments[position:position + 2]
+
+    if len(arguments) < 2 or not arguments[0].isdigit() or arguments[1] not in ("Meters", "Kilometers") or interval <= 0:
+        print("Usage: RouteProfile.py <BufferSize> <BufferSizeUnit> [--interval <Metres>] [<Route> ...]")
+        print("Example: RouteProfile.py 100 Meters --interval 1000")
+        exit(1)
+
+    print("Starting script...")
+    startTime = time.time()
+
+    # the routes given as arguments, or every route of RoutesPaths.txt
+    routes = [(route, route) for route in arguments[2:]] or ReadRoutesFromFile()
+    profile_df = ProfileRoutes(routes, int(arguments[0]), arguments[1], interval)
+
+    print("Saving profile to RouteProfile.csv...")
+    profile_df.to_csv(rootFolder + "RouteProfile.csv", index=False)
+    print("Profile saved to RouteProfile.csv")
+
+    print("Script ended in", round(time.time() - startTime, 2), "s")
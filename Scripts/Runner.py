@@ -15,26 +15,147 @@ Example Usage (assuming you are in the same directory as propy.bat):
 .\propy.bat {LocationToRunner.py}. Then, follow the instructions in the console 
 to run the script.
 
+The routes can also be evaluated without ArcGIS Pro using the NumPy backend
+defined in NumpyModel.py, by passing the backend name as the first argument:
+python {LocationToRunner.py} numpy
+
+Routes sharing most of their course with routes evaluated before (e.g. the
+variants of a prototype) can be evaluated with the incremental backend defined
+in Incremental.py, which only evaluates the stretches that changed:
+python {LocationToRunner.py} incremental
+
+Large sets of candidate routes can be evaluated with the batch backend defined
+in BatchModel.py, which visits every reference layer once for all the routes
+instead of once per route:
+python {LocationToRunner.py} batch
+
+The routes are evaluated one after another by default. Pass a number of
+worker processes as the second argument to evaluate them in parallel, each
+worker using its own scratch workspace:
+python {LocationToRunner.py} numpy 8
+
+The metrics of every route are cached on disk (see ResultCache.py), so routes
+that did not change since the last run are not evaluated again. Pass --no-cache
+to evaluate every route from scratch:
+python {LocationToRunner.py} numpy 8 --no-cache
+
+Pass --profile to also save the time, CPU time, peak memory and feature counts
+of every step of every route (see Profiling.py) next to Results.csv, as
+Profile.jsonl and as a Chrome trace in Profile.trace.json:
+python {LocationToRunner.py} numpy 8 --profile
+
+Pass --simplify with a tolerance in metres to evaluate the routes simplified
+first (see Simplify.py), the simplified routes never deviate from the routes
+by more than the tolerance:
+python {LocationToRunner.py} numpy 8 --simplify 5
+
 Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
 """
-from Model import Model, GetMetrics
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from Model import GetMetrics
+from ResultCache import CachedModel, Evict
+from Profiling import WriteJsonLines, WriteChromeTrace, Summarise
+import Profiling
+from sys import argv
 import pandas as pd
+from multiprocessing.util import Finalize
+import tempfile
+import atexit
+import shutil
 import time
+import os
+
+# Root folder is the project folder containing the Scripts folder
+rootFolder = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
 
-# Root folder may need to be changed based on the location of the project
-rootFolder = "C:\\Users\\14168\\Documents\\ArcGIS\\Projects\\TWM\\"
+# available evaluation backends, arcpy requires an ArcGIS Pro environment
+Backends = ["arcpy", "numpy", "incremental", "batch"]
 
-def RunModelOnRoutesFromFile() -> pd.DataFrame:
+def GetModel(backend: str) -> Callable[[str, int, str], Dict[str, Optional[int]]]:
+    if backend not in Backends:
+        raise ValueError("Unknown backend " + backend + ", expected one of " + ", ".join(Backends))
+    if backend == "numpy":
+        from NumpyModel import Model
+    elif backend == "incremental":
+        from Incremental import Model
+    elif backend == "batch":
+        from BatchModel import Model
+    else:
+        from Model import Model
+    return Model
+
+def ReadRoutesFromFile(path: Optional[str] = None) -> List[Tuple[str, str]]:
     routes = []
 
-    # read test routes from TestRoutesPaths.txt, skipping the first line
-    with open(rootFolder + "RoutesPaths.txt", "r") as file:
+    # read test routes from RoutesPaths.txt, skipping the first line
+    with open(path or rootFolder + "RoutesPaths.txt", "r") as file:
         for line in file.readlines()[1:]:
             # only add if file ends with .shp
             if line.strip().endswith(".shp"):
                 routeName = line.split(",")[0]
-                routePath = rootFolder + "Data\\" + line.split(",")[1]
+                routePath = os.path.join(rootFolder + "Data", *line.split(",")[1].strip().split("\\"))
                 routes.append((routeName, routePath))
+
+    return routes
+
+# scratch workspace of the current worker process, see InitialiseWorker
+workerScratchFolder = None
+
+def InitialiseWorker(backend: str, traceMemory: bool = False, countFeatures: bool = False):
+    # give every worker process its own scratch folder (and scratch geodatabase
+    # for arcpy) so that the intermediate outputs of concurrent runs never collide
+    global workerScratchFolder
+    Profiling.TraceMemory = traceMemory
+    Profiling.CountFeatures = countFeatures
+    workerScratchFolder = tempfile.mkdtemp(prefix="TWM_Worker_") + os.sep
+    # pool workers exit without running atexit handlers, unlike multiprocessing finalizers
+    Finalize(None, shutil.rmtree, (workerScratchFolder, True), exitpriority=0)
+
+    if backend == "arcpy":
+        import arcpy
+        arcpy.env.overwriteOutput = True
+        arcpy.CreateFileGDB_management(workerScratchFolder, "Scratch.gdb")
+        arcpy.env.workspace = workerScratchFolder + "Scratch.gdb"
+        arcpy.env.scratchWorkspace = workerScratchFolder + "Scratch.gdb"
+
+def EvaluateRoute(backend: str, route: str, bufferSize: int, bufferSizeUnit: str, useCache: bool = True) -> Dict[str, Optional[int]]:
+    # run in a worker process, a failing route is reported in the result
+    # instead of being raised so that it does not stop the batch
+    try:
+        return CachedModel(GetModel(backend), backend, route, bufferSize, bufferSizeUnit, workerScratchFolder, useCache)
+    except Exception as e:
+        return {"Error": str(e)}
+
+def RunModelInParallel(routes: List[Tuple[str, str]], bufferSize: int, bufferSizeUnit: str,
+                       backend: str, workers: int, useCache: bool = True) -> List[Dict[str, Optional[int]]]:
+    # results are returned in the order of the routes, whichever finishes first
+    with ProcessPoolExecutor(max_workers=workers, initializer=InitialiseWorker, initargs=(backend, Profiling.TraceMemory, Profiling.CountFeatures)) as executor:
+        futures = [executor.submit(EvaluateRoute, backend, route, bufferSize, bufferSizeUnit, useCache) for _, route in routes]
+        results = []
+        for (route_name, _), future in zip(routes, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # the worker process itself died
+                results.append({"Error": str(e)})
+            print(f"Finished running Model.py for {route_name}.")
+        return results
+
+def WriteProfile(steps: List[Dict], profilePath: str):
+    # JSON lines and Chrome trace of the steps of a batch, profilePath without extension
+    WriteJsonLines(steps, profilePath + ".jsonl")
+    WriteChromeTrace(steps, profilePath + ".trace.json")
+    for total in Summarise(steps):
+        print(f"{total['step']}: {round(total['wall'], 2)} s over {total['runs']} runs")
+
+def RunModelOnRoutesFromFile(backend: str = "arcpy", workers: int = 1, useCache: bool = True,
+                             profilePath: Optional[str] = None, routesPath: Optional[str] = None,
+                             bufferSize: Optional[int] = None, bufferSizeUnit: Optional[str] = None,
+                             simplifyTolerance: Optional[float] = None) -> pd.DataFrame:
+    # the buffer size and unit are prompted for unless given (e.g. by Benchmark.py)
+    Model = GetModel(backend)
+    routes = ReadRoutesFromFile(routesPath)
     print(len(routes), "routes registered succesfully from file.")
 
     # REMOVE ABILITY TO ADD ROUTES MANUALLY DURING SCRIPT EXECUTION
@@ -54,44 +175,93 @@ def RunModelOnRoutesFromFile() -> pd.DataFrame:
         print("No routes to process. Exiting...")
         exit(0)
     
-    # ask the user for buffer size
-    buffer_size_unit = input("Enter the buffer size units (m or km): ")
-    while buffer_size_unit.lower() not in ["m", "km"]:
-        print("Invalid buffer size units. Please enter either m or km.")
+    if bufferSize is not None and bufferSizeUnit is not None:
+        buffer_size, buffer_size_unit = str(bufferSize), bufferSizeUnit
+    else:
+        # ask the user for buffer size
         buffer_size_unit = input("Enter the buffer size units (m or km): ")
-    
-    # ask the user for the buffer distance positive whole number
-    buffer_size = input("Enter the buffer distance (whole positive number): ")
-    while (not buffer_size.isdigit()) or (int(buffer_size) <= 0) or (not float(buffer_size).is_integer()):
-        print("Invalid buffer distance. Please enter a valid positive whole number.")
+        while buffer_size_unit.lower() not in ["m", "km"]:
+            print("Invalid buffer size units. Please enter either m or km.")
+            buffer_size_unit = input("Enter the buffer size units (m or km): ")
+        
+        # ask the user for the buffer distance positive whole number
         buffer_size = input("Enter the buffer distance (whole positive number): ")
+        while (not buffer_size.isdigit()) or (int(buffer_size) <= 0) or (not float(buffer_size).is_integer()):
+            print("Invalid buffer distance. Please enter a valid positive whole number.")
+            buffer_size = input("Enter the buffer distance (whole positive number): ")
 
-    # convert buffer size to appropriate units
-    if buffer_size_unit.lower() == "m":
-        buffer_size_unit = "Meters"
-    else:
-        buffer_size_unit = "Kilometers"
+        # convert buffer size to appropriate units
+        if buffer_size_unit.lower() == "m":
+            buffer_size_unit = "Meters"
+        else:
+            buffer_size_unit = "Kilometers"
+
+    if simplifyTolerance:
+        # evaluate the routes simplified with the tolerance (metres), see Simplify.py
+        from Simplify import SimplifyRoute
+        simplifiedFolder = tempfile.mkdtemp(prefix="TWM_Simplified_") + os.sep
+        atexit.register(shutil.rmtree, simplifiedFolder, True)
+        simplifiedRoutes = []
+        for i, (route_name, route) in enumerate(routes):
+            simplifiedRoute = simplifiedFolder + "Route" + str(i) + ".shp"
+            vertices, kept, deviation = SimplifyRoute(route, simplifyTolerance, simplifiedRoute)
+            print(f"Simplified {route_name} from {vertices} to {kept} vertices (deviation at most {round(deviation, 2)} m).")
+            simplifiedRoutes.append((route_name, simplifiedRoute))
+        routes = simplifiedRoutes
 
     list_of_metrics = GetMetrics()
     results = {}
     for metric in list_of_metrics:
         results[metric] = []
+    # steps of every route, see Profiling.py
+    steps = []
     
-    # run Model.py for each route
-    for route_name, route in routes:
-        print(f"\nRunning Model.py for {route_name}...")
-        result = Model(route, int(buffer_size), buffer_size_unit)
-        if "Error" in result:
-            print("Error running Model.py for", route)
-            print(result["Error"])
-            exit(1)
-        else:
+    if backend == "batch":
+        # run all routes together, one pass per reference layer, failed routes get empty metrics
+        from BatchModel import CachedBatchModel
+        print(f"\nRunning Model.py for {len(routes)} routes in one batch...")
+        for (route_name, route), result in zip(routes, CachedBatchModel([route for _, route in routes], int(buffer_size), buffer_size_unit, useCache)):
+            if "Error" in result:
+                print("Error running Model.py for", route)
+                print(result["Error"])
+            for metric in list_of_metrics:
+                results[metric].append(result.get(metric, None))
+            steps.extend(result.get("Profile", []))
+    elif workers > 1:
+        # run Model.py for all routes in parallel, failed routes get empty metrics
+        print(f"\nRunning Model.py for {len(routes)} routes with {workers} workers...")
+        for (route_name, route), result in zip(routes, RunModelInParallel(routes, int(buffer_size), buffer_size_unit, backend, workers, useCache)):
+            if "Error" in result:
+                print("Error running Model.py for", route)
+                print(result["Error"])
+            for metric in list_of_metrics:
+                results[metric].append(result.get(metric, None))
+            steps.extend(result.get("Profile", []))
+    else:
+        # run Model.py for each route, failed routes get empty metrics
+        for route_name, route in routes:
+            print(f"\nRunning Model.py for {route_name}...")
+            try:
+                result = CachedModel(Model, backend, route, int(buffer_size), buffer_size_unit, UseCache=useCache)
+            except Exception as e:
+                result = {"Error": str(e)}
+            if "Error" in result:
+                print("Error running Model.py for", route)
+                print(result["Error"])
             for metric in list_of_metrics:
-                res = result.get(metric, None)
-                results[metric].append(res)
+                results[metric].append(result.get(metric, None))
+            steps.extend(result.get("Profile", []))
 
     print("\nFinished running Model.py for all routes.")  
 
+    # workers only add to the cache, trim it once for the whole batch
+    if useCache:
+        Evict()
+
+    if profilePath:
+        print("Saving profile of the batch to " + profilePath + ".jsonl...")
+        WriteProfile(steps, profilePath)
+
     # return a 2d dataframe representation of the results
     df = pd.DataFrame(results, index=[route[0] for route in routes])
     df.index.name = "Route"
@@ -103,7 +273,23 @@ if __name__ == "__main__":
     print("Starting script...")
     startTime = time.time()
 
-    result_df = RunModelOnRoutesFromFile()
+    # --no-cache, --profile and --simplify {Tolerance} can be given anywhere after the script name
+    useCache = "--no-cache" not in argv
+    profilePath = rootFolder + "Profile" if "--profile" in argv else None
+    # the peak memory of every step is only traced when profiling, tracing slows down the model,
+    # and the arcpy backend only counts the features of its reference layers when profiling
+    Profiling.TraceMemory = profilePath is not None
+    Profiling.CountFeatures = profilePath is not None
+    arguments = [argument for argument in argv[1:] if argument not in ["--no-cache", "--profile"]]
+    simplifyTolerance = None
+    if "--simplify" in arguments:
+        position = arguments.index("--simplify")
+        simplifyTolerance = float(arguments[position + 1])
+        del arguments[position:position + 2]
+
+    result_df = RunModelOnRoutesFromFile(arguments[0] if len(arguments) > 0 else "arcpy",
+                                         int(arguments[1]) if len(arguments) > 1 else 1,
+                                         useCache, profilePath, simplifyTolerance=simplifyTolerance)
 
     # save the results to a csv file
     print("Saving results to Results.csv...")
@@ -0,0 +1,216 @@
+"""
+Sensitivity of the route ranking to the weights of the metrics.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+The overall weighted score of Rank (see Ranking.py) is the mean of the
+weighted ranks of a route, so it is linear in the weights: with the rank of
+every route in every metric computed once, the scores of all the routes under
+a batch of weight vectors are a single matrix product. Weight vectors are
+sampled either from a Dirichlet distribution (uniform over all the relative
+weights by default, or centred on the weight row of the csv files with a
+concentration) or uniformly and independently in [0, 1] (Monte Carlo), then
+scored a chunk at a time. The report gives, for every route:
+
+- the probability of ranking first and the probability of every rank (ties
+  are broken by the order of the routes in the csv files)
+- the mean rank
+
+and, for every route winning under some weights, the share of the samples it
+wins and the range and mean of every weight in the region where it wins.
+Finally every weight of the weight row is moved on its own between 0 and
+FLIP_WEIGHT_FACTOR times the largest weight, the others kept, and the exact
+weights where the winner flips are reported. Metrics without a weight in the
+weight row are left out, as they are by Rank.
+
+Example Usage (1 million Dirichlet samples around the weight row of the csv
+files, the report is also saved to Sensitivity.csv):
+python Sensitivity.py --samples 1000000 --concentration 20 ../Results.csv ../TurnsElevation.csv
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Optional, List, Tuple
+from sys import argv
+import numpy as np
+import pandas as pd
+import time
+
+from Ranking import MergeCsvFiles, SplitWeights, MaximizingSigns, MaxRanks
+
+# weight samples scored at once, bounds the memory of the score matrix
+SAMPLE_CHUNK = 100_000
+
+# ranks reported in the rank distribution
+RANK_POSITIONS = 10
+
+# the weights are moved one at a time up to this factor of the largest weight
+FLIP_WEIGHT_FACTOR = 10.0
+
+# sampling methods of the weight vectors
+Methods = ["dirichlet", "uniform"]
+
+SensitivitySeed = 2024
+
+
+def RankMatrix(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # (rank of every route in every maximizing metric with 0 for missing
+    # values, number of known metrics of every route), as in Rank
+    ranks = np.zeros(values.shape)
+    for metric in range(values.shape[1]):
+        known = ~np.isnan(values[:, metric])
+        ranks[known, metric] = MaxRanks(values[known, metric])
+    return ranks, np.count_nonzero(~np.isnan(values), axis=1)
+
+
+def SampleWeights(rng: np.random.Generator, samples: int, metrics: int, method: str = "dirichlet",
+                  weights: Optional[np.ndarray] = None, concentration: Optional[float] = None) -> np.ndarray:
+    # samples x metrics weight vectors, scaled to a mean weight of 1 like the
+    # default weights of Rank (the scale does not change the ranking)
+    if method == "uniform":
+        return rng.random((samples, metrics))
+    if method != "dirichlet":
+        raise ValueError("Unknown method " + method + ", expected one of " + ", ".join(Methods))
+    if concentration is None or weights is None:
+        alpha = np.ones(metrics)
+    else:
+        alpha = np.maximum(concentration * weights / weights.sum(), 1e-3)
+    return rng.dirichlet(alpha, samples) * metrics
+
+
+def Scores(weights: np.ndarray, ranks: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    # samples x routes Overall Weighted Score of Rank, -inf for routes without metrics
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = (weights @ ranks.T) / counts[None, :]
+    return np.where(counts[None, :] > 0, scores, -np.inf)
+
+
+def WinnerFlips(ranks: np.ndarray, counts: np.ndarray, weights: np.ndarray, metric: int,
+                maxWeight: float) -> List[Tuple[float, float, int]]:
+    # (from weight, to weight, winner) while the weight of one metric goes
+    # from 0 to maxWeight with the other weights kept. The score of every
+    # route is linear in that weight, so the winner follows the upper
+    # envelope of the score lines.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        others = np.where(np.arange(len(weights)) == metric, 0.0, weights)
+        intercepts = np.where(counts > 0, ranks @ others / counts, -np.inf)
+        slopes = np.where(counts > 0, ranks[:, metric] / counts, 0.0)
+
+    # ties go to the route that scores best after them, then to the first route
+    best = np.flatnonzero(intercepts == intercepts.max())
+    winner = int(best[np.argmax(slopes[best])])
+    regions = []
+    start = 0.0
+    while True:
+        steeper = np.flatnonzero(slopes > slopes[winner])
+        crossings = (intercepts[winner] - intercepts[steeper]) / (slopes[steeper] - slopes[winner])
+        ahead = crossings > start
+        end = float(crossings[ahead].min()) if ahead.any() else np.inf
+        if end >= maxWeight:
+            regions.append((start, maxWeight, winner))
+            return regions
+        regions.append((start, end, winner))
+        # the next winner is taken from the lines crossing the winner at the
+        # breakpoint, not from the scores there, which rounding can leave
+        # tied or in the wrong order
+        crossing = steeper[ahead][crossings[ahead] <= end + 1e-9 * max(end, 1.0)]
+        winner = int(crossing[np.argmax(slopes[crossing])])
+        start = end
+
+
+def Sensitivity(df: pd.DataFrame, samples: int, method: str = "dirichlet", concentration: Optional[float] = None,
+                seed: int = SensitivitySeed) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    # (probability of every rank and mean rank of every route, weight region
+    # of every winner, winner flips of every weight), see the module docstring
+    routes, values, weights = SplitWeights(df)
+    metrics = np.array(df.columns)
+    weighted = ~np.isnan(weights)
+    values, weights, metrics = values[:, weighted], weights[weighted], metrics[weighted]
+    ranks, counts = RankMatrix(values * MaximizingSigns(list(metrics)))
+
+    rng = np.random.default_rng(seed)
+    positions = min(RANK_POSITIONS, len(routes))
+    rankCounts = np.zeros((len(routes), positions), dtype=np.int64)
+    rankSums = np.zeros(len(routes))
+    winCounts = np.zeros(len(routes), dtype=np.int64)
+    winWeightSums = np.zeros((len(routes), len(metrics)))
+    winWeightMin = np.full((len(routes), len(metrics)), np.inf)
+    winWeightMax = np.full((len(routes), len(metrics)), -np.inf)
+
+    for first in range(0, samples, SAMPLE_CHUNK):
+        sampled = SampleWeights(rng, min(SAMPLE_CHUNK, samples - first), len(metrics), method, weights, concentration)
+        order = np.argsort(-Scores(sampled, ranks, counts), axis=1, kind="stable")
+        rank = np.empty_like(order)
+        np.put_along_axis(rank, order, np.arange(1, len(routes) + 1)[None, :], axis=1)
+        rankSums += rank.sum(axis=0)
+        for position in range(positions):
+            rankCounts[:, position] += np.bincount(order[:, position], minlength=len(routes))
+
+        # weights of the samples won by every route, grouped by winner
+        byWinner = np.argsort(order[:, 0], kind="stable")
+        winners, starts = np.unique(order[byWinner, 0], return_index=True)
+        grouped = sampled[byWinner]
+        winCounts[winners] += np.diff(np.append(starts, len(grouped)))
+        winWeightSums[winners] += np.add.reduceat(grouped, starts, axis=0)
+        winWeightMin[winners] = np.minimum(winWeightMin[winners], np.minimum.reduceat(grouped, starts, axis=0))
+        winWeightMax[winners] = np.maximum(winWeightMax[winners], np.maximum.reduceat(grouped, starts, axis=0))
+
+    ranking = pd.DataFrame(rankCounts / samples, index=routes,
+                           columns=["P(Rank " + str(position + 1) + ")" for position in range(positions)])
+    ranking.insert(0, "Mean Rank", rankSums / samples)
+    ranking = ranking.sort_values(["P(Rank 1)", "Mean Rank"], ascending=[False, True])
+
+    won = np.flatnonzero(winCounts)
+    regions = pd.DataFrame({"Route": routes[won], "Share of Samples": winCounts[won] / samples})
+    for metric, name in enumerate(metrics):
+        regions[name + " Mean"] = winWeightSums[won, metric] / winCounts[won]
+        regions[name + " Min"] = winWeightMin[won, metric]
+        regions[name + " Max"] = winWeightMax[won, metric]
+    regions = regions.sort_values("Share of Samples", ascending=False).set_index("Route")
+
+    flips = []
+    maxWeight = FLIP_WEIGHT_FACTOR * max(weights.max(), 1.0)
+    for metric, name in enumerate(metrics):
+        for start, end, winner in WinnerFlips(ranks, counts, weights, metric, maxWeight):
+            flips.append((name, weights[metric], start, end, routes[winner]))
+    flips = pd.DataFrame(flips, columns=["Metric", "Weight", "From Weight", "To Weight", "Winner"])
+
+    return ranking, regions, flips
+
+
+if __name__ == "__main__":
+    arguments = argv[1:]
+    options = {"--samples": "100000", "--method": "dirichlet", "--concentration": None}
+    for option in options:
+        if option in arguments:
+            position = arguments.index(option)
+            options[option] = arguments[position + 1]
+            del arguments[position:position + 2]
+
+    if len(arguments) < 1 or options["--method"] not in Methods:
+        print("Usage: Sensitivity.py [--samples N] [--method dirichlet|uniform] [--concentration C] {at least one CSV files containing result dataframe}")
+        exit(1)
+
+    startTime = time.time()
+    samples = int(options["--samples"])
+    concentration = None if options["--concentration"] is None else float(options["--concentration"])
+    ranking, regions, flips = Sensitivity(MergeCsvFiles(arguments), samples, options["--method"], concentration)
+
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(f"Rank distribution over {samples} {options['--method']} weight samples:")
+        print(ranking.round(4))
+        print("\nShare of the samples won by every route:")
+        print(regions["Share of Samples"].round(4))
+        print("\nWinner while one weight changes, the others kept:")
+        for metric, rows in flips.groupby("Metric", sort=False):
+            print(f"{metric} (weight {rows['Weight'].iloc[0]}): " +
+                  ", ".join(f"{row['Winner']} in [{round(row['From Weight'], 3)}, {round(row['To Weight'], 3)}]"
+                            for _, row in rows.iterrows()))
+
+    ranking.join(regions).to_csv("Sensitivity.csv")
+    flips.to_csv("WeightFlips.csv", index=False)
+    print("\nSaved the report to Sensitivity.csv and WeightFlips.csv.")
+    print("Script ended in", round(time.time() - startTime, 2), "s")
@@ -0,0 +1,374 @@
+"""
+Local evaluation service keeping the reference layers warm between route evaluations.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+Evaluating a route from the command line pays the start of the interpreter and
+the loading of every reference layer each time. This service is started once:
+its worker processes load the layers, their spatial indexes and snapshots when
+they start, and then evaluate routes with the NumPy backend (NumpyModel.py)
+and the on-disk metric cache (ResultCache.py).
+
+Requests are served over HTTP on the local machine by an asyncio front end:
+
+- POST /evaluate with a JSON body {"route": ..., "bufferSize": 100,
+  "bufferSizeUnit": "Meters"}, where route is the path of a route .shp file or
+  an inline GeoJSON LineString, MultiLineString, Feature or FeatureCollection
+  in lon/lat. The response is {"metrics": {...}, "profile": [...], "seconds": ...}
+  where profile holds the steps of the evaluation (see Profiling.py).
+- GET /health returns the number of workers and of requests being evaluated.
+- GET /metrics returns the names of the metrics (see GetMetrics).
+
+Concurrent requests are coalesced: identical requests (same route and buffer)
+wait on a single evaluation, and the requests arriving within BATCH_WINDOW
+seconds of each other are sent to the workers as batches, split over the
+workers of the pool. The workers only add to the metric cache, the service trims
+it every EVICTION_INTERVAL seconds and when it stops.
+
+Example Usage (serve on port 8765 with 4 worker processes):
+python Service.py 8765 4
+
+Example Usage (evaluate a route with curl):
+curl -X POST http://127.0.0.1:8765/evaluate -d "{\"route\": \"Data/TWM-Baseline/TWM-Baseline.shp\", \"bufferSize\": 100, \"bufferSizeUnit\": \"Meters\"}"
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Any, Dict, List, Optional, Tuple, Union
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from sys import argv
+import numpy as np
+import asyncio
+import hashlib
+import signal
+import json
+import time
+import os
+
+from Shapefile import Layer, WriteLayer, NormalisePath
+from Model import GetMetrics
+import NumpyModel
+import ResultCache
+import Runner
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 2
+
+# requests arriving within BATCH_WINDOW seconds of each other are evaluated
+# together, up to MAX_BATCH_SIZE requests per batch
+BATCH_WINDOW = 0.02
+MAX_BATCH_SIZE = 16
+
+# the metric cache is trimmed every EVICTION_INTERVAL seconds (see ResultCache.Evict)
+EVICTION_INTERVAL = 300
+
+# largest accepted request body (bytes)
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+BufferSizeUnits = ["Meters", "Kilometers"]
+
+
+class RequestError(ValueError):
+    # invalid request, answered with 400 Bad Request
+    pass
+
+
+def RouteFromGeoJson(geojson: Dict[str, Any]) -> Layer:
+    # polyline layer with one feature holding every line of the GeoJSON object
+    lines = []
+
+    def Collect(geometry: Optional[Dict[str, Any]]):
+        if not isinstance(geometry, dict):
+            raise RequestError("Invalid GeoJSON geometry")
+        geometryType = geometry.get("type")
+        if geometryType == "FeatureCollection":
+            for feature in geometry.get("features", []):
+                Collect(feature)
+        elif geometryType == "Feature":
+            Collect(geometry.get("geometry"))
+        elif geometryType == "LineString":
+            lines.append(geometry.get("coordinates"))
+        elif geometryType == "MultiLineString":
+            lines.extend(geometry.get("coordinates") or [])
+        else:
+            raise RequestError("Unsupported GeoJSON type " + str(geometryType) + ", expected line strings")
+
+    Collect(geojson)
+    try:
+        parts = [np.asarray(line, dtype=np.float64)[:, 0:2] for line in lines]
+    except (TypeError, ValueError, IndexError):
+        raise RequestError("Invalid GeoJSON coordinates")
+    parts = [part for part in parts if len(part) >= 2]
+    if len(parts) == 0 or not all(np.isfinite(part).all() for part in parts):
+        raise RequestError("The route needs at least one line with 2 valid points")
+
+    xy = np.concatenate(parts)
+    partOffsets = np.concatenate([[0], np.cumsum([len(part) for part in parts])]).astype(np.int64)
+    bbox = np.concatenate([xy.min(axis=0), xy.max(axis=0)])[None, :]
+    return Layer(3, xy, partOffsets, np.array([0, len(parts)], dtype=np.int64), bbox,
+                 {"Id": np.zeros(1, dtype=np.int64)})
+
+
+def ParseRequest(body: Dict[str, Any]) -> Tuple[Union[str, Dict[str, Any]], int, str]:
+    # (route path or GeoJSON, buffer size, buffer size unit) of an /evaluate request
+    route = body.get("route")
+    if isinstance(route, str):
+        route = NormalisePath(route)
+        if not os.path.isabs(route):
+            route = os.path.join(NumpyModel.rootFolder, route)
+        if not route.endswith(".shp") or not os.path.exists(route):
+            raise RequestError("Route must be an existing .shp file: " + route)
+    elif isinstance(route, dict):
+        RouteFromGeoJson(route)
+    else:
+        raise RequestError("Missing route, expected a .shp path or a GeoJSON object")
+
+    bufferSize = body.get("bufferSize")
+    if isinstance(bufferSize, bool) or not isinstance(bufferSize, (int, float)) or bufferSize <= 0 or not float(bufferSize).is_integer():
+        raise RequestError("Buffer size must be a whole positive number")
+    bufferSizeUnit = body.get("bufferSizeUnit", "Meters")
+    if bufferSizeUnit not in BufferSizeUnits:
+        raise RequestError("Buffer size unit must be one of " + ", ".join(BufferSizeUnits))
+    return route, int(bufferSize), bufferSizeUnit
+
+
+def RequestKey(route: Union[str, Dict[str, Any]], bufferSize: int, bufferSizeUnit: str) -> str:
+    # identical requests share the same key, a route file is identified by its modification time
+    digest = hashlib.sha256()
+    if isinstance(route, str):
+        stat = os.stat(route)
+        digest.update(("path\n" + route + "\n" + str(stat.st_size) + "\n" + str(stat.st_mtime_ns)).encode())
+    else:
+        digest.update(("geojson\n" + json.dumps(route, sort_keys=True)).encode())
+    digest.update(("\n" + str(bufferSize) + "\n" + bufferSizeUnit).encode())
+    return digest.hexdigest()
+
+
+def InitialiseWorker():
+    # scratch folder of the worker, then load every reference layer with its
+    # index so that the first request does not pay for it
+    Runner.InitialiseWorker("numpy")
+    for feature in NumpyModel.ReferenceLayers:
+        if not os.path.exists(NumpyModel.dataFolder + feature):
+            continue
+        if feature in (NumpyModel.ZoningFeature, NumpyModel.PropertyFeature):
+            # only parts of the largest layers are read per route, from their snapshots
+            NumpyModel.LoadLayerInBox(feature, np.zeros(4), [])
+            for field in NumpyModel.LayerFields[feature]:
+                NumpyModel.LoadBitmapIndex(feature, field)
+        else:
+            NumpyModel.LoadIndex(NumpyModel.LoadLayer(feature, []))
+    if os.path.exists(NumpyModel.dataFolder + NumpyModel.PropertyFeature):
+        NumpyModel.LoadRepresentativePoints(NumpyModel.PropertyFeature, "F_TYPE", NumpyModel.CondominiumType)
+
+
+def EvaluateBatch(requests: List[Tuple[str, Union[str, Dict[str, Any]], int, str]]) -> List[Dict[str, Any]]:
+    # run in a worker process: result of every (key, route, buffer size, unit)
+    results = []
+    for key, route, bufferSize, bufferSizeUnit in requests:
+        startTime = time.time()
+        routePath = route
+        try:
+            if isinstance(route, dict):
+                # inline routes are written to the scratch folder of the worker
+                routePath = (Runner.workerScratchFolder or "") + "Route-" + key[:16] + ".shp"
+                WriteLayer(routePath, RouteFromGeoJson(route))
+            # the step by step output of the model would flood the console of the service
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                result = ResultCache.CachedModel(NumpyModel.Model, "numpy", routePath, bufferSize, bufferSizeUnit)
+        except Exception as e:
+            result = {"Error": str(e)}
+        finally:
+            if isinstance(route, dict):
+                for extension in (".shp", ".shx", ".dbf", ".prj"):
+                    if os.path.exists(os.path.splitext(routePath)[0] + extension):
+                        os.remove(os.path.splitext(routePath)[0] + extension)
+        result["Seconds"] = time.time() - startTime
+        results.append(result)
+    return results
+
+
+class EvaluationService:
+    # coalesces the requests and dispatches them in batches to a pool of worker processes
+    def __init__(self, workers: int = DEFAULT_WORKERS):
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=InitialiseWorker)
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.queue: Optional[asyncio.Queue] = None
+        self.evaluated = 0
+        self.coalesced = 0
+
+    async def Start(self):
+        self.queue = asyncio.Queue()
+        asyncio.get_running_loop().create_task(self._Dispatch())
+        asyncio.get_running_loop().create_task(self._Evict())
+        # start and warm every worker before the first request
+        await asyncio.gather(*[asyncio.get_running_loop().run_in_executor(self.pool, EvaluateBatch, [])
+                               for _ in range(self.workers)])
+
+    async def Evaluate(self, route: Union[str, Dict[str, Any]], bufferSize: int, bufferSizeUnit: str) -> Dict[str, Any]:
+        key = RequestKey(route, bufferSize, bufferSizeUnit)
+        if key in self.pending:
+            self.coalesced += 1
+        else:
+            self.pending[key] = asyncio.get_running_loop().create_future()
+            await self.queue.put((key, route, bufferSize, bufferSizeUnit))
+        # shield the shared evaluation from the cancellation of one of its requests
+        return await asyncio.shield(self.pending[key])
+
+    async def _Dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + BATCH_WINDOW
+            while len(batch) < MAX_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # spread the batch over the workers
+            chunks = min(len(batch), self.workers)
+            for i in range(chunks):
+                loop.create_task(self._RunBatch(batch[i::chunks]))
+
+    async def _RunBatch(self, batch: List[Tuple[str, Union[str, Dict[str, Any]], int, str]]):
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.pool, EvaluateBatch, batch)
+        except Exception as e:
+            # the worker process died
+            results = [{"Error": str(e)}] * len(batch)
+        for (key, _, _, _), result in zip(batch, results):
+            self.evaluated += 1
+            future = self.pending.pop(key)
+            if not future.done():
+                future.set_result(result)
+
+    async def _Evict(self):
+        # a single task of the main process trims the cache, never the workers
+        while True:
+            await asyncio.sleep(EVICTION_INTERVAL)
+            await asyncio.get_running_loop().run_in_executor(None, ResultCache.Evict)
+
+    def Close(self):
+        # waiting lets the workers exit normally and remove their scratch folders
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        ResultCache.Evict()
+
+
+async def _ReadHttpRequest(reader: asyncio.StreamReader) -> Tuple[str, str, bytes]:
+    # (method, path, body) of an HTTP/1.1 request
+    requestLine = (await reader.readline()).decode("latin1").split()
+    if len(requestLine) < 2:
+        raise RequestError("Invalid HTTP request")
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0") or 0)
+    if length > MAX_REQUEST_SIZE:
+        raise RequestError("Request too large")
+    body = await reader.readexactly(length) if length > 0 else b""
+    return requestLine[0].upper(), requestLine[1].split("?")[0], body
+
+
+def _HttpResponse(status: int, payload: Dict[str, Any]) -> bytes:
+    reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+    body = json.dumps(payload).encode()
+    header = ("HTTP/1.1 " + str(status) + " " + reasons[status] + "\r\n" +
+              "Content-Type: application/json\r\nContent-Length: " + str(len(body)) + "\r\nConnection: close\r\n\r\n")
+    return header.encode("latin1") + body
+
+
+async def HandleConnection(service: EvaluationService, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        try:
+            method, path, body = await _ReadHttpRequest(reader)
+            if path == "/health":
+                status, payload = 200, {"status": "ok", "workers": service.workers, "pending": len(service.pending),
+                                        "evaluated": service.evaluated, "coalesced": service.coalesced}
+            elif path == "/metrics":
+                status, payload = 200, {"metrics": GetMetrics()}
+            elif path != "/evaluate":
+                status, payload = 404, {"error": "Unknown endpoint " + path}
+            elif method != "POST":
+                status, payload = 405, {"error": "Use POST to evaluate a route"}
+            else:
+                try:
+                    request = json.loads(body.decode("utf-8"))
+                except ValueError:
+                    raise RequestError("The body must be a JSON object")
+                if not isinstance(request, dict):
+                    raise RequestError("The body must be a JSON object")
+                result = await service.Evaluate(*ParseRequest(request))
+                metrics = {metric: result[metric] for metric in GetMetrics() if metric in result}
+                payload = {"metrics": metrics, "profile": result.get("Profile", []), "seconds": result.get("Seconds")}
+                status = 200
+                if "Error" in result:
+                    status, payload["error"] = 500, result["Error"]
+        except (RequestError, UnicodeDecodeError, asyncio.IncompleteReadError) as e:
+            status, payload = 400, {"error": str(e)}
+        writer.write(_HttpResponse(status, payload))
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def Serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, workers: int = DEFAULT_WORKERS):
+    service = EvaluationService(workers)
+    try:
+        print("Starting " + str(workers) + " workers and loading the reference layers...")
+        startTime = time.time()
+        await service.Start()
+        print("Workers ready in " + str(round(time.time() - startTime, 2)) + " s.")
+
+        server = await asyncio.start_server(lambda reader, writer: HandleConnection(service, reader, writer), host, port)
+        print("Serving route evaluations on http://" + host + ":" + str(port) + "/evaluate")
+        # stop cleanly on SIGTERM too (not supported by the Windows event loop)
+        serving = asyncio.ensure_future(server.serve_forever())
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+        except (NotImplementedError, AttributeError):
+            pass
+        async with server:
+            try:
+                await serving
+            except asyncio.CancelledError:
+                pass
+    finally:
+        service.Close()
+
+
+def Evaluate(route: Union[str, Dict[str, Any]], bufferSize: int, bufferSizeUnit: str = "Meters",
+             host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> Dict[str, Any]:
+    # client: evaluate a route (.shp path or GeoJSON) with a running service
+    body = json.dumps({"route": route, "bufferSize": bufferSize, "bufferSizeUnit": bufferSizeUnit}).encode()
+    httpRequest = Request("http://" + host + ":" + str(port) + "/evaluate", body, {"Content-Type": "application/json"})
+    try:
+        with urlopen(httpRequest) as response:
+            return json.loads(response.read())
+    except HTTPError as e:
+        return json.loads(e.read())
+
+
+if __name__ == "__main__":
+    port = int(argv[1]) if len(argv) > 1 else DEFAULT_PORT
+    workers = int(argv[2]) if len(argv) > 2 else DEFAULT_WORKERS
+    try:
+        asyncio.run(Serve(DEFAULT_HOST, port, workers))
+    except KeyboardInterrupt:
+        print("Service stopped.")
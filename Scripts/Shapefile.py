@@ -0,0 +1,491 @@
+"""
+Pure Python/NumPy reader for ESRI shapefiles used by the TWM GIS model.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+The reader decodes the .shp geometry and the .dbf attribute table directly so
+that the layers under the Data folder can be used without an ArcGIS Pro
+environment. Geometry is stored in flat columnar arrays:
+
+- xy: every vertex of the layer as a (n, 2) float array of lon/lat
+- partOffsets: start index in xy of every part (ring or line), plus the end
+- featureOffsets: start index in partOffsets of every feature, plus the end
+- bboxes: (minx, miny, maxx, maxy) of every feature
+
+Layers stored in Web Mercator (e.g. above_avg_car_intersections) are converted
+to lon/lat on load so all layers share the same coordinate system.
+
+WriteLayer writes a layer back to a lon/lat (WGS 84) shapefile, e.g. the
+synthetic reference layers and routes of Benchmark.py.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Optional, List, Dict
+import numpy as np
+import struct
+import mmap
+import os
+
+from Geometry import ExpandRanges, ToMetres
+
+# shape type codes from the ESRI shapefile technical description
+NULL_SHAPE = 0
+POINT_SHAPES = (1, 11, 21)
+POLYLINE_SHAPES = (3, 13, 23)
+POLYGON_SHAPES = (5, 15, 25)
+MULTIPOINT_SHAPES = (8, 18, 28)
+
+# radius of the auxiliary sphere used by Web Mercator
+WEB_MERCATOR_RADIUS = 6378137.0
+
+# projection written next to the shapefiles created by WriteLayer
+WGS84_PROJECTION = ('GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],'
+                    'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]')
+
+
+class Layer:
+    def __init__(self, shapeType: int, xy: np.ndarray, partOffsets: np.ndarray,
+                 featureOffsets: np.ndarray, bboxes: np.ndarray,
+                 attributes: Dict[str, np.ndarray], path: str = "",
+                 featureIds: Optional[np.ndarray] = None, metres: Optional[np.ndarray] = None,
+                 metreBoxes: Optional[np.ndarray] = None):
+        self.shapeType = shapeType
+        self.xy = xy
+        self.partOffsets = partOffsets
+        self.featureOffsets = featureOffsets
+        self.bboxes = bboxes
+        self.attributes = attributes
+        self.path = path
+        # ids of the features in the file when only part of it was read
+        self.featureIds = featureIds
+        # vertices and feature bboxes in the metric projection, projected once on first use
+        self.metres = metres
+        self.metreBoxes = metreBoxes
+
+    def __len__(self) -> int:
+        return len(self.featureOffsets) - 1
+
+    def IsPoint(self) -> bool:
+        return self.shapeType in POINT_SHAPES
+
+    def IsPolygon(self) -> bool:
+        return self.shapeType in POLYGON_SHAPES
+
+    def Metres(self) -> np.ndarray:
+        # vertices in metres (see Geometry.ToMetres)
+        if self.metres is None:
+            self.metres = ToMetres(self.xy)
+        return self.metres
+
+    def MetreBoxes(self) -> np.ndarray:
+        # bbox of the vertices of every feature in metres, NaN for null shapes.
+        # The lon/lat bboxes cannot be projected corner by corner as the
+        # meridians are not parallel to the y axis of the projection.
+        if self.metreBoxes is None:
+            boxes = np.full((len(self), 4), np.nan)
+            starts = self.partOffsets[self.featureOffsets[:-1]]
+            hasGeometry = self.partOffsets[self.featureOffsets[1:]] > starts
+            if hasGeometry.any():
+                metres = self.Metres()
+                boxes[hasGeometry, 0:2] = np.minimum.reduceat(metres, starts[hasGeometry], axis=0)
+                boxes[hasGeometry, 2:4] = np.maximum.reduceat(metres, starts[hasGeometry], axis=0)
+            self.metreBoxes = boxes
+        return self.metreBoxes
+
+    def Points(self, metres: bool = False) -> np.ndarray:
+        # first vertex of every feature (lon/lat, or metres), NaN for null shapes
+        points = np.full((len(self), 2), np.nan)
+        hasGeometry = np.diff(self.featureOffsets) > 0
+        firstPart = self.featureOffsets[:-1][hasGeometry]
+        points[hasGeometry] = (self.Metres() if metres else self.xy)[self.partOffsets[firstPart]]
+        return points
+
+    def FeatureParts(self, feature: int, metres: bool = False) -> List[np.ndarray]:
+        # list of vertex arrays (lon/lat, or metres) for every part of the given feature
+        xy = self.Metres() if metres else self.xy
+        start, end = self.featureOffsets[feature], self.featureOffsets[feature + 1]
+        return [xy[self.partOffsets[p]:self.partOffsets[p + 1]] for p in range(start, end)]
+
+    def Subset(self, features: np.ndarray) -> "Layer":
+        # new layer holding only the given features (indices or boolean mask)
+        features = np.arange(len(self))[features] if np.asarray(features).dtype == bool else np.asarray(features, dtype=np.int64)
+        partCounts = self.featureOffsets[features + 1] - self.featureOffsets[features]
+        parts = ExpandRanges(self.featureOffsets[features], partCounts)
+        pointCounts = self.partOffsets[parts + 1] - self.partOffsets[parts]
+        points = ExpandRanges(self.partOffsets[parts], pointCounts)
+        return Layer(self.shapeType,
+                     self.xy[points],
+                     np.concatenate([[0], np.cumsum(pointCounts)]).astype(np.int64),
+                     np.concatenate([[0], np.cumsum(partCounts)]).astype(np.int64),
+                     self.bboxes[features],
+                     {name: values[features] for name, values in self.attributes.items()},
+                     self.path,
+                     features if self.featureIds is None else self.featureIds[features],
+                     None if self.metres is None else self.metres[points],
+                     None if self.metreBoxes is None else self.metreBoxes[features])
+
+
+def NormalisePath(path: str) -> str:
+    # paths in RoutesPaths.txt and the scripts use Windows separators
+    return path.replace("\\", os.sep) if os.sep != "\\" else path
+
+
+def ReadProjection(shpPath: str) -> str:
+    prjPath = os.path.splitext(shpPath)[0] + ".prj"
+    if not os.path.exists(prjPath):
+        return ""
+    with open(prjPath, "r", errors="ignore") as file:
+        return file.read()
+
+
+def IsWebMercator(projection: str) -> bool:
+    return "Mercator_Auxiliary_Sphere" in projection or "3857" in projection or "Pseudo_Mercator" in projection
+
+
+def LonLatToWebMercator(lonlat: np.ndarray) -> np.ndarray:
+    x = np.radians(lonlat[..., 0]) * WEB_MERCATOR_RADIUS
+    y = np.log(np.tan(np.pi / 4 + np.radians(lonlat[..., 1]) / 2)) * WEB_MERCATOR_RADIUS
+    return np.stack([x, y], axis=-1)
+
+
+def WebMercatorToLonLat(xy: np.ndarray) -> np.ndarray:
+    lon = np.degrees(xy[..., 0] / WEB_MERCATOR_RADIUS)
+    lat = np.degrees(2 * np.arctan(np.exp(xy[..., 1] / WEB_MERCATOR_RADIUS)) - np.pi / 2)
+    return np.stack([lon, lat], axis=-1)
+
+
+def ReadGeometry(shpPath: str):
+    with open(shpPath, "rb") as file:
+        data = file.read()
+
+    shapeType = _ReadHeader(data, shpPath)
+
+    shxPath = os.path.splitext(shpPath)[0] + ".shx"
+    if os.path.exists(shxPath):
+        return (shapeType,) + _DecodeRecords(data, ReadRecordOffsets(shxPath), shpPath)
+
+    # without a .shx index, walk the records one after another
+    starts = []
+    offset = 100
+    while offset + 8 <= len(data):
+        contentLength, = struct.unpack(">i", data[offset + 4:offset + 8])
+        starts.append(offset)
+        offset += 8 + contentLength * 2
+
+    return (shapeType,) + _DecodeRecords(data, starts, shpPath)
+
+
+def _ReadHeader(data, shpPath: str) -> int:
+    fileCode, = struct.unpack(">i", data[0:4])
+    if fileCode != 9994:
+        raise ValueError("Not a shapefile: " + shpPath)
+    shapeType, = struct.unpack("<i", data[32:36])
+    return shapeType
+
+
+def _DecodeRecords(data, starts, shpPath: str):
+    # decode the records whose headers start at the given byte offsets
+    starts = np.asarray(starts, dtype=np.int64)
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    recordTypes = _Gather(buffer, starts + 8, 4).view("<i4").ravel()
+    types = set(np.unique(recordTypes).tolist()) - {NULL_SHAPE}
+    if types <= set(POLYLINE_SHAPES + POLYGON_SHAPES) or types <= set(POINT_SHAPES):
+        return _DecodeSimpleRecords(data, buffer, starts, recordTypes)
+    return _DecodeMixedRecords(data, starts.tolist(), shpPath)
+
+
+def _Gather(buffer: np.ndarray, offsets: np.ndarray, size: int) -> np.ndarray:
+    # (len(offsets), size) bytes starting at every offset
+    return buffer[offsets[:, None] + np.arange(size)].copy()
+
+
+def _DecodeSimpleRecords(data, buffer: np.ndarray, starts: np.ndarray, recordTypes: np.ndarray):
+    # vectorized decoding of null shapes with only points, or only polylines and polygons
+    isNull = recordTypes == NULL_SHAPE
+    valid = starts[~isNull]
+    bboxes = np.full((len(starts), 4), np.nan)
+
+    if len(valid) and recordTypes[~isNull][0] in POINT_SHAPES:
+        xy = _Gather(buffer, valid + 12, 16).view("<f8")
+        bboxes[~isNull] = np.concatenate([xy, xy], axis=1)
+        partOffsets = np.arange(len(valid) + 1, dtype=np.int64)
+        featureOffsets = np.concatenate([[0], np.cumsum(~isNull)]).astype(np.int64)
+        return xy.reshape(-1, 2), partOffsets, featureOffsets, bboxes
+
+    bboxes[~isNull] = _Gather(buffer, valid + 12, 32).view("<f8")
+    counts = _Gather(buffer, valid + 44, 8).view("<i4").astype(np.int64)
+    numParts, numPoints = counts[:, 0], counts[:, 1]
+
+    # the part and point arrays of the records are joined as bytes, then converted at once
+    partStarts = valid + 52
+    pointStarts = partStarts + 4 * numParts
+    parts = np.frombuffer(b"".join([data[start:start + 4 * count] for start, count in zip(partStarts.tolist(), numParts.tolist())]), dtype="<i4")
+    xy = np.frombuffer(b"".join([data[start:start + 16 * count] for start, count in zip(pointStarts.tolist(), numPoints.tolist())]), dtype="<f8")
+
+    recordPointOffsets = np.concatenate([[0], np.cumsum(numPoints)])
+    partOffsets = np.append(parts + np.repeat(recordPointOffsets[:-1], numParts), recordPointOffsets[-1]).astype(np.int64)
+    recordParts = np.zeros(len(starts), dtype=np.int64)
+    recordParts[~isNull] = numParts
+    featureOffsets = np.concatenate([[0], np.cumsum(recordParts)]).astype(np.int64)
+    return xy.reshape(-1, 2).astype(np.float64), partOffsets, featureOffsets, bboxes
+
+
+def _DecodeMixedRecords(data, starts, shpPath: str):
+    xyChunks = []
+    partCounts = []
+    featurePartCounts = []
+    bboxes = []
+
+    for offset in starts:
+        recordStart = offset + 8
+        recordType, = struct.unpack("<i", data[recordStart:recordStart + 4])
+
+        if recordType == NULL_SHAPE:
+            featurePartCounts.append(0)
+            bboxes.append((np.nan, np.nan, np.nan, np.nan))
+        elif recordType in POINT_SHAPES:
+            x, y = struct.unpack("<2d", data[recordStart + 4:recordStart + 20])
+            xyChunks.append(np.array([[x, y]]))
+            partCounts.append(1)
+            featurePartCounts.append(1)
+            bboxes.append((x, y, x, y))
+        elif recordType in MULTIPOINT_SHAPES:
+            box = struct.unpack("<4d", data[recordStart + 4:recordStart + 36])
+            numPoints, = struct.unpack("<i", data[recordStart + 36:recordStart + 40])
+            points = np.frombuffer(data, dtype="<f8", count=numPoints * 2, offset=recordStart + 40).reshape(-1, 2)
+            xyChunks.append(points)
+            partCounts.append(numPoints)
+            featurePartCounts.append(1)
+            bboxes.append(box)
+        elif recordType in POLYLINE_SHAPES or recordType in POLYGON_SHAPES:
+            box = struct.unpack("<4d", data[recordStart + 4:recordStart + 36])
+            numParts, numPoints = struct.unpack("<2i", data[recordStart + 36:recordStart + 44])
+            parts = np.frombuffer(data, dtype="<i4", count=numParts, offset=recordStart + 44)
+            points = np.frombuffer(data, dtype="<f8", count=numPoints * 2,
+                                   offset=recordStart + 44 + 4 * numParts).reshape(-1, 2)
+            xyChunks.append(points)
+            partCounts.extend(np.diff(np.append(parts, numPoints)).tolist())
+            featurePartCounts.append(numParts)
+            bboxes.append(box)
+        else:
+            raise ValueError("Unsupported shape type " + str(recordType) + " in " + shpPath)
+
+    xy = np.concatenate(xyChunks) if xyChunks else np.zeros((0, 2))
+    partOffsets = np.concatenate([[0], np.cumsum(partCounts, dtype=np.int64)]).astype(np.int64)
+    featureOffsets = np.concatenate([[0], np.cumsum(featurePartCounts, dtype=np.int64)]).astype(np.int64)
+    return xy.astype(np.float64), partOffsets, featureOffsets, np.array(bboxes, dtype=np.float64).reshape(-1, 4)
+
+
+def ReadRecordOffsets(shxPath: str) -> np.ndarray:
+    # byte offset in the .shp of the header of every record, from the .shx index
+    with open(shxPath, "rb") as file:
+        data = file.read()
+    # 100 byte header, then (offset, content length) pairs in 16-bit words
+    return np.frombuffer(data, dtype=">i4", offset=100).reshape(-1, 2)[:, 0].astype(np.int64) * 2
+
+
+def ReadRecordBoxes(data: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    # stored bbox of every record without decoding the geometry, NaN for null
+    # shapes. data is the .shp as a uint8 array (e.g. a memory map)
+    starts = np.asarray(starts, dtype=np.int64)
+    recordTypes = data[(starts + 8)[:, None] + np.arange(4)].copy().view("<i4").ravel()
+    isPoint = np.isin(recordTypes, POINT_SHAPES)
+    # points store x, y right after the shape type, the other shapes a bbox
+    boxes = np.full((len(starts), 4), np.nan)
+    hasBox = ~isPoint & (recordTypes != NULL_SHAPE)
+    boxes[hasBox] = data[(starts[hasBox] + 12)[:, None] + np.arange(32)].copy().view("<f8")
+    points = data[(starts[isPoint] + 12)[:, None] + np.arange(16)].copy().view("<f8")
+    boxes[isPoint] = np.concatenate([points, points], axis=1)
+    return boxes
+
+
+def ReadAttributes(dbfPath: str, fields: Optional[List[str]] = None,
+                   rows: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    # read the given fields (all fields if None) of a dBASE table into arrays,
+    # optionally only for the given rows
+    with open(dbfPath, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return {}
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    numRecords, headerLength, recordLength = struct.unpack("<IHH", data[4:12])
+
+    # field descriptors are 32 bytes each and end with a 0x0D terminator
+    descriptors = []
+    position = 1  # every record starts with a deletion flag byte
+    for start in range(32, headerLength - 1, 32):
+        if data[start] == 0x0D:
+            break
+        name = data[start:start + 11].split(b"\x00")[0].decode("latin1")
+        fieldType = chr(data[start + 11])
+        length, decimals = data[start + 16], data[start + 17]
+        descriptors.append((name, fieldType, position, length, decimals))
+        position += length
+
+    records = np.frombuffer(data, dtype=np.uint8, count=numRecords * recordLength,
+                            offset=headerLength).reshape(numRecords, recordLength)
+    if rows is not None:
+        records = records[np.asarray(rows, dtype=np.int64)]
+
+    attributes = {}
+    for name, fieldType, position, length, decimals in descriptors:
+        if fields is not None and name not in fields:
+            continue
+        raw = records[:, position:position + length].copy().view("S" + str(length)).ravel()
+        attributes[name] = _ConvertField(raw, fieldType, decimals)
+
+    return attributes
+
+
+def _ConvertField(raw: np.ndarray, fieldType: str, decimals: int) -> np.ndarray:
+    stripped = np.char.strip(raw)
+    if fieldType in ("N", "F"):
+        values = np.full(len(raw), np.nan)
+        valid = (stripped != b"") & (np.char.find(stripped, b"*") < 0)
+        if valid.any():
+            values[valid] = stripped[valid].astype(np.float64)
+        if fieldType == "N" and decimals == 0 and not np.isnan(values).any():
+            return values.astype(np.int64)
+        return values
+    if fieldType == "L":
+        return np.isin(stripped, [b"T", b"t", b"Y", b"y"])
+    return np.char.decode(stripped, "latin1")
+
+
+def ReadLayer(shpPath: str, fields: Optional[List[str]] = None) -> Layer:
+    shpPath = NormalisePath(shpPath)
+    shapeType, xy, partOffsets, featureOffsets, bboxes = ReadGeometry(shpPath)
+
+    dbfPath = os.path.splitext(shpPath)[0] + ".dbf"
+    attributes = ReadAttributes(dbfPath, fields) if os.path.exists(dbfPath) and fields != [] else {}
+
+    if IsWebMercator(ReadProjection(shpPath)):
+        xy = WebMercatorToLonLat(xy)
+        bboxes = np.concatenate([WebMercatorToLonLat(bboxes[:, 0:2]), WebMercatorToLonLat(bboxes[:, 2:4])], axis=1)
+
+    return Layer(shapeType, xy, partOffsets, featureOffsets, bboxes, attributes, shpPath)
+
+
+def ReadLayerInBox(shpPath: str, box: np.ndarray, fields: Optional[List[str]] = None) -> Layer:
+    # only the features whose bbox intersects box (minlon, minlat, maxlon, maxlat).
+    # The .shp is memory mapped and the bbox stored in every record (located
+    # through the .shx index) is tested before any geometry is decoded, so the
+    # cost depends on the number of features in the box, not in the layer.
+    # featureIds of the returned layer are the ids of the features in the file.
+    shpPath = NormalisePath(shpPath)
+    shxPath = os.path.splitext(shpPath)[0] + ".shx"
+    if not os.path.exists(shxPath):
+        layer = ReadLayer(shpPath, fields)
+        return layer.Subset(BoxesIntersect(layer.bboxes, box))
+
+    box = np.asarray(box, dtype=np.float64)
+    if IsWebMercator(ReadProjection(shpPath)):
+        box = np.concatenate([LonLatToWebMercator(box[0:2]), LonLatToWebMercator(box[2:4])])
+
+    with open(shpPath, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    boxes = ReadRecordBoxes(np.frombuffer(data, dtype=np.uint8), ReadRecordOffsets(shxPath))
+    return ReadLayerFeatures(shpPath, np.flatnonzero(BoxesIntersect(boxes, box)), fields)
+
+
+def ReadLayerFeatures(shpPath: str, features: np.ndarray, fields: Optional[List[str]] = None) -> Layer:
+    # only the given features (ids in the file), decoded through the .shx index
+    shpPath = NormalisePath(shpPath)
+    features = np.asarray(features, dtype=np.int64)
+    shxPath = os.path.splitext(shpPath)[0] + ".shx"
+    if not os.path.exists(shxPath):
+        return ReadLayer(shpPath, fields).Subset(features)
+
+    with open(shpPath, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    shapeType = _ReadHeader(data, shpPath)
+    xy, partOffsets, featureOffsets, bboxes = _DecodeRecords(data, ReadRecordOffsets(shxPath)[features], shpPath)
+
+    dbfPath = os.path.splitext(shpPath)[0] + ".dbf"
+    attributes = ReadAttributes(dbfPath, fields, features) if os.path.exists(dbfPath) and fields != [] else {}
+
+    if IsWebMercator(ReadProjection(shpPath)):
+        xy = WebMercatorToLonLat(xy)
+        bboxes = np.concatenate([WebMercatorToLonLat(bboxes[:, 0:2]), WebMercatorToLonLat(bboxes[:, 2:4])], axis=1)
+
+    return Layer(shapeType, xy, partOffsets, featureOffsets, bboxes, attributes, shpPath, features)
+
+
+def BoxesIntersect(boxes: np.ndarray, box: np.ndarray) -> np.ndarray:
+    # NaN (null shape) boxes never intersect
+    return ((boxes[:, 0] <= box[2]) & (boxes[:, 2] >= box[0]) &
+            (boxes[:, 1] <= box[3]) & (boxes[:, 3] >= box[1]))
+
+
+def WriteLayer(shpPath: str, layer: Layer):
+    # write the geometry (.shp, .shx), the attributes (.dbf) and a WGS 84 .prj
+    shpPath = NormalisePath(shpPath)
+    basePath = os.path.splitext(shpPath)[0]
+    shapeType = 1 if layer.IsPoint() else layer.shapeType
+
+    records = []
+    for feature in range(len(layer)):
+        partStart, partEnd = layer.featureOffsets[feature], layer.featureOffsets[feature + 1]
+        start, end = layer.partOffsets[partStart], layer.partOffsets[partEnd]
+        if shapeType in POINT_SHAPES:
+            records.append(struct.pack("<i2d", shapeType, *layer.xy[start]))
+        else:
+            parts = layer.partOffsets[partStart:partEnd] - start
+            records.append(struct.pack("<i4d2i", shapeType, *layer.bboxes[feature], len(parts), end - start) +
+                           parts.astype("<i4").tobytes() + layer.xy[start:end].astype("<f8").tobytes())
+
+    valid = np.isfinite(layer.bboxes).all(axis=1)
+    extent = (np.concatenate([layer.bboxes[valid, 0:2].min(axis=0), layer.bboxes[valid, 2:4].max(axis=0)])
+              if valid.any() else np.zeros(4))
+
+    def Header(fileLength: int) -> bytes:
+        # lengths are in 16-bit words
+        return (struct.pack(">7i", 9994, 0, 0, 0, 0, 0, fileLength // 2) + struct.pack("<2i", 1000, shapeType) +
+                struct.pack("<4d", *extent) + struct.pack("<4d", 0, 0, 0, 0))
+
+    contents = [struct.pack(">2i", i + 1, len(record) // 2) + record for i, record in enumerate(records)]
+    lengths = np.array([len(content) for content in contents], dtype=np.int64)
+    offsets = 100 + np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    with open(shpPath, "wb") as file:
+        file.write(Header(100 + int(lengths.sum())))
+        file.write(b"".join(contents))
+    with open(basePath + ".shx", "wb") as file:
+        file.write(Header(100 + 8 * len(records)))
+        file.write(np.stack([offsets // 2, lengths // 2 - 4], axis=1).astype(">i4").tobytes())
+
+    WriteAttributes(basePath + ".dbf", layer.attributes, len(layer))
+    with open(basePath + ".prj", "w") as file:
+        file.write(WGS84_PROJECTION)
+
+
+def WriteAttributes(dbfPath: str, attributes: Dict[str, np.ndarray], numRecords: int):
+    # dBASE III table, integers as N fields, floats as F fields and the rest as C fields
+    descriptors, columns = [], []
+    for name, values in attributes.items():
+        values = np.asarray(values)
+        if values.dtype.kind in "iub":
+            text, fieldType, decimals = np.char.mod("%d", values.astype(np.int64)), "N", 0
+        elif values.dtype.kind == "f":
+            text, fieldType, decimals = np.char.mod("%.8f", values), "F", 8
+        else:
+            text, fieldType, decimals = values.astype(str), "C", 0
+        encoded = np.char.encode(text, "latin1")
+        length = min(max(int(np.char.str_len(encoded).max()) if len(encoded) else 1, 1), 254)
+        encoded = np.char.ljust(encoded, length) if fieldType == "C" else np.char.rjust(encoded, length)
+        columns.append(np.frombuffer(encoded.astype("S" + str(length)).tobytes(), dtype=np.uint8).reshape(numRecords, length))
+        descriptors.append(name.encode("latin1")[:10].ljust(11, b"\x00") + fieldType.encode() + b"\x00" * 4 +
+                           bytes([length, decimals]) + b"\x00" * 14)
+
+    recordLength = 1 + sum(column.shape[1] for column in columns)
+    headerLength = 32 + 32 * len(descriptors) + 1
+    # every record starts with a blank deletion flag
+    records = np.concatenate([np.full((numRecords, 1), ord(" "), dtype=np.uint8)] + columns, axis=1)
+    with open(dbfPath, "wb") as file:
+        file.write(struct.pack("<4BIHH20x", 3, 124, 1, 1, numRecords, headerLength, recordLength))
+        file.write(b"".join(descriptors) + b"\r")
+        file.write(records.tobytes())
+        file.write(b"\x1a")
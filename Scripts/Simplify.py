@@ -0,0 +1,152 @@
+"""
+Error-bounded simplification of the routes before they are evaluated.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+Routes traced from GPS tracks (e.g. the track points of the 2023 route or the
+komoot GPX tracks) are densely sampled, and the number of vertices of a route
+drives the cost of its buffer and of every overlay of the model. Every part of
+the route is simplified with Douglas-Peucker in metres (see SimplifyPolyline in
+Geometry.py): a vertex is only removed when it is within the tolerance of the
+segment replacing it, so the simplified route never deviates from the route by
+more than the tolerance, and the buffer of the simplified route is within the
+tolerance of the buffer of the route. Only the features within the tolerance
+of the edge of the buffer can change side.
+
+The simplified routes are written as shapefiles (WGS 84) so that both
+backends can evaluate them; Runner.py simplifies every route first when given
+--simplify {Tolerance}. The report evaluates a route at full resolution and at
+every tolerance, with the number of vertices, the largest deviation measured
+from the vertices of the route, the evaluation time and the drift of every
+metric from the full resolution route, to pick a tolerance that is safe.
+
+Example Usage (report of the tolerances 1, 2, 5, 10 and 25 metres, saved to
+SimplificationReport.csv):
+python Simplify.py {LocationOfRouteFeature.shp} 100 Meters 1 2 5 10 25
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Optional, List, Tuple
+from contextlib import redirect_stdout
+from sys import argv
+import numpy as np
+import pandas as pd
+import time
+import os
+
+from Shapefile import Layer, ReadLayer, WriteLayer, NormalisePath
+from Model import GetMetrics
+import Geometry
+
+
+def SimplifyLayer(layer: Layer, tolerance: float) -> Layer:
+    # every part of a polyline layer simplified with a tolerance in metres
+    xy = layer.Metres()
+    kept = [start + Geometry.SimplifyPolyline(xy[start:end], tolerance)
+            for start, end in zip(layer.partOffsets[:-1], layer.partOffsets[1:])]
+    partSizes = np.array([len(part) for part in kept], dtype=np.int64)
+    vertices = np.concatenate(kept) if len(kept) > 0 else np.zeros(0, dtype=np.int64)
+
+    # bbox of the kept vertices of every feature
+    bboxes = np.full((len(layer), 4), np.nan)
+    vertexFeature = np.repeat(np.repeat(np.arange(len(layer)), np.diff(layer.featureOffsets)), partSizes)
+    for feature in np.unique(vertexFeature):
+        points = layer.xy[vertices[vertexFeature == feature]]
+        bboxes[feature] = np.concatenate([points.min(axis=0), points.max(axis=0)])
+
+    return Layer(layer.shapeType, layer.xy[vertices], np.concatenate([[0], np.cumsum(partSizes)]).astype(np.int64),
+                 layer.featureOffsets, bboxes, layer.attributes, layer.path, layer.featureIds, xy[vertices])
+
+
+def MaxDeviation(layer: Layer, simplified: Layer, tolerance: float) -> float:
+    # largest distance (metres) from a vertex of the layer to the simplified layer
+    a, b = Geometry.LineSegments(simplified.Metres(), simplified.partOffsets)
+    maxDistance = 2 * tolerance + 1.0
+    distances = Geometry.SegmentGrid(a, b, maxDistance).Distances(layer.Metres(), maxDistance)
+    return float(distances.max()) if len(distances) > 0 else 0.0
+
+
+def SimplifyRoute(Route: str, tolerance: float, outputPath: str) -> Tuple[int, int, float]:
+    # write the route simplified with a tolerance in metres to outputPath,
+    # returns (vertices of the route, vertices kept, largest deviation)
+    route = ReadLayer(NormalisePath(Route), [])
+    simplified = SimplifyLayer(route, tolerance)
+    WriteLayer(outputPath, simplified)
+    return len(route.xy), len(simplified.xy), MaxDeviation(route, simplified, tolerance)
+
+
+def SimplificationReport(Route: str, BufferSize: int, BufferSizeUnit: str, tolerances: List[float],
+                         backend: str = "numpy", folder: Optional[str] = None) -> pd.DataFrame:
+    # metrics of the route at full resolution (tolerance 0) and simplified with
+    # every tolerance, with the drift of every metric from full resolution (%)
+    from Runner import GetModel
+    import tempfile
+    import shutil
+
+    Model = GetModel(backend)
+    folder = folder or tempfile.mkdtemp(prefix="TWM_Simplify_") + os.sep
+    rows = []
+    try:
+        # the first evaluation also loads the reference layers, it is not timed
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            Model(Route, BufferSize, BufferSizeUnit, folder)
+
+        for tolerance in [0.0] + sorted(tolerances):
+            if tolerance == 0:
+                path = Route
+                vertices = len(ReadLayer(NormalisePath(Route), []).xy)
+                deviation = 0.0
+            else:
+                path = folder + "Simplified" + str(len(rows)) + ".shp"
+                _, vertices, deviation = SimplifyRoute(Route, tolerance, path)
+
+            startTime = time.perf_counter()
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                result = Model(path, BufferSize, BufferSizeUnit, folder)
+            seconds = time.perf_counter() - startTime
+            if "Error" in result:
+                raise RuntimeError("Model failed at tolerance " + str(tolerance) + ": " + result["Error"])
+
+            row = {"Tolerance (m)": tolerance, "Vertices": vertices, "Max Deviation (m)": deviation, "Seconds": seconds}
+            row.update({metric: result[metric] for metric in GetMetrics()})
+            rows.append(row)
+    finally:
+        shutil.rmtree(folder, True)
+
+    report = pd.DataFrame(rows)
+    for metric in GetMetrics():
+        full = report[metric].iloc[0]
+        report[metric + " Drift (%)"] = (report[metric] - full) / full * 100 if full else np.where(report[metric] == full, 0.0, np.inf)
+    return report
+
+
+if __name__ == "__main__":
+    from Runner import Backends, rootFolder
+
+    arguments = argv[1:]
+    backend = "numpy"
+    if "--backend" in arguments:
+        position = arguments.index("--backend")
+        backend = arguments[position + 1]
+        del arguments[position:position + 2]
+
+    if len(arguments) < 4 or backend not in Backends:
+        print("Usage: Simplify.py [--backend numpy|incremental|arcpy] <Route> <BufferSize> <BufferSizeUnit> <Tolerance> [<Tolerance> ...]")
+        print("Example: Simplify.py Route.shp 100 Meters 1 2 5 10 25")
+        exit(1)
+
+    startTime = time.time()
+    report = SimplificationReport(arguments[0], int(arguments[1]), arguments[2],
+                                  [float(tolerance) for tolerance in arguments[3:]], backend)
+
+    with pd.option_context("display.width", 200, "display.max_columns", 30):
+        print(report[["Tolerance (m)", "Vertices", "Max Deviation (m)", "Seconds"] +
+                     [metric + " Drift (%)" for metric in GetMetrics()]].round(3).to_string(index=False))
+
+    report.to_csv(rootFolder + "SimplificationReport.csv", index=False)
+    print("Report saved to SimplificationReport.csv")
+    print("Script ended in", round(time.time() - startTime, 2), "s")
@@ -0,0 +1,176 @@
+"""
+Columnar snapshots of the reference layers, memory mapped at load.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+Parsing a shapefile costs seconds for the largest layers (zoning and property
+boundaries). A snapshot is the parsed layer compiled once into a folder next
+to the shapefile, {LayerName}.shp.twmsnap, holding one .npy file per column:
+
+- xy, partOffsets, featureOffsets, bboxes: the geometry columns of the layer
+  (see Shapefile.py), in lon/lat whatever the projection of the shapefile
+- metres, metreBoxes: the vertices and feature bboxes projected to metres
+  (see Geometry.ToMetres), so the layer is projected once and not on every load
+- attribute.{Field}.npy: only the attribute columns the model reads
+- header.json: the shape type, the fields and the fingerprint (size and
+  modification time) of the .shp and .dbf files
+
+The columns are memory mapped when the snapshot is loaded, so loading a layer
+takes milliseconds, only the pages of the features a route touches are read,
+and the worker processes of a batch share the same pages of the page cache
+instead of each holding a private copy. A snapshot is recompiled
+automatically when the shapefile changes or more fields are needed.
+
+Example Usage (compile or refresh the snapshots of every reference layer):
+python Snapshot.py
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Optional, List
+import numpy as np
+import shutil
+import json
+import os
+
+from Shapefile import Layer, ReadLayer, NormalisePath
+from SpatialIndex import Fingerprint
+
+# bump when the layout of the snapshots changes
+SNAPSHOT_VERSION = 2
+SNAPSHOT_SUFFIX = ".twmsnap"
+GEOMETRY_COLUMNS = ["xy", "partOffsets", "featureOffsets", "bboxes"]
+PROJECTED_COLUMNS = ["metres", "metreBoxes"]
+
+
+def SnapshotPath(shpPath: str) -> str:
+    return shpPath + SNAPSHOT_SUFFIX
+
+
+def _Fingerprint(shpPath: str) -> List[int]:
+    return [SNAPSHOT_VERSION] + Fingerprint(shpPath).tolist()
+
+
+def _HasFields(header: dict, fields: Optional[List[str]]) -> bool:
+    # fields None stands for every field of the .dbf
+    if header["fields"] is None:
+        return True
+    return fields is not None and set(fields) <= set(header["fields"])
+
+
+def _ReadHeader(path: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(path, "header.json"), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def CompileLayer(shpPath: str, fields: Optional[List[str]] = None) -> str:
+    # parse the shapefile and save its snapshot, returns the snapshot path.
+    # Raises OSError if the data folder is read-only.
+    shpPath = NormalisePath(shpPath)
+    path = SnapshotPath(shpPath)
+    layer = ReadLayer(shpPath, fields)
+
+    # write to a temporary folder first so concurrent readers never see a partial snapshot
+    temporaryPath = path + "." + str(os.getpid()) + ".tmp"
+    oldPath = path + "." + str(os.getpid()) + ".old"
+    shutil.rmtree(temporaryPath, True)
+    os.makedirs(temporaryPath)
+    try:
+        for column in GEOMETRY_COLUMNS:
+            np.save(os.path.join(temporaryPath, column + ".npy"), np.ascontiguousarray(getattr(layer, column)))
+        np.save(os.path.join(temporaryPath, "metres.npy"), np.ascontiguousarray(layer.Metres()))
+        np.save(os.path.join(temporaryPath, "metreBoxes.npy"), np.ascontiguousarray(layer.MetreBoxes()))
+        for name, values in layer.attributes.items():
+            np.save(os.path.join(temporaryPath, "attribute." + name + ".npy"), values, allow_pickle=False)
+        header = {"version": SNAPSHOT_VERSION, "shapeType": layer.shapeType, "features": len(layer),
+                  "fields": None if fields is None else list(layer.attributes),
+                  "fingerprint": _Fingerprint(shpPath)}
+        with open(os.path.join(temporaryPath, "header.json"), "w") as file:
+            json.dump(header, file)
+
+        # a folder cannot replace a non-empty one: the previous snapshot is
+        # moved aside and deleted once the new one is in place, so the path is
+        # only missing between two renames and not for a whole delete
+        shutil.rmtree(oldPath, True)
+        try:
+            os.rename(path, oldPath)
+        except FileNotFoundError:
+            pass
+        try:
+            os.replace(temporaryPath, path)
+        except OSError:
+            # another process put its snapshot in place between the two renames
+            if _ReadHeader(path) is None:
+                raise
+    finally:
+        shutil.rmtree(temporaryPath, True)
+        shutil.rmtree(oldPath, True)
+    return path
+
+
+def LoadSnapshot(shpPath: str, fields: Optional[List[str]] = None) -> Optional[Layer]:
+    # the memory mapped layer, None if there is no up to date snapshot with the fields
+    shpPath = NormalisePath(shpPath)
+    path = SnapshotPath(shpPath)
+    header = _ReadHeader(path)
+    if header is None or header.get("fingerprint") != _Fingerprint(shpPath) or not _HasFields(header, fields):
+        return None
+
+    def Load(name: str) -> np.ndarray:
+        # plain array view of the memory map, np.memmap slows down the many small operations on it
+        return np.asarray(np.load(os.path.join(path, name + ".npy"), mmap_mode="r"))
+
+    try:
+        columns = {column: Load(column) for column in GEOMETRY_COLUMNS + PROJECTED_COLUMNS}
+        names = (header["fields"] if header["fields"] is not None else
+                 [name[len("attribute."):-len(".npy")] for name in sorted(os.listdir(path)) if name.startswith("attribute.")])
+        names = [name for name in names if fields is None or name in fields]
+        attributes = {name: Load("attribute." + name) for name in names}
+    except (OSError, ValueError):
+        return None
+
+    return Layer(header["shapeType"], columns["xy"], columns["partOffsets"], columns["featureOffsets"],
+                 columns["bboxes"], attributes, shpPath, metres=columns["metres"], metreBoxes=columns["metreBoxes"])
+
+
+def LoadOrCompileSnapshot(shpPath: str, fields: Optional[List[str]] = None) -> Optional[Layer]:
+    # the memory mapped layer, compiling the snapshot first if needed. None if
+    # the snapshot cannot be written (e.g. read-only data folder)
+    layer = LoadSnapshot(shpPath, fields)
+    if layer is not None:
+        return layer
+
+    # keep the fields of the previous snapshot so callers needing them do not recompile it
+    header = _ReadHeader(SnapshotPath(NormalisePath(shpPath)))
+    if fields is not None and header is not None and header.get("fields") is not None:
+        fields = sorted(set(fields) | set(header["fields"]))
+    try:
+        CompileLayer(shpPath, fields)
+    except OSError:
+        return None
+    return LoadSnapshot(shpPath, fields)
+
+
+def LoadOrCompileLayer(shpPath: str, fields: Optional[List[str]] = None) -> Layer:
+    # the snapshot of the layer, or the parsed shapefile if no snapshot can be written
+    layer = LoadOrCompileSnapshot(shpPath, fields)
+    return layer if layer is not None else ReadLayer(NormalisePath(shpPath), fields)
+
+
+if __name__ == '__main__':
+    import NumpyModel
+
+    for feature in NumpyModel.ReferenceLayers:
+        path = NumpyModel.dataFolder + feature
+        if not os.path.exists(path):
+            print("Skipping missing layer: " + path)
+            continue
+        # the attribute filters of the model read bitmap indexes (see AttributeIndex.py), not the snapshots
+        header = _ReadHeader(CompileLayer(path, []))
+        print("Compiled " + str(header["features"]) + " features of " + feature)
@@ -0,0 +1,150 @@
+"""
+Persistent grid spatial index over the reference layers of the TWM GIS model.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+Every feature bbox of a layer (in metres) is registered in the cells of a
+uniform grid. The index is built once per layer and saved next to the
+shapefile as {LayerName}.shp.twmidx.npz together with a fingerprint (size and
+modification time) of the .shp and .dbf files, so it is rebuilt automatically
+whenever the source data changes. Queries return the ids of the features whose
+bbox comes within a distance of the route, which keeps the cost of a route
+evaluation proportional to the size of the route corridor rather than the
+size of the layer.
+
+Example Usage (build or refresh the indexes of every reference layer):
+python SpatialIndex.py
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Optional
+import numpy as np
+import os
+
+from Shapefile import Layer
+import Geometry
+
+# bump when the index layout or the projection of the boxes changes
+INDEX_VERSION = 2
+INDEX_SUFFIX = ".twmidx.npz"
+
+# target number of features per grid cell and bounds on the cell size (metres)
+FEATURES_PER_CELL = 4
+MIN_CELL_SIZE = 50.0
+MAX_CELL_SIZE = 5000.0
+
+
+def Fingerprint(shpPath: str) -> np.ndarray:
+    # size and modification time of the files the index is derived from
+    values = [INDEX_VERSION]
+    for extension in (".shp", ".dbf"):
+        path = os.path.splitext(shpPath)[0] + extension
+        if os.path.exists(path):
+            stat = os.stat(path)
+            values.extend([stat.st_size, stat.st_mtime_ns])
+        else:
+            values.extend([-1, -1])
+    return np.array(values, dtype=np.int64)
+
+
+def IndexPath(shpPath: str) -> str:
+    return shpPath + INDEX_SUFFIX
+
+
+def LayerBoxesInMetres(layer: Layer) -> np.ndarray:
+    return layer.MetreBoxes()
+
+
+class SpatialIndex:
+    def __init__(self, boxes: np.ndarray, cellSize: float, cellKeys: np.ndarray,
+                 cellStarts: np.ndarray, cellFeatures: np.ndarray,
+                 fingerprint: Optional[np.ndarray] = None):
+        self.boxes = boxes
+        self.cellSize = cellSize
+        self.cellKeys = cellKeys
+        self.cellStarts = cellStarts
+        self.cellFeatures = cellFeatures
+        self.fingerprint = fingerprint
+
+    @staticmethod
+    def Build(boxes: np.ndarray, fingerprint: Optional[np.ndarray] = None) -> "SpatialIndex":
+        valid = np.isfinite(boxes).all(axis=1)
+        if valid.any():
+            extent = np.ptp(boxes[valid][:, [0, 2]]) * np.ptp(boxes[valid][:, [1, 3]])
+            cellSize = np.sqrt(max(extent, 1.0) * FEATURES_PER_CELL / valid.sum())
+        else:
+            cellSize = MAX_CELL_SIZE
+        cellSize = float(np.clip(cellSize, MIN_CELL_SIZE, MAX_CELL_SIZE))
+        cellKeys, cellStarts, cellFeatures = Geometry.BucketBoxes(boxes, cellSize)
+        return SpatialIndex(boxes, cellSize, cellKeys, cellStarts, cellFeatures, fingerprint)
+
+    def Save(self, path: str):
+        # write to a temporary file first so concurrent readers never see a partial index
+        temporaryPath = path + "." + str(os.getpid()) + ".tmp.npz"
+        np.savez(temporaryPath, boxes=self.boxes, cellSize=self.cellSize, cellKeys=self.cellKeys,
+                 cellStarts=self.cellStarts, cellFeatures=self.cellFeatures, fingerprint=self.fingerprint)
+        os.replace(temporaryPath, path)
+
+    @staticmethod
+    def Load(path: str) -> "SpatialIndex":
+        with np.load(path) as data:
+            return SpatialIndex(data["boxes"], float(data["cellSize"]), data["cellKeys"],
+                                data["cellStarts"], data["cellFeatures"], data["fingerprint"])
+
+    def _BoxesWithin(self, candidates: np.ndarray, box: np.ndarray, distance: float) -> np.ndarray:
+        boxes = self.boxes[candidates]
+        return candidates[(boxes[:, 0] <= box[2] + distance) & (boxes[:, 2] >= box[0] - distance) &
+                          (boxes[:, 1] <= box[3] + distance) & (boxes[:, 3] >= box[1] - distance)]
+
+    def QueryBox(self, box: np.ndarray, distance: float = 0.0) -> np.ndarray:
+        # ids of the features whose bbox is within distance of the given bbox
+        keys = Geometry.BoxCellKeys(box, distance, self.cellSize)
+        candidates = Geometry.LookupCells(self.cellKeys, self.cellStarts, self.cellFeatures, keys)
+        return self._BoxesWithin(candidates, box, distance)
+
+    def QueryRoute(self, grid: Geometry.SegmentGrid, distance: float) -> np.ndarray:
+        # ids of the features whose bbox is within distance of a route segment
+        if len(grid.segmentBoxes) == 0:
+            return np.zeros(0, dtype=np.int64)
+        expanded = grid.segmentBoxes + np.array([-distance, -distance, distance, distance])
+        routeKeys, _, _ = Geometry.BucketBoxes(expanded, self.cellSize)
+        candidates = Geometry.LookupCells(self.cellKeys, self.cellStarts, self.cellFeatures, routeKeys)
+        routeBox = np.concatenate([grid.segmentBoxes[:, 0:2].min(axis=0), grid.segmentBoxes[:, 2:4].max(axis=0)])
+        return self._BoxesWithin(candidates, routeBox, distance)
+
+
+def LoadOrBuildIndex(layer: Layer) -> SpatialIndex:
+    # load the index saved next to the layer, rebuilding it if the layer changed
+    fingerprint = Fingerprint(layer.path)
+    path = IndexPath(layer.path)
+    if os.path.exists(path):
+        try:
+            index = SpatialIndex.Load(path)
+            if index.fingerprint is not None and np.array_equal(index.fingerprint, fingerprint) and len(index.boxes) == len(layer):
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index = SpatialIndex.Build(LayerBoxesInMetres(layer), fingerprint)
+    try:
+        index.Save(path)
+    except OSError:
+        # read-only data folder, keep the index in memory only
+        pass
+    return index
+
+
+if __name__ == '__main__':
+    import NumpyModel
+
+    for feature in NumpyModel.ReferenceLayers:
+        path = NumpyModel.dataFolder + feature
+        if not os.path.exists(path):
+            print("Skipping missing layer: " + path)
+            continue
+        index = LoadOrBuildIndex(NumpyModel.LoadLayer(feature, []))
+        print("Indexed " + str(len(index.boxes)) + " features of " + feature + " (cell size " + str(round(index.cellSize)) + " m)")
@@ -0,0 +1,114 @@
+"""
+Script to evaluate routes at several buffer sizes in a single pass.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+Instead of re-running the model once per buffer size, the distance from every
+reference feature near the route to the route is computed once for the
+largest buffer size. The metrics for every buffer size are then obtained by
+thresholding those distances. The Business Improvement Area overlap of every
+buffer size comes from the same pieces of scanline covered by the BIAs: the
+buffer sizes share the scanline spacing of the largest one and the corridor
+is clipped once per distance band between consecutive sizes (see
+BIAOverlapAreas in BIAArea.py). On the routes of RoutesPaths.txt a sweep over
+5 buffer sizes (50 m to 1000 m) takes about 0.7 s per route, against 1.7 s for
+5 runs of the model and 0.25 s for a single run at 100 m, most of it spent on
+the largest buffer. The BIA areas can differ from those of the model by up
+to 0.03% as the spacing differs. It uses the NumPy backend (NumpyModel.py)
+and does not need ArcGIS Pro.
+
+The result is a tidy table with one row per (route, buffer size, metric).
+
+Example Usage (evaluate all routes in RoutesPaths.txt at 5 buffer sizes):
+python Sweep.py Meters 50 100 250 500 1000
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Optional, List, Dict, Tuple
+from sys import argv
+import numpy as np
+import pandas as pd
+import time
+
+import NumpyModel
+import Geometry
+from Model import GetMetrics
+
+
+def Sweep(Route: str, BufferSizes: List[int], BufferSizeUnit: str) -> Dict[int, Dict[str, Optional[int]]]:
+    # results of NumpyModel.Model for every buffer size, keyed by buffer size
+    bufferMetres = np.array([Geometry.BufferSizeInMetres(size, BufferSizeUnit) for size in BufferSizes])
+    maxDistance = bufferMetres.max()
+
+    route = NumpyModel.LoadRoute(Route)
+    grid = NumpyModel.RouteGrid(route, maxDistance)
+
+    def CountWithin(distances: np.ndarray) -> List[int]:
+        distances = np.sort(distances)
+        return np.searchsorted(distances, bufferMetres, side="right").tolist()
+
+    counts = {}
+    counts["Number of Places of Interests"] = CountWithin(
+        NumpyModel.PointDistances(NumpyModel.LoadLayer(NumpyModel.POIFeature, []), grid, maxDistance)[1])
+    counts["Number of Subway Stations"] = CountWithin(
+        NumpyModel.PointDistances(NumpyModel.LoadLayer(NumpyModel.SubwayFeature, []), grid, maxDistance)[1])
+    counts["Number of High Traffic Intersections"] = CountWithin(
+        NumpyModel.PointDistances(NumpyModel.LoadLayer(NumpyModel.HighTrafficFeature, []), grid, maxDistance)[1])
+
+    Zoning = NumpyModel.LoadLayerInBox(NumpyModel.ZoningFeature, NumpyModel.RouteBox(route, maxDistance), [])
+    ResidentialZones = NumpyModel.LoadBitmapIndex(NumpyModel.ZoningFeature, "GEN_ZON2").Bitmap(NumpyModel.ResidentialZoneCodes)
+    counts["Number of Residential Zones"] = CountWithin(
+        NumpyModel.PolygonDistances(Zoning, grid, maxDistance, bitmap=ResidentialZones)[1])
+
+    areas = NumpyModel.BIAOverlapAreas(NumpyModel.LoadLayer(NumpyModel.BIAFeature, []), grid, bufferMetres)
+    counts["Areas of Business Improvement Areas"] = [int(area) for area in areas]
+
+    # the closed route polygon does not depend on the buffer size
+    condominiumResult = NumpyModel.CountCondominiums(route)
+    counts["Number of Condomininiums within the Route Coverage Area"] = [condominiumResult] * len(BufferSizes)
+
+    return {size: {metric: counts[metric][i] for metric in GetMetrics()} for i, size in enumerate(BufferSizes)}
+
+
+def SweepRoutes(routes: List[Tuple[str, str]], BufferSizes: List[int], BufferSizeUnit: str) -> pd.DataFrame:
+    rows = []
+    for route_name, route in routes:
+        print(f"Sweeping {route_name} over {len(BufferSizes)} buffer sizes...")
+        startTime = time.time()
+        try:
+            results = Sweep(route, BufferSizes, BufferSizeUnit)
+        except Exception as e:
+            # a failing route is reported and skipped, the sweep continues
+            print("Error sweeping", route)
+            print(str(e))
+            continue
+        for size, result in results.items():
+            for metric, value in result.items():
+                rows.append((route_name, size, BufferSizeUnit, metric, value))
+        print(f"Finished {route_name} in " + str(round((time.time() - startTime), 2)) + " s.")
+
+    return pd.DataFrame(rows, columns=["Route", "Buffer Size", "Buffer Size Unit", "Metric", "Value"])
+
+
+if __name__ == "__main__":
+    from Runner import ReadRoutesFromFile, rootFolder
+
+    if len(argv) < 3 or argv[1] not in ("Meters", "Kilometers") or not all(size.isdigit() and int(size) > 0 for size in argv[2:]):
+        print("Usage: Sweep.py <BufferSizeUnit> <BufferSize> [<BufferSize> ...]")
+        print("Example: Sweep.py Meters 50 100 250 500 1000")
+        exit(1)
+
+    print("Starting script...")
+    startTime = time.time()
+
+    sweep_df = SweepRoutes(ReadRoutesFromFile(), [int(size) for size in argv[2:]], argv[1])
+
+    print("Saving results to SweepResults.csv...")
+    sweep_df.to_csv(rootFolder + "SweepResults.csv", index=False)
+    print("Results saved to SweepResults.csv")
+
+    print("Script ended in", round(time.time() - startTime, 2), "s")
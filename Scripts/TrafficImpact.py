@@ -0,0 +1,478 @@
+"""
+Local estimator of the traffic impact of the road closures of a route.
+
+This script is created by the Toronto Waterfront Marathon (TWM) team to analyse
+and evaluate marathon routes against various criteria. It is a project conducted
+in collaboration with Tata Consultancy Services & Canada Running Series as
+part of the Multidisciplinary Urban Capstone Project (MUCP) at the University
+of Toronto.
+
+The Vehicle Delay, Stopped Delay and Emissions All columns of
+TWM-Turns-Elevation-Traffic-Modelling.csv come from an external traffic
+simulation, too expensive to repeat for every route (Proto 1.1 and 1.2 are
+left at the 9999 placeholder). This script estimates the same three metrics
+locally, from a road graph seeded with the above average car intersections:
+
+- the intersections are the nodes, linked to the next intersections of the
+  same streets (parsed from the location, i.e. "KINGSTON RD AT SANDOWN AVE")
+  and to their nearest intersections, with free flow times from the length of
+  the links and a stop delay at every intersection scaled by its mean_cars
+- a sample origin-destination demand (a gravity model weighted by mean_cars)
+  is routed once on the open graph, and the free flow paths are saved with the
+  graph next to the layer as {LayerName}.shp.twmgraph.npz, together with the
+  costs from LANDMARKS landmarks to every intersection
+- for a route, the links within the buffer of the route are closed, and only
+  the trips whose free flow path uses a closed link are routed again, with A*
+  guided by the landmark bounds (ALT), so no full Dijkstra is run per route
+
+The metrics are the mean over the trips of the demand of the extra minutes
+(Vehicle Delay), of the extra minutes stopped at intersections (Stopped Delay)
+and of the extra kg of CO2 of the longer and slower trips (Emissions All).
+Trips starting or ending inside the closures count as UNREACHABLE_DELAY_FACTOR
+times their free flow time. They are proxies of the simulation, comparable
+between routes but not with the simulated values, so the routes should be
+ranked with the estimates of every route (Ranking.py keeps the first value of
+every route, pass TrafficImpact.csv before the modelling csv file).
+
+Example Usage (estimate the traffic impact of every route in RoutesPaths.txt
+with a 100 metre buffer, saved to TrafficImpact.csv):
+python TrafficImpact.py 100 Meters
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import Optional, List, Dict, Tuple
+from sys import argv
+import numpy as np
+import pandas as pd
+import heapq
+import time
+import re
+import os
+
+from Shapefile import Layer
+from SpatialIndex import SpatialIndex, Fingerprint
+import NumpyModel
+import Geometry
+
+# bump when the way the graph or the demand is built changes
+GRAPH_VERSION = 1
+GRAPH_SUFFIX = ".twmgraph.npz"
+
+# nearest intersections every intersection is linked to, and the longest gap
+# (metres) between linked intersections of the same street
+GRAPH_NEIGHBOURS = 4
+MAX_STREET_GAP = 3000.0
+
+# ratio of the road distance to the straight distance of a link between
+# nearest intersections, the streets are taken as straight
+DETOUR_FACTOR = 1.3
+
+# free flow speeds (metres per minute) along the streets and across the
+# links between nearest intersections
+ARTERIAL_SPEED = 50 * 1000 / 60
+LOCAL_SPEED = 30 * 1000 / 60
+
+# minutes stopped at an intersection with the mean traffic, scaled by its mean_cars
+SIGNAL_DELAY = 0.5
+
+# landmarks of the A* bounds
+LANDMARKS = 16
+
+# sample demand: trips from DEMAND_ORIGINS origins, with destinations
+# decaying with the distance (metres) from the origin
+DEMAND_ORIGINS = 250
+DEMAND_TRIPS = 5000
+DEMAND_DECAY = 5000.0
+DemandSeed = 2024
+
+# delay of the trips with an end inside the closures, as a factor of their free flow time
+UNREACHABLE_DELAY_FACTOR = 2.0
+
+# emission proxies (kg of CO2) per vehicle km and per minute stopped
+EMISSIONS_PER_KM = 0.25
+EMISSIONS_PER_STOPPED_MINUTE = 0.03
+
+TrafficMetrics = ["Vehicle Delay", "Stopped Delay", "Emissions All"]
+
+# road graphs are kept for the lifetime of the process, built again when the
+# intersections layer changes
+_graphCache: Dict[str, "RoadGraph"] = {}
+
+
+def StreetNames(location: str) -> List[str]:
+    # streets of an intersection, i.e. "KINGSTON RD AT BROOKLAWN AVE & ST CLAIR AVE E (PX 150)"
+    location = re.sub(r"\(.*?\)", "", location)
+    return [name.strip() for name in re.split(r"\bAT\b|&", location) if name.strip()]
+
+
+def StreetLinks(points: np.ndarray, locations: np.ndarray) -> np.ndarray:
+    # (node, node) of the consecutive intersections of every street, in the
+    # order of their projection on the main axis of the street
+    streets: Dict[str, List[int]] = {}
+    for node, location in enumerate(locations):
+        for name in StreetNames(str(location)):
+            streets.setdefault(name, []).append(node)
+
+    links = []
+    for nodes in streets.values():
+        if len(nodes) < 2:
+            continue
+        nodes = np.array(nodes)
+        centred = points[nodes] - points[nodes].mean(axis=0)
+        axis = np.linalg.svd(centred, full_matrices=False)[2][0]
+        nodes = nodes[np.argsort(centred @ axis)]
+        gaps = np.hypot(*(points[nodes[1:]] - points[nodes[:-1]]).T)
+        keep = gaps <= MAX_STREET_GAP
+        links.append(np.stack([nodes[:-1][keep], nodes[1:][keep]], axis=1))
+    return np.concatenate(links) if len(links) > 0 else np.zeros((0, 2), dtype=np.int64)
+
+
+def NeighbourLinks(points: np.ndarray) -> np.ndarray:
+    # (node, node) of every intersection and its GRAPH_NEIGHBOURS nearest intersections
+    k = min(GRAPH_NEIGHBOURS, len(points) - 1)
+    if k <= 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    links = []
+    chunk = max(1, Geometry.MAX_MATRIX_SIZE // len(points))
+    for start in range(0, len(points), chunk):
+        distances = np.hypot(*(points[start:start + chunk, None, :] - points[None, :, :]).transpose(2, 0, 1))
+        distances[np.arange(len(distances)), np.arange(start, start + len(distances))] = np.inf
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        links.append(np.stack([np.repeat(np.arange(start, start + len(distances)), k), nearest.reshape(-1)], axis=1))
+    return np.concatenate(links)
+
+
+def _Components(nodes: int, edges: np.ndarray) -> np.ndarray:
+    # connected component of every node (union find)
+    parent = np.arange(nodes)
+
+    def Find(node: int) -> int:
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for u, v in edges:
+        rootU, rootV = Find(u), Find(v)
+        if rootU != rootV:
+            parent[rootU] = rootV
+    return np.array([Find(node) for node in range(nodes)])
+
+
+def BridgeLinks(points: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    # shortest links joining the components of the graph into one
+    bridges = []
+    components = _Components(len(points), edges)
+    while len(np.unique(components)) > 1:
+        labels, sizes = np.unique(components, return_counts=True)
+        inside = np.flatnonzero(components == labels[np.argmin(sizes)])
+        outside = np.flatnonzero(components != labels[np.argmin(sizes)])
+        distances = np.hypot(*(points[inside, None, :] - points[None, outside, :]).transpose(2, 0, 1))
+        i, j = np.unravel_index(np.argmin(distances), distances.shape)
+        bridges.append((inside[i], outside[j]))
+        components[components == components[inside[i]]] = components[outside[j]]
+    return np.array(bridges, dtype=np.int64).reshape(-1, 2)
+
+
+class RoadGraph:
+    def __init__(self, points: np.ndarray, stopMinutes: np.ndarray, edges: np.ndarray, lengths: np.ndarray,
+                 minutes: np.ndarray, landmarkCosts: np.ndarray, origins: np.ndarray, destinations: np.ndarray,
+                 baseCosts: np.ndarray, pathOffsets: np.ndarray, pathEdges: np.ndarray,
+                 fingerprint: Optional[np.ndarray] = None):
+        # intersections (metres) and their stop delay, links (node, node) with
+        # their length (metres) and free flow minutes, the landmark costs
+        # (landmarks x nodes) and the trips of the demand with the cost and
+        # links (CSR) of their free flow path
+        self.points = points
+        self.stopMinutes = stopMinutes
+        self.edges = edges
+        self.lengths = lengths
+        self.minutes = minutes
+        self.landmarkCosts = landmarkCosts
+        self.origins = origins
+        self.destinations = destinations
+        self.baseCosts = baseCosts
+        self.pathOffsets = pathOffsets
+        self.pathEdges = pathEdges
+        self.fingerprint = fingerprint
+
+        # half of the stop delay of both ends is paid along every link, so the
+        # costs stay symmetric and the landmark bounds hold in both directions
+        self.edgeStops = (stopMinutes[edges[:, 0]] + stopMinutes[edges[:, 1]]) / 2 if len(edges) > 0 else np.zeros(0)
+        self.costs = minutes + self.edgeStops
+        self._costList = self.costs.tolist()
+        self._adjacency: List[List[Tuple[int, int]]] = [[] for _ in range(len(points))]
+        for edge, (u, v) in enumerate(edges.tolist()):
+            self._adjacency[u].append((v, edge))
+            self._adjacency[v].append((u, edge))
+        self.index = SpatialIndex.Build(np.concatenate([np.minimum(points[edges[:, 0]], points[edges[:, 1]]),
+                                                        np.maximum(points[edges[:, 0]], points[edges[:, 1]])], axis=1))
+
+    @staticmethod
+    def Build(layer: Layer, fingerprint: Optional[np.ndarray] = None) -> "RoadGraph":
+        points = layer.Points(metres=True)
+        valid = np.isfinite(points).all(axis=1)
+        points = points[valid]
+        cars = pd.to_numeric(pd.Series(layer.attributes["mean_cars"][valid]), errors="coerce").to_numpy(dtype=float)
+        cars = np.where(np.isfinite(cars) & (cars > 0), cars, np.nanmean(cars[cars > 0]) if (cars > 0).any() else 1.0)
+        stopMinutes = SIGNAL_DELAY * cars / cars.mean()
+
+        # street links first so that a link on a street keeps the arterial speed
+        street = StreetLinks(points, layer.attributes["location"][valid])
+        local = NeighbourLinks(points)
+        edges = np.sort(np.concatenate([street, local]), axis=1)
+        arterial = np.concatenate([np.ones(len(street), dtype=bool), np.zeros(len(local), dtype=bool)])
+        keep = edges[:, 0] != edges[:, 1]
+        edges, arterial = edges[keep], arterial[keep]
+        _, first = np.unique(edges, axis=0, return_index=True)
+        edges, arterial = edges[first], arterial[first]
+        bridges = BridgeLinks(points, edges)
+        edges = np.concatenate([edges, np.sort(bridges, axis=1)])
+        arterial = np.concatenate([arterial, np.zeros(len(bridges), dtype=bool)])
+
+        straight = np.hypot(*(points[edges[:, 1]] - points[edges[:, 0]]).T)
+        lengths = np.where(arterial, straight, straight * DETOUR_FACTOR)
+        minutes = lengths / np.where(arterial, ARTERIAL_SPEED, LOCAL_SPEED)
+
+        empty = np.zeros(0, dtype=np.int64)
+        graph = RoadGraph(points, stopMinutes, edges, lengths, minutes, np.zeros((0, len(points))),
+                          empty, empty, np.zeros(0), np.zeros(1, dtype=np.int64), empty, fingerprint)
+        graph.landmarkCosts = graph.Landmarks(LANDMARKS)
+        graph.origins, graph.destinations = SampleDemand(points, cars)
+        graph.baseCosts, graph.pathOffsets, graph.pathEdges = graph.FreeFlowPaths()
+        return graph
+
+    def Save(self, path: str):
+        # write to a temporary file first so concurrent readers never see a partial graph
+        temporaryPath = path + "." + str(os.getpid()) + ".tmp.npz"
+        np.savez(temporaryPath, points=self.points, stopMinutes=self.stopMinutes, edges=self.edges,
+                 lengths=self.lengths, minutes=self.minutes, landmarkCosts=self.landmarkCosts,
+                 origins=self.origins, destinations=self.destinations, baseCosts=self.baseCosts,
+                 pathOffsets=self.pathOffsets, pathEdges=self.pathEdges, fingerprint=self.fingerprint)
+        os.replace(temporaryPath, path)
+
+    @staticmethod
+    def Load(path: str) -> "RoadGraph":
+        with np.load(path) as data:
+            return RoadGraph(data["points"], data["stopMinutes"], data["edges"], data["lengths"], data["minutes"],
+                             data["landmarkCosts"], data["origins"], data["destinations"], data["baseCosts"],
+                             data["pathOffsets"], data["pathEdges"], data["fingerprint"])
+
+    def Search(self, source: int, target: int = -1, closed: Optional[set] = None,
+               heuristic: Optional[List[float]] = None) -> Tuple[List[float], List[int]]:
+        # (cost, link to the previous node) of the nodes from source, avoiding
+        # the closed links. With a target, A* stops once the target is settled.
+        costs = [np.inf] * len(self.points)
+        previous = [-1] * len(self.points)
+        costs[source] = 0.0
+        heap = [(heuristic[source] if heuristic else 0.0, 0.0, source)]
+        adjacency, edgeCosts = self._adjacency, self._costList
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if cost > costs[node]:
+                continue
+            if node == target:
+                break
+            for neighbour, edge in adjacency[node]:
+                if closed and edge in closed:
+                    continue
+                newCost = cost + edgeCosts[edge]
+                if newCost < costs[neighbour]:
+                    costs[neighbour] = newCost
+                    previous[neighbour] = edge
+                    heapq.heappush(heap, (newCost + (heuristic[neighbour] if heuristic else 0.0), newCost, neighbour))
+        return costs, previous
+
+    def PathEdges(self, previous: List[int], target: int) -> List[int]:
+        # links of the path ending at target, from the links to the previous nodes
+        path = []
+        node = target
+        while previous[node] >= 0:
+            edge = previous[node]
+            path.append(edge)
+            u, v = self.edges[edge]
+            node = u if v == node else v
+        return path[::-1]
+
+    def Landmarks(self, count: int) -> np.ndarray:
+        # costs from count landmarks to every node, each landmark the node the
+        # furthest from the landmarks before it
+        landmarks = [int(np.argmax(np.hypot(*(self.points - self.points.mean(axis=0)).T)))]
+        costs = [np.array(self.Search(landmarks[0])[0])]
+        while len(costs) < min(count, len(self.points)):
+            nearest = np.min(costs, axis=0)
+            landmark = int(np.argmax(np.where(np.isfinite(nearest), nearest, -1)))
+            if landmark in landmarks:
+                break
+            landmarks.append(landmark)
+            costs.append(np.array(self.Search(landmark)[0]))
+        return np.array(costs)
+
+    def Heuristic(self, target: int) -> List[float]:
+        # lower bound on the cost from every node to target (triangle
+        # inequality on the landmarks). Closing links only makes the costs
+        # longer, so the bound of the open graph holds for every route.
+        return np.abs(self.landmarkCosts[:, target][:, None] - self.landmarkCosts).max(axis=0).tolist()
+
+    def FreeFlowPaths(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # (cost, path offsets, path links) of every trip on the open graph,
+        # one full search per origin
+        costs = np.zeros(len(self.origins))
+        paths = []
+        for origin in np.unique(self.origins):
+            searchCosts, previous = self.Search(int(origin))
+            for trip in np.flatnonzero(self.origins == origin):
+                costs[trip] = searchCosts[self.destinations[trip]]
+                paths.append((trip, self.PathEdges(previous, int(self.destinations[trip]))))
+        paths.sort()
+        pathOffsets = np.concatenate([[0], np.cumsum([len(path) for _, path in paths])]).astype(np.int64)
+        pathEdges = np.array([edge for _, path in paths for edge in path], dtype=np.int64)
+        return costs, pathOffsets, pathEdges
+
+    def ClosedEdges(self, grid: Geometry.SegmentGrid, bufferMetres: float) -> np.ndarray:
+        # ids of the links within bufferMetres of the route
+        closed = []
+        for edge in self.index.QueryRoute(grid, bufferMetres):
+            segments = grid.SegmentsNearBox(self.index.boxes[edge], bufferMetres)
+            u, v = self.edges[edge]
+            if len(segments) > 0 and Geometry.SegmentSegmentDistance(
+                    self.points[u:u + 1], self.points[v:v + 1], grid.a[segments], grid.b[segments]) <= bufferMetres:
+                closed.append(edge)
+        return np.array(closed, dtype=np.int64)
+
+
+def SampleDemand(points: np.ndarray, cars: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # (origin, destination) of every trip: origins drawn by mean_cars, and
+    # destinations by mean_cars decaying with the distance from the origin
+    rng = np.random.default_rng(DemandSeed)
+    weights = cars / cars.sum()
+    origins = rng.choice(len(points), min(DEMAND_ORIGINS, len(points)), replace=False, p=weights)
+    trips = np.array_split(np.arange(DEMAND_TRIPS), len(origins))
+    tripOrigins, tripDestinations = [], []
+    for origin, originTrips in zip(origins, trips):
+        attraction = weights * np.exp(-np.hypot(*(points - points[origin]).T) / DEMAND_DECAY)
+        attraction[origin] = 0.0
+        if attraction.sum() <= 0:
+            continue
+        tripOrigins.append(np.full(len(originTrips), origin))
+        tripDestinations.append(rng.choice(len(points), len(originTrips), p=attraction / attraction.sum()))
+    return np.concatenate(tripOrigins).astype(np.int64), np.concatenate(tripDestinations).astype(np.int64)
+
+
+def GraphPath(shpPath: str) -> str:
+    return shpPath + GRAPH_SUFFIX
+
+
+def LoadOrBuildGraph(relativePath: str = NumpyModel.HighTrafficFeature) -> RoadGraph:
+    # the road graph saved next to the intersections layer, rebuilt when the layer changes
+    shpPath = NumpyModel.dataFolder + relativePath
+    fingerprint = np.append(Fingerprint(shpPath), GRAPH_VERSION)
+    if shpPath in _graphCache and np.array_equal(_graphCache[shpPath].fingerprint, fingerprint):
+        return _graphCache[shpPath]
+
+    path = GraphPath(shpPath)
+    graph = None
+    if os.path.exists(path):
+        try:
+            graph = RoadGraph.Load(path)
+            if graph.fingerprint is None or not np.array_equal(graph.fingerprint, fingerprint):
+                graph = None
+        except (OSError, ValueError, KeyError):
+            graph = None
+
+    if graph is None:
+        graph = RoadGraph.Build(NumpyModel.LoadLayer(relativePath, ["location", "mean_cars"]), fingerprint)
+        try:
+            graph.Save(path)
+        except OSError:
+            # read-only data folder, keep the graph in memory only
+            pass
+    _graphCache[shpPath] = graph
+    return graph
+
+
+def TrafficImpact(Route: str, BufferSize: int, BufferSizeUnit: str, graph: Optional[RoadGraph] = None) -> Dict[str, float]:
+    # traffic metrics of the closures of the route (see the module docstring)
+    graph = graph or LoadOrBuildGraph()
+    bufferMetres = Geometry.BufferSizeInMetres(BufferSize, BufferSizeUnit)
+    grid = NumpyModel.RouteGrid(NumpyModel.LoadRoute(Route), bufferMetres)
+    closedEdges = graph.ClosedEdges(grid, bufferMetres)
+    closed = set(closedEdges.tolist())
+
+    # only the trips whose free flow path uses a closed link change
+    isClosed = np.zeros(len(graph.edges), dtype=bool)
+    isClosed[closedEdges] = True
+    pathLengths = np.diff(graph.pathOffsets)
+    affected = np.zeros(len(graph.origins), dtype=bool)
+    hasPath = pathLengths > 0
+    affected[hasPath] = np.logical_or.reduceat(isClosed[graph.pathEdges], graph.pathOffsets[:-1][hasPath]) if len(graph.pathEdges) > 0 else False
+
+    delay, stopped, emissions = np.zeros(len(graph.origins)), np.zeros(len(graph.origins)), np.zeros(len(graph.origins))
+    unreachable = 0
+    heuristics: Dict[int, List[float]] = {}
+    for trip in np.flatnonzero(affected):
+        origin, destination = int(graph.origins[trip]), int(graph.destinations[trip])
+        basePath = graph.pathEdges[graph.pathOffsets[trip]:graph.pathOffsets[trip + 1]]
+        baseStops = graph.edgeStops[basePath].sum()
+        if destination not in heuristics:
+            heuristics[destination] = graph.Heuristic(destination)
+        costs, previous = graph.Search(origin, destination, closed, heuristics[destination])
+        if not np.isfinite(costs[destination]):
+            # an end of the trip is cut off by the closures
+            unreachable += 1
+            delay[trip] = UNREACHABLE_DELAY_FACTOR * graph.baseCosts[trip]
+            stopped[trip] = UNREACHABLE_DELAY_FACTOR * baseStops
+            emissions[trip] = stopped[trip] * EMISSIONS_PER_STOPPED_MINUTE
+            continue
+        path = np.array(graph.PathEdges(previous, destination), dtype=np.int64)
+        delay[trip] = costs[destination] - graph.baseCosts[trip]
+        stopped[trip] = graph.edgeStops[path].sum() - baseStops
+        emissions[trip] = ((graph.lengths[path].sum() - graph.lengths[basePath].sum()) / 1000 * EMISSIONS_PER_KM
+                           + stopped[trip] * EMISSIONS_PER_STOPPED_MINUTE)
+
+    return {"Vehicle Delay": float(delay.mean()), "Stopped Delay": float(stopped.mean()),
+            "Emissions All": float(emissions.mean()), "Closed Links": len(closedEdges),
+            "Rerouted Trips": int(np.count_nonzero(affected)) - unreachable, "Unreachable Trips": unreachable}
+
+
+def TrafficImpactRoutes(routes: List[Tuple[str, str]], BufferSize: int, BufferSizeUnit: str) -> pd.DataFrame:
+    graph = LoadOrBuildGraph()
+    rows = {}
+    for route_name, route in routes:
+        print(f"Estimating the traffic impact of {route_name}...")
+        startTime = time.time()
+        try:
+            result = TrafficImpact(route, BufferSize, BufferSizeUnit, graph)
+        except Exception as e:
+            # a failing route is reported and skipped, the batch continues
+            print("Error estimating", route)
+            print(str(e))
+            continue
+        rows[route_name] = result
+        print(f"Finished {route_name} in " + str(round((time.time() - startTime), 2)) + " s: " +
+              str(result["Closed Links"]) + " links closed, " + str(result["Rerouted Trips"]) + " trips rerouted, " +
+              str(result["Unreachable Trips"]) + " trips cut off.")
+
+    return pd.DataFrame.from_dict(rows, orient="index").rename_axis("Route")
+
+
+if __name__ == "__main__":
+    from Runner import ReadRoutesFromFile, rootFolder
+
+    if len(argv) < 3 or not argv[1].isdigit() or argv[2] not in ("Meters", "Kilometers"):
+        print("Usage: TrafficImpact.py <BufferSize> <BufferSizeUnit> [<Route> ...]")
+        print("Example: TrafficImpact.py 100 Meters")
+        exit(1)
+
+    print("Starting script...")
+    startTime = time.time()
+
+    # the routes given as arguments, or every route of RoutesPaths.txt
+    routes = [(route, route) for route in argv[3:]] or ReadRoutesFromFile()
+    impact_df = TrafficImpactRoutes(routes, int(argv[1]), argv[2])
+
+    print("Saving results to TrafficImpact.csv...")
+    impact_df[TrafficMetrics].round(3).to_csv(rootFolder + "TrafficImpact.csv")
+    print("Results saved to TrafficImpact.csv")
+
+    print("Script ended in", round(time.time() - startTime, 2), "s")
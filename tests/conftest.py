@@ -0,0 +1,46 @@
+"""
+Shared set up of the tests of the scripts.
+
+The scripts import each other from the Scripts folder, which is added to the
+path here. The tests are run with pytest from the root of the repository
+(i.e. `python -m pytest tests`), the tests on the routes of RoutesPaths.txt
+are skipped when the Data folder is not there. The other tests run on small
+synthetic layers and routes generated with Benchmark.py.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from typing import List, Tuple
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Scripts"))
+
+import Benchmark
+import NumpyModel
+import ResultCache
+
+# number of features of the synthetic layers and routes (see BenchmarkScales in Benchmark.py)
+SyntheticScale = {"poi": 150, "subway": 40, "intersections": 400, "zoning": 600, "bia": 20,
+                  "property": 3000, "routes": 2, "routeVertices": 400}
+
+
+@pytest.fixture(autouse=True)
+def cacheFolder(tmp_path, monkeypatch) -> str:
+    # keep the entries of ResultCache.py and Incremental.py out of the Cache folder of the repository
+    folder = str(tmp_path) + os.sep + "Cache" + os.sep
+    monkeypatch.setattr(ResultCache, "cacheFolder", folder)
+    return folder
+
+
+@pytest.fixture
+def syntheticRoutes(tmp_path, monkeypatch) -> List[Tuple[str, str]]:
+    # (name, path) of synthetic routes, with the synthetic layers as the Data folder
+    rng = np.random.default_rng(Benchmark.BenchmarkSeed)
+    folder = str(tmp_path) + os.sep + "Data" + os.sep
+    Benchmark.GenerateLayers(folder, SyntheticScale, rng)
+    routes, _ = Benchmark.GenerateRoutes(folder, SyntheticScale, rng)
+    monkeypatch.setattr(NumpyModel, "dataFolder", folder)
+    return routes
@@ -0,0 +1,101 @@
+"""
+Checks of the layer-major batches of BatchModel.py: parity with the results of
+the arcpy model (Results.csv) and with NumpyModel.py route by route, one load
+of the condominiums for the whole batch, and the errors of a step or of a
+route kept to the routes they belong to.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import os
+
+import pandas as pd
+import pytest
+
+import BatchModel
+import NumpyModel
+from Model import GetMetrics
+from Runner import ReadRoutesFromFile
+
+# metrics computed exactly by every backend
+ExactMetrics = ["Number of Places of Interests",
+                "Number of Subway Stations",
+                "Number of High Traffic Intersections"]
+
+CondominiumMetric = "Number of Condomininiums within the Route Coverage Area"
+
+Routes = ReadRoutesFromFile() if os.path.isdir(NumpyModel.dataFolder) else []
+
+requiresData = pytest.mark.skipif(not all(os.path.exists(path) for _, path in Routes) or len(Routes) == 0,
+                                  reason="the Data folder with the routes is not available")
+
+
+@pytest.fixture(scope="module")
+def expected() -> pd.DataFrame:
+    return pd.read_csv(os.path.join(NumpyModel.rootFolder, "Results.csv"), index_col=0)
+
+
+@requiresData
+def test_batch_matches_results(expected):
+    results = BatchModel.BatchModel([path for _, path in Routes], 100, "Meters", ExactMetrics)
+    for (name, _), result in zip(Routes, results):
+        assert {metric: result[metric] for metric in ExactMetrics} == expected.loc[name, ExactMetrics].to_dict()
+
+
+@requiresData
+def test_batch_reports_unreadable_route(expected):
+    name, path = Routes[0]
+    results = BatchModel.BatchModel([path, path + ".missing.shp"], 100, "Meters", ExactMetrics)
+    assert {metric: results[0][metric] for metric in ExactMetrics} == expected.loc[name, ExactMetrics].to_dict()
+    assert "Error" in results[1]
+
+
+@pytest.mark.parametrize("within", [False, True])
+def test_batch_matches_route_by_route(syntheticRoutes, within):
+    paths = [path for _, path in syntheticRoutes]
+    results = BatchModel.BatchModel(paths, 500, "Meters", CondominiumWithin=within)
+    for path, result in zip(paths, results):
+        expected = NumpyModel.Model(path, 500, "Meters", CondominiumWithin=within)
+        assert {metric: result[metric] for metric in GetMetrics()} == {metric: expected[metric] for metric in GetMetrics()}
+
+
+def test_condominiums_are_loaded_once_per_batch(syntheticRoutes, monkeypatch):
+    loads = []
+    LoadLayerInBox = NumpyModel.LoadLayerInBox
+    monkeypatch.setattr(NumpyModel, "LoadLayerInBox",
+                        lambda relativePath, *args: loads.append(relativePath) or LoadLayerInBox(relativePath, *args))
+    paths = [path for _, path in syntheticRoutes] * 3
+    BatchModel.BatchModel(paths, 100, "Meters", [CondominiumMetric], CondominiumWithin=True)
+    assert loads == [NumpyModel.PropertyFeature]
+
+
+def test_failing_step_keeps_the_other_metrics(syntheticRoutes, monkeypatch):
+    def FailingAreas(*args):
+        raise ValueError("no BIA")
+    monkeypatch.setattr(BatchModel, "BIAAreas", FailingAreas)
+    paths = [path for _, path in syntheticRoutes]
+    for path, result in zip(paths, BatchModel.BatchModel(paths, 100, "Meters")):
+        expected = NumpyModel.Model(path, 100, "Meters")
+        assert result["Error"] == "no BIA"
+        assert "Areas of Business Improvement Areas" not in result
+        for metric in GetMetrics():
+            if metric != "Areas of Business Improvement Areas":
+                assert result[metric] == expected[metric]
+
+
+@pytest.mark.parametrize("within", [False, True])
+def test_failing_route_keeps_the_other_routes(syntheticRoutes, monkeypatch, within):
+    (_, path), (_, otherPath) = syntheticRoutes[:2]
+    failing = NumpyModel.LoadRoute(otherPath).path
+    ClosedRoutePolygon = NumpyModel.ClosedRoutePolygon
+
+    def FailingPolygon(route):
+        if route.path == failing:
+            raise ValueError("open route")
+        return ClosedRoutePolygon(route)
+    monkeypatch.setattr(NumpyModel, "ClosedRoutePolygon", FailingPolygon)
+
+    first, second = BatchModel.BatchModel([path, otherPath], 100, "Meters", CondominiumWithin=within)
+    assert "Error" not in first and first[CondominiumMetric] is not None
+    assert second["Error"] == "open route"
+    assert CondominiumMetric not in second
+    assert all(metric in second for metric in GetMetrics() if metric != CondominiumMetric)
@@ -0,0 +1,117 @@
+"""
+Checks of the course search of CourseSearch.py: the segment library found from
+routes with detours from the baseline, the courses built from it, the scores
+against Rank (see Ranking.py) and a search on the synthetic routes.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import CourseSearch
+import Geometry
+import NumpyModel
+import Ranking
+from Model import GetMetrics
+from Shapefile import Layer, WriteLayer
+
+# runs of vertices of the baseline moved aside by the routes (first vertex, last vertex, metres)
+DetourVertices = [(100, 110, 40.0), (250, 262, -40.0)]
+
+
+def DetourRoute(baseline: Layer, path: str, detours) -> str:
+    # the baseline with the runs of vertices moved aside, the other vertices
+    # keep their lon/lat so they stay on the baseline
+    metres = baseline.Metres()
+    lonlat = baseline.xy.copy()
+    for first, last, offset in detours:
+        tangents = metres[first + 1:last + 2] - metres[first - 1:last]
+        normals = tangents[:, ::-1] * [1.0, -1.0] / np.hypot(*tangents.T)[:, None]
+        lonlat[first:last + 1] = Geometry.ToLonLat(metres[first:last + 1] + offset * normals)
+    WriteLayer(path, Layer(baseline.shapeType, lonlat, baseline.partOffsets, baseline.featureOffsets,
+                           np.concatenate([lonlat.min(axis=0), lonlat.max(axis=0)])[None, :], {}))
+    return path
+
+
+@pytest.fixture
+def detourRoutes(syntheticRoutes, tmp_path):
+    # (name, path) of the baseline and of routes making each detour, the first
+    # detour drawn on two routes
+    name, path = syntheticRoutes[0]
+    baseline = NumpyModel.LoadRoute(path)
+    return [(name, path)] + [("Detour " + str(number + 1), DetourRoute(baseline, str(tmp_path / ("Detour" + str(number + 1) + ".shp")), [detour]))
+                             for number, detour in enumerate(DetourVertices + DetourVertices[:1])]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_longest_non_decreasing(seed):
+    values = np.random.default_rng(seed).integers(0, 6, 9).astype(float)
+    positions = CourseSearch.LongestNonDecreasing(values)
+    assert (np.diff(positions) > 0).all() and (np.diff(values[positions]) >= 0).all()
+    longest = max(length for length in range(len(values) + 1) for subset in itertools.combinations(values, length)
+                  if (np.diff(subset) >= 0).all())
+    assert len(positions) == longest
+
+
+def test_swap_library_finds_the_detours(detourRoutes):
+    baseline = NumpyModel.LoadRoute(detourRoutes[0][1])
+    routes = [(name, NumpyModel.LoadRoute(path)) for name, path in detourRoutes[1:]]
+    swaps = CourseSearch.SwapLibrary(baseline, routes)
+    # the detour drawn twice is kept once
+    assert [swap.name for swap in swaps] == ["Detour 1 #1", "Detour 2 #1"]
+    for swap, (first, last, _), (_, route) in zip(swaps, DetourVertices, routes):
+        assert first - 2 <= swap.firstSegment < first and last <= swap.lastSegment <= last + 1
+        # the baseline with the swap is the route
+        course = CourseSearch.BuildCourse(baseline, [swap])
+        assert np.isclose(CourseSearch.PathLength(course.Metres()), CourseSearch.PathLength(route.Metres()), atol=1e-3)
+        assert np.isclose(swap.lengthChange, CourseSearch.PathLength(route.Metres()) - CourseSearch.PathLength(baseline.Metres()))
+
+    # the baseline alone has no detour
+    assert CourseSearch.SwapLibrary(baseline, [("Baseline", baseline)]) == []
+
+
+def test_extensions_do_not_overlap():
+    swaps = [CourseSearch.Swap(str(number), first, last, np.zeros((0, 2)), np.zeros((0, 2)), 0.0)
+             for number, (first, last) in enumerate([(10, 20), (15, 30), (40, 50), (5, 8)])]
+    assert CourseSearch.Extensions((), swaps) == [(0,), (1,), (2,), (3,)]
+    assert CourseSearch.Extensions((0,), swaps) == [(0, 2), (3, 0)]
+    assert CourseSearch.Extensions((3, 0, 2), swaps) == []
+
+
+def test_overall_scores_match_rank():
+    metrics = GetMetrics()
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 8, size=(8, len(metrics))).astype(float)
+    weights = rng.uniform(0.2, 2.0, len(metrics))
+    df = pd.DataFrame(values, columns=metrics, index=pd.Index(["Route " + str(route) for route in range(8)], name="Route"))
+    df.loc["weight"] = weights
+    # the minimizing metrics are ranked on their negative values, as by Ranking.py
+    expected = Ranking.Rank(Ranking.ConvertToMaximizingMetrics(df))["Overall Weighted Score"].to_numpy()
+    assert np.allclose(CourseSearch.OverallScores(values, weights, metrics), expected)
+
+
+def test_search_reports_the_courses_within_the_length(detourRoutes, tmp_path):
+    results, variants, courses = CourseSearch.CourseSearch(250, "Meters", detourRoutes, candidates=100, beamWidth=4)
+    # every course of the library within LENGTH_TOLERANCE once the baseline is scaled to MARATHON_LENGTH
+    baseline = NumpyModel.LoadRoute(detourRoutes[0][1])
+    swaps = CourseSearch.SwapLibrary(baseline, [(name, NumpyModel.LoadRoute(path)) for name, path in detourRoutes[1:]])
+    baseLength = CourseSearch.PathLength(baseline.Metres())
+    expected = [" + ".join(swap.name for swap in state) or "Baseline"
+                for length in range(len(swaps) + 1) for state in itertools.combinations(swaps, length)
+                if abs((baseLength + sum(swap.lengthChange for swap in state)) * CourseSearch.MARATHON_LENGTH / baseLength
+                       - CourseSearch.MARATHON_LENGTH) <= CourseSearch.LENGTH_TOLERANCE]
+    assert sorted(variants["Swaps"]) == sorted(expected) and len(expected) > 1
+    assert (np.abs(variants["Length (m)"] - CourseSearch.MARATHON_LENGTH) <= CourseSearch.LENGTH_TOLERANCE).all()
+    assert variants["Overall Weighted Score"].is_monotonic_decreasing
+    assert list(results.index) == [name for name, _ in detourRoutes] + list(variants.index) + ["weight"]
+
+    for name, course in courses.items():
+        path = str(tmp_path / (name.replace(" ", "-") + ".shp"))
+        WriteLayer(path, course)
+        expected = NumpyModel.Model(path, 250, "Meters")
+        assert {metric: results.loc[name, metric] for metric in GetMetrics()} == {metric: expected[metric] for metric in GetMetrics()}
+    variant, = variants.index[variants["Swaps"] == "Baseline"]
+    assert results.loc[variant].equals(results.loc[detourRoutes[0][0]].rename(variant))
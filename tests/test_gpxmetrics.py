@@ -0,0 +1,116 @@
+"""
+Checks of the turn and elevation metrics of GpxMetrics.py on synthetic tracks,
+and of their agreement with the hand counted values of
+TWM-Turns-Elevation-Traffic-Modelling.csv on the GPX tracks of the routes.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import Geometry
+import GpxMetrics
+from Runner import ReadRoutesFromFile, rootFolder
+
+
+def WriteGpx(path: str, xy: np.ndarray, elevation: np.ndarray):
+    # GPX track of the points (metres), an elevation of NaN is left out
+    lonlat = Geometry.ToLonLat(xy)
+    with open(path, "w") as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1"><trk><trkseg>\n')
+        for (lon, lat), value in zip(lonlat, elevation):
+            file.write('<trkpt lat="' + repr(float(lat)) + '" lon="' + repr(float(lon)) + '">' +
+                       ("" if np.isnan(value) else "<ele>" + repr(float(value)) + "</ele>") + "</trkpt>\n")
+        file.write("</trkseg></trk></gpx>\n")
+
+
+def Polyline(*corners) -> np.ndarray:
+    # points every 10 metres along the straight lines between the corners
+    parts = []
+    for start, end in zip(corners[:-1], corners[1:]):
+        count = max(int(np.hypot(end[0] - start[0], end[1] - start[1]) // 10), 1)
+        parts.append(np.linspace(start, end, count, endpoint=False))
+    return np.concatenate(parts + [np.array([corners[-1]], dtype=float)])
+
+
+def test_read_track_in_chunks(tmp_path, monkeypatch):
+    xy = Polyline((0, 0), (1000, 0))
+    elevation = np.linspace(80, 90, len(xy))
+    elevation[[3, 50]] = np.nan
+    WriteGpx(str(tmp_path / "Track.gpx"), xy, elevation)
+    monkeypatch.setattr(GpxMetrics, "READ_CHUNK_SIZE", 64)
+    lonlat, read = GpxMetrics.ReadTrack(str(tmp_path / "Track.gpx"))
+    assert np.allclose(Geometry.ToMetres(lonlat), xy, atol=1e-4)
+    assert np.array_equal(np.isnan(read), np.isnan(elevation))
+    assert np.allclose(read[~np.isnan(read)], elevation[~np.isnan(elevation)])
+
+
+def test_corners_and_u_turns(tmp_path):
+    # 3 right angle corners, then a U-turn back along the last street
+    xy = Polyline((0, 0), (1000, 0), (1000, 1000), (0, 1000), (0, 2000), (0, 1200))
+    WriteGpx(str(tmp_path / "Track.gpx"), xy, np.full(len(xy), 80.0))
+    result = GpxMetrics.TrackMetrics(str(tmp_path / "Track.gpx"))
+    assert result == {"Wide Turns": 3, "Sharp Turns": 1, "Elevation Gain": 0}
+
+
+def test_short_spurs_are_removed(tmp_path):
+    # a 40 metre out and back spur in the middle of a straight street is not a
+    # turn, a turnaround after 500 metres is
+    spur = Polyline((0, 0), (1000, 0), (1000, 40), (1000, 0), (2000, 0))
+    WriteGpx(str(tmp_path / "Spur.gpx"), spur, np.full(len(spur), 80.0))
+    assert GpxMetrics.TrackMetrics(str(tmp_path / "Spur.gpx"))["Sharp Turns"] == 0
+
+    turnaround = Polyline((0, 0), (1000, 0), (1000, 500), (1000, 0), (2000, 0))
+    WriteGpx(str(tmp_path / "Turnaround.gpx"), turnaround, np.full(len(turnaround), 80.0))
+    assert GpxMetrics.TrackMetrics(str(tmp_path / "Turnaround.gpx"))["Sharp Turns"] == 1
+
+
+def test_remove_spurs_keeps_a_straight_track():
+    points = Polyline((0, 0), (2000, 0))
+    assert np.array_equal(GpxMetrics.RemoveSpurs(points, 60, 10.0), points)
+
+
+def test_elevation_gain_ignores_the_noise(tmp_path):
+    # two climbs of 20 metres with 0.5 metre noise at every point, about 400
+    # metres of gain without the smoothing
+    xy = Polyline((0, 0), (4000, 0))
+    profile = np.interp(xy[:, 0], [0, 1000, 2000, 3000, 4000], [80, 100, 90, 110, 100])
+    noise = np.where(np.arange(len(xy)) % 2 == 0, 0.5, -0.5)
+    WriteGpx(str(tmp_path / "Track.gpx"), xy, profile + noise)
+    assert abs(GpxMetrics.TrackMetrics(str(tmp_path / "Track.gpx"))["Elevation Gain"] - 40) <= 5
+
+
+def test_run_on_tracks_reports_unreadable_tracks(tmp_path):
+    xy = Polyline((0, 0), (1000, 0))
+    WriteGpx(str(tmp_path / "Track.gpx"), xy, np.full(len(xy), 80.0))
+    df = GpxMetrics.RunOnTracks([("Track", str(tmp_path / "Track.gpx")), ("Missing", str(tmp_path / "Missing.gpx"))])
+    assert df.loc["Track"].tolist() == [0, 0, 0]
+    assert df.loc["Missing"].isna().all()
+
+
+Tracks = [(name, os.path.splitext(path)[0] + ".gpx") for name, path in ReadRoutesFromFile()]
+
+
+@pytest.mark.skipif(not all(os.path.exists(path) for _, path in Tracks),
+                    reason="the GPX tracks of the routes are not available")
+def test_agreement_with_hand_counts():
+    hand = pd.read_csv(os.path.join(rootFolder, "TWM-Turns-Elevation-Traffic-Modelling.csv"), index_col=0,
+                       encoding="utf-8-sig")
+    computed = GpxMetrics.RunOnTracks(Tracks)
+    hand = hand.loc[computed.index, GpxMetrics.GetTrackMetrics()]
+
+    def DiscordantPairs(metric: str) -> int:
+        a, b = computed[metric].to_numpy(dtype=float), hand[metric].to_numpy(dtype=float)
+        signs = np.sign(a[:, None] - a[None, :]) * np.sign(b[:, None] - b[None, :])
+        return int(np.count_nonzero(signs < 0)) // 2
+
+    # the agreement documented in GpxMetrics.py
+    assert np.count_nonzero(computed["Sharp Turns"] == hand["Sharp Turns"]) == len(Tracks) - 1
+    assert ((computed["Wide Turns"] - hand["Wide Turns"]).between(0, 4)).all()
+    assert ((computed["Elevation Gain"] / hand["Elevation Gain"]).between(0.77, 0.84)).all()
+    assert DiscordantPairs("Wide Turns") <= 1
+    assert DiscordantPairs("Sharp Turns") == 0
+    assert DiscordantPairs("Elevation Gain") == 0
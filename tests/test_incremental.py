@@ -0,0 +1,85 @@
+"""
+Checks of the incremental re-evaluation of Incremental.py: parity with the
+results of the arcpy model (Results.csv) and with NumpyModel.py, and an edited
+route evaluating only the segments the edit touched.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import Geometry
+import Incremental
+import NumpyModel
+from Model import GetMetrics
+from Runner import ReadRoutesFromFile
+from Shapefile import Layer, WriteLayer
+
+# metrics computed exactly by every backend
+ExactMetrics = ["Number of Places of Interests",
+                "Number of Subway Stations",
+                "Number of High Traffic Intersections"]
+
+Routes = ReadRoutesFromFile() if os.path.isdir(NumpyModel.dataFolder) else []
+
+requiresData = pytest.mark.skipif(not all(os.path.exists(path) for _, path in Routes) or len(Routes) == 0,
+                                  reason="the Data folder with the routes is not available")
+
+
+@pytest.fixture(scope="module")
+def expected() -> pd.DataFrame:
+    return pd.read_csv(os.path.join(NumpyModel.rootFolder, "Results.csv"), index_col=0)
+
+
+def SegmentCounts(result) -> tuple:
+    # (segments, evaluated segments) of an evaluation, from its profile
+    step, = [step for step in result["Profile"] if step["step"] == "Step 2: Segments"]
+    return step["scanned"], step["matched"]
+
+
+def EditedRoute(path: str, folder: str) -> str:
+    # the route with a few vertices in the middle moved 40 m aside
+    route = NumpyModel.LoadRoute(path)
+    lonlat = route.xy.copy()
+    lonlat[200:206] = Geometry.ToLonLat(route.Metres()[200:206] + [0.0, 40.0])
+    editedPath = os.path.join(folder, "Edited.shp")
+    WriteLayer(editedPath, Layer(route.shapeType, lonlat, route.partOffsets, route.featureOffsets,
+                                 np.concatenate([lonlat.min(axis=0), lonlat.max(axis=0)])[None, :], {}))
+    return editedPath
+
+
+@requiresData
+def test_incremental_reuses_segments(expected):
+    # the second evaluation of a route only aggregates the cached segments
+    name, path = Routes[0]
+    first = Incremental.Model(path, 100, "Meters", Metrics=ExactMetrics)
+    second = Incremental.Model(path, 100, "Meters", Metrics=ExactMetrics)
+    for result in (first, second):
+        assert {metric: result[metric] for metric in ExactMetrics} == expected.loc[name, ExactMetrics].to_dict()
+    assert SegmentCounts(second)[1] == 0
+
+
+@pytest.mark.parametrize("within", [False, True])
+def test_incremental_matches_numpy_model(syntheticRoutes, within):
+    for _, path in syntheticRoutes:
+        result = Incremental.Model(path, 250, "Meters", CondominiumWithin=within)
+        expected = NumpyModel.Model(path, 250, "Meters", CondominiumWithin=within)
+        assert "Error" not in result
+        assert {metric: result[metric] for metric in GetMetrics()} == {metric: expected[metric] for metric in GetMetrics()}
+
+
+def test_edit_only_evaluates_the_touched_segments(syntheticRoutes, tmp_path):
+    _, path = syntheticRoutes[0]
+    first = Incremental.Model(path, 250, "Meters")
+    segments, evaluated = SegmentCounts(first)
+    assert evaluated == segments > 2
+
+    editedPath = EditedRoute(path, str(tmp_path))
+    edited = Incremental.Model(editedPath, 250, "Meters")
+    editedSegments, editedEvaluated = SegmentCounts(edited)
+    assert 0 < editedEvaluated <= 2 and editedSegments == segments
+    expected = NumpyModel.Model(editedPath, 250, "Meters")
+    assert {metric: edited[metric] for metric in GetMetrics()} == {metric: expected[metric] for metric in GetMetrics()}
@@ -0,0 +1,40 @@
+"""
+Parity of the NumPy backend with the results of the arcpy model.
+
+The counts of points of interest, subway stations and high traffic
+intersections of NumpyModel.py match the counts of Model.py in Results.csv
+(buffer of 100 metres) exactly. The same checks of Incremental.py and
+BatchModel.py are in test_incremental.py and test_batchmodel.py.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import os
+
+import pandas as pd
+import pytest
+
+import NumpyModel
+from Runner import ReadRoutesFromFile
+
+# metrics computed exactly by the NumPy backend
+ExactMetrics = ["Number of Places of Interests",
+                "Number of Subway Stations",
+                "Number of High Traffic Intersections"]
+
+Routes = ReadRoutesFromFile() if os.path.isdir(NumpyModel.dataFolder) else []
+
+pytestmark = pytest.mark.skipif(not all(os.path.exists(path) for _, path in Routes) or len(Routes) == 0,
+                                reason="the Data folder with the routes is not available")
+
+
+@pytest.fixture(scope="module")
+def expected() -> pd.DataFrame:
+    return pd.read_csv(os.path.join(NumpyModel.rootFolder, "Results.csv"), index_col=0)
+
+
+@pytest.mark.parametrize("name, path", Routes, ids=[name for name, _ in Routes])
+def test_model_matches_results(name, path, expected):
+    result = NumpyModel.Model(path, 100, "Meters", Metrics=ExactMetrics)
+    assert "Error" not in result
+    assert {metric: result[metric] for metric in ExactMetrics} == expected.loc[name, ExactMetrics].to_dict()
+
@@ -0,0 +1,157 @@
+"""
+Checks of the ranking engine of Ranking.py against the straightforward
+versions: folding the csv files with combine_first, the rank matrix of Rank
+(with and without missing values), and comparing every pair of routes for the
+Pareto front.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import Ranking
+
+RootFolder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def BruteForcePareto(values: np.ndarray) -> np.ndarray:
+    # rows not dominated by any other row, missing values the worst
+    values = np.where(np.isnan(values), -np.inf, values)
+    front = []
+    for row in range(len(values)):
+        atLeast = (values >= values[row]).all(axis=1)
+        better = (values > values[row]).any(axis=1)
+        if not (atLeast & better).any():
+            front.append(row)
+    return np.array(front, dtype=np.int64)
+
+
+def RandomTable(rng: np.random.Generator, routes: int, metrics: int, weights: bool = True) -> pd.DataFrame:
+    # integer metric values with many ties, some of them minimizing metrics
+    names = ["Metric " + str(metric) for metric in range(metrics - 2)] + Ranking.MinimizingMetrics[:2]
+    df = pd.DataFrame(rng.integers(0, 20, size=(routes, metrics)).astype(float), columns=names,
+                      index=pd.Index(["Route " + str(route) for route in range(routes)], name="Route"))
+    if weights:
+        df.loc["weight"] = rng.choice([0.25, 0.5, 1.0], size=metrics)
+    return df
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_pareto_front_matches_brute_force(seed, monkeypatch):
+    rng = np.random.default_rng(seed)
+    # blocks smaller than the table to compare the blocks with each other
+    monkeypatch.setattr(Ranking, "PARETO_BLOCK", 16)
+    values = rng.integers(0, 6, size=(300, 1 + seed % 4)).astype(float)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    assert np.array_equal(Ranking.ParetoFront(values), BruteForcePareto(values))
+
+
+def test_pareto_routes_flip_minimizing_metrics():
+    df = RandomTable(np.random.default_rng(7), 200, 5)
+    routes = df.drop(index="weight")
+    front = BruteForcePareto(routes.to_numpy() * Ranking.MaximizingSigns(list(df.columns)))
+    assert list(Ranking.ParetoRoutes(df).index) == list(routes.index[front])
+
+
+@pytest.mark.parametrize("weights", [True, False])
+def test_top_routes_match_rank(weights):
+    df = RandomTable(np.random.default_rng(3), 150, 6, weights)
+    ranks = Ranking.Rank(Ranking.ConvertToMaximizingMetrics(df.copy()))["Overall Weighted Score"]
+
+    top = Ranking.TopRoutes(df, len(df))
+    assert np.allclose(top["Overall Weighted Score"], ranks[top.index])
+    # best first, ties by the order of the routes
+    expected = ranks.reset_index(drop=True).sort_values(ascending=False, kind="stable")
+    assert list(top.index) == list(ranks.index[expected.index])
+
+    best = Ranking.TopRoutes(df, 10)
+    assert list(best.index) == list(top.index[:10])
+
+
+def test_top_routes_leave_missing_values_out():
+    # a route missing a metric is ranked on its other metrics, as in Rank
+    df = RandomTable(np.random.default_rng(5), 120, 5)
+    routes = df.index != "weight"
+    values = df.loc[routes].to_numpy(copy=True)
+    values[np.random.default_rng(6).random(values.shape) < 0.1] = np.nan
+    df.loc[routes] = values
+    ranks = Ranking.Rank(Ranking.ConvertToMaximizingMetrics(df.copy()))["Overall Weighted Score"]
+
+    top = Ranking.TopRoutes(df, len(df))
+    assert np.allclose(top["Overall Weighted Score"], ranks[top.index])
+
+
+def test_top_routes_match_rank_of_results():
+    df = pd.read_csv(os.path.join(RootFolder, "Results.csv"), index_col=0)
+    ranks = Ranking.Rank(Ranking.ConvertToMaximizingMetrics(df.copy()))["Overall Weighted Score"]
+    top = Ranking.TopRoutes(df, 3)
+    assert np.allclose(top["Overall Weighted Score"], ranks.sort_values(ascending=False).iloc[:3])
+
+
+def test_merge_csv_files_matches_combine_first(tmp_path):
+    rng = np.random.default_rng(11)
+    paths = []
+    for number in range(4):
+        # overlapping routes and metrics, some of the values missing
+        routes = rng.choice(40, size=25, replace=False)
+        metrics = rng.choice(8, size=5, replace=False)
+        df = pd.DataFrame(rng.integers(0, 1000, size=(len(routes), len(metrics))).astype(float),
+                          index=pd.Index(["Route " + str(route) for route in routes], name="Route"),
+                          columns=["Metric " + str(metric) for metric in metrics])
+        df[rng.random(df.shape) < 0.2] = np.nan
+        if number == 1:
+            df.loc["weight"] = 0.5
+        paths.append(str(tmp_path / ("Results" + str(number) + ".csv")))
+        df.to_csv(paths[-1])
+
+    folded = pd.read_csv(paths[0], index_col=0)
+    for path in paths[1:]:
+        folded = folded.combine_first(pd.read_csv(path, index_col=0))
+
+    merged = Ranking.MergeCsvFiles(paths, chunkSize=7)
+    assert sorted(merged.index) == sorted(folded.index)
+    assert sorted(merged.columns) == sorted(folded.columns)
+    pd.testing.assert_frame_equal(merged, folded.reindex(index=merged.index, columns=merged.columns).astype(float))
+
+
+def test_merge_csv_files_fills_placeholders(tmp_path):
+    first, second = str(tmp_path / "Results.csv"), str(tmp_path / "Traffic.csv")
+    pd.DataFrame({"Vehicle Delay": [Ranking.PLACEHOLDER_VALUE, 12.0]},
+                 index=pd.Index(["Proto 1.1", "Proto 2.1"], name="Route")).to_csv(first)
+    pd.DataFrame({"Vehicle Delay": [30.0, 40.0]},
+                 index=pd.Index(["Proto 1.1", "Proto 2.1"], name="Route")).to_csv(second)
+    merged = Ranking.MergeCsvFiles([first, second])
+    assert merged["Vehicle Delay"].tolist() == [30.0, 12.0]
+
+
+def test_unfilled_placeholders_rank_last(tmp_path):
+    path = str(tmp_path / "Results.csv")
+    pd.DataFrame({"Vehicle Delay": [Ranking.PLACEHOLDER_VALUE, 12.0, 15.0],
+                  "Number of Subway Stations": [Ranking.PLACEHOLDER_VALUE, 6.0, 8.0]},
+                 index=pd.Index(["Proto 1.1", "Proto 2.1", "Proto 2.2"], name="Route")).to_csv(path)
+    merged = Ranking.MergeCsvFiles([path])
+    ranks = Ranking.Rank(Ranking.ConvertToMaximizingMetrics(merged.copy()))
+    # the metric is kept in the mean of the route, with the worst rank
+    assert ranks.loc["Proto 1.1"].tolist() == [1.0, 1.0, 1.0]
+    assert Ranking.TopRoutes(merged, 3).index[-1] == "Proto 1.1"
+
+
+def test_rank_committed_results():
+    # the merge gives the scores of folding the csv files with combine_first,
+    # where the 9999 placeholders of Proto 1.1 and 1.2 rank last
+    paths = [os.path.join(RootFolder, "Results.csv"), os.path.join(RootFolder, "TWM-Turns-Elevation-Traffic-Modelling.csv")]
+    folded = pd.read_csv(paths[0], index_col=0).combine_first(pd.read_csv(paths[1], index_col=0))
+    expected = Ranking.Rank(Ranking.ConvertToMaximizingMetrics(folded))["Overall Weighted Score"]
+
+    merged = Ranking.MergeCsvFiles(paths)
+    scores = Ranking.Rank(Ranking.ConvertToMaximizingMetrics(merged.copy()))["Overall Weighted Score"]
+    assert np.allclose(scores, expected[scores.index])
+    assert scores.round(2).to_dict() == {"Baseline": 1.38, "Proto 1.1": 1.1, "Proto 1.2": 1.23, "Proto 2.1": 1.23,
+                                         "Proto 2.2": 1.17, "Proto 2.3": 1.51, "Proto 2.4": 1.38, "Proto 2.5": 1.19}
+
+    top = Ranking.TopRoutes(merged, 3)
+    assert list(top.index) == ["Proto 2.3", "Baseline", "Proto 2.4"]
+    assert np.allclose(top["Overall Weighted Score"], expected[top.index])
@@ -0,0 +1,133 @@
+"""
+Checks of the metric cache of ResultCache.py: the keys of the entries, the
+eviction of the least recently used entries, and the evaluation of the metrics
+missing from the cache only.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import os
+import shutil
+
+import pytest
+
+import Benchmark
+import Model
+import NumpyModel
+import ResultCache
+from Model import GetMetrics
+from Shapefile import WriteLayer
+
+POIMetric = "Number of Places of Interests"
+SubwayMetric = "Number of Subway Stations"
+
+
+def FakeModel(calls):
+    # model returning the position of every metric, recording the metrics asked for
+    def Evaluate(Route, BufferSize, BufferSizeUnit, ScratchFolder=None, Metrics=None):
+        metrics = Metrics if Metrics is not None else GetMetrics()
+        calls.append(list(metrics))
+        return {metric: GetMetrics().index(metric) for metric in metrics}
+    return Evaluate
+
+
+def test_route_hash_ignores_the_path_of_the_route(syntheticRoutes, tmp_path):
+    (_, path), (_, otherPath) = syntheticRoutes[:2]
+    copy = str(tmp_path) + os.sep + "Copy.shp"
+    for extension in (".shp", ".shx", ".dbf", ".prj"):
+        if os.path.exists(os.path.splitext(path)[0] + extension):
+            shutil.copyfile(os.path.splitext(path)[0] + extension, os.path.splitext(copy)[0] + extension)
+    assert ResultCache.RouteHash(copy) == ResultCache.RouteHash(path)
+    assert ResultCache.RouteHash(otherPath) != ResultCache.RouteHash(path)
+
+
+def test_metric_key_changes_with_every_input(syntheticRoutes):
+    routeHash = ResultCache.RouteHash(syntheticRoutes[0][1])
+    otherHash = ResultCache.RouteHash(syntheticRoutes[1][1])
+    keys = [ResultCache.MetricKey("numpy", POIMetric, routeHash, 100, "Meters"),
+            ResultCache.MetricKey("numpy", POIMetric, routeHash, 200, "Meters"),
+            ResultCache.MetricKey("numpy", POIMetric, routeHash, 100, "Kilometers"),
+            ResultCache.MetricKey("numpy", POIMetric, otherHash, 100, "Meters"),
+            ResultCache.MetricKey("numpy", SubwayMetric, routeHash, 100, "Meters"),
+            ResultCache.MetricKey("incremental", POIMetric, routeHash, 100, "Meters")]
+    assert len(set(keys)) == len(keys)
+    assert keys[0] == ResultCache.MetricKey("numpy", POIMetric, routeHash, 100, "Meters")
+
+
+def test_metric_key_follows_its_own_layers(syntheticRoutes):
+    _, path = syntheticRoutes[0]
+    routeHash = ResultCache.RouteHash(path)
+    poiKey = ResultCache.MetricKey("numpy", POIMetric, routeHash, 100, "Meters")
+    subwayKey = ResultCache.MetricKey("numpy", SubwayMetric, routeHash, 100, "Meters")
+
+    points = NumpyModel.LoadRoute(path).Metres()[::20] + 10.0
+    WriteLayer(NumpyModel.dataFolder + NumpyModel.POIFeature, Benchmark.PointLayer(points))
+    assert ResultCache.MetricKey("numpy", POIMetric, routeHash, 100, "Meters") != poiKey
+    assert ResultCache.MetricKey("numpy", SubwayMetric, routeHash, 100, "Meters") == subwayKey
+
+
+def test_arcpy_key_follows_the_data_folder_of_model(syntheticRoutes, monkeypatch, tmp_path):
+    # Model.py reads its layers from its own data folder, not NumpyModel.dataFolder
+    _, path = syntheticRoutes[0]
+    routeHash = ResultCache.RouteHash(path)
+    monkeypatch.setattr(Model, "dataFolder", str(tmp_path) + os.sep + "ArcpyData" + os.sep)
+    os.makedirs(Model.dataFolder)
+    arcpyKey = ResultCache.MetricKey("arcpy", POIMetric, routeHash, 100, "Meters")
+
+    points = NumpyModel.LoadRoute(path).Metres()[::20] + 10.0
+    WriteLayer(NumpyModel.dataFolder + NumpyModel.POIFeature, Benchmark.PointLayer(points))
+    assert ResultCache.MetricKey("arcpy", POIMetric, routeHash, 100, "Meters") == arcpyKey
+
+    with open(ResultCache.LayerPath("arcpy", NumpyModel.POIFeature), "wb") as file:
+        file.write(b"\0" * 100)
+    assert ResultCache.MetricKey("arcpy", POIMetric, routeHash, 100, "Meters") != arcpyKey
+
+
+def test_evict_removes_the_least_recently_used_entries(cacheFolder):
+    for number, key in enumerate(["first", "second", "third"]):
+        ResultCache.Store(key, {"metric": POIMetric, "value": number})
+        os.utime(ResultCache.EntryPath(key), ns=(number * 10 ** 9, number * 10 ** 9))
+    size = os.path.getsize(ResultCache.EntryPath("first"))
+
+    # loading an entry marks it as recently used
+    assert ResultCache.Load("first")["value"] == 0
+    assert ResultCache.Evict(3 * size) == 0
+    assert ResultCache.Evict(2 * size) == 1
+    assert not os.path.exists(ResultCache.EntryPath("second"))
+    assert ResultCache.Load("third")["value"] == 2
+    assert ResultCache.Evict(0) == 2
+    assert ResultCache.CacheEntries() == []
+
+
+def test_cached_model_only_evaluates_the_missing_metrics(syntheticRoutes, monkeypatch):
+    _, path = syntheticRoutes[0]
+    # the workers only add to the cache, the entry points evict
+    monkeypatch.setattr(ResultCache, "Evict", lambda *args: pytest.fail("Evict called by CachedModel"))
+    calls = []
+    expected = {metric: position for position, metric in enumerate(GetMetrics())}
+
+    result = ResultCache.CachedModel(FakeModel(calls), "numpy", path, 100, "Meters")
+    assert {metric: result[metric] for metric in GetMetrics()} == expected
+    result = ResultCache.CachedModel(FakeModel(calls), "numpy", path, 100, "Meters")
+    assert {metric: result[metric] for metric in GetMetrics()} == expected
+    assert calls == [GetMetrics()]
+
+    routeHash = ResultCache.RouteHash(path)
+    os.remove(ResultCache.EntryPath(ResultCache.MetricKey("numpy", SubwayMetric, routeHash, 100, "Meters")))
+    ResultCache.CachedModel(FakeModel(calls), "numpy", path, 100, "Meters")
+    ResultCache.CachedModel(FakeModel(calls), "numpy", path, 200, "Meters")
+    assert calls[1:] == [[SubwayMetric], GetMetrics()]
+
+
+def test_cached_model_keeps_the_metrics_computed_before_an_error(syntheticRoutes):
+    _, path = syntheticRoutes[0]
+    calls = []
+
+    def FailingModel(Route, BufferSize, BufferSizeUnit, ScratchFolder=None, Metrics=None):
+        calls.append(list(Metrics))
+        return {Metrics[0]: 1, "Error": "failed"}
+
+    result = ResultCache.CachedModel(FailingModel, "numpy", path, 100, "Meters")
+    assert result["Error"] == "failed" and result[GetMetrics()[0]] == 1
+    result = ResultCache.CachedModel(FakeModel(calls), "numpy", path, 100, "Meters")
+    assert "Error" not in result and result[GetMetrics()[0]] == 1
+    assert calls == [GetMetrics(), GetMetrics()[1:]]
@@ -0,0 +1,66 @@
+"""
+Checks of the per-interval profile of RouteProfile.py: the intervals cover the
+route, the features are placed at their measure along the route, and the
+intervals add up to the totals of NumpyModel.py.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import numpy as np
+import pytest
+
+import Benchmark
+import NumpyModel
+import RouteProfile
+from Shapefile import WriteLayer
+
+
+@pytest.fixture
+def separateBIAs(syntheticRoutes) -> None:
+    # BIAs on the first route that do not overlap each other, so the area
+    # covered by a BIA inside the buffer is the metric of Model (see RouteProfile.py)
+    route = NumpyModel.LoadRoute(syntheticRoutes[0][1]).Metres()
+    centres = route[[0, 100, 200, 300]] + [50.0, 0.0]
+    WriteLayer(NumpyModel.dataFolder + NumpyModel.BIAFeature,
+               Benchmark.PolygonLayer(np.random.default_rng(3), centres, 150.0, 400.0, 24))
+
+
+@pytest.mark.parametrize("interval", [1000.0, 5000.0])
+def test_profile_adds_up_to_the_totals(syntheticRoutes, separateBIAs, interval):
+    for _, path in syntheticRoutes:
+        profile = RouteProfile.RouteProfile(path, 250, "Meters", interval)
+        expected = NumpyModel.Model(path, 250, "Meters")
+        for metric, _ in RouteProfile.PointMetrics:
+            assert profile[metric].sum() == expected[metric]
+        # every interval is rounded on its own
+        assert abs(profile[RouteProfile.BIAMetric].sum() - expected[RouteProfile.BIAMetric]) <= len(profile)
+
+
+def test_intervals_cover_the_route(syntheticRoutes):
+    _, path = syntheticRoutes[0]
+    grid = NumpyModel.RouteGrid(NumpyModel.LoadRoute(path), 100.0)
+    length = RouteProfile.SegmentMeasures(grid)[-1]
+    profile = RouteProfile.RouteProfile(path, 100, "Meters", 3000.0)
+    assert len(profile) == int(np.ceil(length / 3000.0))
+    assert profile["From (km)"].iloc[0] == 0.0 and np.isclose(profile["To (km)"].iloc[-1], length / 1000)
+    assert np.allclose(profile["From (km)"].iloc[1:], profile["To (km)"].iloc[:-1])
+
+
+def test_measures_along_the_route(syntheticRoutes):
+    _, path = syntheticRoutes[0]
+    route = NumpyModel.LoadRoute(path).Metres()
+    grid = NumpyModel.RouteGrid(NumpyModel.LoadRoute(path), 100.0)
+    measures = RouteProfile.SegmentMeasures(grid)
+    # points 20 m beside the middle of some segments, and one too far from the route
+    segments = np.array([10, 150, 320])
+    middles = (route[segments] + route[segments + 1]) / 2
+    normals = (route[segments + 1] - route[segments])[:, ::-1] * [1.0, -1.0]
+    points = middles + 20.0 * normals / np.hypot(*normals.T)[:, None]
+    found = RouteProfile.Measures(grid, measures, np.concatenate([points, [[1e7, 1e7]]]), 100.0)
+    assert np.allclose(found[:-1], (measures[segments] + measures[segments + 1]) / 2, atol=1e-6)
+    assert np.isnan(found[-1])
+
+
+def test_profile_routes_skips_failing_routes(syntheticRoutes):
+    (name, path), = syntheticRoutes[:1]
+    profiles = RouteProfile.ProfileRoutes([(name, path), ("Missing", path + ".missing.shp")], 100, "Meters")
+    assert set(profiles["Route"]) == {name}
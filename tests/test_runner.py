@@ -0,0 +1,41 @@
+"""
+Checks of the batches of Runner.py: a failing route is reported with empty
+metrics and the other routes of the batch are still evaluated, on one worker
+or on a pool of workers.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import os
+
+import pytest
+
+import NumpyModel
+import Runner
+from Model import GetMetrics
+
+
+@pytest.fixture
+def routesFile(syntheticRoutes, tmp_path, monkeypatch) -> str:
+    # RoutesPaths.txt style file of the synthetic routes with a missing route in the middle
+    monkeypatch.setattr(Runner, "rootFolder", str(tmp_path) + os.sep)
+    lines = ["Route Name,Route Path"]
+    for name, path in syntheticRoutes:
+        lines.append(name + "," + os.path.relpath(path, NumpyModel.dataFolder).replace(os.sep, "\\"))
+        if len(lines) == 2:
+            lines.append("Missing,Missing\\Missing.shp")
+    path = str(tmp_path) + os.sep + "RoutesPaths.txt"
+    with open(path, "w") as file:
+        file.write("\n".join(lines) + "\n")
+    return path
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_failing_route_does_not_stop_the_batch(syntheticRoutes, routesFile, workers):
+    results = Runner.RunModelOnRoutesFromFile("numpy", workers, True, routesPath=routesFile,
+                                              bufferSize=100, bufferSizeUnit="Meters")
+    names = [name for name, _ in syntheticRoutes]
+    assert results.index.tolist() == names[:1] + ["Missing"] + names[1:]
+    assert results.loc["Missing"].isna().all()
+    for name, path in syntheticRoutes:
+        expected = NumpyModel.Model(path, 100, "Meters")
+        assert results.loc[name].tolist() == [expected[metric] for metric in GetMetrics()]
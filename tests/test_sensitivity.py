@@ -0,0 +1,73 @@
+"""
+Checks of the weight sensitivity analysis of Sensitivity.py: the scores of a
+batch of weight vectors against Rank (see Ranking.py), the winner flips
+against scoring a fine grid of weights, and the report on the committed csv
+files.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import Ranking
+import Sensitivity
+
+RootFolder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ResultFiles = [os.path.join(RootFolder, "Results.csv"), os.path.join(RootFolder, "TWM-Turns-Elevation-Traffic-Modelling.csv")]
+
+
+def RandomRanks(seed: int, routes: int = 12, metrics: int = 5):
+    rng = np.random.default_rng(seed)
+    values = rng.integers(0, 8, size=(routes, metrics)).astype(float)
+    values[rng.random(values.shape) < 0.1] = np.nan
+    return Sensitivity.RankMatrix(values) + (rng.uniform(0.2, 2.0, metrics),)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_scores_match_rank(seed):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.integers(0, 8, size=(10, 4)).astype(float), columns=["A", "B", "C", "D"],
+                      index=pd.Index(["Route " + str(route) for route in range(10)], name="Route"))
+    df.iloc[2, 1] = np.nan
+    weights = rng.uniform(0.2, 2.0, 4)
+    df.loc["weight"] = weights
+    expected = Ranking.Rank(df.copy())["Overall Weighted Score"].to_numpy()
+
+    routes, values, _ = Ranking.SplitWeights(df)
+    ranks, counts = Sensitivity.RankMatrix(values)
+    assert np.allclose(Sensitivity.Scores(weights[None, :], ranks, counts)[0], expected)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_winner_flips_match_a_grid_of_weights(seed):
+    ranks, counts, weights = RandomRanks(seed)
+    for metric in range(len(weights)):
+        regions = Sensitivity.WinnerFlips(ranks, counts, weights, metric, 20.0)
+        # the regions cover [0, 20] one after the other, with a new winner each time
+        assert regions[0][0] == 0.0 and regions[-1][1] == 20.0
+        assert all(previous[1] == region[0] for previous, region in zip(regions, regions[1:]))
+        assert all(previous[2] != region[2] for previous, region in zip(regions, regions[1:]))
+
+        for start, end, winner in regions:
+            grid = np.linspace(start, end, 7)[1:-1]
+            sampled = np.repeat(weights[None, :], len(grid), axis=0)
+            sampled[:, metric] = grid
+            assert (np.argmax(Sensitivity.Scores(sampled, ranks, counts), axis=1) == winner).all()
+
+
+def test_sensitivity_of_the_committed_results():
+    df = Ranking.MergeCsvFiles(ResultFiles)
+    ranking, regions, flips = Sensitivity.Sensitivity(df, 20_000, concentration=50.0)
+    assert np.allclose(ranking.filter(like="P(Rank").sum(axis=0), 1.0)
+    assert np.isclose(regions["Share of Samples"].sum(), 1.0)
+    assert np.allclose(ranking.loc[regions.index, "P(Rank 1)"], regions["Share of Samples"])
+
+    # at the weights of the csv files the winner is the winner of Rank
+    winner = Ranking.TopRoutes(df, 1).index[0]
+    current = flips[(flips["From Weight"] <= flips["Weight"]) & (flips["Weight"] <= flips["To Weight"])]
+    assert winner == "Proto 2.3"
+    assert set(current["Winner"]) == {winner}
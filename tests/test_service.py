@@ -0,0 +1,136 @@
+"""
+Checks of the request handling of Service.py: parsing and validating the
+requests, coalescing identical requests into one evaluation, and reloading a
+reference layer updated while the workers keep it in memory.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+import Benchmark
+import NumpyModel
+import Service
+from Shapefile import WriteLayer
+
+Line = {"type": "LineString", "coordinates": [[-79.38, 43.64], [-79.37, 43.65], [-79.36, 43.65]]}
+
+
+def test_route_from_geojson_collects_every_line():
+    collection = {"type": "FeatureCollection", "features": [
+        {"type": "Feature", "geometry": Line},
+        {"type": "Feature", "geometry": {"type": "MultiLineString",
+                                         "coordinates": [[[-79.35, 43.66], [-79.34, 43.66]], [[-79.33, 43.67]]]}}]}
+    route = Service.RouteFromGeoJson(collection)
+    # the line of a single point is left out
+    assert route.partOffsets.tolist() == [0, 3, 5]
+    assert route.featureOffsets.tolist() == [0, 2]
+    assert np.allclose(route.bboxes[0], [-79.38, 43.64, -79.34, 43.66])
+
+
+@pytest.mark.parametrize("geojson", [{"type": "Point", "coordinates": [-79.38, 43.64]},
+                                     {"type": "LineString", "coordinates": [[-79.38, 43.64]]},
+                                     {"type": "LineString", "coordinates": [[-79.38, "north"], [-79.37, 43.65]]},
+                                     {"type": "Feature", "geometry": None}])
+def test_route_from_geojson_rejects_invalid_routes(geojson):
+    with pytest.raises(Service.RequestError):
+        Service.RouteFromGeoJson(geojson)
+
+
+def test_parse_request(tmp_path):
+    path = str(tmp_path / "Route.shp")
+    WriteLayer(path, Service.RouteFromGeoJson(Line))
+    assert Service.ParseRequest({"route": path, "bufferSize": 100}) == (path, 100, "Meters")
+    assert Service.ParseRequest({"route": Line, "bufferSize": 1.0, "bufferSizeUnit": "Kilometers"}) == (Line, 1, "Kilometers")
+    # relative paths are relative to the root of the project
+    relative = Service.ParseRequest({"route": os.path.relpath(path, NumpyModel.rootFolder), "bufferSize": 100})[0]
+    assert os.path.samefile(relative, path)
+
+
+@pytest.mark.parametrize("body", [{"bufferSize": 100},
+                                  {"route": "Data/Missing.shp", "bufferSize": 100},
+                                  {"route": Line, "bufferSize": 0},
+                                  {"route": Line, "bufferSize": 2.5},
+                                  {"route": Line, "bufferSize": True},
+                                  {"route": Line, "bufferSize": "100"},
+                                  {"route": Line, "bufferSize": 100, "bufferSizeUnit": "Feet"}])
+def test_parse_request_rejects_invalid_requests(body):
+    with pytest.raises(Service.RequestError):
+        Service.ParseRequest(body)
+
+
+def test_request_key(tmp_path):
+    path = str(tmp_path / "Route.shp")
+    WriteLayer(path, Service.RouteFromGeoJson(Line))
+    key = Service.RequestKey(path, 100, "Meters")
+    assert Service.RequestKey(path, 100, "Meters") == key
+    assert Service.RequestKey(path, 200, "Meters") != key
+    assert Service.RequestKey(dict(reversed(list(Line.items()))), 100, "Meters") == Service.RequestKey(Line, 100, "Meters")
+
+    # a route file written again is a new request
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 1))
+    assert Service.RequestKey(path, 100, "Meters") != key
+
+
+def test_identical_requests_are_coalesced(monkeypatch):
+    batches = []
+
+    def EvaluateBatch(requests):
+        batches.append([key for key, _, _, _ in requests])
+        return [{"Number of Subway Stations": bufferSize} for _, _, bufferSize, _ in requests]
+
+    monkeypatch.setattr(Service, "EvaluateBatch", EvaluateBatch)
+
+    async def Run():
+        service = Service.EvaluationService(workers=2)
+        service.pool.shutdown()
+        service.pool = ThreadPoolExecutor(max_workers=2)
+        await service.Start()
+        batches.clear()
+        try:
+            results = await asyncio.gather(*[service.Evaluate(Line, bufferSize, "Meters")
+                                             for bufferSize in (100, 100, 200, 100, 200, 300)])
+        finally:
+            service.Close()
+        return service, results
+
+    service, results = asyncio.run(Run())
+    assert [result["Number of Subway Stations"] for result in results] == [100, 100, 200, 100, 200, 300]
+    # 3 evaluations for 6 requests, all in the same batch window
+    assert sorted(len(set(batch)) for batch in batches) == [1, 2]
+    assert service.evaluated == 3 and service.coalesced == 3
+    assert len(service.pending) == 0
+
+
+def test_updated_layer_is_reloaded(syntheticRoutes):
+    # a worker keeps the layers in memory between requests: a layer written
+    # again must be read again, not served from memory
+    _, path = syntheticRoutes[0]
+    metric = "Number of Places of Interests"
+    before = NumpyModel.Model(path, 500, "Meters", Metrics=[metric])[metric]
+
+    route = NumpyModel.LoadRoute(path).Metres()
+    points = route[::20] + 10.0
+    WriteLayer(NumpyModel.dataFolder + NumpyModel.POIFeature, Benchmark.PointLayer(points))
+    after = NumpyModel.Model(path, 500, "Meters", Metrics=[metric])[metric]
+    assert before != after
+    assert after == len(points)
+
+
+def test_layers_of_another_data_folder_are_not_reused(syntheticRoutes, monkeypatch, tmp_path):
+    # same relative path under two data folders (i.e. Benchmark.py swapping the Data folder)
+    first = NumpyModel.LoadBitmapIndex(NumpyModel.PropertyFeature, "F_TYPE").Bitmap([NumpyModel.CondominiumType])
+    firstPoints = NumpyModel.LoadRepresentativePoints(NumpyModel.PropertyFeature, "F_TYPE", NumpyModel.CondominiumType)
+
+    folder = str(tmp_path) + os.sep + "Other" + os.sep
+    Benchmark.GenerateLayers(folder, {"poi": 10, "subway": 10, "intersections": 10, "zoning": 10, "bia": 2,
+                                      "property": 500}, np.random.default_rng(1))
+    monkeypatch.setattr(NumpyModel, "dataFolder", folder)
+    second = NumpyModel.LoadBitmapIndex(NumpyModel.PropertyFeature, "F_TYPE").Bitmap([NumpyModel.CondominiumType])
+    secondPoints = NumpyModel.LoadRepresentativePoints(NumpyModel.PropertyFeature, "F_TYPE", NumpyModel.CondominiumType)
+    assert len(secondPoints) != len(firstPoints)
+    assert not np.array_equal(first, second)
@@ -0,0 +1,82 @@
+"""
+Checks of the error bound of the route simplification (SimplifyPolyline in
+Geometry.py and Simplify.py), and of the metric drift report of Simplify.py.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import numpy as np
+import pytest
+
+import Geometry
+import NumpyModel
+import Simplify
+from Model import GetMetrics
+from Shapefile import Layer, ReadLayer
+
+
+def RandomWalk(rng: np.random.Generator, vertices: int) -> np.ndarray:
+    # densely sampled polyline (metres) with turns, like a GPS track
+    headings = np.cumsum(rng.normal(0.0, 0.3, size=vertices))
+    steps = rng.uniform(1.0, 10.0, size=vertices)
+    return np.cumsum(np.stack([steps * np.cos(headings), steps * np.sin(headings)], axis=1), axis=0)
+
+
+@pytest.mark.parametrize("tolerance", [0.5, 2.0, 10.0, 50.0])
+@pytest.mark.parametrize("seed", range(3))
+def test_simplified_polyline_within_tolerance(seed, tolerance):
+    xy = RandomWalk(np.random.default_rng(seed), 2000)
+    kept = Geometry.SimplifyPolyline(xy, tolerance)
+
+    assert kept[0] == 0 and kept[-1] == len(xy) - 1
+    assert np.all(np.diff(kept) > 0)
+    assert len(kept) < len(xy)
+    # every removed vertex is within tolerance of the segment replacing it
+    for first, last in zip(kept[:-1], kept[1:]):
+        removed = xy[first + 1:last]
+        if len(removed) > 0:
+            distances = Geometry.PointSegmentDistances(removed, xy[first:first + 1], xy[last:last + 1])
+            assert distances.max() <= tolerance + 1e-9
+
+
+def test_straight_line_keeps_its_ends():
+    xy = np.stack([np.linspace(0.0, 1000.0, 101), np.zeros(101)], axis=1)
+    assert Geometry.SimplifyPolyline(xy, 0.1).tolist() == [0, 100]
+    assert Geometry.SimplifyPolyline(xy[:2], 0.1).tolist() == [0, 1]
+
+
+def test_simplified_layer_deviation_within_tolerance():
+    rng = np.random.default_rng(5)
+    parts = [RandomWalk(rng, 500) + [0.0, 5000.0 * part] for part in range(2)]
+    xy = np.concatenate(parts)
+    lonlat = Geometry.ToLonLat(xy)
+    partOffsets = np.array([0, 500, 1000], dtype=np.int64)
+    bboxes = np.concatenate([lonlat.min(axis=0), lonlat.max(axis=0)])[None, :]
+    layer = Layer(3, lonlat, partOffsets, np.array([0, 2], dtype=np.int64), bboxes, {})
+
+    for tolerance in (1.0, 5.0, 20.0):
+        simplified = Simplify.SimplifyLayer(layer, tolerance)
+        assert len(simplified.partOffsets) == 3
+        assert len(simplified.xy) < len(layer.xy)
+        assert Simplify.MaxDeviation(layer, simplified, tolerance) <= tolerance + 1e-6
+
+
+def test_simplify_route_writes_the_simplified_route(syntheticRoutes, tmp_path):
+    _, path = syntheticRoutes[0]
+    outputPath = str(tmp_path / "Simplified.shp")
+    vertices, kept, deviation = Simplify.SimplifyRoute(path, 5.0, outputPath)
+    simplified = ReadLayer(outputPath, [])
+    assert vertices == len(NumpyModel.LoadRoute(path).xy) and kept == len(simplified.xy) < vertices
+    assert deviation <= 5.0 + 1e-6
+
+
+def test_simplification_report(syntheticRoutes):
+    _, path = syntheticRoutes[0]
+    report = Simplify.SimplificationReport(path, 250, "Meters", [20.0, 1.0, 5.0])
+    assert report["Tolerance (m)"].tolist() == [0.0, 1.0, 5.0, 20.0]
+    assert report["Vertices"].is_monotonic_decreasing
+    assert (report["Max Deviation (m)"] <= report["Tolerance (m)"] + 1e-6).all()
+
+    # the first row is the route at full resolution, without drift
+    expected = NumpyModel.Model(path, 250, "Meters")
+    assert report.loc[0, GetMetrics()].tolist() == [expected[metric] for metric in GetMetrics()]
+    assert (report.loc[0, [metric + " Drift (%)" for metric in GetMetrics()]] == 0).all()
@@ -0,0 +1,69 @@
+"""
+Checks of the snapshots of Snapshot.py: a snapshot loads back the same layer
+as the shapefile, is compiled again when the shapefile changes or more fields
+are needed, and replacing it never deletes the previous snapshot before the
+new one is in place.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import os
+
+import numpy as np
+import pytest
+
+import Benchmark
+import NumpyModel
+import Snapshot
+from Shapefile import ReadLayer, WriteLayer
+
+
+@pytest.fixture
+def zoningPath(syntheticRoutes) -> str:
+    return NumpyModel.dataFolder + NumpyModel.ZoningFeature
+
+
+def test_snapshot_round_trip(zoningPath):
+    Snapshot.CompileLayer(zoningPath, ["GEN_ZON2"])
+    layer = Snapshot.LoadSnapshot(zoningPath, ["GEN_ZON2"])
+    expected = ReadLayer(zoningPath, ["GEN_ZON2"])
+    assert layer.shapeType == expected.shapeType
+    for column in Snapshot.GEOMETRY_COLUMNS:
+        assert np.array_equal(getattr(layer, column), getattr(expected, column))
+    assert np.array_equal(layer.Metres(), expected.Metres())
+    assert np.array_equal(layer.MetreBoxes(), expected.MetreBoxes())
+    assert np.array_equal(layer.attributes["GEN_ZON2"], expected.attributes["GEN_ZON2"])
+    # the fields missing from the snapshot need a new one
+    assert Snapshot.LoadSnapshot(zoningPath, ["GEN_ZON2", "OTHER"]) is None
+    assert list(Snapshot.LoadSnapshot(zoningPath, []).attributes) == []
+
+
+def test_snapshot_follows_the_shapefile(syntheticRoutes):
+    path = NumpyModel.dataFolder + NumpyModel.POIFeature
+    first = Snapshot.LoadOrCompileSnapshot(path, [])
+    points = np.array([[0.0, 0.0], [100.0, 50.0], [200.0, -30.0]])
+    WriteLayer(path, Benchmark.PointLayer(points))
+    assert Snapshot.LoadSnapshot(path, []) is None
+    second = Snapshot.LoadOrCompileSnapshot(path, [])
+    assert len(second) == 3 and len(first) != 3
+    assert np.allclose(second.Metres(), points, atol=1e-4)
+
+
+def test_replacing_a_snapshot_never_deletes_it_first(zoningPath, monkeypatch):
+    first = Snapshot.LoadOrCompileSnapshot(zoningPath, [])
+    path = Snapshot.SnapshotPath(zoningPath)
+
+    # the snapshot path must hold a snapshot whenever a folder is deleted
+    rmtree = Snapshot.shutil.rmtree
+    def CheckedRmtree(folder, *args):
+        assert os.path.normpath(folder) != os.path.normpath(path)
+        assert Snapshot._ReadHeader(path) is not None
+        return rmtree(folder, *args)
+    monkeypatch.setattr(Snapshot.shutil, "rmtree", CheckedRmtree)
+
+    Snapshot.CompileLayer(zoningPath, ["GEN_ZON2"])
+    second = Snapshot.LoadSnapshot(zoningPath, ["GEN_ZON2"])
+    assert second is not None
+    assert np.array_equal(second.xy, first.xy)
+    # nothing left next to the snapshot
+    folder, name = os.path.split(path)
+    assert [entry for entry in os.listdir(folder) if entry.startswith(name)] == [name]
@@ -0,0 +1,49 @@
+"""
+Checks of the single pass multi-buffer sweep of Sweep.py against one run of
+NumpyModel.py per buffer size.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import numpy as np
+import pytest
+
+import NumpyModel
+import Sweep
+from Model import GetMetrics
+
+BufferSizes = [50, 100, 250, 500, 1000]
+
+BIAMetric = "Areas of Business Improvement Areas"
+
+
+@pytest.mark.parametrize("unit, sizes", [("Meters", BufferSizes), ("Kilometers", [1, 2])])
+def test_sweep_matches_one_run_per_buffer_size(syntheticRoutes, unit, sizes):
+    for _, path in syntheticRoutes:
+        results = Sweep.Sweep(path, sizes, unit)
+        assert list(results) == sizes
+        for size in sizes:
+            expected = NumpyModel.Model(path, size, unit)
+            for metric in GetMetrics():
+                if metric == BIAMetric:
+                    # the buffer sizes share the scanline spacing of the largest one
+                    assert np.isclose(results[size][metric], expected[metric], rtol=3e-4, atol=1)
+                else:
+                    assert results[size][metric] == expected[metric]
+
+
+def test_counts_grow_with_the_buffer_size(syntheticRoutes):
+    _, path = syntheticRoutes[0]
+    results = Sweep.Sweep(path, BufferSizes, "Meters")
+    for metric in GetMetrics():
+        values = [results[size][metric] for size in BufferSizes]
+        assert values == sorted(values)
+
+
+def test_sweep_routes_skips_failing_routes(syntheticRoutes):
+    (name, path), = syntheticRoutes[:1]
+    table = Sweep.SweepRoutes([(name, path), ("Missing", path + ".missing.shp")], BufferSizes[:2], "Meters")
+    assert list(table.columns) == ["Route", "Buffer Size", "Buffer Size Unit", "Metric", "Value"]
+    assert len(table) == len(BufferSizes[:2]) * len(GetMetrics())
+    assert set(table["Route"]) == {name}
+    values = table.set_index(["Buffer Size", "Metric"])["Value"]
+    assert values[(100, "Number of Subway Stations")] == NumpyModel.Model(path, 100, "Meters")["Number of Subway Stations"]
@@ -0,0 +1,148 @@
+"""
+Checks of the traffic impact estimator of TrafficImpact.py on a grid of
+intersections: the road graph links the intersections of every street, A*
+finds the costs of Dijkstra, the delays of a route match a full search of
+every trip, and the graph saved next to the layer is rebuilt when the layer
+changes.
+
+Copyright 2024 Toronto Waterfront Marathon Team (MUCP 2023/24)
+"""
+import os
+
+import numpy as np
+import pytest
+
+import Geometry
+import NumpyModel
+import TrafficImpact
+from Shapefile import Layer, WriteLayer
+
+# intersections of GridSize streets by GridSize avenues, GridSpacing metres
+# apart, over the synthetic routes
+GridSize = 12
+GridSpacing = 1500.0
+GridOrigin = np.array([-9000.0, -4000.0])
+
+
+def GridLayer(size: int = GridSize, seed: int = 0) -> Layer:
+    # intersection (i, j) is "ST i AT AVE j", with a few signal numbers in brackets
+    i, j = np.meshgrid(np.arange(size), np.arange(size), indexing="ij")
+    i, j = i.reshape(-1), j.reshape(-1)
+    lonlat = Geometry.ToLonLat(GridOrigin + GridSpacing * np.stack([i, j], axis=1))
+    offsets = np.arange(len(lonlat) + 1, dtype=np.int64)
+    locations = np.array(["ST " + str(a) + " AT AVE " + str(b) + (" (PX " + str(a * size + b) + ")" if b % 3 == 0 else "")
+                          for a, b in zip(i, j)])
+    cars = np.random.default_rng(seed).uniform(100, 2000, len(lonlat))
+    return Layer(1, lonlat, offsets, offsets, np.concatenate([lonlat, lonlat], axis=1),
+                 {"location": locations, "mean_cars": cars})
+
+
+def LineRoute(path: str, xy: np.ndarray) -> str:
+    lonlat = Geometry.ToLonLat(xy)
+    WriteLayer(path, Layer(3, lonlat, np.array([0, len(xy)]), np.array([0, 1]),
+                           np.concatenate([lonlat.min(axis=0), lonlat.max(axis=0)])[None, :],
+                           {"Id": np.zeros(1, dtype=np.int64)}))
+    return path
+
+
+@pytest.fixture
+def intersections(syntheticRoutes, monkeypatch) -> str:
+    # the grid as the high traffic intersections, with a smaller demand
+    monkeypatch.setattr(TrafficImpact, "DEMAND_ORIGINS", 40)
+    monkeypatch.setattr(TrafficImpact, "DEMAND_TRIPS", 400)
+    monkeypatch.setattr(TrafficImpact, "_graphCache", {})
+    path = NumpyModel.dataFolder + NumpyModel.HighTrafficFeature
+    WriteLayer(path, GridLayer())
+    return path
+
+
+@pytest.fixture
+def graph(intersections) -> TrafficImpact.RoadGraph:
+    return TrafficImpact.LoadOrBuildGraph()
+
+
+def test_street_names():
+    assert TrafficImpact.StreetNames("KINGSTON RD AT BROOKLAWN AVE & ST CLAIR AVE E (PX 150)") == \
+        ["KINGSTON RD", "BROOKLAWN AVE", "ST CLAIR AVE E"]
+    assert TrafficImpact.StreetNames("ATLANTIC AVE AT KING ST W") == ["ATLANTIC AVE", "KING ST W"]
+
+
+def test_graph_links_the_streets(graph):
+    assert len(graph.points) == GridSize * GridSize
+    assert len(np.unique(TrafficImpact._Components(len(graph.points), graph.edges))) == 1
+    # every pair of consecutive intersections of a street is an arterial link
+    edges = {tuple(edge) for edge in graph.edges.tolist()}
+    for a in range(GridSize):
+        for b in range(GridSize - 1):
+            assert (a * GridSize + b, a * GridSize + b + 1) in edges
+            assert (b * GridSize + a, (b + 1) * GridSize + a) in edges
+    street = np.isclose(graph.lengths, GridSpacing, rtol=1e-3)
+    assert np.allclose(graph.minutes[street], GridSpacing / TrafficImpact.ARTERIAL_SPEED, rtol=1e-3)
+
+
+def test_a_star_finds_the_costs_of_dijkstra(graph):
+    rng = np.random.default_rng(1)
+    closed = set(rng.choice(len(graph.edges), len(graph.edges) // 5, replace=False).tolist())
+    for source, target in rng.integers(0, len(graph.points), (20, 2)).tolist():
+        costs = graph.Search(source, closed=closed)[0]
+        found, previous = graph.Search(source, target, closed, graph.Heuristic(target))
+        assert np.isclose(found[target], costs[target]) or (np.isinf(found[target]) and np.isinf(costs[target]))
+        if np.isfinite(found[target]) and source != target:
+            path = graph.PathEdges(previous, target)
+            assert not closed.intersection(path)
+            assert np.isclose(graph.costs[path].sum(), costs[target])
+
+
+def test_delays_match_a_full_search_of_every_trip(graph, syntheticRoutes):
+    _, path = syntheticRoutes[0]
+    result = TrafficImpact.TrafficImpact(path, 250, "Meters", graph)
+    grid = NumpyModel.RouteGrid(NumpyModel.LoadRoute(path), 250.0)
+    closed = set(graph.ClosedEdges(grid, 250.0).tolist())
+    assert result["Closed Links"] == len(closed) > 0
+
+    delays, unreachable = [], 0
+    for origin, destination, baseCost in zip(graph.origins.tolist(), graph.destinations.tolist(), graph.baseCosts):
+        cost = graph.Search(origin, closed=closed)[0][destination]
+        if np.isinf(cost):
+            unreachable += 1
+            delays.append(TrafficImpact.UNREACHABLE_DELAY_FACTOR * baseCost)
+        else:
+            delays.append(cost - baseCost)
+    assert min(delays) >= -1e-9
+    assert np.isclose(result["Vehicle Delay"], np.mean(delays))
+    assert result["Unreachable Trips"] == unreachable
+    assert result["Rerouted Trips"] + unreachable <= len(graph.origins)
+
+
+def test_route_away_from_the_streets(graph, tmp_path):
+    path = LineRoute(str(tmp_path / "Away.shp"), np.array([[40000.0, 40000.0], [45000.0, 40000.0], [45000.0, 45000.0]]))
+    result = TrafficImpact.TrafficImpact(path, 250, "Meters", graph)
+    assert result == {"Vehicle Delay": 0.0, "Stopped Delay": 0.0, "Emissions All": 0.0,
+                      "Closed Links": 0, "Rerouted Trips": 0, "Unreachable Trips": 0}
+
+
+def test_graph_is_saved_and_rebuilt_when_the_layer_changes(intersections, monkeypatch):
+    graph = TrafficImpact.LoadOrBuildGraph()
+    graphPath = TrafficImpact.GraphPath(intersections)
+    assert os.path.exists(graphPath)
+    assert TrafficImpact.LoadOrBuildGraph() is graph
+
+    # a new process loads the saved graph
+    monkeypatch.setattr(TrafficImpact, "_graphCache", {})
+    loaded = TrafficImpact.LoadOrBuildGraph()
+    assert loaded is not graph
+    for name in ("edges", "costs", "landmarkCosts", "origins", "destinations", "baseCosts", "pathOffsets", "pathEdges"):
+        assert np.array_equal(getattr(loaded, name), getattr(graph, name))
+
+    # and builds it again from the layer once the layer changes
+    WriteLayer(intersections, GridLayer(GridSize - 2))
+    rebuilt = TrafficImpact.LoadOrBuildGraph()
+    assert len(rebuilt.points) == (GridSize - 2) ** 2
+    assert np.array_equal(TrafficImpact.RoadGraph.Load(graphPath).fingerprint, rebuilt.fingerprint)
+
+
+def test_traffic_impact_routes_skips_failing_routes(intersections, syntheticRoutes):
+    (name, path), = syntheticRoutes[:1]
+    table = TrafficImpact.TrafficImpactRoutes([(name, path), ("Missing", path + ".missing.shp")], 250, "Meters")
+    assert list(table.index) == [name]
+    assert table.loc[name, "Closed Links"] > 0